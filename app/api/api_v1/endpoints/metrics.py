@@ -0,0 +1,17 @@
+# app/api/api_v1/endpoints/metrics.py
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends
+
+from app.api.deps.user_deps import get_current_admin_user
+from app.core.metrics import metrics
+from app.models.prompt_session import User as UserModel
+
+router = APIRouter()
+
+@router.get("", name="metrics:snapshot")
+async def get_metrics_snapshot(current_user: UserModel = Depends(get_current_admin_user)) -> Dict[str, Any]:
+    """
+    In-process metrics for this worker (counters, gauges such as admission queue depth, histograms).
+    """
+    return metrics.snapshot()
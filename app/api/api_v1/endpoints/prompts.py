@@ -1,12 +1,14 @@
 # app/api/api_v1/endpoints/prompts.py
 
-import base64, io, datetime, httpx, re, traceback, uuid
-from typing import Optional, List, Dict, Any, Union
+import asyncio, base64, contextlib, io, datetime, hashlib, httpx, re, traceback, uuid
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Union
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Depends, Request
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import FormData
 from PIL import Image
 from sqlalchemy.orm import Session
-from pydantic import ValidationError 
+from pydantic import TypeAdapter, ValidationError 
 import json
 
 from app.api.deps.user_deps import get_current_user
@@ -14,16 +16,43 @@ from app.models.prompt_session import User as UserModel
 # Ensure this name matches what you have in your schemas/prompt.py for the detailed structure
 from app.schemas import (
     RichImageAnalysisSchema, 
+    ImageMetadata,
     GeneratedPromptData,
     PromptAnalysisResponse,
     PromptSessionCreate,
     GeneratedPromptCreate,
     PromptSessionInDB,
+    PageOrderUpdate,
+    SessionReanalyzeRequest,
+    HistorySearchResponse,
+    ColumnarElementTree,
     # ImageEntryCreate is used by CRUD
 )
+from app.schemas.prompt import ANALYSIS_STORAGE_FORMAT, ANALYSIS_STORAGE_FORMAT_KEY
+from app.schemas.element_repeats import RepeatGroup, find_repeat_groups, iter_compacted_nodes, repeat_texts, to_compact_storage, to_prompt_dicts
+from app.core.admission import analyze_admission
+from app.core.blob_store import StoredUpload, open_stored_upload, store_uploads
 from app.core.config import settings
-from app.db.session import get_db
+from app.core.history_export import iter_history_ndjson, iter_history_zip
+from app.core.image_tiling import ImageTile, image_dimensions, merge_tile_analyses, needs_tiling, split_tall_image
+from app.core.etags import etag_headers, not_modified_response, weak_etag
+from app.core.deadline import ClientDisconnected, DeadlineExceeded, outbound_call, run_with_deadline_and_disconnect
+from app.core.llm_governor import LLMCallPermit, llm_governor
+from app.core.llm_usage import llm_usage_user, track_llm_call
+from app.core.metrics import metrics
+from app.core.model_tiering import (
+    ImageFeatures, ModelTier, choose_planner_tier, choose_vision_tier, compute_image_features, escalated_planner_tier,
+    escalated_vision_tier, plan_incomplete_reason, vision_output_incomplete_reason, vision_tiering_active,
+)
+from app.core.single_flight import SingleFlight
+from app.core.streaming_json import IncrementalJSONScanner, StreamingJSONError
+from app.core.tracing import span, traced
+from app.core.uploads import estimated_image_memory, image_memory_budget, read_upload_bytes, upload_form, upload_image_dimensions
+from app.db.session import get_db, get_read_db, read_session_factory
 from app.crud.crud_prompt_session import prompt_session as crud_prompt_session
+from app.crud.crud_idempotency import idempotency_key as crud_idempotency_key
+from app.crud.crud_image_blob import image_blob as crud_image_blob
+from app.models.prompt_session import IdempotencyKey, ImageEntry, PromptSession
 
 # --- AI Provider Configurations ---
 # ... (This section is fine as you pasted it) ...
@@ -50,6 +79,9 @@ if settings.ACTIVE_AI_PROVIDER == "OPENROUTER":
 
 router = APIRouter()
 
+# Identical /analyze-image submissions that are in flight at the same time share one pipeline run
+analyze_single_flight = SingleFlight("analyze_image", handoff_on=(ClientDisconnected,))
+
 # --- HELPER FUNCTIONS ---
 
 def format_specific_elements_for_prompt(elements: Optional[List[Any]], category_name: str, indent_level: int = 1) -> str:
@@ -88,89 +120,316 @@ def format_detected_elements_tree_for_prompt(elements: Optional[List[Any]], inde
             output_str += format_detected_elements_tree_for_prompt(el_data.children, indent_level + 1)
     return output_str
 
-async def call_openrouter_vision_api(image_bytes: bytes, image_filename: Optional[str]) -> RichImageAnalysisSchema:
-    # ... (Keep your working call_openrouter_vision_api function from response #43) ...
-    # This function seems to be working correctly now, returning parsable JSON.
-    if not OPENROUTER_CONFIGURED_SUCCESSFULLY:
-        raise HTTPException(status_code=503, detail="OpenRouter API is not configured.")
-    openrouter_model_identifier = settings.OPENROUTER_MODEL_IDENTIFIER
-    print(f"--- Using OpenRouter vision model: '{openrouter_model_identifier}' ---")
-    img_width, img_height = None, None
-    image_dimensions_json_part = '"width": "integer", "height": "integer"'
+def format_columnar_elements_tree_for_prompt(tree: ColumnarElementTree, indent_level: int = 1, repeat_groups: Optional[Dict[int, RepeatGroup]] = None) -> str:
+    # Same output as format_detected_elements_tree_for_prompt, but reads the flat columns
+    # directly (no recursion, no pydantic attribute access per node). With `repeat_groups`, each
+    # run of repeated siblings is printed once, followed by the text of every instance.
+    node_count = tree.node_count
+    if not node_count: return f"{'  ' * indent_level}- None\n"
+    strings, parents, depths = tree.strings, tree.parent, tree.depth
+    types, semantics, texts = tree.columns["element_type"], tree.columns["semantic_guess"], tree.columns["text_content"]
+    style_offsets, style_properties, style_values = tree.style_offsets, tree.style_properties, tree.style_values
+    lines = []
+    for kind, index, extra_depth in (iter_compacted_nodes(tree, repeat_groups) if repeat_groups else (("node", index, 0) for index in range(node_count))):
+        if kind != "node":
+            group = index; indent = "  " * (indent_level + depths[group.roots[0]] + extra_depth)
+            if kind == "repeat_start":
+                lines.append(f"{indent}- Repeated {group.count}x (same structure and styles, text differs); first instance:\n")
+            else:
+                lines.append(f"{indent}  Text of each instance:\n")
+                for number, instance_texts in enumerate(repeat_texts(tree, group), start=1):
+                    lines.append(f"{indent}    {number}. {' | '.join(json.dumps(text.strip()[:70]) for text in instance_texts) or '(no text)'}\n")
+            continue
+        indent = "  " * (indent_level + depths[index] + extra_depth)
+        line = f"{indent}- Type: {strings[types[index]]}"
+        if semantics[index] >= 0 and strings[semantics[index]]: line += f" (Semantic: {strings[semantics[index]]})"
+        if texts[index] >= 0 and strings[texts[index]]:
+            stripped = strings[texts[index]].strip()
+            line += f"\n{indent}  Content: \"{stripped[:70]}{'...' if len(stripped) > 70 else ''}\""
+        style_start, style_end = style_offsets[index], style_offsets[index + 1]
+        if style_end > style_start:
+            hints_summary = [f"{strings[style_properties[i]]}: {strings[style_values[i]]}" for i in range(style_start, min(style_end, style_start + 2))]
+            line += f"\n{indent}  Styles: {'; '.join(hints_summary)}{'...' if style_end - style_start > 2 else ''}"
+        lines.append(line + "\n")
+        if index + 1 < node_count and parents[index + 1] == index:
+            lines.append(f"{indent}  Children:\n")
+    return "".join(lines)
+
+def format_columnar_elements_tree_outline(tree: ColumnarElementTree, repeat_groups: Optional[Dict[int, RepeatGroup]] = None) -> str:
+    # One line per node, indented by depth: `type [semantic] "text" @x,y wxh`. Used by the compact planner encoding.
+    # Runs of repeated siblings become `repeat xN:` + the first instance + one `#n:` text line per instance.
+    lines = []
+    for kind, index, extra_depth in (iter_compacted_nodes(tree, repeat_groups) if repeat_groups else (("node", index, 0) for index in range(tree.node_count))):
+        if kind != "node":
+            group = index; indent = "  " * (tree.depth[group.roots[0]] + extra_depth)
+            if kind == "repeat_start":
+                lines.append(f"{indent}repeat x{group.count} (same structure, text varies):")
+            else:
+                lines.extend(f"{indent}  #{number}: {' | '.join(json.dumps(text.strip()[:120]) for text in instance_texts)}" for number, instance_texts in enumerate(repeat_texts(tree, group), start=1))
+            continue
+        parts = ["  " * (tree.depth[index] + extra_depth) + (tree.get("element_type", index) or "?")]
+        semantic_guess = tree.get("semantic_guess", index)
+        if semantic_guess: parts.append(f"[{semantic_guess}]")
+        text_content = tree.get("text_content", index)
+        if text_content: parts.append(json.dumps(text_content.strip()[:120]))
+        bbox = tree.bounding_box(index)
+        if bbox and all(key in bbox for key in ("x", "y", "width", "height")): parts.append(f"@{bbox['x']},{bbox['y']} {bbox['width']}x{bbox['height']}")
+        hints = tree.style_hints(index)
+        if hints: parts.append("{" + "; ".join(f"{prop}: {value}" for prop, value in hints) + "}")
+        lines.append(" ".join(parts))
+    return "\n".join(lines)
+
+def find_element_repeat_groups(element_columns: ColumnarElementTree) -> Dict[int, RepeatGroup]:
+    if not settings.ELEMENT_REPEAT_COMPACTION_ENABLED: return {}
+    return find_repeat_groups(element_columns, max(2, settings.ELEMENT_REPEAT_MIN_COUNT))
+
+def encode_analysis_for_planner(analysis_obj: RichImageAnalysisSchema, element_columns: Optional[ColumnarElementTree] = None, repeat_groups: Optional[Dict[int, RepeatGroup]] = None) -> str:
+    if settings.PLANNER_ANALYSIS_ENCODING != "compact" and not repeat_groups:
+        return analysis_obj.model_dump_json(indent=2)
+    if element_columns is None:
+        element_columns = ColumnarElementTree.from_elements(analysis_obj.detected_elements_tree)
+    if settings.PLANNER_ANALYSIS_ENCODING != "compact":
+        analysis_dict = analysis_obj.model_dump(mode="json", exclude={"detected_elements_tree"})
+        analysis_dict["detected_elements_tree"] = to_prompt_dicts(element_columns, repeat_groups)
+        return "(In detected_elements_tree, an entry with repeat_count stands for that many consecutive siblings shaped like its template; variants lists the texts of each.)\n" + json.dumps(analysis_dict, indent=2, ensure_ascii=False)
+    encoded = analysis_obj.model_dump_json(exclude={"detected_elements_tree"})
+    return f"{encoded}\nDETECTED ELEMENTS TREE (one node per line, indented by depth):\n{format_columnar_elements_tree_outline(element_columns, repeat_groups)}"
+
+def dump_analysis_for_storage(analysis_obj: RichImageAnalysisSchema, element_columns: Optional[ColumnarElementTree] = None) -> Dict[str, Any]:
+    analysis_dict = dump_analysis_tree_for_storage(analysis_obj, element_columns)
+    analysis_dict[ANALYSIS_STORAGE_FORMAT_KEY] = ANALYSIS_STORAGE_FORMAT # A complete dump in the current shape: /history serves it as stored
+    return analysis_dict
+
+def dump_analysis_tree_for_storage(analysis_obj: RichImageAnalysisSchema, element_columns: Optional[ColumnarElementTree] = None) -> Dict[str, Any]:
+    if not settings.STORE_ELEMENT_TREE_COLUMNAR and not settings.ELEMENT_REPEAT_COMPACTION_ENABLED:
+        return analysis_obj.model_dump()
+    if element_columns is None:
+        element_columns = ColumnarElementTree.from_elements(analysis_obj.detected_elements_tree)
+    if settings.STORE_ELEMENT_TREE_COLUMNAR:
+        analysis_dict = analysis_obj.model_dump(exclude={"detected_elements_tree"})
+        analysis_dict["detected_elements_tree"] = []
+        analysis_dict["detected_elements_columns"] = element_columns.to_storage()
+        return analysis_dict
+    repeat_groups = find_element_repeat_groups(element_columns)
+    if not repeat_groups:
+        return analysis_obj.model_dump()
+    analysis_dict = analysis_obj.model_dump(exclude={"detected_elements_tree"})
+    analysis_dict["detected_elements_tree"] = []
+    analysis_dict["detected_elements_compact"] = to_compact_storage(element_columns, repeat_groups)
+    metrics.increment("elements.repeat_groups_stored", len(repeat_groups))
+    return analysis_dict
+
+VISION_SCHEMA_BODY = """
+    "overall_analysis": { "page_title_guess": "string (Concise title)", "page_purpose_and_audience": "string", "dominant_theme": "string", "primary_layout_type": "string", "general_description": "string", "key_takeaways": ["string"] },
+    "navigation_elements": [ { "id": "string_id", "element_type": "string", "items": ["string"], "style_hints": "string" } ],
+    "layout_components": [ { "id": "string_id", "element_type": "string", "description": "string", "grid_details": "string" } ],
+    "content_sections": [ { "id": "string_id", "element_type": "string", "headline": "string", "text_elements": ["string"], "image_elements": ["string"] } ],
+    "interactive_controls": [ { "id": "string_id", "element_type": "string", "label_or_text": "string", "purpose": "string" } ],
+    "visual_style_guide": { "primary_colors": [{ "hex": "string", "name": "string", "usage": "string" }], "secondary_colors": [], "accent_colors": [], "neutral_colors": [], "primary_font_family": "string", "secondary_font_family": "string", "heading_typography": [{ "level": "string", "font_size": "string", "font_weight": "string", "line_height": "string" }], "body_typography": { "font_size": "string", "line_height": "string" }, "spacing_density": "string", "component_spacing": "string", "corner_radius_style": "string", "shadow_style": "string", "iconography_style": "string" },
+    "detected_elements_tree": [ { "id": "string", "element_type": "string", "semantic_guess": "string", "text_content": "string", "bounding_box": { "x": 0, "y": 0, "width": 0, "height": 0 }, "style_hints": [{ "property": "string", "value": "string" }], "interaction_notes": "string", "accessibility_notes": "string", "children": [] } ]
+"""
+
+# Vision instructions are a static, versioned prefix (identical bytes on every request, so
+# providers can serve it from their prompt cache) followed by a short per-image suffix.
+# image_metadata is not requested from the model; it is filled in server-side after parsing.
+# Bump the version whenever the prefix text changes.
+VISION_INSTRUCTION_VERSION = "vision-v2"
+VISION_INSTRUCTION_PREFIX = f"""[{VISION_INSTRUCTION_VERSION}] Your task is to meticulously analyze the provided UI screenshot and return ONLY a valid JSON object. This JSON object MUST strictly adhere to the following Pydantic-style schema. Do NOT include any explanatory text, markdown backticks, or comments outside or inside the JSON structure.
+
+Schema Definition:
+{{{VISION_SCHEMA_BODY}}}
+Return an empty list [] for array fields if no items apply. Return null for optional string/object fields if not applicable. No comments.
+"""
+VISION_BATCH_INSTRUCTION_PREFIX = f"""[{VISION_INSTRUCTION_VERSION}-batch] Your task is to meticulously analyze each of the provided UI screenshots and return ONLY a valid JSON object of the form {{"pages": [ ... ]}} with exactly one analysis object per screenshot, in the order the screenshots are given. Each analysis object MUST strictly adhere to the following Pydantic-style schema. Do NOT include any explanatory text, markdown backticks, or comments outside or inside the JSON structure.
+
+Schema Definition (one per screenshot):
+{{{VISION_SCHEMA_BODY}}}
+Return an empty list [] for array fields if no items apply. Return null for optional string/object fields if not applicable. No comments.
+"""
+
+def _vision_prefix_part(prefix_text: str) -> Dict[str, Any]:
+    part: Dict[str, Any] = {"type": "text", "text": prefix_text}
+    if settings.VISION_PROMPT_CACHE_CONTROL:
+        part["cache_control"] = {"type": "ephemeral"} # Explicit cache breakpoint (needed by some providers behind OpenRouter)
+    return part
+
+VISION_PREFIX_PART = _vision_prefix_part(VISION_INSTRUCTION_PREFIX)
+VISION_BATCH_PREFIX_PART = _vision_prefix_part(VISION_BATCH_INSTRUCTION_PREFIX)
+
+def prepare_vision_image(image_bytes: bytes, image_filename: Optional[str]) -> Dict[str, Any]:
+    # Dimensions, MIME type and base64 payload for one screenshot
+    img_width, img_height, mime_type = None, None, "image/png"
     try:
         img = Image.open(io.BytesIO(image_bytes))
         img_width, img_height = img.width, img.height
-        if img_width is not None and img_height is not None:
-            image_dimensions_json_part = f'"width": {img_width}, "height": {img_height}'
+        if img.format == "JPEG": mime_type = "image/jpeg"
+        elif img.format == "WEBP": mime_type = "image/webp"
     except Exception as img_err:
         print(f"Could not get image dimensions: {img_err}")
-    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-    mime_type = "image/png"
-    try:
-        img_for_mime = Image.open(io.BytesIO(image_bytes))
-        if img_for_mime.format == "JPEG": mime_type = "image/jpeg"
-        elif img_for_mime.format == "WEBP": mime_type = "image/webp"
-    except Exception: pass
-    json_instruction_prompt = f"""Your task is to meticulously analyze the provided UI screenshot and return ONLY a valid JSON object. This JSON object MUST strictly adhere to the following Pydantic-style schema. Do NOT include any explanatory text, markdown backticks, or comments outside or inside the JSON structure.
+    dimensions_text = f", {img_width}x{img_height} px" if img_width is not None and img_height is not None else ""
+    return {
+        "filename": image_filename or "uploaded_image.png", "width": img_width, "height": img_height,
+        "suffix_text": f"{image_filename or 'uploaded_image.png'}{dimensions_text}",
+        "image_url_part": {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"}},
+    }
 
-Schema Definition:
-{{
-    "image_metadata": {{ "original_filename": "{image_filename or 'uploaded_image.png'}", "image_dimensions": {{ {image_dimensions_json_part} }}, "analysis_timestamp": "{datetime.datetime.now(datetime.timezone.utc).isoformat()}" }},
-    "overall_analysis": {{ "page_title_guess": "string (Concise title)", "page_purpose_and_audience": "string", "dominant_theme": "string", "primary_layout_type": "string", "general_description": "string", "key_takeaways": ["string"] }},
-    "navigation_elements": [ {{ "id": "string_id", "element_type": "string", "items": ["string"], "style_hints": "string" }} ],
-    "layout_components": [ {{ "id": "string_id", "element_type": "string", "description": "string", "grid_details": "string" }} ],
-    "content_sections": [ {{ "id": "string_id", "element_type": "string", "headline": "string", "text_elements": ["string"], "image_elements": ["string"] }} ],
-    "interactive_controls": [ {{ "id": "string_id", "element_type": "string", "label_or_text": "string", "purpose": "string" }} ],
-    "visual_style_guide": {{ "primary_colors": [{{ "hex": "string", "name": "string", "usage": "string" }}], "secondary_colors": [], "accent_colors": [], "neutral_colors": [], "primary_font_family": "string", "secondary_font_family": "string", "heading_typography": [{{ "level": "string", "font_size": "string", "font_weight": "string", "line_height": "string" }}], "body_typography": {{ "font_size": "string", "line_height": "string" }}, "spacing_density": "string", "component_spacing": "string", "corner_radius_style": "string", "shadow_style": "string", "iconography_style": "string" }},
-    "detected_elements_tree": [ {{ "id": "string", "element_type": "string", "semantic_guess": "string", "text_content": "string", "bounding_box": {{ "x": 0, "y": 0, "width": 0, "height": 0 }}, "style_hints": [{{ "property": "string", "value": "string" }}], "interaction_notes": "string", "accessibility_notes": "string", "children": [] }} ]
-}}
-Return an empty list [] for array fields if no items apply. Return null for optional string/object fields if not applicable. No comments.
-"""
-    payload = { "model": openrouter_model_identifier, "messages": [{"role": "user", "content": [{"type": "text", "text": json_instruction_prompt}, {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}]}], "max_tokens": 500000, "response_format": {"type": "json_object"}}
+def fill_image_metadata(analysis_obj: RichImageAnalysisSchema, vision_image: Dict[str, Any]) -> RichImageAnalysisSchema:
+    analysis_obj.image_metadata = ImageMetadata(
+        original_filename=vision_image["filename"],
+        image_dimensions={"width": vision_image["width"], "height": vision_image["height"]} if vision_image["width"] is not None else None,
+        analysis_timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        instruction_version=VISION_INSTRUCTION_VERSION,
+    )
+    return analysis_obj
+
+async def request_openrouter_vision_json(payload: Dict[str, Any]) -> Any:
+    # POST a vision payload and return the parsed JSON content. HTTP / JSON errors become HTTPExceptions.
     headers = {"Authorization": f"Bearer {settings.OPENROUTER_API_KEY}", "Content-Type": "application/json", "HTTP-Referer": settings.PROJECT_NAME, "X-Title": settings.PROJECT_NAME}
     raw_json_text_for_error_reporting = "AI response content not retrieved due to an early error."
-    ai_data_dict_for_error_reporting = None
+    async def attempt(permit: LLMCallPermit) -> Any:
+        nonlocal raw_json_text_for_error_reporting
+        with track_llm_call("vision", payload.get("model")) as llm_call:
+            with outbound_call("vision", 120.0) as timeout_seconds:
+                async with httpx.AsyncClient(timeout=timeout_seconds) as client:
+                    response = await client.post(f"{settings.OPENROUTER_BASE_URL}/chat/completions", json=payload, headers=headers)
+            permit.observe_response(response)
+            response.raise_for_status()
+            api_response_json = response.json()
+            usage = llm_call.record_usage(api_response_json)
+            if usage["prompt_tokens"]: print(f"--- Vision usage: {usage['prompt_tokens']} prompt tokens ({usage['cached_tokens']} cached), {usage['completion_tokens']} completion tokens ---")
+            if not (choices := api_response_json.get("choices")) or not (message := choices[0].get("message")) or not (raw_json_text := message.get("content")):
+                raw_json_text_for_error_reporting = str(api_response_json)
+                raise ValueError("Unexpected response structure from OpenRouter vision model (choices/message/content path).")
+            raw_json_text_for_error_reporting = raw_json_text 
+            if isinstance(raw_json_text, str):
+                raw_json_text = re.sub(r"//.*", "", raw_json_text)
+                raw_json_text = raw_json_text.strip()
+            if not raw_json_text:
+                raise ValueError("AI returned empty content after stripping comments/whitespace.")
+            return json.loads(raw_json_text) 
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(f"{settings.OPENROUTER_BASE_URL}/chat/completions", json=payload, headers=headers)
-        response.raise_for_status()
-        api_response_json = response.json()
-        if not (choices := api_response_json.get("choices")) or not (message := choices[0].get("message")) or not (raw_json_text := message.get("content")):
-            raw_json_text_for_error_reporting = str(api_response_json)
-            raise ValueError("Unexpected response structure from OpenRouter vision model (choices/message/content path).")
-        raw_json_text_for_error_reporting = raw_json_text 
-        if isinstance(raw_json_text, str):
-            raw_json_text = re.sub(r"//.*", "", raw_json_text)
-            raw_json_text = raw_json_text.strip()
-        if not raw_json_text:
-            raise ValueError("AI returned empty content after stripping comments/whitespace.")
-        ai_data_dict = json.loads(raw_json_text) 
-        ai_data_dict_for_error_reporting = ai_data_dict 
-        strict_analysis = RichImageAnalysisSchema.model_validate(ai_data_dict)
-        return strict_analysis
+        return await llm_governor.run(payload.get("model"), "vision", attempt)
     except httpx.HTTPStatusError as e: print(f"HTTP error calling OpenRouter Vision: {e.response.status_code} - {e.response.text}"); raise HTTPException(status_code=e.response.status_code, detail=f"OpenRouter Vision API Error: {e.response.text}")
     except json.JSONDecodeError as e: print(f"JSONDecodeError from Vision: {e}"); print(f"Raw text that failed JSON parsing: {raw_json_text_for_error_reporting}"); raise HTTPException(status_code=500, detail=f"AI Vision response was not valid JSON: {e.msg} at pos {e.pos}")
-    except ValidationError as e: print(f"Pydantic ValidationError from Vision: {e}"); print(f"Data that failed Pydantic validation: {ai_data_dict_for_error_reporting}"); raise HTTPException(status_code=500, detail=f"AI Vision response schema error: {e.errors()}")
+    except HTTPException: raise # Includes DeadlineExceeded
     except Exception as e: print(f"General error in vision call: {e}"); traceback.print_exc(); raise HTTPException(status_code=500, detail=f"Vision processing error: {str(e)}")
 
+# Per-section validators for streamed vision output (detected_elements_tree is validated with the whole document)
+_vision_section_adapters: Dict[str, TypeAdapter] = {}
 
-async def call_planner_llm(
-    project_title: str,
-    all_page_analyses_json_strings: List[str], 
-    page_titles: List[str],
-    overall_requirements: str
-) -> str:
-    # ... (Keep your existing call_planner_llm function from response #41) ...
-    if not OPENROUTER_CONFIGURED_SUCCESSFULLY: 
-        print("WARNING: Planner LLM (OpenRouter) not configured, returning basic planning.")
-        return f"<development_planning>\n<error_in_planning>Planner LLM was not configured or failed.</error_in_planning>\n1. Project Structure: Basic Next.js structure.\n</development_planning>"
-    planner_model_identifier = settings.OPENROUTER_PLANNER_MODEL_IDENTIFIER
-    print(f"--- Calling Planner LLM: '{planner_model_identifier}' ---")
-    planning_prompt_parts = [f"{overall_requirements}\n\n", f"<project_summary_title>\n{project_title}\n</project_summary_title>\n\n"]
-    for i, analysis_json_str in enumerate(all_page_analyses_json_strings):
-        planning_prompt_parts.append(f"--- DETAILED JSON ANALYSIS FOR PAGE: {page_titles[i]} ---\n{analysis_json_str}\n\n")
-    planning_prompt_parts.append(f"""
-Based on ALL the above page analyses (provided as structured JSON) and the overall project requirements, generate ONLY the content for a <development_planning> XML-style block.
+def validate_vision_section(key: str, raw_json_text: str) -> None:
+    field = RichImageAnalysisSchema.model_fields.get(key)
+    if field is None or key == "detected_elements_tree": return
+    adapter = _vision_section_adapters.get(key)
+    if adapter is None: adapter = _vision_section_adapters[key] = TypeAdapter(field.annotation)
+    try:
+        adapter.validate_python(json.loads(raw_json_text))
+    except (ValueError, ValidationError) as e: # json.JSONDecodeError is a ValueError
+        raise StreamingJSONError("invalid_section", f"Section '{key}' failed validation: {e}")
+
+async def stream_openrouter_vision_json(payload: Dict[str, Any]) -> Any:
+    """
+    Streams a vision completion through IncrementalJSONScanner. Sections are validated as they
+    close; malformed, invalid or repeating output raises StreamingJSONError, which closes the
+    connection and stops the generation. Hitting the node cap also stops the stream and returns
+    the document cut after the last complete element node.
+    """
+    headers = {"Authorization": f"Bearer {settings.OPENROUTER_API_KEY}", "Content-Type": "application/json", "HTTP-Referer": settings.PROJECT_NAME, "X-Title": settings.PROJECT_NAME}
+    scanner = IncrementalJSONScanner(node_array_keys=("detected_elements_tree", "children"), max_nodes=settings.VISION_STREAM_MAX_ELEMENT_NODES, max_repeated_siblings=settings.VISION_STREAM_MAX_REPEATED_SIBLINGS, max_string_chars=settings.VISION_STREAM_MAX_STRING_CHARS)
+    async def attempt(permit: LLMCallPermit) -> None:
+        with track_llm_call("vision", payload.get("model"), streamed=True) as llm_call:
+            with outbound_call("vision", 120.0) as timeout_seconds:
+                async with httpx.AsyncClient(timeout=timeout_seconds) as client:
+                    async with client.stream("POST", f"{settings.OPENROUTER_BASE_URL}/chat/completions", json={**payload, "stream": True, "stream_options": {"include_usage": True}}, headers=headers) as response:
+                        permit.observe_response(response)
+                        if response.status_code >= 400: await response.aread()
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"): continue # SSE comments / keep-alives
+                            data = line[5:].strip()
+                            if data == "[DONE]": break
+                            event = json.loads(data)
+                            if event.get("usage"): llm_call.record_usage(event)
+                            if event.get("error"): raise ValueError(f"Provider error mid-stream: {event['error']}")
+                            delta_text = ((event.get("choices") or [{}])[0].get("delta") or {}).get("content")
+                            if not delta_text: continue
+                            for section_key, section_json in scanner.feed(delta_text):
+                                validate_vision_section(section_key, section_json)
+                            if scanner.node_limit_reached:
+                                print(f"--- Vision stream hit the {settings.VISION_STREAM_MAX_ELEMENT_NODES}-node cap, stopping generation ---")
+                                metrics.increment("vision.stream_node_cap_hits")
+                                break
+    try:
+        await llm_governor.run(payload.get("model"), "vision", attempt)
+    except httpx.HTTPStatusError as e: print(f"HTTP error calling OpenRouter Vision: {e.response.status_code} - {e.response.text}"); raise HTTPException(status_code=e.response.status_code, detail=f"OpenRouter Vision API Error: {e.response.text}")
+    except (StreamingJSONError, json.JSONDecodeError, HTTPException): raise
+    except Exception as e: print(f"General error in streamed vision call: {e}"); traceback.print_exc(); raise HTTPException(status_code=500, detail=f"Vision processing error: {str(e)}")
+    return json.loads(scanner.document_text())
+
+async def request_vision_json_with_stream_retries(payload: Dict[str, Any]) -> Any:
+    if not settings.VISION_STREAMING_ENABLED:
+        return await request_openrouter_vision_json(payload)
+    max_attempts = max(1, settings.VISION_STREAM_MAX_ATTEMPTS)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await stream_openrouter_vision_json(payload)
+        except (StreamingJSONError, json.JSONDecodeError) as e:
+            reason = e.reason if isinstance(e, StreamingJSONError) else "invalid_json"
+            metrics.increment("vision.stream_aborts", reason=reason)
+            print(f"--- Vision stream aborted on attempt {attempt}/{max_attempts} ({reason}): {e} ---")
+            if attempt == max_attempts:
+                raise HTTPException(status_code=500, detail=f"AI Vision response was not usable after {max_attempts} attempts: {e}")
+
+@traced("vision")
+async def call_openrouter_vision_api(image_bytes: bytes, image_filename: Optional[str], tier: Optional[ModelTier] = None, tile: Optional[ImageTile] = None) -> RichImageAnalysisSchema:
+    if not OPENROUTER_CONFIGURED_SUCCESSFULLY:
+        raise HTTPException(status_code=503, detail="OpenRouter API is not configured.")
+    openrouter_model_identifier = tier.model if tier else settings.OPENROUTER_MODEL_IDENTIFIER
+    max_tokens = tier.max_tokens if tier else settings.VISION_MAX_TOKENS_LARGE
+    print(f"--- Using OpenRouter vision model: '{openrouter_model_identifier}'{f' ({tier.name} tier: {tier.reason})' if tier else ''} ---")
+    vision_image = prepare_vision_image(image_bytes, image_filename)
+    content_parts = [VISION_PREFIX_PART, {"type": "text", "text": f"Screenshot: {vision_image['suffix_text']}{tile.prompt_note if tile else ''}"}, vision_image["image_url_part"]]
+    payload = { "model": openrouter_model_identifier, "messages": [{"role": "user", "content": content_parts}], "max_tokens": max_tokens, "response_format": {"type": "json_object"}}
+    ai_data_dict = await request_vision_json_with_stream_retries(payload)
+    try:
+        return fill_image_metadata(RichImageAnalysisSchema.model_validate(ai_data_dict), vision_image)
+    except ValidationError as e: print(f"Pydantic ValidationError from Vision: {e}"); print(f"Data that failed Pydantic validation: {ai_data_dict}"); raise HTTPException(status_code=500, detail=f"AI Vision response schema error: {e.errors()}")
+
+@traced("vision_batch")
+async def call_openrouter_vision_api_batch(images: List[Tuple[bytes, Optional[str]]], tier: Optional[ModelTier] = None) -> List[Optional[RichImageAnalysisSchema]]:
+    """
+    Analyzes several screenshots in one vision request; the schema instructions are sent once and
+    the model answers with {"pages": [...]} in image order. Returns one entry per image: the
+    validated analysis, or None if that page failed validation (the caller retries it on its own).
+    Raises if the combined response as a whole is unusable.
+    """
+    if not OPENROUTER_CONFIGURED_SUCCESSFULLY:
+        raise HTTPException(status_code=503, detail="OpenRouter API is not configured.")
+    openrouter_model_identifier = tier.model if tier else settings.OPENROUTER_MODEL_IDENTIFIER
+    max_tokens = tier.max_tokens if tier else settings.VISION_MAX_TOKENS_LARGE
+    print(f"--- Using OpenRouter vision model: '{openrouter_model_identifier}' for a batch of {len(images)} screenshots ---")
+    content_parts: List[Dict[str, Any]] = [VISION_BATCH_PREFIX_PART]
+    vision_images = [prepare_vision_image(image_bytes, image_filename) for image_bytes, image_filename in images]
+    for page_index, vision_image in enumerate(vision_images, start=1):
+        content_parts.append({"type": "text", "text": f"Screenshot {page_index} of {len(images)}: {vision_image['suffix_text']}"})
+        content_parts.append(vision_image["image_url_part"])
+    payload = { "model": openrouter_model_identifier, "messages": [{"role": "user", "content": content_parts}], "max_tokens": max_tokens, "response_format": {"type": "json_object"}}
+    ai_data = await request_openrouter_vision_json(payload)
+    pages = ai_data.get("pages") if isinstance(ai_data, dict) else ai_data
+    if not isinstance(pages, list) or len(pages) != len(images):
+        raise HTTPException(status_code=500, detail=f"AI Vision batch response had {len(pages) if isinstance(pages, list) else 'no'} pages for {len(images)} screenshots.")
+    analyses: List[Optional[RichImageAnalysisSchema]] = []
+    for page_index, (page_data, vision_image) in enumerate(zip(pages, vision_images), start=1):
+        try:
+            analyses.append(fill_image_metadata(RichImageAnalysisSchema.model_validate(page_data), vision_image))
+        except ValidationError as e:
+            print(f"Pydantic ValidationError for batch page {page_index}: {e}")
+            analyses.append(None)
+    return analyses
+
+
+PLANNING_INSTRUCTIONS = """
+Based on ALL the above {source} and the overall project requirements, generate ONLY the content for a <development_planning> XML-style block.
 This block MUST detail:
 1.  A suggested Project Structure (detailed file/folder layout for a Next.js/React/Tailwind project, showing key components specific to EACH analyzed page, and shared components).
 2.  A list of Key Features to implement across the entire application, derived from a holistic view of all pages.
@@ -180,33 +439,121 @@ This block MUST detail:
 6.  Notes on Responsive Breakpoints and specific Tailwind CSS strategies for achieving responsiveness based on the analyzed layouts.
 7.  Suggestions for data fetching or placeholder data if dynamic content is implied.
 
-The plan should be coherent, actionable, and directly based on the provided structured analyses. Ensure the output is ONLY the content for the <development_planning> section, starting with "1. Project Structure..." and ending after all planning points. Do not include the <development_planning> tags themselves in your response text.
-""")
-    full_planning_prompt = "".join(planning_prompt_parts)
-    payload = { "model": planner_model_identifier, "messages": [{"role": "user", "content": full_planning_prompt}], "max_tokens": 3500 }
+The plan should be coherent, actionable, and directly based on the provided {basis}. Ensure the output is ONLY the content for the <development_planning> section, starting with "1. Project Structure..." and ending after all planning points. Do not include the <development_planning> tags themselves in your response text.
+"""
+
+SECTION_PLANNING_INSTRUCTIONS = """
+The pages above are section {section_number} of {section_count} of a larger application (all page titles: {all_titles}).
+Write a COMPACT section plan for ONLY these pages; it will be merged with the other sections' plans into one development plan, so do not plan the rest of the app. Cover, as terse bullet points:
+- Routes for these pages (and dynamic routes they imply)
+- Page-specific components, and components that look shared/reusable across pages (mark them "shared")
+- Key features and interactions
+- State management and data needs (placeholder data, fetching)
+- Layout and responsive notes (breakpoints, Tailwind strategies)
+Stay under {word_limit} words. Output only the bullet points, no preamble.
+"""
+
+async def request_planner_completion(prompt_text: str, model: str, max_tokens: int, stage: str = "planner") -> str:
+    """One planner-model chat completion; returns the message text or raises."""
+    payload = { "model": model, "messages": [{"role": "user", "content": prompt_text}], "max_tokens": max_tokens }
     headers = {"Authorization": f"Bearer {settings.OPENROUTER_API_KEY}", "Content-Type": "application/json", "HTTP-Referer": settings.PROJECT_NAME, "X-Title": settings.PROJECT_NAME}
+    async def attempt(permit: LLMCallPermit) -> str:
+        with track_llm_call(stage, model) as llm_call:
+            with outbound_call(stage, 240.0) as timeout_seconds:
+                async with httpx.AsyncClient(timeout=timeout_seconds) as client:
+                    response = await client.post(f"{settings.OPENROUTER_BASE_URL}/chat/completions", json=payload, headers=headers)
+            permit.observe_response(response)
+            response.raise_for_status()
+            api_response_json = response.json()
+            llm_call.record_usage(api_response_json)
+            if not (choices := api_response_json.get("choices")) or not (message := choices[0].get("message")) or not (text := message.get("content")):
+                raise ValueError(f"Unexpected response structure from Planner LLM ({stage}).")
+            return text
+    return await llm_governor.run(model, stage, attempt)
+
+@traced("planner")
+async def call_planner_llm(
+    project_title: str,
+    all_page_analyses_json_strings: List[str], 
+    page_titles: List[str],
+    overall_requirements: str,
+    tier: Optional[ModelTier] = None,
+    section_plans: Optional[List[str]] = None
+) -> str:
+    """Single-shot planning over every page's analysis, or (with `section_plans`) the reduce step of hierarchical planning."""
+    if not OPENROUTER_CONFIGURED_SUCCESSFULLY: 
+        print("WARNING: Planner LLM (OpenRouter) not configured, returning basic planning.")
+        return f"<development_planning>\n<error_in_planning>Planner LLM was not configured or failed.</error_in_planning>\n1. Project Structure: Basic Next.js structure.\n</development_planning>"
+    planner_model_identifier = tier.model if tier else settings.OPENROUTER_PLANNER_MODEL_IDENTIFIER
+    print(f"--- Calling Planner LLM: '{planner_model_identifier}'{f' ({tier.name} tier: {tier.reason})' if tier else ''}{f' to merge {len(section_plans)} section plans' if section_plans is not None else ''} ---")
+    planning_prompt_parts = [f"{overall_requirements}\n\n", f"<project_summary_title>\n{project_title}\n</project_summary_title>\n\n"]
+    if section_plans is None:
+        for i, analysis_json_str in enumerate(all_page_analyses_json_strings):
+            planning_prompt_parts.append(f"--- DETAILED JSON ANALYSIS FOR PAGE: {page_titles[i]} ---\n{analysis_json_str}\n\n")
+        planning_prompt_parts.append(PLANNING_INSTRUCTIONS.format(source="page analyses (provided as structured JSON)", basis="structured analyses"))
+    else:
+        planning_prompt_parts.append(f"ALL PAGES, IN ORDER: {', '.join(page_titles)}\n\n")
+        for section_plan in section_plans:
+            planning_prompt_parts.append(f"{section_plan}\n\n")
+        planning_prompt_parts.append(PLANNING_INSTRUCTIONS.format(source="section plans (each covering a group of pages; merge shared components, routes and state across sections)", basis="section plans"))
     raw_planner_output_for_error = "Planner LLM did not produce output."
     try:
-        async with httpx.AsyncClient(timeout=240.0) as client:
-            response = await client.post(f"{settings.OPENROUTER_BASE_URL}/chat/completions", json=payload, headers=headers)
-        response.raise_for_status()
-        api_response_json = response.json()
-        if not (choices := api_response_json.get("choices")) or not (message := choices[0].get("message")) or not (dev_plan_text := message.get("content")):
-            raise ValueError("Unexpected response structure from Planner LLM.")
+        dev_plan_text = await request_planner_completion("".join(planning_prompt_parts), planner_model_identifier, tier.max_tokens if tier else settings.PLANNER_MAX_TOKENS_LARGE)
         raw_planner_output_for_error = dev_plan_text
         print(f"--- Planner LLM Raw Output (first 500 chars): {dev_plan_text[:500]}... ---")
         return dev_plan_text 
+    except DeadlineExceeded: raise
     except Exception as e:
         print(f"Error during Planner LLM call: {e}")
         if isinstance(e, httpx.HTTPStatusError): print(f"Planner LLM HTTP Error Response: {e.response.text}")
         traceback.print_exc()
         return f"""<error_in_planning>Planner LLM failed: {str(e)}\nRaw output for debug (if any): {raw_planner_output_for_error[:300]}...</error_in_planning>"""
 
+# --- HIERARCHICAL (MAP-REDUCE) PLANNING FOR LARGE SESSIONS ---
+def use_hierarchical_planning(page_count: int) -> bool:
+    return settings.PLANNER_HIERARCHICAL_ENABLED and page_count >= settings.PLANNER_HIERARCHICAL_MIN_PAGES
+
+@traced("planner_map")
+async def call_section_planner_llm(project_title: str, section_number: int, section_count: int, analyses_json_strings: List[str], section_titles: List[str], all_titles: List[str], tier: ModelTier) -> str:
+    """Map step: a compact plan for one group of pages. Failures become an error note in that section instead of failing the whole plan."""
+    prompt_parts = [f"<project_summary_title>\n{project_title}\n</project_summary_title>\n\n"]
+    for title, analysis_json_str in zip(section_titles, analyses_json_strings):
+        prompt_parts.append(f"--- DETAILED JSON ANALYSIS FOR PAGE: {title} ---\n{analysis_json_str}\n\n")
+    prompt_parts.append(SECTION_PLANNING_INSTRUCTIONS.format(section_number=section_number, section_count=section_count, all_titles=", ".join(all_titles), word_limit=settings.PLANNER_SECTION_PLAN_MAX_WORDS))
+    header = f"--- SECTION PLAN {section_number}/{section_count}: {', '.join(section_titles)} ---"
+    metrics.increment("planner.map_calls", tier=tier.name)
+    try:
+        section_plan = await request_planner_completion("".join(prompt_parts), tier.model, settings.PLANNER_MAP_MAX_TOKENS, stage="planner_map")
+        return f"{header}\n{section_plan.strip()}"
+    except DeadlineExceeded: raise
+    except Exception as e:
+        print(f"--- Section plan {section_number}/{section_count} failed: {e} ---")
+        metrics.increment("planner.map_failures")
+        return f"{header}\n<error_in_section_plan>Section planning failed ({e}); plan these pages from their titles.</error_in_section_plan>"
+
+async def plan_page_sections(project_title: str, analyses_json_strings: List[str], page_titles: List[str], element_counts: List[int]) -> List[str]:
+    """Map step over all pages: groups of PLANNER_MAP_PAGES_PER_GROUP pages, planned in parallel (at most PLANNER_MAP_CONCURRENCY at once), in page order."""
+    group_size = max(1, settings.PLANNER_MAP_PAGES_PER_GROUP)
+    groups = [range(start, min(start + group_size, len(page_titles))) for start in range(0, len(page_titles), group_size)]
+    print(f"--- Hierarchical planning: {len(page_titles)} pages in {len(groups)} sections ---")
+    metrics.increment("planner.hierarchical_runs")
+    semaphore = asyncio.Semaphore(max(1, settings.PLANNER_MAP_CONCURRENCY))
+
+    async def plan_group(section_number: int, group: range) -> str:
+        async with semaphore:
+            tier = choose_planner_tier(len(group), sum(element_counts[i] for i in group))
+            return await call_section_planner_llm(project_title, section_number, len(groups), [analyses_json_strings[i] for i in group], [page_titles[i] for i in group], page_titles, tier)
+
+    return list(await asyncio.gather(*(plan_group(number, group) for number, group in enumerate(groups, start=1))))
+
 # --- CONSOLIDATED PROMPT GENERATION (CORRECTED) ---
+@traced("prompt_build")
 async def generate_final_consolidated_prompt_with_planner(
     all_image_analyses_structured: List[Dict[str, Any]], 
-    session_name: Optional[str]
+    session_name: Optional[str],
+    development_plan: Optional[str] = None
 ) -> List[GeneratedPromptData]:
+    """`development_plan`, if given, is used as-is instead of calling the planner (re-rendering a stored session)."""
     if not all_image_analyses_structured:
         return [GeneratedPromptData(prompt_type="error_no_analysis", prompt_text="No image analyses were provided.")]
     
@@ -221,18 +568,27 @@ async def generate_final_consolidated_prompt_with_planner(
     image_analysis_blocks_for_final_prompt = []
     analysis_json_strings_for_planner = []
     page_titles_for_planner = []
+    total_element_count = 0
+    page_element_counts = []
 
     for i, image_data in enumerate(all_image_analyses_structured):
         title = image_data.get("title", f"Page {i+1}")
         page_titles_for_planner.append(title)
         analysis_obj: Optional[RichImageAnalysisSchema] = image_data.get("analysis_output")
+        element_columns: Optional[ColumnarElementTree] = image_data.get("element_columns")
         error_msg = image_data.get("error")
         current_page_analysis_text_block = f"--- ANALYSIS FOR PAGE: {title} ---\n"
         if error_msg or not analysis_obj:
             current_page_analysis_text_block += f"<image_analysis_error>\nAnalysis failed. Error: {error_msg or 'Unknown'}\n</image_analysis_error>\n\n"
             analysis_json_strings_for_planner.append(f'{{"error_analysing_page": "{title}", "detail": "{error_msg or "Unknown"}"}}')
+            page_element_counts.append(0)
         else:
-            analysis_json_strings_for_planner.append(analysis_obj.model_dump_json(indent=2))
+            if element_columns is None:
+                element_columns = ColumnarElementTree.from_elements(analysis_obj.detected_elements_tree)
+            total_element_count += element_columns.node_count
+            page_element_counts.append(element_columns.node_count)
+            repeat_groups = find_element_repeat_groups(element_columns)
+            analysis_json_strings_for_planner.append(encode_analysis_for_planner(analysis_obj, element_columns, repeat_groups))
             current_page_analysis_text_block += "<image_analysis>\n"
             if analysis_obj.overall_analysis:
                 current_page_analysis_text_block += f"  Page Overview: {analysis_obj.overall_analysis.general_description or 'N/A'}\n"
@@ -267,65 +623,519 @@ async def generate_final_consolidated_prompt_with_planner(
                 current_page_analysis_text_block += f"     - Shadows: {vs.shadow_style or 'N/A'}\n"
                 current_page_analysis_text_block += f"     - Iconography: {vs.iconography_style or 'N/A'}\n"
             
-            if analysis_obj.detected_elements_tree:
-                current_page_analysis_text_block += "  6. Detailed Element Tree:\n" + format_detected_elements_tree_for_prompt(analysis_obj.detected_elements_tree, 2)
+            if element_columns.node_count:
+                current_page_analysis_text_block += "  6. Detailed Element Tree:\n" + format_columnar_elements_tree_for_prompt(element_columns, 2, repeat_groups)
             
             current_page_analysis_text_block += "</image_analysis>\n\n"
         image_analysis_blocks_for_final_prompt.append(current_page_analysis_text_block)
 
-    development_plan_str = await call_planner_llm(project_title=project_title_for_planner, all_page_analyses_json_strings=analysis_json_strings_for_planner, page_titles=page_titles_for_planner, overall_requirements=overall_requirements_text)
+    if development_plan is not None:
+        development_plan_str = development_plan
+    else:
+        # Large sessions: plan page groups in parallel (map), then merge the section plans (reduce)
+        section_plans = None
+        if OPENROUTER_CONFIGURED_SUCCESSFULLY and use_hierarchical_planning(len(all_image_analyses_structured)):
+            section_plans = await plan_page_sections(project_title_for_planner, analysis_json_strings_for_planner, page_titles_for_planner, page_element_counts)
+        planner_tier = choose_planner_tier(len(all_image_analyses_structured), total_element_count)
+        development_plan_str = await call_planner_llm(project_title=project_title_for_planner, all_page_analyses_json_strings=analysis_json_strings_for_planner, page_titles=page_titles_for_planner, overall_requirements=overall_requirements_text, tier=planner_tier, section_plans=section_plans)
+        if planner_tier.is_small and (incomplete_reason := plan_incomplete_reason(development_plan_str)):
+            print(f"--- Small planner output rejected ({incomplete_reason}), escalating to the large planner ---")
+            development_plan_str = await call_planner_llm(project_title=project_title_for_planner, all_page_analyses_json_strings=analysis_json_strings_for_planner, page_titles=page_titles_for_planner, overall_requirements=overall_requirements_text, tier=escalated_planner_tier(incomplete_reason), section_plans=section_plans)
     final_prompt_text = overall_requirements_text + "\n\n"; final_prompt_text += f"<project_summary_title>\n{project_title_for_planner}\n</project_summary_title>\n\n"; final_prompt_text += "".join(image_analysis_blocks_for_final_prompt); final_prompt_text += f"<development_planning>\n{development_plan_str}\n</development_planning>"
     return [GeneratedPromptData(prompt_type="ultra_detailed_multi_page_app_with_ai_planning", prompt_text=final_prompt_text.strip())]
 
+# --- Analysis Pipeline (vision per image or per batch -> planner -> save) ---
+def build_page_result(title: str, original_filename: Optional[str], analysis_obj: Optional[RichImageAnalysisSchema], analysis_dict_for_db: Optional[Dict[str, Any]], error_message_for_prompt_gen: Optional[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Returns (ImageEntry data for the DB, page input for generate_final_consolidated_prompt_with_planner)."""
+    element_columns = ColumnarElementTree.from_elements(analysis_obj.detected_elements_tree) if analysis_obj else None
+    if analysis_obj: analysis_dict_for_db = dump_analysis_for_storage(analysis_obj, element_columns)
+    db_entry = {"title": title, "original_filename": original_filename, "analysis_output_json": analysis_dict_for_db}
+    prompt_input = {"title": title, "analysis_output": analysis_obj, "element_columns": element_columns, "error": error_message_for_prompt_gen}
+    return db_entry, prompt_input
+
+async def call_vision_with_tiering(image_bytes: bytes, image_filename: Optional[str], features: Optional[ImageFeatures] = None, tier: Optional[ModelTier] = None, tile: Optional[ImageTile] = None) -> RichImageAnalysisSchema:
+    """Single-image vision call on the tier picked from the image features; small-tier output that fails validation or looks incomplete is redone on the large tier."""
+    if tier is None:
+        routing_features = features
+        if routing_features is None and vision_tiering_active():
+            routing_features = await asyncio.to_thread(compute_image_features, image_bytes) # Decodes the image: keep it off the event loop
+        tier = choose_vision_tier(routing_features)
+    if not tier.is_small:
+        return await call_openrouter_vision_api(image_bytes, image_filename, tier, tile)
+    try:
+        analysis_obj = await call_openrouter_vision_api(image_bytes, image_filename, tier, tile)
+    except HTTPException as e:
+        if e.status_code != 500: raise # Only invalid JSON / schema errors are worth a second attempt on the large model
+        print(f"--- Small vision model output failed for {image_filename}, escalating to the large model ---")
+        return await call_openrouter_vision_api(image_bytes, image_filename, escalated_vision_tier("validation_failed"), tile)
+    if incomplete_reason := vision_output_incomplete_reason(analysis_obj, features):
+        print(f"--- Small vision model output for {image_filename} looks incomplete ({incomplete_reason}), escalating to the large model ---")
+        return await call_openrouter_vision_api(image_bytes, image_filename, escalated_vision_tier(incomplete_reason), tile)
+    return analysis_obj
+
+@traced("vision_tiled")
+async def call_vision_tiled(tiles: List[ImageTile], image_filename: Optional[str], tier: Optional[ModelTier] = None) -> RichImageAnalysisSchema:
+    """
+    Analyzes the bands of a tall screenshot concurrently (each on its own tier unless `tier` is
+    forced) and merges them into one page analysis. Bands that fail are left out of the merge;
+    the page fails only if every band does.
+    """
+    print(f"--- Tall screenshot {image_filename} ({tiles[0].page_width}x{tiles[0].page_height}): analyzing {len(tiles)} bands ---")
+    semaphore = asyncio.Semaphore(max(1, settings.VISION_TILE_CONCURRENCY))
+    async def analyze_tile(tile: ImageTile) -> RichImageAnalysisSchema:
+        async with semaphore:
+            features = await asyncio.to_thread(compute_image_features, tile.image_bytes) if tier is None and vision_tiering_active() else None
+            return await call_vision_with_tiering(tile.image_bytes, image_filename, features, tier, tile)
+    tile_results = await asyncio.gather(*(analyze_tile(tile) for tile in tiles), return_exceptions=True)
+    for result in tile_results:
+        if isinstance(result, (DeadlineExceeded, asyncio.CancelledError)): raise result
+    succeeded = [(tile, result) for tile, result in zip(tiles, tile_results) if not isinstance(result, BaseException)]
+    metrics.increment("vision.tiled_images")
+    metrics.observe("vision.tiles_per_image", len(tiles))
+    if len(succeeded) < len(tiles):
+        failed = [(tile, result) for tile, result in zip(tiles, tile_results) if isinstance(result, BaseException)]
+        metrics.increment("vision.tile_failures", len(failed))
+        print(f"--- {len(failed)} of {len(tiles)} bands of {image_filename} failed: {'; '.join(f'{tile}: {error}' for tile, error in failed)} ---")
+        if not succeeded: raise failed[0][1]
+    merged, duplicates = merge_tile_analyses([analysis for _, analysis in succeeded], [tile for tile, _ in succeeded])
+    metrics.increment("vision.tile_overlap_duplicates", duplicates)
+    vision_image = {"filename": image_filename or "uploaded_image.png", "width": tiles[0].page_width, "height": tiles[0].page_height}
+    return fill_image_metadata(merged, vision_image)
+
+async def analyze_image_bytes(image_bytes: bytes, title: str, original_filename: Optional[str], page_number: int, features: Optional[ImageFeatures] = None, tier: Optional[ModelTier] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Runs the vision stage for one image on its own."""
+    print(f"--- Processing image {page_number}: {original_filename}, Title: {title} ---")
+    try:
+        if settings.ACTIVE_AI_PROVIDER == "OPENROUTER" and OPENROUTER_CONFIGURED_SUCCESSFULLY:
+            tiles = await asyncio.to_thread(split_tall_image, image_bytes) if needs_tiling(*image_dimensions(image_bytes)) else None
+            if tiles:
+                current_image_analysis_obj = await call_vision_tiled(tiles, original_filename, tier)
+            else:
+                current_image_analysis_obj = await call_vision_with_tiering(image_bytes, original_filename, features, tier)
+        elif settings.ACTIVE_AI_PROVIDER == "GEMINI" and GEMINI_CONFIGURED_SUCCESSFULLY:
+            current_image_analysis_obj = await call_gemini_vision_api(image_bytes, original_filename) # Needs similar Rich Schema update
+        else: raise HTTPException(status_code=503, detail=f"No active AI provider: {settings.ACTIVE_AI_PROVIDER}")
+        if not current_image_analysis_obj:
+            return build_page_result(title, original_filename, None, {"error": "AI vision analysis returned None."}, "AI vision analysis returned None.")
+        return build_page_result(title, original_filename, current_image_analysis_obj, None, None)
+    except DeadlineExceeded: raise # Out of budget: abandon the whole request rather than each page in turn
+    except Exception as e_vision: 
+        print(f"--- Error Vision AI for {original_filename}: {e_vision} ---")
+        if not isinstance(e_vision, HTTPException): # Don't print traceback for our own HTTPExceptions
+            traceback.print_exc()       
+        return build_page_result(title, original_filename, None, {"error": f"Vision AI call failed: {str(e_vision)}"}, str(e_vision))
+
+async def analyze_uploaded_images(uploads: List[Tuple[UploadFile, str, int]], results: Optional[List[Any]] = None) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Runs the vision stage for (upload, title, page_number) triples, in order. With a batch size > 1
+    for the vision model, images are sent N per request; pages the batch could not deliver fall
+    back to one request each. Very tall screenshots are never batched; they are analyzed in
+    bands (see app/core/image_tiling.py). If `results` is given it is filled in place as pages
+    finish, so a cancelled caller can see which pages were done.
+
+    Image bytes are only held while their page (or batch) is analyzed: routing reads the headers,
+    and each batch is read back from the spooled upload inside `image_memory_budget`.
+    """
+    if results is None: results = []
+    results[:] = [None] * len(uploads)
+    pending_by_model: Dict[Optional[str], List[Tuple[int, Optional[ImageFeatures], ModelTier, int]]] = {} # Vision model -> images routed to it
+    tall_images: List[Tuple[int, int]] = []
+    openrouter_active = settings.ACTIVE_AI_PROVIDER == "OPENROUTER" and OPENROUTER_CONFIGURED_SUCCESSFULLY
+    for index, (image_file_obj, title, page_number) in enumerate(uploads):
+        if not image_file_obj.content_type or not image_file_obj.content_type.startswith("image/"):
+            print(f"--- Skipped non-image file: {image_file_obj.filename} ---")
+            results[index] = build_page_result(title, image_file_obj.filename, None, {"error": f"Invalid file type: {image_file_obj.filename}"}, "Invalid file type")
+            continue
+        width, height = await upload_image_dimensions(image_file_obj)
+        memory_estimate = estimated_image_memory(image_file_obj.size or 0, width, height)
+        if openrouter_active and needs_tiling(width, height):
+            tall_images.append((index, memory_estimate * 2)) # Analyzed in bands on their own, never batched; the bands are encoded copies too
+            continue
+        features = None
+        if openrouter_active and vision_tiering_active():
+            async with image_memory_budget.reserve(memory_estimate):
+                with span("image_read"):
+                    image_bytes = await read_upload_bytes(image_file_obj)
+                features = await asyncio.to_thread(compute_image_features, image_bytes)
+                del image_bytes
+        tier = choose_vision_tier(features)
+        pending_by_model.setdefault(tier.model, []).append((index, features, tier, memory_estimate))
+
+    async def analyze_batch(batch: List[Tuple[int, Optional[ImageFeatures], ModelTier, int]]) -> None:
+        async with image_memory_budget.reserve(sum(memory_estimate for *_, memory_estimate in batch)):
+            with span("image_read"):
+                batch_bytes = [await read_upload_bytes(uploads[index][0]) for index, *_ in batch]
+            batch_tier = batch[0][2]
+            batch_analyses: List[Optional[RichImageAnalysisSchema]] = [None] * len(batch)
+            if len(batch) > 1:
+                print(f"--- Processing images {', '.join(str(uploads[index][2]) for index, *_ in batch)} in one vision request ---")
+                metrics.increment("vision.batch_requests")
+                try:
+                    batch_analyses = await call_openrouter_vision_api_batch([(image_bytes, uploads[index][0].filename) for (index, *_), image_bytes in zip(batch, batch_bytes)], batch_tier)
+                except Exception as e_batch:
+                    print(f"--- Batched vision request failed, falling back to one request per image: {e_batch} ---")
+                    metrics.increment("vision.batch_failures")
+            for (index, features, tier, _), image_bytes, analysis_obj in zip(batch, batch_bytes, batch_analyses):
+                image_file_obj, title, page_number = uploads[index]
+                retry_tier = None
+                if analysis_obj is not None and tier.is_small and (incomplete_reason := vision_output_incomplete_reason(analysis_obj, features)):
+                    analysis_obj, retry_tier = None, escalated_vision_tier(incomplete_reason)
+                if analysis_obj is not None:
+                    results[index] = build_page_result(title, image_file_obj.filename, analysis_obj, None, None)
+                    continue
+                if len(batch) > 1:
+                    metrics.increment("vision.batch_fallback_pages")
+                    if retry_tier is None and tier.is_small: retry_tier = escalated_vision_tier("validation_failed")
+                results[index] = await analyze_image_bytes(image_bytes, title, image_file_obj.filename, page_number, features, retry_tier or tier)
+
+    for model, pending_images in pending_by_model.items():
+        batch_size = settings.vision_batch_size_for_model(model) if openrouter_active else 1
+        for batch_start in range(0, len(pending_images), batch_size):
+            await analyze_batch(pending_images[batch_start:batch_start + batch_size])
+    for index, memory_estimate in tall_images:
+        image_file_obj, title, page_number = uploads[index]
+        async with image_memory_budget.reserve(memory_estimate):
+            with span("image_read"):
+                image_bytes = await read_upload_bytes(image_file_obj)
+            results[index] = await analyze_image_bytes(image_bytes, title, image_file_obj.filename, page_number)
+            del image_bytes
+    return results
+
+def save_partial_session(db: Session, current_user: UserModel, session_name_form: Optional[str], image_files_form: List[UploadFile], image_titles_form: List[str], page_results: List[Any], image_hashes: List[Optional[str]]) -> Optional[int]:
+    """Stores the pages analyzed before a cancellation; unfinished pages get an error entry so they can be replaced (or re-analyzed from their stored original) later."""
+    finished_count = sum(1 for page_result in page_results if page_result is not None)
+    if not finished_count: return None
+    analyses_for_db = [dict(page_result[0] if page_result is not None else {"title": image_titles_form[i], "original_filename": image_files_form[i].filename, "analysis_output_json": {"error": "Analysis cancelled before this page was processed."}}, image_sha256=image_hashes[i]) for i, page_result in enumerate(page_results)]
+    session_create_data = PromptSessionCreate(session_name=f"{session_name_form or 'Multi-Page Analysis'} (partial)", image_filename=image_files_form[0].filename if image_files_form else None)
+    partial_note = GeneratedPromptCreate(prompt_type="partial_cancelled", prompt_text=f"Analysis was cancelled after {finished_count} of {len(page_results)} pages. Replace the unfinished pages to complete this session.")
+    created_db_session = crud_prompt_session.create_with_images_and_final_prompt(db=db, session_obj_in=session_create_data, image_analyses=analyses_for_db, final_prompts_obj_in=[partial_note], owner_id=current_user.id)
+    return created_db_session.id
+
+async def run_analysis_pipeline(db: Session, current_user: UserModel, session_name_form: Optional[str], image_files_form: List[UploadFile], image_titles_form: List[str]) -> PromptAnalysisResponse:
+    page_results: List[Any] = []; image_hashes: List[Optional[str]] = [None] * len(image_files_form)
+    store_task: Optional[asyncio.Task] = None
+    try:
+        with llm_usage_user(current_user.id):
+            await analyze_uploaded_images([(image_file_obj, image_titles_form[i], i + 1) for i, image_file_obj in enumerate(image_files_form)], page_results)
+            # Originals, for re-analysis without a re-upload: written while the planner runs (vision reads the same files)
+            store_task = asyncio.create_task(store_uploads(image_files_form, current_user.id))
+            prompt_generation_input = [prompt_input for _, prompt_input in page_results]
+            final_prompts_for_ui = await generate_final_consolidated_prompt_with_planner(prompt_generation_input, session_name_form)
+            image_hashes = await store_task
+            all_individual_analyses_for_db = [dict(db_entry, image_sha256=image_hashes[i]) for i, (db_entry, _) in enumerate(page_results)]
+    except (asyncio.CancelledError, DeadlineExceeded):
+        # Client went away or the request ran out of budget
+        save_partial = settings.CANCELLED_ANALYSIS_POLICY == "save_partial" and any(page_result is not None for page_result in page_results)
+        if store_task is not None or save_partial: # The form's files are closed with the response, so finish with them first
+            image_hashes = await (store_task if store_task is not None else store_uploads(image_files_form, current_user.id))
+        if save_partial and (partial_session_id := save_partial_session(db, current_user, session_name_form, image_files_form, image_titles_form, page_results, image_hashes)):
+            print(f"--- Analysis cancelled, saved partial PromptSession ID: {partial_session_id} ---")
+            metrics.increment("cancellation.partial_sessions_saved")
+        else:
+            print("--- Analysis cancelled, discarding partial results ---")
+            metrics.increment("cancellation.partial_sessions_discarded")
+        raise
+
+    session_create_data = PromptSessionCreate(session_name=session_name_form or f"Multi-Page Analysis - {datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M')}", image_filename=image_files_form[0].filename if image_files_form else None)
+    db_final_prompts_to_create = [GeneratedPromptCreate(prompt_type=p.prompt_type, prompt_text=p.prompt_text) for p in final_prompts_for_ui]
+    created_db_session = crud_prompt_session.create_with_images_and_final_prompt(db=db, session_obj_in=session_create_data, image_analyses=all_individual_analyses_for_db, final_prompts_obj_in=db_final_prompts_to_create, owner_id=current_user.id)
+    print(f"--- Saved PromptSession ID: {created_db_session.id} ---")
+    return PromptAnalysisResponse(id=created_db_session.id, session_name=created_db_session.session_name, image_filename=created_db_session.image_filename, prompts=final_prompts_for_ui)
+
+# --- Incremental Session Editing (reuse stored analyses, vision only for new pages) ---
+def page_input_from_stored_entry(entry: ImageEntry) -> Dict[str, Any]:
+    """Rebuilds the planner input for a page from its stored analysis, without calling the vision model again."""
+    stored_analysis = entry.analysis_output_json
+    if not isinstance(stored_analysis, dict) or stored_analysis.get("error"):
+        error_msg = stored_analysis.get("error") if isinstance(stored_analysis, dict) else "No stored analysis for this page."
+        return {"title": entry.title, "analysis_output": None, "element_columns": None, "error": error_msg}
+    try:
+        analysis_obj = RichImageAnalysisSchema.model_validate(stored_analysis)
+    except ValidationError as e:
+        print(f"--- Stored analysis for ImageEntry {entry.id} no longer validates: {e} ---")
+        return {"title": entry.title, "analysis_output": None, "element_columns": None, "error": "Stored analysis could not be loaded; replace the page to re-analyze it."}
+    return {"title": entry.title, "analysis_output": analysis_obj, "element_columns": None, "error": None}
+
+def get_owned_session_or_404(db: Session, session_id: int, current_user: UserModel) -> PromptSession:
+    db_session = crud_prompt_session.get_by_owner(db, id=session_id, owner_id=current_user.id)
+    if db_session is None: raise HTTPException(status_code=404, detail="Session not found.")
+    return db_session
+
+async def apply_session_page_edit(db: Session, current_user: UserModel, db_session: PromptSession, ordered_pages: List[Union[ImageEntry, Tuple[UploadFile, str]]]) -> PromptAnalysisResponse:
+    """
+    `ordered_pages` is the session's new page list: kept ImageEntry rows and (upload, title) pairs
+    for new pages (or StoredUploads, for pages re-analyzed from their stored original). Only the
+    uploads go through vision; the planner re-runs over all pages and the result is stored as a new
+    GeneratedPrompt version.
+    """
+    if not ordered_pages: raise HTTPException(status_code=400, detail="A session must keep at least one page.")
+    new_upload_count = sum(1 for page in ordered_pages if not isinstance(page, ImageEntry))
+    pages_for_db: List[Union[ImageEntry, Dict[str, Any]]] = []; prompt_generation_input = []
+    async with analyze_admission.admit(current_user.id, cost=max(1, new_upload_count)):
+        with llm_usage_user(current_user.id):
+            new_uploads = [page[0] for page in ordered_pages if not isinstance(page, ImageEntry)]
+            new_page_results = iter(await analyze_uploaded_images([(page[0], page[1], page_number) for page_number, page in enumerate(ordered_pages, start=1) if not isinstance(page, ImageEntry)]))
+            store_task = asyncio.create_task(store_uploads(new_uploads, current_user.id)) # Written while the planner runs
+            try:
+                for page in ordered_pages:
+                    if isinstance(page, ImageEntry):
+                        pages_for_db.append(page); prompt_generation_input.append(page_input_from_stored_entry(page))
+                    else:
+                        db_entry, prompt_input = next(new_page_results)
+                        pages_for_db.append(db_entry); prompt_generation_input.append(prompt_input)
+                final_prompts_for_ui = await generate_final_consolidated_prompt_with_planner(prompt_generation_input, db_session.session_name)
+            finally:
+                new_page_hashes = iter(await store_task) # Also on cancellation: the form's files are closed with the response
+    pages_for_db = [page if isinstance(page, ImageEntry) else dict(page, image_sha256=next(new_page_hashes)) for page in pages_for_db]
+    db_final_prompts_to_create = [GeneratedPromptCreate(prompt_type=p.prompt_type, prompt_text=p.prompt_text) for p in final_prompts_for_ui]
+    updated_db_session = crud_prompt_session.update_pages_with_new_prompt_version(db=db, db_session=db_session, ordered_pages=pages_for_db, final_prompts_obj_in=db_final_prompts_to_create)
+    print(f"--- Updated PromptSession ID: {updated_db_session.id} ({len(ordered_pages)} pages, {new_upload_count} re-analyzed) ---")
+    return PromptAnalysisResponse(id=updated_db_session.id, session_name=updated_db_session.session_name, image_filename=updated_db_session.image_filename, prompts=final_prompts_for_ui)
+
+# --- Duplicate Submission Handling ---
+async def fingerprint_submission(user_id: int, session_name: Optional[str], image_files: List[UploadFile], image_titles: List[str]) -> str:
+    # sha256 over everything that affects the pipeline output; the image files are hashed in
+    # chunks and rewound so the pipeline can read them again.
+    digest = hashlib.sha256(f"{user_id}\0{session_name or ''}\0".encode("utf-8"))
+    for image_file_obj, title in zip(image_files, image_titles):
+        digest.update(f"{title}\0{image_file_obj.filename or ''}\0{image_file_obj.content_type or ''}\0".encode("utf-8"))
+        while chunk := await image_file_obj.read(1024 * 1024):
+            digest.update(chunk)
+        await image_file_obj.seek(0)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def replay_idempotent_submission(record: IdempotencyKey, response: Response) -> PromptAnalysisResponse:
+    if record.status != "completed" or not record.response_json:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed.", headers={"Retry-After": "5"})
+    print(f"--- Replaying stored response for Idempotency-Key '{record.key}' (session {record.prompt_session_id}) ---")
+    response.headers["Idempotent-Replayed"] = "true"
+    return PromptAnalysisResponse.model_validate(record.response_json)
+
+def _claim_is_abandoned(record: IdempotencyKey) -> bool:
+    created_at = record.created_at
+    if created_at is None:
+        return False
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    return (datetime.datetime.now(datetime.timezone.utc) - created_at).total_seconds() > settings.IDEMPOTENCY_IN_PROGRESS_TIMEOUT_SECONDS
+
 # --- Main API Endpoint ---
 @router.post("/analyze-image", response_model=PromptAnalysisResponse)
-async def analyze_image_endpoint(request: Request, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
+async def analyze_image_endpoint(request: Request, response: Response, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user), form_data: FormData = Depends(upload_form)):
     # ... (This logic remains the same from your pasted code, it calls the updated helpers) ...
-    form_data = await request.form()
     session_name_form: Optional[str] = form_data.get("session_name")
     image_files_form: List[UploadFile] = form_data.getlist("image_files")
     image_titles_form: List[str] = form_data.getlist("image_titles")
     print(f"--- analyze_image_endpoint by {current_user.email}, {len(image_files_form)} files, {len(image_titles_form)} titles ---")
     if not image_files_form or len(image_files_form) != len(image_titles_form): raise HTTPException(status_code=400, detail="Mismatch: images and titles count.")
-    
-    all_individual_analyses_for_db = []; prompt_generation_input = []
-    for i, image_file_obj in enumerate(image_files_form):
-        title = image_titles_form[i]; original_filename = image_file_obj.filename
-        current_image_analysis_obj: Optional[RichImageAnalysisSchema] = None; analysis_dict_for_db = None; error_message_for_prompt_gen = None
-        if not image_file_obj.content_type or not image_file_obj.content_type.startswith("image/"):
-            print(f"--- Skipped non-image file: {original_filename} ---"); analysis_dict_for_db = {"error": f"Invalid file type: {original_filename}"}; error_message_for_prompt_gen = f"Invalid file type"
-        else:
-            image_bytes = await image_file_obj.read(); print(f"--- Processing image {i+1}: {original_filename}, Title: {title} ---")
-            try:
-                if settings.ACTIVE_AI_PROVIDER == "OPENROUTER" and OPENROUTER_CONFIGURED_SUCCESSFULLY:
-                    current_image_analysis_obj = await call_openrouter_vision_api(image_bytes, original_filename)
-                elif settings.ACTIVE_AI_PROVIDER == "GEMINI" and GEMINI_CONFIGURED_SUCCESSFULLY:
-                    current_image_analysis_obj = await call_gemini_vision_api(image_bytes, original_filename) # Needs similar Rich Schema update
-                else: raise HTTPException(status_code=503, detail=f"No active AI provider: {settings.ACTIVE_AI_PROVIDER}")
-                
-                analysis_dict_for_db = current_image_analysis_obj.model_dump() if current_image_analysis_obj else {"error": "AI vision analysis returned None."}
-                if not current_image_analysis_obj: error_message_for_prompt_gen = "AI vision analysis returned None."
-
-            except Exception as e_vision: 
-                error_message_for_prompt_gen = str(e_vision)
-                analysis_dict_for_db = {"error": f"Vision AI call failed: {error_message_for_prompt_gen}"}
-                print(f"--- Error Vision AI for {original_filename}: {e_vision} ---")
-                if not isinstance(e_vision, HTTPException): # Don't print traceback for our own HTTPExceptions
-                    traceback.print_exc()       
-        
-        all_individual_analyses_for_db.append({"title": title, "original_filename": original_filename, "analysis_output_json": analysis_dict_for_db})
-        prompt_generation_input.append({"title": title, "analysis_output": current_image_analysis_obj, "error": error_message_for_prompt_gen})
-
-    final_prompts_for_ui = await generate_final_consolidated_prompt_with_planner(prompt_generation_input, session_name_form)
-    session_create_data = PromptSessionCreate(session_name=session_name_form or f"Multi-Page Analysis - {datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M')}", image_filename=image_files_form[0].filename if image_files_form else None)
-    db_final_prompts_to_create = [GeneratedPromptCreate(prompt_type=p.prompt_type, prompt_text=p.prompt_text) for p in final_prompts_for_ui]
-    created_db_session = crud_prompt_session.create_with_images_and_final_prompt(db=db, session_obj_in=session_create_data, image_analyses=all_individual_analyses_for_db, final_prompts_obj_in=db_final_prompts_to_create, owner_id=current_user.id)
-    print(f"--- Saved PromptSession ID: {created_db_session.id} ---")
-    return PromptAnalysisResponse(id=created_db_session.id, session_name=created_db_session.session_name, image_filename=created_db_session.image_filename, prompts=final_prompts_for_ui)
+
+    with span("fingerprint"):
+        submission_fingerprint = await fingerprint_submission(current_user.id, session_name_form, image_files_form, image_titles_form)
+
+    # Idempotency-Key: a retry within the TTL gets the stored response instead of a new run
+    idempotency_key_header = request.headers.get("Idempotency-Key")
+    idempotency_record: Optional[IdempotencyKey] = None
+    if idempotency_key_header:
+        if len(idempotency_key_header) > 255: raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 255 characters.")
+        existing_record = crud_idempotency_key.get_active(db, owner_id=current_user.id, key=idempotency_key_header)
+        if existing_record is None:
+            idempotency_record = crud_idempotency_key.claim(db, owner_id=current_user.id, key=idempotency_key_header, request_fingerprint=submission_fingerprint, ttl=datetime.timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS))
+            if idempotency_record is None: # Lost the race to a concurrent request with the same key
+                existing_record = crud_idempotency_key.get_active(db, owner_id=current_user.id, key=idempotency_key_header)
+        if existing_record is not None:
+            if existing_record.request_fingerprint != submission_fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different submission.")
+            if existing_record.status == "completed":
+                return replay_idempotent_submission(existing_record, response)
+            if _claim_is_abandoned(existing_record):
+                idempotency_record = existing_record # The original run died without releasing its claim; take it over
+            elif not analyze_single_flight.is_in_flight(submission_fingerprint):
+                return replay_idempotent_submission(existing_record, response) # Running in another worker -> 409
+            # Otherwise the original run is in flight in this process; the single-flight below joins it
+
+    async def admitted_pipeline_run() -> PromptAnalysisResponse:
+        # Per-user image rate limit + per-user/global concurrency caps (429 + Retry-After when overloaded)
+        async with analyze_admission.admit(current_user.id, cost=len(image_files_form)):
+            return await run_analysis_pipeline(db, current_user, session_name_form, image_files_form, image_titles_form)
+
+    async def guarded_pipeline_run() -> PromptAnalysisResponse:
+        # Cancelled when this client disconnects (a coalesced follower then takes over the run) or the deadline passes
+        return await run_with_deadline_and_disconnect(request, admitted_pipeline_run(), endpoint="analyze_image", deadline_seconds=settings.ANALYZE_REQUEST_DEADLINE_SECONDS)
+
+    coalescing_key = submission_fingerprint if settings.REQUEST_COALESCING_ENABLED else uuid.uuid4().hex
+    try:
+        analysis_response, shared = await analyze_single_flight.do(coalescing_key, guarded_pipeline_run)
+    except BaseException:
+        if idempotency_record is not None:
+            crud_idempotency_key.release(db, record=idempotency_record)
+        raise
+    if shared:
+        print(f"--- Coalesced duplicate submission with in-flight run (session {analysis_response.id}) ---")
+        response.headers["X-Coalesced"] = "true"
+    if idempotency_key_header and idempotency_record is None:
+        # Joined the run of the request holding this key; if that one's client went away, its claim was
+        # released and this request finished the run, so record the result under the key here
+        if existing_record is not None:
+            db.expunge(existing_record) # Loaded before the run; completed or released since
+        idempotency_record = crud_idempotency_key.get_active(db, owner_id=current_user.id, key=idempotency_key_header)
+        if idempotency_record is None:
+            idempotency_record = crud_idempotency_key.claim(db, owner_id=current_user.id, key=idempotency_key_header, request_fingerprint=submission_fingerprint, ttl=datetime.timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS))
+        elif idempotency_record.status == "completed" or idempotency_record.request_fingerprint != submission_fingerprint:
+            idempotency_record = None # Completed by the original request (or claimed again by another submission)
+    if idempotency_record is not None:
+        crud_idempotency_key.complete(db, record=idempotency_record, response_json=analysis_response.model_dump(mode="json"), prompt_session_id=analysis_response.id)
+    return analysis_response
 
 # --- GET HISTORY ENDPOINT ---
 @router.get("/history", response_model=List[PromptSessionInDB], name="prompts:get_history")
-async def get_prompt_history(db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user), skip: int = 0, limit: int = 100):
+async def get_prompt_history(request: Request, response: Response, db: Session = Depends(get_read_db), current_user: UserModel = Depends(get_current_user), skip: int = 0, limit: int = 100):
     print(f"--- Getting history for user ID: {current_user.id} ---")
+    headers: Dict[str, str] = {}
+    if settings.HISTORY_ETAGS_ENABLED:
+        # Idle polls stop here: one index lookup instead of the history query and serialization
+        session_count, last_updated_at = crud_prompt_session.get_history_version_by_owner(db, owner_id=current_user.id)
+        etag = weak_etag("history", current_user.id, session_count, last_updated_at, skip, limit)
+        not_modified = not_modified_response(request, etag, endpoint="history")
+        if not_modified is not None: return not_modified
+        headers = etag_headers(etag)
+    if settings.HISTORY_SQL_JSON_ENABLED and db.get_bind().dialect.name == "postgresql":
+        metrics.increment("history.sql_json_responses")
+        return StreamingResponse(iter_history_json(current_user.id, skip, limit), media_type="application/json", headers=headers)
     history_sessions = crud_prompt_session.get_multi_by_owner(db=db, owner_id=current_user.id, skip=skip, limit=limit)
-    return history_sessions
\ No newline at end of file
+    response.headers.update(headers)
+    return history_sessions
+
+def iter_history_json(owner_id: int, skip: int, limit: int) -> Iterator[bytes]:
+    # Sessions arrive as JSON text built by PostgreSQL and go out as-is; only sessions with an analysis
+    # that isn't a current-format dump (columnar/compacted trees, older shapes) go through PromptSessionInDB.
+    db = read_session_factory() # Own session: the body is streamed after the endpoint has returned
+    try:
+        yield b"["
+        for index, (session_json, needs_expansion) in enumerate(crud_prompt_session.iter_history_json_rows(db, owner_id=owner_id, skip=skip, limit=limit)):
+            if needs_expansion:
+                session_json = PromptSessionInDB.model_validate_json(session_json).model_dump_json()
+            yield (b"," if index else b"") + session_json.encode("utf-8")
+        yield b"]"
+    finally:
+        db.close()
+
+def encode_search_cursor(rank: float, session_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, session_id]).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, session_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(rank), int(session_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid search cursor.")
+
+@router.get("/history/search", response_model=HistorySearchResponse, name="prompts:search_history")
+async def search_prompt_history(
+    q: str = Query(..., min_length=1, max_length=256),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    # Ranked full-text search over the user's sessions; keyset-paginated on (rank, id), so pages stay stable and cheap
+    after = decode_search_cursor(cursor) if cursor else None
+    rows = crud_prompt_session.search_by_owner(db=db, owner_id=current_user.id, query_text=q.strip(), limit=limit + 1, after=after)
+    next_cursor = encode_search_cursor(rows[limit - 1]["rank"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return HistorySearchResponse(results=rows[:limit], next_cursor=next_cursor)
+
+@router.get("/history/export", name="prompts:export_history")
+async def export_prompt_history(format: str = Query("ndjson", pattern="^(ndjson|zip)$"), current_user: UserModel = Depends(get_current_user)):
+    # One session per NDJSON line (pages, analyses and all prompt versions), streamed from server-side cursors
+    print(f"--- Exporting history for user ID: {current_user.id} as {format} ---")
+    filename = f"voidcoder-history-{current_user.id}-{datetime.date.today().isoformat()}"
+    if format == "zip":
+        body, media_type, filename = iter_history_zip(read_session_factory, current_user.id), "application/zip", filename + ".zip"
+    else:
+        body, media_type, filename = iter_history_ndjson(read_session_factory, current_user.id), "application/x-ndjson", filename + ".ndjson"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# --- SESSION DETAIL + INCREMENTAL EDIT ENDPOINTS ---
+@router.get("/sessions/{session_id}", response_model=PromptSessionInDB, name="prompts:get_session")
+async def get_prompt_session(session_id: int, request: Request, response: Response, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
+    if settings.HISTORY_ETAGS_ENABLED:
+        exists, updated_at = crud_prompt_session.get_updated_at_by_owner(db, id=session_id, owner_id=current_user.id)
+        if not exists: raise HTTPException(status_code=404, detail="Session not found.")
+        etag = weak_etag("session", session_id, updated_at)
+        not_modified = not_modified_response(request, etag, endpoint="session")
+        if not_modified is not None: return not_modified
+        response.headers.update(etag_headers(etag))
+    return get_owned_session_or_404(db, session_id, current_user)
+
+@router.post("/sessions/{session_id}/pages", response_model=PromptAnalysisResponse, name="prompts:add_pages")
+async def add_session_pages(session_id: int, request: Request, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user), form_data: FormData = Depends(upload_form)):
+    # Form fields: image_files + image_titles (same as /analyze-image), optional insert_at (0-based page index, default: append)
+    db_session = get_owned_session_or_404(db, session_id, current_user)
+    image_files_form: List[UploadFile] = form_data.getlist("image_files")
+    image_titles_form: List[str] = form_data.getlist("image_titles")
+    if not image_files_form or len(image_files_form) != len(image_titles_form): raise HTTPException(status_code=400, detail="Mismatch: images and titles count.")
+    ordered_pages: List[Union[ImageEntry, Tuple[UploadFile, str]]] = list(db_session.image_entries)
+    insert_at = form_data.get("insert_at")
+    try: insert_at = len(ordered_pages) if insert_at in (None, "") else int(insert_at)
+    except ValueError: raise HTTPException(status_code=400, detail="insert_at must be an integer.")
+    if not 0 <= insert_at <= len(ordered_pages): raise HTTPException(status_code=400, detail=f"insert_at must be between 0 and {len(ordered_pages)}.")
+    ordered_pages[insert_at:insert_at] = list(zip(image_files_form, image_titles_form))
+    return await run_with_deadline_and_disconnect(request, apply_session_page_edit(db, current_user, db_session, ordered_pages), endpoint="session_edit", deadline_seconds=settings.ANALYZE_REQUEST_DEADLINE_SECONDS)
+
+@router.put("/sessions/{session_id}/pages/{entry_id}", response_model=PromptAnalysisResponse, name="prompts:replace_page")
+async def replace_session_page(session_id: int, entry_id: int, request: Request, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user), form_data: FormData = Depends(upload_form)):
+    # Form fields: image_file (new screenshot for this page), optional image_title (defaults to the current title)
+    db_session = get_owned_session_or_404(db, session_id, current_user)
+    image_file_obj = form_data.get("image_file")
+    if image_file_obj is None or isinstance(image_file_obj, str): raise HTTPException(status_code=400, detail="image_file is required.")
+    ordered_pages: List[Union[ImageEntry, Tuple[UploadFile, str]]] = list(db_session.image_entries)
+    position = next((i for i, entry in enumerate(ordered_pages) if entry.id == entry_id), None)
+    if position is None: raise HTTPException(status_code=404, detail="Page not found in this session.")
+    ordered_pages[position] = (image_file_obj, form_data.get("image_title") or ordered_pages[position].title)
+    return await run_with_deadline_and_disconnect(request, apply_session_page_edit(db, current_user, db_session, ordered_pages), endpoint="session_edit", deadline_seconds=settings.ANALYZE_REQUEST_DEADLINE_SECONDS)
+
+@router.delete("/sessions/{session_id}/pages/{entry_id}", response_model=PromptAnalysisResponse, name="prompts:remove_page")
+async def remove_session_page(session_id: int, entry_id: int, request: Request, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
+    db_session = get_owned_session_or_404(db, session_id, current_user)
+    ordered_pages = [entry for entry in db_session.image_entries if entry.id != entry_id]
+    if len(ordered_pages) == len(db_session.image_entries): raise HTTPException(status_code=404, detail="Page not found in this session.")
+    return await run_with_deadline_and_disconnect(request, apply_session_page_edit(db, current_user, db_session, ordered_pages), endpoint="session_edit", deadline_seconds=settings.ANALYZE_REQUEST_DEADLINE_SECONDS)
+
+@router.put("/sessions/{session_id}/page-order", response_model=PromptAnalysisResponse, name="prompts:reorder_pages")
+async def reorder_session_pages(session_id: int, page_order: PageOrderUpdate, request: Request, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
+    db_session = get_owned_session_or_404(db, session_id, current_user)
+    entries_by_id = {entry.id: entry for entry in db_session.image_entries}
+    if sorted(page_order.entry_ids) != sorted(entries_by_id): raise HTTPException(status_code=400, detail="entry_ids must list every page of the session exactly once.")
+    ordered_pages = [entries_by_id[entry_id] for entry_id in page_order.entry_ids]
+    return await run_with_deadline_and_disconnect(request, apply_session_page_edit(db, current_user, db_session, ordered_pages), endpoint="session_edit", deadline_seconds=settings.ANALYZE_REQUEST_DEADLINE_SECONDS)
+
+@router.post("/sessions/{session_id}/reanalyze", response_model=PromptAnalysisResponse, name="prompts:reanalyze_session")
+async def reanalyze_session(session_id: int, request: Request, reanalyze: Optional[SessionReanalyzeRequest] = None, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
+    # Runs pages through vision again from their stored originals (no re-upload); the planner re-runs over all pages.
+    # Optional body: entry_ids (default: every page with a stored original) and only_failed.
+    reanalyze = reanalyze or SessionReanalyzeRequest()
+    db_session = get_owned_session_or_404(db, session_id, current_user)
+    entries = list(db_session.image_entries)
+    selected = entries
+    if reanalyze.entry_ids is not None:
+        requested_ids = set(reanalyze.entry_ids)
+        if requested_ids - {entry.id for entry in entries}: raise HTTPException(status_code=404, detail="Page not found in this session.")
+        selected = [entry for entry in entries if entry.id in requested_ids]
+    if reanalyze.only_failed:
+        selected = [entry for entry in selected if not isinstance(entry.analysis_output_json, dict) or entry.analysis_output_json.get("error")]
+    if not selected: raise HTTPException(status_code=400, detail="No pages to re-analyze.")
+    blobs = crud_image_blob.get_many(db, sha256s=[entry.image_sha256 for entry in selected if entry.image_sha256])
+    with contextlib.ExitStack() as open_uploads:
+        stored_uploads: Dict[int, StoredUpload] = {}
+        for entry in selected:
+            blob = blobs.get(entry.image_sha256) if entry.image_sha256 else None
+            stored_upload = open_stored_upload(blob, entry.original_filename) if blob is not None else None
+            if stored_upload is not None:
+                open_uploads.callback(stored_upload.file.close) # The mapping stays readable even if the blob is evicted meanwhile
+                stored_uploads[entry.id] = stored_upload
+        missing_ids = [entry.id for entry in selected if entry.id not in stored_uploads]
+        if not stored_uploads or (reanalyze.entry_ids is not None and missing_ids):
+            raise HTTPException(status_code=409, detail=f"No stored original for pages {missing_ids}; upload them again with PUT /sessions/{session_id}/pages/{{entry_id}}.")
+        ordered_pages: List[Union[ImageEntry, Tuple[UploadFile, str]]] = [(stored_uploads[entry.id], entry.title) if entry.id in stored_uploads else entry for entry in entries]
+        metrics.increment("blob_store.reanalyzed_pages", len(stored_uploads))
+        return await run_with_deadline_and_disconnect(request, apply_session_page_edit(db, current_user, db_session, ordered_pages), endpoint="session_reanalyze", deadline_seconds=settings.ANALYZE_REQUEST_DEADLINE_SECONDS)
@@ -0,0 +1,87 @@
+# app/api/api_v1/endpoints/usage.py
+import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.api.deps.user_deps import get_current_user
+from app.core.config import settings
+from app.crud.crud_llm_call import LLM_USAGE_GROUP_COLUMNS, llm_call as crud_llm_call
+from app.db.session import get_read_db
+from app.models.prompt_session import User as UserModel
+from app.schemas import LLMUsageSummary, LLMUsageSummaryRow
+
+router = APIRouter()
+
+
+def _summary_row(aggregate: Dict[str, Any], window_minutes: float) -> LLMUsageSummaryRow:
+    calls = int(aggregate["calls"])
+    total_latency_ms = float(aggregate["total_latency_ms"] or 0)
+    prompt_tokens = int(aggregate["prompt_tokens"])
+    completion_tokens = int(aggregate["completion_tokens"])
+    day = aggregate.get("day")
+    return LLMUsageSummaryRow(
+        user_id=aggregate.get("user"),
+        model=aggregate.get("model"),
+        stage=aggregate.get("stage"),
+        outcome=aggregate.get("outcome"),
+        day=str(day) if day is not None else None,
+        calls=calls,
+        failed_calls=int(aggregate["failed_calls"]),
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=int(aggregate["cached_tokens"]),
+        cached_prompt_fraction=round(int(aggregate["cached_tokens"]) / prompt_tokens, 4) if prompt_tokens else 0.0,
+        cost_usd=round(float(aggregate["cost_usd"]), 6) if aggregate["cost_usd"] is not None else None,
+        calls_without_cost=int(aggregate["calls_without_cost"]),
+        avg_latency_ms=round(total_latency_ms / calls, 3) if calls else 0.0,
+        max_latency_ms=aggregate["max_latency_ms"],
+        completion_tokens_per_second=round(completion_tokens / (total_latency_ms / 1000), 3) if total_latency_ms else 0.0,
+        calls_per_minute=round(calls / window_minutes, 4) if window_minutes else 0.0,
+    )
+
+
+@router.get("/summary", response_model=LLMUsageSummary, name="usage:summary")
+async def get_llm_usage_summary(
+    group_by: str = Query("model", description=f"Comma-separated: {', '.join(LLM_USAGE_GROUP_COLUMNS)}. Empty for totals only."),
+    since: Optional[datetime.datetime] = Query(None, description="Defaults to 7 days before `until`."),
+    until: Optional[datetime.datetime] = Query(None, description="Defaults to now."),
+    user_id: Optional[int] = Query(None, description="Admins only; other users always see their own calls."),
+    db: Session = Depends(get_read_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    """
+    Token usage, cost, latency and throughput of outbound LLM calls (llm_calls table), grouped by
+    user / model / stage / outcome / day. Admins see every user; other users only their own calls.
+    Rows are written in batches, so the last few seconds of calls may not be included yet.
+    """
+    group_keys: List[str] = [key.strip() for key in group_by.split(",") if key.strip()]
+    unknown_keys = [key for key in group_keys if key not in LLM_USAGE_GROUP_COLUMNS]
+    if unknown_keys:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by key(s): {', '.join(unknown_keys)}")
+    group_keys = list(dict.fromkeys(group_keys))
+
+    is_admin = bool(current_user.email) and current_user.email.lower() in settings.parsed_admin_emails
+    if not is_admin:
+        if user_id is not None and user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="The user doesn't have enough privileges")
+        user_id = current_user.id
+
+    until = until or datetime.datetime.now(datetime.timezone.utc)
+    since = since or until - datetime.timedelta(days=7)
+    if until.tzinfo is None: until = until.replace(tzinfo=datetime.timezone.utc)
+    if since.tzinfo is None: since = since.replace(tzinfo=datetime.timezone.utc)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="`since` must be before `until`.")
+    window_minutes = (until - since).total_seconds() / 60
+
+    rows = crud_llm_call.aggregate(db, group_by=group_keys, since=since, until=until, user_id=user_id)
+    totals = crud_llm_call.aggregate(db, group_by=[], since=since, until=until, user_id=user_id)
+    return LLMUsageSummary(
+        since=since,
+        until=until,
+        group_by=group_keys,
+        rows=[_summary_row(row, window_minutes) for row in rows],
+        totals=_summary_row(totals[0], window_minutes) if totals else LLMUsageSummaryRow(),
+    )
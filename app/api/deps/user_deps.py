@@ -6,7 +6,7 @@ from jose import JWTError # For catching JWT specific errors if needed beyond wh
 
 from app.core.config import settings
 from app.core.security import decode_access_token
-from app.db.session import get_db
+from app.db.session import get_db, get_read_db
 from app.models.prompt_session import User as UserModel # SQLAlchemy User model
 from app.schemas.token import TokenData
 from app.crud.crud_user import user as crud_user # User CRUD operations
@@ -20,7 +20,8 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db)
 ) -> UserModel:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -40,12 +41,20 @@ async def get_current_user(
         raise credentials_exception
         
     db_user = crud_user.get(db, id=user_id) # Use the generic get from CRUDBase
+    if db_user is None and db is not primary_db:
+        db_user = crud_user.get(primary_db, id=user_id) # Just signed up; the replica may not have the row yet
     if db_user is None:
         raise credentials_exception
     
     # You could add checks here like: if not db_user.is_active: raise HTTPException(...)
     return db_user
 
+async def get_current_admin_user(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+    # Admins are configured by email in ADMIN_EMAILS_CSV
+    if not current_user.email or current_user.email.lower() not in settings.parsed_admin_emails:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The user doesn't have enough privileges")
+    return current_user
+
 # Optional: A dependency for superuser access if you implement roles
 # def get_current_active_superuser(current_user: UserModel = Depends(get_current_user)) -> UserModel:
 #     if not crud_user.is_superuser(current_user): # Assumes is_superuser method/property in CRUDUser or UserModel
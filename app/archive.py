@@ -0,0 +1,63 @@
+# app/archive.py
+"""
+Archival of old session data into compressed cold partitions (PostgreSQL, DB_PARTITIONING_ENABLED;
+see app/db/partitioning.py). Meant to run from cron, e.g. monthly:
+
+    python -m app.archive                          # archive partitions older than ARCHIVE_AFTER_MONTHS
+    python -m app.archive --older-than-months 6 --dry-run
+    python -m app.archive --status                 # partitions with their sizes
+
+Each run also creates the upcoming monthly partitions. Archived sessions stay readable through the
+API as before; only their storage changes.
+"""
+import argparse
+import datetime
+
+from app.core.config import settings
+from app.db.partitioning import PARTITIONED_TABLES, archive_partitions, install_partitioning, is_partitioned, list_partitions, month_start, relation_size
+from app.db.session import engine
+
+
+def _mib(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+
+def print_status() -> None:
+    with engine.connect() as connection:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(connection, table):
+                print(f"--- {table}: not partitioned ---")
+                continue
+            partitions = list_partitions(connection, table)
+            print(f"--- {table}: {len(partitions)} partitions, {_mib(sum(relation_size(connection, p.name) for p in partitions))} ---")
+            for partition in partitions:
+                print(f"    {partition.name:<40} {_mib(relation_size(connection, partition.name)):>12}  {'cold' if partition.is_cold else 'hot '}  {partition.bound}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move old image_entries / generated_prompts partitions to compressed cold storage.")
+    parser.add_argument("--older-than-months", type=int, default=settings.ARCHIVE_AFTER_MONTHS, help="Archive months that ended at least this many months ago.")
+    parser.add_argument("--dry-run", action="store_true", help="List the partitions that would be archived.")
+    parser.add_argument("--status", action="store_true", help="Only print the partitions and their sizes.")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Partitioning and archival need PostgreSQL.")
+    if not settings.DB_PARTITIONING_ENABLED:
+        raise SystemExit("DB_PARTITIONING_ENABLED is off; enable it (the API converts the tables at startup) before archiving.")
+    if args.status:
+        print_status()
+        return
+    install_partitioning(engine)
+    cutoff = month_start(datetime.datetime.now(datetime.timezone.utc).date(), -max(0, args.older_than_months))
+    print(f"--- {'Would archive' if args.dry_run else 'Archiving'} partitions ending on or before {cutoff:%Y-%m-%d} ---")
+    results = archive_partitions(engine, cutoff, dry_run=args.dry_run)
+    for result in results:
+        pieces = ", ".join(f"{name}{f' {_mib(size)}' if size is not None else ''}" for name, size in result["pieces"].items())
+        print(f"    {result['partition']:<40} {_mib(result['bytes_before'])} -> {pieces}")
+    if not results:
+        print("    nothing to archive")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# app/blobs.py
+"""
+Maintenance of the stored originals (BLOB_STORE_DIR; see app/core/blob_store.py). Meant to run
+from cron, e.g. daily, on each host that serves the API:
+
+    python -m app.blobs --gc            # delete unreferenced blobs, orphan files, and evict down to BLOB_STORE_MAX_BYTES
+    python -m app.blobs --gc --dry-run
+    python -m app.blobs --status        # blob count and bytes, referenced vs unreferenced
+
+A blob is unreferenced once no page points at it (its sessions or pages were deleted, or the page
+was replaced) and it is kept for BLOB_STORE_GC_GRACE_SECONDS after its last use before it goes.
+"""
+import argparse
+
+from app.core.blob_store import collect_garbage
+from app.core.config import settings
+from app.crud.crud_image_blob import image_blob as crud_image_blob
+from app.db.image_blobs import install_image_blob_reference
+from app.db.session import SessionLocal, engine
+from app.models import prompt_session
+
+
+def _mib(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+
+def print_status() -> None:
+    db = SessionLocal()
+    try:
+        summary = crud_image_blob.reference_summary(db)
+    finally:
+        db.close()
+    quota = _mib(settings.BLOB_STORE_MAX_BYTES) if settings.BLOB_STORE_MAX_BYTES else "unlimited"
+    print(f"--- {settings.BLOB_STORE_DIR}: {summary['blobs']} blobs, {_mib(summary['bytes'])} of {quota} ---")
+    print(f"    unreferenced: {summary['unreferenced_blobs']} blobs, {_mib(summary['unreferenced_bytes'])}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Garbage-collect and inspect the stored original uploads.")
+    parser.add_argument("--gc", action="store_true", help="Delete unreferenced blobs and enforce BLOB_STORE_MAX_BYTES.")
+    parser.add_argument("--dry-run", action="store_true", help="With --gc: only report what would be deleted.")
+    parser.add_argument("--status", action="store_true", help="Only print the store's size.")
+    args = parser.parse_args()
+
+    # The CLI may run before the API has started against this database
+    prompt_session.Base.metadata.create_all(bind=engine, tables=[prompt_session.ImageBlob.__table__])
+    install_image_blob_reference(engine)
+    if args.status or not args.gc:
+        print_status()
+        return
+    print(f"--- {'Would collect' if args.dry_run else 'Collecting'} blobs unused for {settings.BLOB_STORE_GC_GRACE_SECONDS}s and not referenced by any page ---")
+    result = collect_garbage(dry_run=args.dry_run)
+    print(f"    unreferenced: {result['unreferenced_blobs']} blobs ({_mib(result['unreferenced_bytes'])})")
+    print(f"    over quota:   {result['evicted_blobs']} blobs ({_mib(result['evicted_bytes'])})")
+    print(f"    orphan files: {result['orphan_files']}, stale temp files: {result['temp_files']}")
+    print_status()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# app/core/admission.py
+"""
+Admission control and load shedding for expensive endpoints.
+
+Each request asks `AdmissionController.admit(user_id, cost)` for permission to run:
+
+1. Rate limit: the user's token bucket must hold `cost` tokens (e.g. one token per image).
+2. Concurrency: the user must be under the per-user cap and the process under the global cap.
+   Otherwise the request waits in a bounded FIFO queue. Waiters that are only blocked by their
+   own per-user cap do not hold up other users.
+3. Deadline: a request that cannot start within `max_queue_wait_seconds`, or that finds the
+   queue full, is rejected with 429 and a `Retry-After` estimate instead of piling up.
+
+State is per worker process. Queue depth, active requests, wait times and rejections are
+exported through `app.core.metrics`.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.deadline import remaining_seconds
+from app.core.metrics import metric_key, metrics
+
+
+class AdmissionRejected(HTTPException):
+    """429 with a Retry-After header. FastAPI turns it into the response directly."""
+
+    def __init__(self, reason: str, detail: str, retry_after_seconds: float):
+        self.reason = reason
+        self.retry_after_seconds = max(1, math.ceil(min(retry_after_seconds, 3600)))
+        super().__init__(status_code=429, detail=detail, headers={"Retry-After": str(self.retry_after_seconds)})
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def try_take(self, amount: float) -> float:
+        """Takes `amount` tokens and returns 0, or returns the seconds until they would be available."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        if self.refill_per_second <= 0:
+            return math.inf
+        return (amount - self.tokens) / self.refill_per_second
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Waiter:
+    __slots__ = ("user_id", "future", "enqueued_at")
+
+    def __init__(self, user_id: Any, future: asyncio.Future):
+        self.user_id = user_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        name: str,
+        *,
+        units_per_minute: float,
+        burst: int,
+        per_user_concurrency: int,
+        global_concurrency: int,
+        max_queue_depth: int,
+        max_queue_wait_seconds: float,
+        enabled: bool = True,
+    ):
+        self.name = name
+        self.units_per_minute = units_per_minute
+        self.burst = burst
+        self.per_user_concurrency = per_user_concurrency
+        self.global_concurrency = global_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+        self.enabled = enabled
+
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._active_by_user: Dict[Any, int] = {}
+        self._active_total = 0
+        self._queue: Deque[_Waiter] = deque()
+        # Exponentially weighted mean of how long an admitted request holds its slot,
+        # used for Retry-After estimates.
+        self._mean_hold_seconds = 10.0
+
+        metrics.register_gauge_callback(f"admission.{name}", self._gauges)
+
+    def _gauges(self) -> Dict[str, float]:
+        return {
+            metric_key("admission.active", {"controller": self.name}): self._active_total,
+            metric_key("admission.queue_depth", {"controller": self.name}): len(self._queue),
+            metric_key("admission.active_users", {"controller": self.name}): len(self._active_by_user),
+        }
+
+    def _bucket_for(self, user_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.burst, self.units_per_minute / 60.0)
+            if len(self._buckets) > 10000:
+                # Drop buckets that have refilled completely; they carry no state worth keeping.
+                for stale_user_id in [uid for uid, b in self._buckets.items() if uid != user_id and b.is_full()]:
+                    del self._buckets[stale_user_id]
+        return bucket
+
+    def _can_start(self, user_id: Any) -> bool:
+        return self._active_total < self.global_concurrency and self._active_by_user.get(user_id, 0) < self.per_user_concurrency
+
+    def _start(self, user_id: Any) -> None:
+        self._active_total += 1
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+
+    def _finish(self, user_id: Any, held_seconds: float) -> None:
+        self._active_total -= 1
+        remaining = self._active_by_user.get(user_id, 1) - 1
+        if remaining:
+            self._active_by_user[user_id] = remaining
+        else:
+            self._active_by_user.pop(user_id, None)
+        self._mean_hold_seconds = 0.8 * self._mean_hold_seconds + 0.2 * held_seconds
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        for waiter in list(self._queue):
+            if self._active_total >= self.global_concurrency:
+                break
+            if waiter.future.done():
+                self._queue.remove(waiter)
+                continue
+            if self._can_start(waiter.user_id):
+                self._queue.remove(waiter)
+                self._start(waiter.user_id)
+                waiter.future.set_result(True)
+
+    def _estimated_wait_seconds(self) -> float:
+        return self._mean_hold_seconds * (len(self._queue) + 1) / max(1, self.global_concurrency)
+
+    def _reject(self, reason: str, detail: str, retry_after_seconds: float) -> AdmissionRejected:
+        metrics.increment("admission.rejected", controller=self.name, reason=reason)
+        print(f"--- Admission '{self.name}' rejected request ({reason}): {detail} ---")
+        return AdmissionRejected(reason, detail, retry_after_seconds)
+
+    @asynccontextmanager
+    async def admit(self, user_id: Any, cost: int = 1) -> AsyncIterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        if cost > self.burst:
+            raise HTTPException(status_code=400, detail=f"Too many images in one request ({cost}); the limit is {self.burst}.")
+
+        bucket = self._bucket_for(user_id)
+        wait_for_tokens = bucket.try_take(cost)
+        if wait_for_tokens > 0:
+            raise self._reject("rate_limited", f"Image rate limit of {self.units_per_minute:g} per minute exceeded.", wait_for_tokens)
+
+        if not self._queue and self._can_start(user_id):
+            self._start(user_id)
+            metrics.observe("admission.queue_wait_seconds", 0.0, controller=self.name)
+        else:
+            if len(self._queue) >= self.max_queue_depth:
+                bucket.refund(cost)
+                raise self._reject("queue_full", "Server is busy, please retry shortly.", self._estimated_wait_seconds())
+            waiter = _Waiter(user_id, asyncio.get_running_loop().create_future())
+            self._queue.append(waiter)
+            # Waiters ahead of us may only be blocked by their own per-user cap.
+            self._wake_waiters()
+            remaining = remaining_seconds() # Don't queue past the request's own deadline
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_queue_wait_seconds if remaining is None else max(0.0, min(self.max_queue_wait_seconds, remaining)))
+            except asyncio.TimeoutError:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    if waiter in self._queue:
+                        self._queue.remove(waiter)
+                    bucket.refund(cost)
+                    raise self._reject("queue_timeout", "Server is busy, please retry shortly.", self._estimated_wait_seconds())
+            except asyncio.CancelledError:
+                # Client went away while queued. If we were granted a slot at the same moment, give it back.
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._finish(user_id, 0.0)
+                else:
+                    waiter.future.cancel()
+                    if waiter in self._queue:
+                        self._queue.remove(waiter)
+                bucket.refund(cost)
+                raise
+            metrics.observe("admission.queue_wait_seconds", time.monotonic() - waiter.enqueued_at, controller=self.name)
+
+        metrics.increment("admission.admitted", controller=self.name)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self._finish(user_id, time.monotonic() - started_at)
+
+
+analyze_admission = AdmissionController(
+    "analyze_image",
+    units_per_minute=settings.ADMISSION_IMAGES_PER_MINUTE_PER_USER,
+    burst=settings.ADMISSION_IMAGE_BURST_PER_USER,
+    per_user_concurrency=settings.ADMISSION_MAX_CONCURRENT_PER_USER,
+    global_concurrency=settings.ADMISSION_MAX_CONCURRENT_GLOBAL,
+    max_queue_depth=settings.ADMISSION_MAX_QUEUE_DEPTH,
+    max_queue_wait_seconds=settings.ADMISSION_MAX_QUEUE_WAIT_SECONDS,
+    enabled=settings.ADMISSION_CONTROL_ENABLED,
+)
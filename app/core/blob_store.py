@@ -0,0 +1,326 @@
+# app/core/blob_store.py
+"""
+Content-addressed store for original uploads on local disk, so sessions can be re-analyzed
+(POST /sessions/{id}/reanalyze) without the client uploading the screenshots again.
+
+Layout: a blob is named by the sha256 of its bytes and sharded two levels deep,
+`{BLOB_STORE_DIR}/ab/cd/abcd...`, with in-progress writes under `{BLOB_STORE_DIR}/tmp/`.
+The same image uploaded twice, by one user or several, is stored once.
+
+- Writes are atomic: the upload is streamed (hashing as it goes) into a temp file, fsynced and
+  renamed into place with os.replace, so a reader never sees a partial blob. Spooled uploads are
+  copied in chunks, never read into memory as a whole.
+- Metadata lives in `image_blobs` (size, content type, last use); ImageEntry.image_sha256 is the
+  reference. The row is written before the file is renamed into place, and a blob only becomes
+  garbage once no ImageEntry references it and it has not been used for
+  BLOB_STORE_GC_GRACE_SECONDS, so a request that stored a blob but has not committed its pages yet
+  is safe from a concurrent GC run.
+- Quotas: BLOB_STORE_MAX_BYTES bounds the whole store (`python -m app.blobs --gc` evicts the least
+  recently used blobs once it is exceeded; their pages simply can't be re-analyzed any more), and
+  BLOB_STORE_MAX_BYTES_PER_USER bounds the distinct bytes one user's pages reference (uploads
+  past it are analyzed as usual but not kept).
+- Stored blobs are read back through mmap: `StoredUpload` wraps the mapping in an UploadFile,
+  so re-analysis goes through the same vision path (memory budget, batching, tiling) as uploads.
+
+Keeping originals never fails a request: storage errors are logged and counted, and the page is
+stored without a reference. The store is local to the host; workers on one host share it.
+"""
+import asyncio
+import datetime
+import hashlib
+import mmap
+import os
+import time
+import uuid
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from fastapi import UploadFile
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tracing import span
+from app.crud.crud_image_blob import image_blob as crud_image_blob
+from app.db.session import SessionLocal
+from app.models.prompt_session import ImageBlob
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class StoredUpload(UploadFile):
+    """An UploadFile over a memory-mapped stored blob; `sha256` names the blob it came from."""
+
+    def __init__(self, mapped: mmap.mmap, sha256: str, filename: Optional[str], content_type: Optional[str]):
+        super().__init__(file=mapped, size=len(mapped), filename=filename, headers=Headers({"content-type": content_type or "application/octet-stream"}))
+        self.sha256 = sha256
+
+
+class BlobStore:
+    """The files; the `image_blobs` bookkeeping is done by the functions below."""
+
+    def __init__(self, root: str, *, fsync: bool = True):
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")
+        self.fsync = fsync
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def _fsync_dir(self, path: str) -> None:
+        if not self.fsync:
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def write_temp(self, source: BinaryIO) -> Tuple[str, str, int]:
+        """Copies `source` from its start into a temp file. Returns (temp path, sha256, size)."""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        temp_path = os.path.join(self.temp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        source.seek(0)
+        try:
+            with open(temp_path, "wb") as temp_file:
+                while chunk := source.read(COPY_CHUNK_BYTES):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+                if self.fsync:
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+        except BaseException:
+            self.discard_temp(temp_path)
+            raise
+        finally:
+            source.seek(0)
+        return temp_path, digest.hexdigest(), size
+
+    def discard_temp(self, temp_path: str) -> None:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def commit_temp(self, temp_path: str, sha256: str) -> bool:
+        """Moves a temp file into place. Returns False (dropping the temp file) if the blob already exists."""
+        final_path = self.path_for(sha256)
+        if os.path.exists(final_path):
+            self.discard_temp(temp_path)
+            return False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path) # Atomic; a concurrent writer of the same content replaces it with identical bytes
+        self._fsync_dir(os.path.dirname(final_path))
+        return True
+
+    def open_mapped(self, sha256: str) -> mmap.mmap:
+        """Read-only mapping of a blob. Raises FileNotFoundError if it is not on disk."""
+        with open(self.path_for(sha256), "rb") as blob_file:
+            return mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ) # Stays valid after the file is closed
+
+    def delete(self, sha256: str) -> bool:
+        try:
+            os.unlink(self.path_for(sha256))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def file_size(self, sha256: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path_for(sha256))
+        except FileNotFoundError:
+            return None
+
+    def iter_blob_names(self):
+        for shard in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            shard_path = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_path):
+                continue
+            for subshard in sorted(os.listdir(shard_path)):
+                subshard_path = os.path.join(shard_path, subshard)
+                if os.path.isdir(subshard_path):
+                    yield from (name for name in os.listdir(subshard_path) if len(name) == 64)
+
+    def remove_stale_temp_files(self, older_than_seconds: float) -> int:
+        removed = 0
+        if not os.path.isdir(self.temp_dir):
+            return removed
+        cutoff = time.time() - older_than_seconds
+        for name in os.listdir(self.temp_dir):
+            path = os.path.join(self.temp_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+blob_store = BlobStore(settings.BLOB_STORE_DIR, fsync=settings.BLOB_STORE_FSYNC)
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _remove_blob_file(db: Session, sha256: str) -> None:
+    # Someone may have stored the same image again between our row delete and now; their row wins.
+    if not crud_image_blob.exists(db, sha256=sha256):
+        blob_store.delete(sha256)
+
+
+def evict_over_quota(db: Session, max_bytes: int, *, dry_run: bool = False) -> Dict[str, int]:
+    """Evicts least recently used blobs until the store is within `max_bytes`."""
+    total = crud_image_blob.total_bytes(db)
+    evicted = {"blobs": 0, "bytes": 0}
+    while total > max_bytes:
+        candidates = crud_image_blob.least_recently_used(db, limit=None if dry_run else 100) # A dry run deletes nothing, so it looks at all of them at once
+        if not candidates:
+            break
+        for blob in candidates:
+            if total <= max_bytes:
+                break
+            if dry_run or crud_image_blob.delete_if_unused_since(db, sha256=blob.sha256, last_used_at=blob.last_used_at):
+                if not dry_run:
+                    _remove_blob_file(db, blob.sha256)
+                total -= blob.size_bytes
+                evicted["blobs"] += 1
+                evicted["bytes"] += blob.size_bytes
+        if dry_run:
+            break
+    if evicted["blobs"] and not dry_run:
+        metrics.increment("blob_store.evicted", evicted["blobs"])
+        print(f"--- Blob store over its {max_bytes} byte quota: evicted {evicted['blobs']} blobs ({evicted['bytes']} bytes) ---")
+    metrics.set_gauge("blob_store.bytes", total)
+    return evicted
+
+
+def _store_upload(source: BinaryIO, content_type: Optional[str], owner_id: int, pending: Dict[str, int]) -> Optional[Tuple[str, int]]:
+    """Keeps one upload. Returns (sha256, bytes newly charged to the owner), or None if the owner's quota is used up."""
+    temp_path, sha256, size = blob_store.write_temp(source)
+    db = SessionLocal()
+    try:
+        charged_bytes = 0
+        pending_bytes = sum(pending.values())
+        if sha256 not in pending and not crud_image_blob.is_referenced_by_owner(db, owner_id=owner_id, sha256=sha256):
+            charged_bytes = size
+            if settings.BLOB_STORE_MAX_BYTES_PER_USER and crud_image_blob.bytes_referenced_by_owner(db, owner_id=owner_id) + pending_bytes + size > settings.BLOB_STORE_MAX_BYTES_PER_USER:
+                blob_store.discard_temp(temp_path)
+                metrics.increment("blob_store.skipped", reason="user_quota")
+                return None
+        crud_image_blob.record_upload(db, sha256=sha256, size_bytes=size, content_type=content_type)
+        created = blob_store.commit_temp(temp_path, sha256)
+        metrics.increment("blob_store.writes", result="stored" if created else "deduplicated")
+        if created:
+            metrics.increment("blob_store.bytes_written", size)
+        return sha256, charged_bytes
+    except BaseException:
+        blob_store.discard_temp(temp_path)
+        raise
+    finally:
+        db.close()
+
+
+def _touch(sha256s: List[str]) -> None:
+    db = SessionLocal()
+    try:
+        crud_image_blob.touch(db, sha256s=sha256s)
+    finally:
+        db.close()
+
+
+async def store_uploads(uploads: List[UploadFile], owner_id: int) -> List[Optional[str]]:
+    """
+    Keeps the original of every image upload; returns each upload's sha256, or None where it was not
+    kept (store disabled, not an image, empty, over the owner's quota, or a storage error).
+    StoredUploads (re-analysis) already are blobs: they are only marked as used.
+    """
+    hashes: List[Optional[str]] = [None] * len(uploads)
+    if not settings.BLOB_STORE_ENABLED:
+        return hashes
+    pending: Dict[str, int] = {} # Charged to the owner by earlier uploads of this request, whose pages aren't saved yet
+    with span("blob_store"):
+        for index, upload in enumerate(uploads):
+            if isinstance(upload, StoredUpload):
+                hashes[index] = upload.sha256
+                continue
+            if not upload.content_type or not upload.content_type.startswith("image/") or not upload.size:
+                continue
+            try:
+                stored = await asyncio.to_thread(_store_upload, upload.file, upload.content_type, owner_id, dict(pending))
+            except Exception as e:
+                print(f"--- Could not keep the original of {upload.filename}: {e} ---")
+                metrics.increment("blob_store.skipped", reason="error")
+                continue
+            if stored is not None:
+                hashes[index], charged_bytes = stored
+                pending[hashes[index]] = pending.get(hashes[index], 0) + charged_bytes
+        reused = [upload.sha256 for upload in uploads if isinstance(upload, StoredUpload)]
+        if reused:
+            await asyncio.to_thread(_touch, reused)
+    return hashes
+
+
+def open_stored_upload(blob: ImageBlob, filename: Optional[str]) -> Optional[StoredUpload]:
+    """The stored original as an UploadFile (close it when done), or None if its file is gone."""
+    try:
+        mapped = blob_store.open_mapped(blob.sha256)
+    except (FileNotFoundError, ValueError): # ValueError: empty file, can't be mapped
+        metrics.increment("blob_store.missing_files")
+        return None
+    return StoredUpload(mapped, blob.sha256, filename, blob.content_type)
+
+
+def collect_garbage(*, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Deletes blobs no page references (unused for BLOB_STORE_GC_GRACE_SECONDS), files without a row,
+    abandoned temp files, and evicts down to BLOB_STORE_MAX_BYTES. Meant for `python -m app.blobs --gc`.
+    """
+    grace = datetime.timedelta(seconds=settings.BLOB_STORE_GC_GRACE_SECONDS)
+    used_before = _utcnow() - grace
+    result = {"unreferenced_blobs": 0, "unreferenced_bytes": 0, "orphan_files": 0, "temp_files": 0, "evicted_blobs": 0, "evicted_bytes": 0}
+    db = SessionLocal()
+    try:
+        seen = set() # Rows that lost the delete race (used again meanwhile) come back in the next batch
+        while True:
+            candidates = [blob for blob in crud_image_blob.unreferenced(db, used_before=used_before, limit=None if dry_run else 500) if blob.sha256 not in seen]
+            if not candidates:
+                break
+            for blob in candidates:
+                seen.add(blob.sha256)
+                if dry_run or crud_image_blob.delete_if_unreferenced(db, sha256=blob.sha256, used_before=used_before):
+                    if not dry_run:
+                        _remove_blob_file(db, blob.sha256)
+                    result["unreferenced_blobs"] += 1
+                    result["unreferenced_bytes"] += blob.size_bytes
+
+        # Files whose row is gone (an interrupted GC or eviction, or a restored database)
+        orphan_cutoff = time.time() - grace.total_seconds()
+        names = list(blob_store.iter_blob_names())
+        for chunk_start in range(0, len(names), 500):
+            chunk = names[chunk_start:chunk_start + 500]
+            known = crud_image_blob.get_many(db, sha256s=chunk)
+            for orphan in (name for name in chunk if name not in known):
+                try:
+                    if os.path.getmtime(blob_store.path_for(orphan)) >= orphan_cutoff:
+                        continue # Recent files are left to the next run
+                except FileNotFoundError:
+                    continue
+                if not dry_run:
+                    blob_store.delete(orphan)
+                result["orphan_files"] += 1
+
+        if not dry_run:
+            result["temp_files"] = blob_store.remove_stale_temp_files(grace.total_seconds())
+        if settings.BLOB_STORE_MAX_BYTES:
+            evicted = evict_over_quota(db, settings.BLOB_STORE_MAX_BYTES, dry_run=dry_run)
+            result["evicted_blobs"], result["evicted_bytes"] = evicted["blobs"], evicted["bytes"]
+    finally:
+        db.close()
+    if not dry_run:
+        metrics.increment("blob_store.gc_deleted", result["unreferenced_blobs"] + result["orphan_files"])
+    return result
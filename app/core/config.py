@@ -1,7 +1,8 @@
 import os
+from functools import cached_property
 # from dotenv import load_dotenv # We'll let Pydantic handle .env loading directly
 from pydantic_settings import BaseSettings, SettingsConfigDict # Import SettingsConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 # env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
 # dotenv_loaded = load_dotenv(dotenv_path=env_path) # REMOVE this global load_dotenv
@@ -47,6 +48,176 @@ class Settings(BaseSettings):
 12. Ensure all HTML is semantic and accessible (ARIA attributes where appropriate).
 \n"""
 
+    # Store detected_elements_tree in the flat columnar form (app/schemas/element_columns.py)
+    STORE_ELEMENT_TREE_COLUMNAR: bool = False
+    # Runs of ELEMENT_REPEAT_MIN_COUNT+ sibling subtrees that differ only in text/ids/boxes (card grids,
+    # tables, lists) are written once as a template + repeat count + variants: in stored analyses
+    # (`detected_elements_compact`, unless STORE_ELEMENT_TREE_COLUMNAR is on), the prompt's element
+    # tree and the planner encodings. See app/schemas/element_repeats.py.
+    ELEMENT_REPEAT_COMPACTION_ENABLED: bool = True
+    ELEMENT_REPEAT_MIN_COUNT: int = 3
+    # How page analyses are encoded for the planner: "json" (full nested JSON) or
+    # "compact" (JSON without the element tree + a one-line-per-node outline of the tree)
+    PLANNER_ANALYSIS_ENCODING: str = "json"
+
+    # Admission control for /analyze-image (per worker process)
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_IMAGES_PER_MINUTE_PER_USER: float = 30.0
+    ADMISSION_IMAGE_BURST_PER_USER: int = 30 # Also the max number of images in a single request
+    ADMISSION_MAX_CONCURRENT_PER_USER: int = 2
+    ADMISSION_MAX_CONCURRENT_GLOBAL: int = 8
+    ADMISSION_MAX_QUEUE_DEPTH: int = 32
+    ADMISSION_MAX_QUEUE_WAIT_SECONDS: float = 30.0
+
+    # Outbound LLM governor (per worker, app/core/llm_governor.py): every vision/planner call takes a
+    # per-model concurrency slot and requests-per-minute token first; waiting calls are served by weighted
+    # fair queuing across (priority class, user) flows, weighted by LLM_PRIORITY_WEIGHTS_CSV.
+    # Per-model limits as "model=concurrency:rpm" (rpm 0 = only what the provider's headers say).
+    # A 429 pauses the model for its Retry-After and halves its concurrency; the call is retried
+    # up to LLM_RATE_LIMIT_RETRIES times once the pause is over
+    LLM_GOVERNOR_ENABLED: bool = True
+    LLM_MAX_CONCURRENT_PER_MODEL: int = 16
+    LLM_REQUESTS_PER_MINUTE_PER_MODEL: float = 0.0
+    LLM_MODEL_LIMITS_CSV: str = ""
+    LLM_PRIORITY_WEIGHTS_CSV: str = "interactive=8,batch=1"
+    LLM_RATE_LIMIT_RETRIES: int = 2
+    LLM_RATE_LIMIT_DEFAULT_BACKOFF_SECONDS: float = 2.0 # 429 without Retry-After / reset headers
+    LLM_RATE_LIMIT_MAX_BACKOFF_SECONDS: float = 60.0
+
+    # Multipart uploads (/analyze-image, session page edits): file parts are spooled to temp files (in
+    # memory up to UPLOAD_SPOOL_MAX_MEMORY_BYTES, then on disk); bigger files or bodies are rejected with 413
+    UPLOAD_MAX_FILE_BYTES: int = 25 * 1024 * 1024
+    UPLOAD_MAX_REQUEST_BYTES: int = 200 * 1024 * 1024
+    UPLOAD_MAX_FILES: int = 50
+    UPLOAD_SPOOL_MAX_MEMORY_BYTES: int = 1024 * 1024
+    # Per-worker cap on the estimated memory of images being read, decoded and sent to the vision model
+    # at once (app/core/uploads.py); pages wait for room, one larger than the whole budget runs alone
+    IMAGE_MEMORY_BUDGET_BYTES: int = 256 * 1024 * 1024
+
+    # Duplicate submissions: in-process coalescing of identical in-flight requests, and
+    # Idempotency-Key replays of stored responses within the TTL
+    REQUEST_COALESCING_ENABLED: bool = True
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+    IDEMPOTENCY_IN_PROGRESS_TIMEOUT_SECONDS: int = 900 # After this an in-progress claim is considered abandoned
+
+    # Batched vision: up to N screenshots per vision request, schema instructions sent once.
+    # Per-model sizes as "model=N,model=N"; unlisted models use VISION_BATCH_SIZE_DEFAULT (1 = one image per request)
+    VISION_BATCH_SIZE_DEFAULT: int = 1
+    VISION_BATCH_SIZES_BY_MODEL_CSV: str = ""
+    # Mark the static vision instruction prefix with an explicit cache_control breakpoint
+    # (some providers behind OpenRouter only cache marked prefixes)
+    VISION_PROMPT_CACHE_CONTROL: bool = False
+
+    # Tall screenshots (full-page captures) are split into overlapping horizontal bands that are
+    # analyzed concurrently and merged back into one analysis. An image is tiled when it is at
+    # least VISION_TILE_MIN_ASPECT_RATIO times taller than wide or VISION_TILE_MIN_HEIGHT_PX tall.
+    # Bands are VISION_TILE_BAND_ASPECT_RATIO * width tall (fewer, taller bands past VISION_TILE_MAX_TILES).
+    VISION_TILING_ENABLED: bool = True
+    VISION_TILE_MIN_ASPECT_RATIO: float = 3.0
+    VISION_TILE_MIN_HEIGHT_PX: int = 6000
+    VISION_TILE_BAND_ASPECT_RATIO: float = 1.5
+    VISION_TILE_OVERLAP_PX: int = 240
+    VISION_TILE_MAX_TILES: int = 12
+    VISION_TILE_CONCURRENCY: int = 4
+
+    # Streamed vision responses: each top-level section is validated as soon as it closes and the
+    # stream is aborted (and retried) on malformed or repeating output; the element tree is cut
+    # at VISION_STREAM_MAX_ELEMENT_NODES nodes.
+    VISION_STREAMING_ENABLED: bool = True
+    VISION_STREAM_MAX_ATTEMPTS: int = 2
+    VISION_STREAM_MAX_ELEMENT_NODES: int = 1500
+    VISION_STREAM_MAX_REPEATED_SIBLINGS: int = 25 # Consecutive sibling nodes identical apart from digits
+    VISION_STREAM_MAX_STRING_CHARS: int = 20000
+
+    # End-to-end budget for /analyze-image and session edits (all vision + planner calls); the work
+    # is also cancelled when the client disconnects. Analyses cancelled part-way are either
+    # "discard"ed or saved as a partial session ("save_partial") that can be completed page by page.
+    ANALYZE_REQUEST_DEADLINE_SECONDS: float = 1200.0
+    CANCELLED_ANALYSIS_POLICY: str = "discard"
+
+    # Hierarchical planning for large sessions: from PLANNER_HIERARCHICAL_MIN_PAGES pages on, groups of
+    # PLANNER_MAP_PAGES_PER_GROUP pages are summarized into compact section plans in parallel (map) and
+    # the final plan is written from those (reduce). Smaller sessions use a single planner call.
+    PLANNER_HIERARCHICAL_ENABLED: bool = True
+    PLANNER_HIERARCHICAL_MIN_PAGES: int = 10
+    PLANNER_MAP_PAGES_PER_GROUP: int = 4
+    PLANNER_MAP_CONCURRENCY: int = 4
+    PLANNER_MAP_MAX_TOKENS: int = 1500
+    PLANNER_SECTION_PLAN_MAX_WORDS: int = 600
+
+    # Per-call LLM telemetry (llm_calls table): rows are buffered per worker and inserted in batches of
+    # LLM_CALL_LOG_BATCH_SIZE or every LLM_CALL_LOG_FLUSH_SECONDS. Costs come from the provider's usage
+    # block when present, else from LLM_PRICING_CSV: "model=prompt:completion:cached" in USD per
+    # million tokens (cached defaults to the prompt price), e.g. "google/gemini-2.5-pro=1.25:10:0.31".
+    LLM_CALL_LOG_ENABLED: bool = True
+    LLM_CALL_LOG_BATCH_SIZE: int = 50
+    LLM_CALL_LOG_FLUSH_SECONDS: float = 5.0
+    LLM_CALL_LOG_MAX_BUFFER: int = 10000 # Oldest rows are dropped beyond this (e.g. while the DB is down)
+    LLM_PRICING_CSV: str = ""
+
+    # Model tiering: simple pages / small projects go to the small models; output that fails
+    # validation or looks incomplete is retried on the large model. Off unless a small model is set.
+    MODEL_TIERING_ENABLED: bool = True
+    OPENROUTER_SMALL_MODEL_IDENTIFIER: Optional[str] = None # e.g. "google/gemini-2.5-flash"
+    OPENROUTER_SMALL_PLANNER_MODEL_IDENTIFIER: Optional[str] = None
+    VISION_MAX_TOKENS_SMALL: int = 32000
+    VISION_MAX_TOKENS_LARGE: int = 500000
+    PLANNER_MAX_TOKENS_SMALL: int = 2500
+    PLANNER_MAX_TOKENS_LARGE: int = 3500
+    TIER_SMALL_MAX_IMAGE_PIXELS: int = 1920 * 1200
+    TIER_SMALL_MAX_IMAGE_ENTROPY: float = 6.0 # bits (grayscale, 0-8)
+    TIER_SMALL_MAX_ESTIMATED_ELEMENTS: int = 120
+    TIER_SMALL_MAX_PAGES: int = 2
+    TIER_SMALL_MAX_PLANNER_ELEMENTS: int = 300
+
+    # Connection pools (per engine, per worker process). With pool recycling in place the per-checkout
+    # pre-ping round trip can be turned off; a dropped connection then fails one query and the pool is reset.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800 # -1 disables recycling
+    DB_POOL_PRE_PING: bool = True
+    # Optional read replica for history, search, export and auth lookups. Reads fall back to the
+    # primary when it is unset, disabled, or unreachable (retried after DATABASE_READ_REPLICA_RETRY_SECONDS).
+    DATABASE_READ_REPLICA_URL: Optional[str] = None
+    DATABASE_READ_REPLICA_ENABLED: bool = True
+    DATABASE_READ_REPLICA_RETRY_SECONDS: float = 30.0
+
+    # /history on PostgreSQL: the response JSON is built by the database (json_build_object/json_agg)
+    # and streamed as raw bytes instead of going through ORM objects and pydantic
+    HISTORY_SQL_JSON_ENABLED: bool = True
+    # Weak ETags on /history and /sessions/{id} from per-user counts and updated_at timestamps;
+    # a matching If-None-Match gets a 304 before the history query runs (app/core/etags.py)
+    HISTORY_ETAGS_ENABLED: bool = True
+
+    # Full-text search over session history (/history/search). On PostgreSQL a tsvector column kept in
+    # sync by triggers plus a GIN index; other databases fall back to substring matching.
+    HISTORY_SEARCH_TEXT_CONFIG: str = "english" # PostgreSQL text search configuration
+    HISTORY_SEARCH_MAX_PROMPT_CHARS: int = 200000 # Per prompt; tsvector values are capped at 1MB
+
+    # Monthly range partitions (by created_at) for the large child tables, image_entries and
+    # generated_prompts, on PostgreSQL (app/db/partitioning.py). Opt-in: the first startup with it
+    # enabled converts the existing tables in place. `python -m app.archive` rewrites partitions older
+    # than ARCHIVE_AFTER_MONTHS as compressed cold partitions (optionally in ARCHIVE_TABLESPACE).
+    DB_PARTITIONING_ENABLED: bool = False
+    DB_PARTITION_MONTHS_AHEAD: int = 3
+    ARCHIVE_AFTER_MONTHS: int = 12
+    ARCHIVE_COMPRESSION: str = "lz4" # TOAST compression of the cold copies; pglz if the server lacks lz4
+    ARCHIVE_TABLESPACE: Optional[str] = None
+
+    # Original uploads kept in a content-addressed store on local disk (app/core/blob_store.py), so
+    # sessions can be re-analyzed without a new upload (opt-in). Identical images are stored once and
+    # written while the planner runs. Blobs no session references are deleted by `python -m app.blobs --gc`
+    # after BLOB_STORE_GC_GRACE_SECONDS; the same job evicts the least recently used blobs past
+    # BLOB_STORE_MAX_BYTES. Uploads that would take a user past BLOB_STORE_MAX_BYTES_PER_USER are
+    # analyzed but not kept (0 = no per-user limit).
+    BLOB_STORE_ENABLED: bool = False
+    BLOB_STORE_DIR: str = "blob_store"
+    BLOB_STORE_MAX_BYTES: int = 20 * 1024 * 1024 * 1024
+    BLOB_STORE_MAX_BYTES_PER_USER: int = 2 * 1024 * 1024 * 1024
+    BLOB_STORE_GC_GRACE_SECONDS: int = 24 * 3600 # Also covers blobs written by requests still in flight
+    BLOB_STORE_FSYNC: bool = True
+
     # Active AI Provider Setting
     ACTIVE_AI_PROVIDER: str = "GEMINI" # Default to GEMINI if not set in .env
 
@@ -55,12 +226,81 @@ class Settings(BaseSettings):
 
     FRONTEND_URL: str = "http://localhost:3000"
 
-    @property
+    # Comma-separated list of admin emails (can request per-request profiles, etc.)
+    ADMIN_EMAILS_CSV: str = ""
+
+    # Request tracing (Server-Timing header + JSON trace log) and on-demand profiling
+    TRACING_ENABLED: bool = True
+    TRACE_LOG_JSON: bool = True
+    PROFILER_SAMPLE_INTERVAL_MS: float = 5.0
+    PROFILE_OUTPUT_DIR: str = "profiles"
+
+    # The parsed_* views of the CSV settings are built on first use and kept: settings are loaded once at
+    # startup, and some of these are read per request (admin checks, vision batch sizes).
+    @cached_property
+    def parsed_llm_pricing(self) -> Dict[str, Tuple[float, float, float]]:
+        pricing: Dict[str, Tuple[float, float, float]] = {}
+        for item in self.LLM_PRICING_CSV.split(","):
+            model, _, prices = item.strip().rpartition("=")
+            if not model or not prices:
+                continue
+            try:
+                values = [float(value) for value in prices.split(":")]
+            except ValueError:
+                print(f"WARNING: Ignoring invalid LLM_PRICING_CSV entry '{item}'")
+                continue
+            prompt_price, completion_price = values[0], values[1] if len(values) > 1 else values[0]
+            pricing[model.strip()] = (prompt_price, completion_price, values[2] if len(values) > 2 else prompt_price)
+        return pricing
+
+    @cached_property
     def parsed_cors_origins(self) -> List[str]: # Renamed property for clarity
         if isinstance(self.BACKEND_CORS_ORIGINS_CSV, str):
             return [origin.strip() for origin in self.BACKEND_CORS_ORIGINS_CSV.split(",") if origin.strip()]
         return [] # Return empty list if not a string (e.g. if directly set as list by other means)
 
+    @cached_property
+    def parsed_admin_emails(self) -> List[str]:
+        return [email.strip().lower() for email in self.ADMIN_EMAILS_CSV.split(",") if email.strip()]
+
+    @cached_property
+    def parsed_vision_batch_sizes(self) -> Dict[str, int]:
+        batch_sizes = {}
+        for item in self.VISION_BATCH_SIZES_BY_MODEL_CSV.split(","):
+            model, _, size = item.rpartition("=")
+            if model.strip() and size.strip().isdigit():
+                batch_sizes[model.strip()] = max(1, int(size))
+        return batch_sizes
+
+    def vision_batch_size_for_model(self, model: Optional[str]) -> int:
+        return self.parsed_vision_batch_sizes.get(model or "", max(1, self.VISION_BATCH_SIZE_DEFAULT))
+
+    @cached_property
+    def parsed_llm_model_limits(self) -> Dict[str, Tuple[int, float]]:
+        limits: Dict[str, Tuple[int, float]] = {}
+        for item in self.LLM_MODEL_LIMITS_CSV.split(","):
+            model, _, values = item.strip().rpartition("=")
+            if not model or not values:
+                continue
+            concurrency, _, requests_per_minute = values.partition(":")
+            try:
+                limits[model.strip()] = (max(1, int(concurrency or self.LLM_MAX_CONCURRENT_PER_MODEL)), max(0.0, float(requests_per_minute or self.LLM_REQUESTS_PER_MINUTE_PER_MODEL)))
+            except ValueError:
+                print(f"WARNING: Ignoring invalid LLM_MODEL_LIMITS_CSV entry '{item}'")
+        return limits
+
+    @cached_property
+    def parsed_llm_priority_weights(self) -> Dict[str, float]:
+        weights: Dict[str, float] = {}
+        for item in self.LLM_PRIORITY_WEIGHTS_CSV.split(","):
+            priority, _, weight = item.strip().partition("=")
+            try:
+                if priority and float(weight) > 0:
+                    weights[priority.strip()] = float(weight)
+            except ValueError:
+                print(f"WARNING: Ignoring invalid LLM_PRIORITY_WEIGHTS_CSV entry '{item}'")
+        return weights
+
     # Pydantic V2 way to configure .env file loading for BaseSettings
     model_config = SettingsConfigDict(
         env_file=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env'),
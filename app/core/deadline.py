@@ -0,0 +1,116 @@
+# app/core/deadline.py
+"""
+Request deadlines and client-disconnect cancellation for long-running endpoints.
+
+`run_with_deadline_and_disconnect(request, work, ...)` runs the endpoint's work under a
+request-level deadline (a contextvar, inherited by every task the work starts) and watches the
+ASGI receive channel for `http.disconnect`. If the client goes away or the deadline passes, the
+work is cancelled, which cancels any in-flight vision/planner request.
+
+Outbound calls wrap themselves in `outbound_call(stage, default_timeout)`: it fails fast when the
+deadline has already passed, clips the HTTP timeout to the remaining budget, and counts calls
+that were cancelled mid-flight.
+"""
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+from fastapi import HTTPException, Request
+
+from app.core.metrics import metrics
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(status_code=504, detail=f"Request deadline exceeded ({stage}).")
+
+
+class ClientDisconnected(HTTPException):
+    # 499 is the de-facto "client closed request" status; nobody is left to read it.
+    def __init__(self):
+        super().__init__(status_code=499, detail="Client closed the request.")
+
+
+def remaining_seconds() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(stage: str) -> None:
+    remaining = remaining_seconds()
+    if remaining is not None and remaining <= 0:
+        metrics.increment("cancellation.deadline_exceeded", stage=stage)
+        raise DeadlineExceeded(stage)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """Sets a deadline `seconds` from now (never later than an enclosing one)."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def outbound_call(stage: str, default_timeout: float) -> Iterator[float]:
+    """Yields the timeout to use for one outbound request (default, clipped to the remaining budget)."""
+    check_deadline(stage)
+    remaining = remaining_seconds()
+    try:
+        yield default_timeout if remaining is None else max(0.1, min(default_timeout, remaining))
+    except asyncio.CancelledError:
+        metrics.increment("cancellation.outbound_calls_cancelled", stage=stage)
+        raise
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # Only valid once the request body has been consumed: from then on the next ASGI message
+    # is http.disconnect, sent when the client goes away (or after the response is complete).
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_with_deadline_and_disconnect(request: Request, work: Awaitable[T], *, endpoint: str, deadline_seconds: Optional[float]) -> T:
+    with deadline_scope(deadline_seconds):
+        work_task = asyncio.ensure_future(work)
+        disconnect_task = asyncio.ensure_future(_wait_for_disconnect(request))
+        remaining = remaining_seconds()
+        try:
+            done, _ = await asyncio.wait({work_task, disconnect_task}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            work_task.cancel()
+            raise
+        finally:
+            disconnect_task.cancel()
+
+        if work_task in done:
+            return work_task.result()
+
+        work_task.cancel()
+        try:
+            await work_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        if disconnect_task in done and not disconnect_task.cancelled():
+            print(f"--- Client disconnected during {endpoint}, cancelled in-flight work ---")
+            metrics.increment("cancellation.client_disconnects", endpoint=endpoint)
+            raise ClientDisconnected()
+        print(f"--- {endpoint} exceeded its {deadline_seconds}s deadline, cancelled in-flight work ---")
+        metrics.increment("cancellation.deadline_exceeded", stage=endpoint)
+        raise DeadlineExceeded(endpoint)
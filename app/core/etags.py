@@ -0,0 +1,58 @@
+# app/core/etags.py
+"""
+Weak ETags and If-None-Match handling for polled read endpoints (/history, /sessions/{id}).
+
+The tag is computed from cheap per-user state (row counts and `updated_at` values read through
+an index) rather than from the response body, so a matching If-None-Match can be answered with
+304 before the heavy query and serialization run. Tags are weak: the body is only
+semantically the same for a given tag, not byte-identical (e.g. JSON built by PostgreSQL vs pydantic).
+"""
+import datetime
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+from app.core.metrics import metrics
+
+# Sent with every tagged response: the browser may store it but must revalidate before each use
+CACHE_CONTROL = "private, no-cache"
+
+
+def _part(value: Any) -> str:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return "" if value is None else str(value)
+
+
+def weak_etag(*parts: Any) -> str:
+    """W/"<hash>" over `parts` (ids, counts, timestamps, query parameters)."""
+    digest = hashlib.sha256("\0".join(_part(part) for part in parts).encode("utf-8")).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison (RFC 9110 13.1.2): the W/ prefix is ignored on both sides
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque_tag:
+            return True
+    return False
+
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified_response(request: Request, etag: str, endpoint: str) -> Optional[Response]:
+    """A 304 response if the request's If-None-Match matches `etag`, else None."""
+    if not etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.increment("http.etag_misses", endpoint=endpoint)
+        return None
+    metrics.increment("http.not_modified", endpoint=endpoint)
+    return Response(status_code=304, headers=etag_headers(etag))
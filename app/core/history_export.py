@@ -0,0 +1,112 @@
+# app/core/history_export.py
+"""
+Streaming export of a user's full history (GET /prompts/history/export).
+
+Records come from `crud_prompt_session.iter_export_records` (server-side cursors, no ORM graphs)
+and are serialized one session per line as NDJSON, optionally inside a zip that is written to the
+response as it is produced. Output is flushed in ~EXPORT_CHUNK_BYTES chunks, so memory use stays
+flat whatever the size of the history.
+
+The generators open their own DB session: a StreamingResponse body runs after the endpoint (and
+its request-scoped dependencies) has returned.
+"""
+import datetime
+import json
+import zipfile
+from typing import Any, Callable, Dict, Iterator, List
+
+from sqlalchemy.orm import Session
+
+from app.core.metrics import metrics
+from app.crud.crud_prompt_session import prompt_session as crud_prompt_session
+from app.schemas.prompt import ANALYSIS_STORAGE_FORMAT_KEY
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FETCH_BATCH_SIZE = 500
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _expand_stored_analysis(analysis: Any) -> Any:
+    # Same as RichImageAnalysisSchema's validator: columnar and compacted trees are exported in the nested form
+    if isinstance(analysis, dict) and ANALYSIS_STORAGE_FORMAT_KEY in analysis:
+        analysis = {key: value for key, value in analysis.items() if key != ANALYSIS_STORAGE_FORMAT_KEY} # Internal stamp, see /history
+    if isinstance(analysis, dict) and analysis.get("detected_elements_columns") and not analysis.get("detected_elements_tree"):
+        from app.schemas.element_columns import ColumnarElementTree
+        analysis = dict(analysis)
+        analysis["detected_elements_tree"] = ColumnarElementTree.from_storage(analysis.pop("detected_elements_columns")).to_dicts()
+    elif isinstance(analysis, dict) and analysis.get("detected_elements_compact") and not analysis.get("detected_elements_tree"):
+        from app.schemas.element_repeats import expand_compact_storage
+        analysis = dict(analysis)
+        analysis["detected_elements_tree"] = expand_compact_storage(analysis.pop("detected_elements_compact"))
+    return analysis
+
+
+def export_record_to_json_line(record: Dict[str, Any]) -> bytes:
+    for entry in record["image_entries"]:
+        entry["analysis_output_json"] = _expand_stored_analysis(entry["analysis_output_json"])
+    return json.dumps(record, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _iter_json_lines(session_factory: Callable[[], Session], owner_id: int) -> Iterator[bytes]:
+    db = session_factory()
+    exported = 0
+    try:
+        for record in crud_prompt_session.iter_export_records(db, owner_id=owner_id, batch_size=EXPORT_FETCH_BATCH_SIZE):
+            yield export_record_to_json_line(record)
+            exported += 1
+    finally:
+        db.close()
+        metrics.increment("export.sessions", exported)
+
+
+def iter_history_ndjson(session_factory: Callable[[], Session], owner_id: int) -> Iterator[bytes]:
+    metrics.increment("export.requests", format="ndjson")
+    chunk = bytearray()
+    for line in _iter_json_lines(session_factory, owner_id):
+        chunk += line
+        if len(chunk) >= EXPORT_CHUNK_BYTES:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+
+class _ZipStreamSink:
+    """Write-only file object for ZipFile; without tell/seek ZipFile writes a streamable archive."""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def iter_history_zip(session_factory: Callable[[], Session], owner_id: int, member_name: str = "history.ndjson") -> Iterator[bytes]:
+    metrics.increment("export.requests", format="zip")
+    sink = _ZipStreamSink()
+    pending = 0
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(member_name, mode="w", force_zip64=True) as member:
+            for line in _iter_json_lines(session_factory, owner_id):
+                member.write(line)
+                pending += len(line)
+                if pending >= EXPORT_CHUNK_BYTES:
+                    pending = 0
+                    data = sink.drain()
+                    if data:
+                        yield data
+    yield sink.drain() # Rest of the compressed member, data descriptor and central directory
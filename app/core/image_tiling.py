@@ -0,0 +1,259 @@
+# app/core/image_tiling.py
+"""
+Tiling of very tall screenshots for the vision stage.
+
+Full-page captures (e.g. 1440x12000 px) are downsampled hard by vision models and their element
+trees come back truncated. `split_tall_image` cuts such images into overlapping horizontal bands;
+each band is analyzed on its own (concurrently) and `merge_tile_analyses` puts the per-band
+analyses back together as one RichImageAnalysisSchema for the whole page:
+
+- bounding boxes are shifted by the band's top offset into full-page coordinates,
+- top-level elements seen by two neighbouring bands in their overlap are kept once (with the
+  union of both boxes and the more complete subtree),
+- the section lists (navigation, layout, content, controls) and the style guide are unioned
+  without duplicates, and element ids are made unique across bands.
+"""
+import io
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from app.core.config import settings
+from app.schemas.prompt import BaseElementSchema, OverallAnalysis, RichImageAnalysisSchema, VisualStyleSchema
+
+
+class ImageTile:
+    def __init__(self, index: int, count: int, top: int, bottom: int, page_width: int, page_height: int, image_bytes: bytes):
+        self.index = index
+        self.count = count
+        self.top = top
+        self.bottom = bottom
+        self.page_width = page_width
+        self.page_height = page_height
+        self.image_bytes = image_bytes
+
+    @property
+    def prompt_note(self) -> str:
+        # Appended to the per-image suffix of the vision prompt
+        return (
+            f" (horizontal band {self.index + 1} of {self.count} of a {self.page_width}x{self.page_height} px full-page screenshot,"
+            f" page y={self.top}-{self.bottom}; neighbouring bands overlap by a few hundred px."
+            f" Describe only what is visible in this band; bounding boxes are relative to this band.)"
+        )
+
+    def __repr__(self) -> str:
+        return f"ImageTile({self.index + 1}/{self.count}, y={self.top}-{self.bottom})"
+
+
+def needs_tiling(width: Optional[int], height: Optional[int]) -> bool:
+    if not settings.VISION_TILING_ENABLED or not width or not height:
+        return False
+    if height <= band_height_for_width(width):
+        return False
+    return height >= settings.VISION_TILE_MIN_HEIGHT_PX or height / width >= settings.VISION_TILE_MIN_ASPECT_RATIO
+
+
+def band_height_for_width(width: int) -> int:
+    return max(int(width * settings.VISION_TILE_BAND_ASPECT_RATIO), 2 * settings.VISION_TILE_OVERLAP_PX + 1)
+
+
+def plan_tile_bands(width: int, height: int) -> List[Tuple[int, int]]:
+    """(top, bottom) of each band; equal heights, evenly spread, neighbours overlapping by at least VISION_TILE_OVERLAP_PX."""
+    overlap = max(0, settings.VISION_TILE_OVERLAP_PX)
+    band_height = band_height_for_width(width)
+    if height <= band_height:
+        return [(0, height)]
+    count = math.ceil((height - overlap) / (band_height - overlap))
+    max_tiles = max(2, settings.VISION_TILE_MAX_TILES)
+    if count > max_tiles: # Too many bands: use the maximum number of taller bands instead
+        count = max_tiles
+        band_height = math.ceil((height + (count - 1) * overlap) / count)
+    step = (height - band_height) / (count - 1)
+    return [(round(i * step), round(i * step) + band_height) for i in range(count)]
+
+
+def image_dimensions(image_bytes: bytes) -> Tuple[Optional[int], Optional[int]]:
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img: # Reads the header only
+            return img.width, img.height
+    except Exception:
+        return None, None
+
+
+def split_tall_image(image_bytes: bytes) -> Optional[List[ImageTile]]:
+    """Bands for an image that needs tiling (encoded in the source format), else None. CPU-bound: call via asyncio.to_thread."""
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if not needs_tiling(img.width, img.height):
+            return None
+        image_format = img.format if img.format in ("PNG", "JPEG", "WEBP") else "PNG"
+        bands = plan_tile_bands(img.width, img.height)
+        img.load()
+        tiles = []
+        for index, (top, bottom) in enumerate(bands):
+            band = img.crop((0, top, img.width, bottom))
+            if image_format == "JPEG" and band.mode not in ("RGB", "L"):
+                band = band.convert("RGB")
+            buffer = io.BytesIO()
+            band.save(buffer, format=image_format, **({"quality": 90} if image_format in ("JPEG", "WEBP") else {}))
+            tiles.append(ImageTile(index, len(bands), top, bottom, img.width, img.height, buffer.getvalue()))
+        return tiles
+    except Exception as e:
+        print(f"Could not split tall image into tiles, analyzing it whole: {e}")
+        return None
+
+
+# --- Merging ---
+
+def _box(element: BaseElementSchema) -> Optional[Tuple[int, int, int, int]]:
+    bbox = element.bounding_box
+    if not bbox or not all(isinstance(bbox.get(key), (int, float)) for key in ("x", "y", "width", "height")):
+        return None
+    return int(bbox["x"]), int(bbox["y"]), int(bbox["width"]), int(bbox["height"])
+
+
+def _offset_element_boxes(element: BaseElementSchema, dy: int) -> None:
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        if node.bounding_box and isinstance(node.bounding_box.get("y"), (int, float)):
+            node.bounding_box = {**node.bounding_box, "y": int(node.bounding_box["y"]) + dy}
+        stack.extend(node.children)
+
+
+def _subtree_size(element: BaseElementSchema) -> int:
+    count, stack = 0, [element]
+    while stack:
+        node = stack.pop(); count += 1; stack.extend(node.children)
+    return count
+
+
+def _normalized_text(value: Optional[str]) -> str:
+    return " ".join((value or "").lower().split())
+
+
+def _same_element(a: BaseElementSchema, b: BaseElementSchema) -> bool:
+    """Two band-local detections of the same element (boxes already in page coordinates)."""
+    if a.element_type.strip().lower() != b.element_type.strip().lower():
+        return False
+    text_a, text_b = _normalized_text(a.text_content), _normalized_text(b.text_content)
+    if text_a and text_b and text_a != text_b and not (text_a.startswith(text_b) or text_b.startswith(text_a)): # A cut-off text is a prefix
+        return False
+    box_a, box_b = _box(a), _box(b)
+    if box_a is None or box_b is None:
+        return box_a is None and box_b is None and bool(text_a) and text_a == text_b
+    horizontal_overlap = min(box_a[0] + box_a[2], box_b[0] + box_b[2]) - max(box_a[0], box_b[0])
+    vertical_overlap = min(box_a[1] + box_a[3], box_b[1] + box_b[3]) - max(box_a[1], box_b[1])
+    return horizontal_overlap >= 0.5 * max(1, min(box_a[2], box_b[2])) and vertical_overlap > 0
+
+
+def _union_box(a: BaseElementSchema, b: BaseElementSchema) -> Optional[Dict[str, int]]:
+    box_a, box_b = _box(a), _box(b)
+    if box_a is None or box_b is None:
+        return a.bounding_box or b.bounding_box
+    left, top = min(box_a[0], box_b[0]), min(box_a[1], box_b[1])
+    right, bottom = max(box_a[0] + box_a[2], box_b[0] + box_b[2]), max(box_a[1] + box_a[3], box_b[1] + box_b[3])
+    return {"x": left, "y": top, "width": right - left, "height": bottom - top}
+
+
+def _in_band(element: BaseElementSchema, top: int, bottom: int) -> bool:
+    box = _box(element)
+    return box is None or (box[1] < bottom and box[1] + box[3] > top)
+
+
+def _merge_element_trees(trees: Sequence[List[BaseElementSchema]], tiles: Sequence[ImageTile]) -> Tuple[List[BaseElementSchema], int]:
+    merged: List[BaseElementSchema] = []
+    previous_band: List[int] = [] # Indexes into `merged` of the previous band's top-level elements
+    duplicates = 0
+    for tree, tile, previous_tile in zip(trees, tiles, [None, *tiles[:-1]]):
+        current_band: List[int] = []
+        for element in tree:
+            _offset_element_boxes(element, tile.top)
+            match = None
+            if previous_tile is not None and _in_band(element, tile.top, previous_tile.bottom):
+                match = next((i for i in previous_band if i not in current_band and _in_band(merged[i], tile.top, previous_tile.bottom) and _same_element(merged[i], element)), None)
+            if match is None:
+                current_band.append(len(merged))
+                merged.append(element)
+                continue
+            duplicates += 1
+            kept = merged[match] if _subtree_size(merged[match]) >= _subtree_size(element) else element
+            kept.bounding_box = _union_box(merged[match], element)
+            merged[match] = kept
+            current_band.append(match) # An element spanning several bands can match again in the next one
+        previous_band = current_band
+    return merged, duplicates
+
+
+def _make_ids_unique(elements: List[BaseElementSchema]) -> None:
+    seen = set()
+    stack = list(reversed(elements))
+    while stack:
+        node = stack.pop()
+        if node.id in seen:
+            suffix = 2
+            while f"{node.id}_{suffix}" in seen: suffix += 1
+            node.id = f"{node.id}_{suffix}"
+        seen.add(node.id)
+        stack.extend(reversed(node.children))
+
+
+def _section_key(item: Any) -> Tuple[Any, ...]:
+    text = getattr(item, "headline", None) or getattr(item, "label_or_text", None) or getattr(item, "description", None)
+    items = tuple(_normalized_text(value) for value in getattr(item, "items", None) or [])
+    return (item.element_type.strip().lower(), _normalized_text(text), items)
+
+
+def _union_unique(lists: Sequence[Sequence[Any]], key=lambda item: item) -> List[Any]:
+    seen, merged = set(), []
+    for items in lists:
+        for item in items:
+            item_key = key(item)
+            if item_key not in seen:
+                seen.add(item_key); merged.append(item)
+    return merged
+
+
+def _merge_overall(overalls: List[OverallAnalysis]) -> Optional[OverallAnalysis]:
+    if not overalls:
+        return None
+    merged = overalls[0].model_copy() # The top band carries the header: its title / purpose / theme win
+    descriptions = _union_unique([[overall.general_description] for overall in overalls if overall.general_description], key=_normalized_text)
+    merged.general_description = " ".join(descriptions) or merged.general_description
+    merged.key_takeaways = _union_unique([overall.key_takeaways for overall in overalls], key=_normalized_text)
+    return merged
+
+
+def _merge_style_guides(guides: List[VisualStyleSchema]) -> Optional[VisualStyleSchema]:
+    if not guides:
+        return None
+    merged = guides[0].model_copy()
+    color_key = lambda color: (_normalized_text(color.hex), _normalized_text(color.name))
+    for field in ("primary_colors", "secondary_colors", "accent_colors", "neutral_colors"):
+        setattr(merged, field, _union_unique([getattr(guide, field) for guide in guides], key=color_key))
+    merged.heading_typography = _union_unique([guide.heading_typography for guide in guides], key=lambda entry: tuple(sorted(entry.items())))
+    for field in ("secondary_font_family", "component_spacing", "iconography_style"):
+        if getattr(merged, field) is None:
+            setattr(merged, field, next((getattr(guide, field) for guide in guides if getattr(guide, field) is not None), None))
+    return merged
+
+
+def merge_tile_analyses(analyses: Sequence[RichImageAnalysisSchema], tiles: Sequence[ImageTile]) -> Tuple[RichImageAnalysisSchema, int]:
+    """
+    One page analysis from the per-band analyses (same order as `tiles`; bands whose analysis
+    failed are simply left out). Returns the merged analysis and the number of overlap duplicates dropped.
+    """
+    analyses = [analysis.model_copy(deep=True) for analysis in analyses] # Boxes and ids are rewritten in place
+    merged_tree, duplicates = _merge_element_trees([analysis.detected_elements_tree for analysis in analyses], tiles)
+    _make_ids_unique(merged_tree)
+    merged = RichImageAnalysisSchema(
+        overall_analysis=_merge_overall([analysis.overall_analysis for analysis in analyses if analysis.overall_analysis]),
+        navigation_elements=_union_unique([analysis.navigation_elements for analysis in analyses], key=_section_key),
+        layout_components=_union_unique([analysis.layout_components for analysis in analyses], key=_section_key),
+        content_sections=_union_unique([analysis.content_sections for analysis in analyses], key=_section_key),
+        interactive_controls=_union_unique([analysis.interactive_controls for analysis in analyses], key=_section_key),
+        visual_style_guide=_merge_style_guides([analysis.visual_style_guide for analysis in analyses if analysis.visual_style_guide]),
+        detected_elements_tree=merged_tree,
+    )
+    return merged, duplicates
@@ -0,0 +1,379 @@
+# app/core/llm_governor.py
+"""
+Process-wide scheduler in front of every outbound LLM call (vision and planner).
+
+Call sites run each provider request through `llm_governor.run(model, stage, attempt)`. Per model:
+
+1. Concurrency: at most `concurrency_limit` calls in flight. The limit starts at the configured
+   maximum, is halved when the provider answers 429 and grows back by one per limit's worth of
+   successful calls (AIMD), so a worker settles just under what the provider accepts.
+2. Rate: a requests-per-minute token bucket, from LLM_MODEL_LIMITS_CSV or learned from the
+   provider's `x-ratelimit-limit-requests` header (whichever is lower).
+3. Pauses: `Retry-After` on a 429, or an exhausted `x-ratelimit-remaining` with its reset time,
+   stops dispatching to that model until the provider is ready again. The `attempt` that hit the
+   429 is retried behind the pause (up to LLM_RATE_LIMIT_RETRIES times) instead of failing the page.
+
+Calls that cannot start right away wait in a per-model queue served by weighted fair queuing:
+every (priority class, user) pair is a flow, and each call gets a virtual finish tag of
+max(virtual time, the flow's last tag) + 1 / weight, the weight being the class's entry in
+LLM_PRIORITY_WEIGHTS_CSV. The smallest tag goes next, so a user with fifty pages does not starve
+one with a single page, and batch work (`llm_priority("batch")`, used by app/reprocess.py) only
+gets a small share while interactive requests are waiting. Queued calls give up at the request
+deadline (DeadlineExceeded).
+
+State is per worker process. Queue time, queue depth, in-flight calls, the current limits and
+throttling events are exported through `app.core.metrics`.
+"""
+import asyncio
+import contextvars
+import email.utils
+import heapq
+import itertools
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import httpx
+
+from app.core.admission import TokenBucket
+from app.core.config import settings
+from app.core.deadline import DeadlineExceeded, remaining_seconds
+from app.core.llm_usage import current_llm_user_id
+from app.core.metrics import metric_key, metrics
+
+T = TypeVar("T")
+
+_current_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default="interactive")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+@contextmanager
+def llm_priority(priority: str) -> Iterator[None]:
+    """Schedules the LLM calls made inside the block (and the tasks it starts) in the `priority` class."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """`Retry-After` as delta-seconds or an HTTP date; seconds from now, or None if absent/invalid."""
+    if not value or not value.strip():
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Rate-limit reset headers: epoch milliseconds (OpenRouter), epoch seconds, delta seconds, or
+    durations such as "6m0s" / "250ms" (OpenAI-style upstreams). Seconds from now, or None.
+    """
+    if not value or not value.strip():
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts or "".join(amount + unit for amount, unit in parts) != value:
+            return None
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    if number > 1e11:
+        return max(0.0, number / 1000.0 - time.time())
+    if number > 1e9:
+        return max(0.0, number - time.time())
+    return max(0.0, number)
+
+
+def _header_float(headers: httpx.Headers, *names: str) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class _Waiter:
+    __slots__ = ("finish_tag", "start_tag", "sequence", "future", "enqueued_at")
+
+    def __init__(self, start_tag: float, finish_tag: float, sequence: int, future: asyncio.Future):
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.sequence = sequence
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.finish_tag, self.sequence) < (other.finish_tag, other.sequence)
+
+
+class ModelLimiter:
+    """Concurrency, rate and pause state for one model, with its weighted fair queue."""
+
+    def __init__(self, model: str, max_concurrency: int, requests_per_minute: float):
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency_limit = float(self.max_concurrency)
+        self.configured_requests_per_minute = requests_per_minute
+        self.requests_per_minute = 0.0
+        self.rate: Optional[TokenBucket] = None
+        self.paused_until = 0.0
+        self.active = 0
+
+        self._virtual_time = 0.0
+        self._flow_finish: Dict[Tuple[str, Any], float] = {}
+        self._queue: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer_due = 0.0
+        self._decrease_hold_until = 0.0
+        self._set_requests_per_minute(requests_per_minute)
+
+    def _set_requests_per_minute(self, requests_per_minute: float) -> None:
+        self.requests_per_minute = requests_per_minute
+        if requests_per_minute <= 0:
+            self.rate = None
+            return
+        capacity = max(1.0, min(float(self.max_concurrency), requests_per_minute / 60.0 * 10))
+        if self.rate is None:
+            self.rate = TokenBucket(capacity, requests_per_minute / 60.0)
+        else:
+            self.rate.capacity = capacity
+            self.rate.refill_per_second = requests_per_minute / 60.0
+            self.rate.tokens = min(self.rate.tokens, capacity)
+
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._queue if not waiter.future.done())
+
+    def _tags_for(self, flow: Tuple[str, Any], weight: float) -> Tuple[float, float]:
+        start_tag = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        self._flow_finish[flow] = finish_tag
+        if len(self._flow_finish) > 10000:
+            # Flows whose last call is behind the virtual clock get the same tags without an entry.
+            for idle_flow in [f for f, tag in self._flow_finish.items() if tag <= self._virtual_time]:
+                del self._flow_finish[idle_flow]
+        return start_tag, finish_tag
+
+    def _can_start_now(self, now: float) -> bool:
+        return self.active < int(self.concurrency_limit) and now >= self.paused_until
+
+    def _start(self, start_tag: float) -> None:
+        self.active += 1
+        self._virtual_time = max(self._virtual_time, start_tag)
+
+    def _schedule_dispatch(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        due = time.monotonic() + delay
+        if self._timer is not None and self._timer_loop is loop and self._timer_due <= due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_loop, self._timer_due = loop, due
+        self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._queue and self.active < int(self.concurrency_limit):
+            head = self._queue[0]
+            if head.future.done(): # Cancelled or timed out while queued
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            if now < self.paused_until:
+                self._schedule_dispatch(self.paused_until - now)
+                return
+            if self.rate is not None:
+                wait_for_token = self.rate.try_take(1)
+                if wait_for_token > 0:
+                    self._schedule_dispatch(wait_for_token)
+                    return
+            heapq.heappop(self._queue)
+            self._start(head.start_tag)
+            head.future.set_result(True)
+
+    async def acquire(self, flow: Tuple[str, Any], weight: float, stage: str) -> float:
+        """Waits for a slot (and a rate token). Returns the seconds spent queued."""
+        start_tag, finish_tag = self._tags_for(flow, weight)
+        if not self._queue and self._can_start_now(time.monotonic()) and (self.rate is None or self.rate.try_take(1) == 0):
+            self._start(start_tag)
+            return 0.0
+
+        remaining = remaining_seconds() # Don't queue past the request's own deadline
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(stage)
+        waiter = _Waiter(start_tag, finish_tag, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=remaining)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                metrics.increment("llm_governor.queue_timeouts", model=self.model, stage=stage)
+                raise DeadlineExceeded(stage)
+        except asyncio.CancelledError:
+            # Request cancelled while queued. If we were granted a slot at the same moment, give it back.
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()
+            else:
+                waiter.future.cancel()
+            raise
+        return time.monotonic() - waiter.enqueued_at
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def pause(self, seconds: float, reason: str) -> None:
+        seconds = min(max(0.0, seconds), settings.LLM_RATE_LIMIT_MAX_BACKOFF_SECONDS)
+        now = time.monotonic()
+        if now + seconds <= self.paused_until:
+            return
+        self.paused_until = now + seconds
+        metrics.increment("llm_governor.pauses", model=self.model, reason=reason)
+        print(f"--- LLM governor: pausing calls to '{self.model}' for {seconds:.1f}s ({reason}) ---")
+
+    def observe_response(self, response: httpx.Response) -> bool:
+        """Adjusts the limits from one provider response. Returns True if it was rate limited (429)."""
+        headers = response.headers
+        limit_per_minute = _header_float(headers, "x-ratelimit-limit-requests")
+        if limit_per_minute and limit_per_minute > 0:
+            learned = limit_per_minute if self.configured_requests_per_minute <= 0 else min(limit_per_minute, self.configured_requests_per_minute)
+            if learned != self.requests_per_minute:
+                self._set_requests_per_minute(learned)
+        reset_seconds = parse_reset_seconds(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset"))
+
+        if response.status_code == 429:
+            delay = parse_retry_after(headers.get("retry-after"))
+            if delay is None:
+                delay = reset_seconds if reset_seconds is not None else settings.LLM_RATE_LIMIT_DEFAULT_BACKOFF_SECONDS
+            metrics.increment("llm_governor.rate_limited", model=self.model)
+            now = time.monotonic()
+            # Calls already in flight when the first 429 arrived tend to get one too: halve only once per pause.
+            if now >= self._decrease_hold_until:
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+                self._decrease_hold_until = now + max(1.0, delay)
+            self.pause(delay, "429")
+            return True
+
+        remaining = _header_float(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining")
+        if remaining is not None and remaining <= 0 and reset_seconds:
+            self.pause(reset_seconds, "quota_exhausted")
+        if response.status_code < 400 and self.concurrency_limit < self.max_concurrency:
+            self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1.0 / self.concurrency_limit)
+        return False
+
+
+class LLMCallPermit:
+    """Handed to each attempt; the call site reports the provider's response through it."""
+
+    def __init__(self, limiter: Optional[ModelLimiter]):
+        self.limiter = limiter
+        self.rate_limited = False
+
+    def observe_response(self, response: httpx.Response) -> None:
+        if self.limiter is not None:
+            self.rate_limited = self.limiter.observe_response(response)
+
+
+class LLMGovernor:
+    def __init__(
+        self,
+        *,
+        default_concurrency: int,
+        default_requests_per_minute: float,
+        model_limits: Dict[str, Tuple[int, float]],
+        priority_weights: Dict[str, float],
+        max_rate_limit_retries: int,
+        enabled: bool = True,
+    ):
+        self.default_concurrency = default_concurrency
+        self.default_requests_per_minute = default_requests_per_minute
+        self.model_limits = model_limits
+        self.priority_weights = priority_weights
+        self.max_rate_limit_retries = max(0, max_rate_limit_retries)
+        self.enabled = enabled
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+        metrics.register_gauge_callback("llm_governor", self._gauges)
+
+    def _gauges(self) -> Dict[str, float]:
+        gauges: Dict[str, float] = {}
+        now = time.monotonic()
+        for model, limiter in self._limiters.items():
+            labels = {"model": model}
+            gauges[metric_key("llm_governor.active", labels)] = limiter.active
+            gauges[metric_key("llm_governor.queue_depth", labels)] = limiter.queue_depth()
+            gauges[metric_key("llm_governor.concurrency_limit", labels)] = int(limiter.concurrency_limit)
+            gauges[metric_key("llm_governor.requests_per_minute", labels)] = limiter.requests_per_minute
+            gauges[metric_key("llm_governor.paused_seconds", labels)] = max(0.0, limiter.paused_until - now)
+        return gauges
+
+    def limiter_for(self, model: Optional[str]) -> ModelLimiter:
+        model = model or "unknown"
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            concurrency, requests_per_minute = self.model_limits.get(model, (self.default_concurrency, self.default_requests_per_minute))
+            limiter = self._limiters[model] = ModelLimiter(model, concurrency, requests_per_minute)
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, model: Optional[str], stage: str) -> AsyncIterator[LLMCallPermit]:
+        """Holds one in-flight slot for `model` for the duration of the block."""
+        if not self.enabled:
+            yield LLMCallPermit(None)
+            return
+        limiter = self.limiter_for(model)
+        priority = _current_priority.get()
+        waited_seconds = await limiter.acquire((priority, current_llm_user_id()), self.priority_weights.get(priority, 1.0), stage)
+        metrics.observe("llm_governor.queue_wait_seconds", waited_seconds, model=limiter.model, priority=priority)
+        try:
+            yield LLMCallPermit(limiter)
+        finally:
+            limiter.release()
+
+    async def run(self, model: Optional[str], stage: str, attempt: Callable[[LLMCallPermit], Awaitable[T]]) -> T:
+        """
+        Runs `attempt(permit)` in a slot. The attempt must pass the provider's response to
+        `permit.observe_response` before raising for its status; if that response was a 429, the
+        attempt is retried once the model's pause is over.
+        """
+        for retry in itertools.count():
+            async with self.slot(model, stage) as permit:
+                try:
+                    return await attempt(permit)
+                except Exception:
+                    if not permit.rate_limited or retry >= self.max_rate_limit_retries:
+                        raise
+            metrics.increment("llm_governor.rate_limit_retries", model=model or "unknown", stage=stage)
+            print(f"--- Retrying {stage} call to '{model}' after a 429 ({retry + 1}/{self.max_rate_limit_retries}) ---")
+
+
+llm_governor = LLMGovernor(
+    default_concurrency=settings.LLM_MAX_CONCURRENT_PER_MODEL,
+    default_requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE_PER_MODEL,
+    model_limits=settings.parsed_llm_model_limits,
+    priority_weights=settings.parsed_llm_priority_weights,
+    max_rate_limit_retries=settings.LLM_RATE_LIMIT_RETRIES,
+    enabled=settings.LLM_GOVERNOR_ENABLED,
+)
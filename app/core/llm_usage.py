@@ -0,0 +1,232 @@
+# app/core/llm_usage.py
+"""
+Token usage reported by the LLM provider, per call stage ("vision", "planner", ...) and model.
+
+OpenRouter returns OpenAI-style usage blocks; prompt tokens served from the provider's prompt
+cache are reported as `usage.prompt_tokens_details.cached_tokens`.
+
+Besides the in-process metrics, every call is persisted as one `llm_calls` row (tokens, latency,
+model, outcome, cost) for per-user / per-model reporting (GET /api/v1/usage/summary). Call sites
+wrap the request in `track_llm_call(stage, model)`; rows are buffered in `llm_call_recorder` and
+written with one multi-row INSERT per batch from a worker thread, off the event loop.
+"""
+import asyncio
+import contextvars
+import datetime
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.deadline import DeadlineExceeded
+from app.core.metrics import metrics
+from app.core.streaming_json import StreamingJSONError
+from app.core.tracing import get_current_trace
+from app.crud.crud_llm_call import llm_call as crud_llm_call
+from app.db.session import SessionLocal
+
+_current_user_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("llm_usage_user_id", default=None)
+_llm_pricing = settings.parsed_llm_pricing # USD per million (prompt, completion, cached) tokens by model
+
+
+def extract_usage(api_response_json: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    usage = (api_response_json or {}).get("usage") or {}
+    prompt_tokens_details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+        "cached_tokens": int(prompt_tokens_details.get("cached_tokens") or 0),
+    }
+
+
+def record_llm_usage(stage: str, model: Optional[str], api_response_json: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    usage = extract_usage(api_response_json)
+    labels = {"stage": stage, "model": model or "unknown"}
+    metrics.increment("llm.calls", **labels)
+    metrics.increment("llm.prompt_tokens", usage["prompt_tokens"], **labels)
+    metrics.increment("llm.completion_tokens", usage["completion_tokens"], **labels)
+    metrics.increment("llm.cached_prompt_tokens", usage["cached_tokens"], **labels)
+    if usage["prompt_tokens"]:
+        metrics.observe("llm.cached_prompt_fraction", usage["cached_tokens"] / usage["prompt_tokens"], **labels)
+    return usage
+
+
+def estimate_cost_usd(model: Optional[str], usage: Dict[str, int], api_response_json: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """Provider-reported cost (OpenRouter's `usage.cost`) if present, else LLM_PRICING_CSV, else None."""
+    reported_cost = ((api_response_json or {}).get("usage") or {}).get("cost")
+    if isinstance(reported_cost, (int, float)):
+        return float(reported_cost)
+    prices = _llm_pricing.get(model or "")
+    if prices is None:
+        return None
+    prompt_price, completion_price, cached_price = prices
+    uncached_tokens = max(0, usage["prompt_tokens"] - usage["cached_tokens"])
+    return (uncached_tokens * prompt_price + usage["cached_tokens"] * cached_price + usage["completion_tokens"] * completion_price) / 1_000_000
+
+
+@contextmanager
+def llm_usage_user(user_id: Optional[int]) -> Iterator[None]:
+    """Attributes the LLM calls made inside the block (and the tasks it starts) to `user_id`."""
+    token = _current_user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user_id.reset(token)
+
+
+def current_llm_user_id() -> Optional[int]:
+    return _current_user_id.get()
+
+
+class LLMCallRecord:
+    """Handed out by `track_llm_call`; the call site reports the provider's usage block through it."""
+
+    def __init__(self, stage: str, model: Optional[str]):
+        self.stage = stage
+        self.model = model
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.cost_usd: Optional[float] = None
+
+    def record_usage(self, api_response_json: Optional[Dict[str, Any]]) -> Dict[str, int]:
+        self.usage = record_llm_usage(self.stage, self.model, api_response_json)
+        self.cost_usd = estimate_cost_usd(self.model, self.usage, api_response_json)
+        return self.usage
+
+
+def _outcome_for(error: BaseException) -> str:
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"http_{error.response.status_code}"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, StreamingJSONError):
+        return f"aborted_{error.reason}"[:32]
+    if isinstance(error, (ValueError, json.JSONDecodeError)): # Empty / malformed content
+        return "invalid_output"
+    return "error"
+
+
+@contextmanager
+def track_llm_call(stage: str, model: Optional[str], streamed: bool = False) -> Iterator[LLMCallRecord]:
+    """
+    Wraps one outbound LLM request: measures latency, derives the outcome from the exception (if
+    any) and queues an `llm_calls` row. Must wrap the raw provider call, before errors are mapped
+    to HTTPExceptions, so the outcome reflects what actually happened.
+    """
+    record = LLMCallRecord(stage, model)
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield record
+    except BaseException as e:
+        outcome = _outcome_for(e)
+        raise
+    finally:
+        latency_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("llm.call_latency_ms", latency_ms, stage=stage, model=model or "unknown")
+        if outcome != "ok":
+            metrics.increment("llm.call_failures", stage=stage, outcome=outcome)
+        trace = get_current_trace()
+        llm_call_recorder.add({
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+            "user_id": _current_user_id.get(),
+            "request_id": trace.request_id[:64] if trace else None,
+            "stage": stage,
+            "model": model or "unknown",
+            "outcome": outcome,
+            "streamed": streamed,
+            **record.usage,
+            "latency_ms": round(latency_ms, 3),
+            "cost_usd": record.cost_usd,
+        })
+
+
+class LLMCallRecorder:
+    """
+    Per-worker buffer of `llm_calls` rows. A batch is written once LLM_CALL_LOG_BATCH_SIZE rows
+    are queued, and a background task flushes whatever is left every LLM_CALL_LOG_FLUSH_SECONDS.
+    Telemetry must never fail an LLM call: write errors are logged and counted, and rows beyond
+    LLM_CALL_LOG_MAX_BUFFER are dropped oldest-first.
+    """
+
+    def __init__(self):
+        self._rows: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add(self, row: Dict[str, Any]) -> None:
+        if not settings.LLM_CALL_LOG_ENABLED:
+            return
+        with self._lock:
+            self._rows.append(row)
+            overflow = len(self._rows) - max(1, settings.LLM_CALL_LOG_MAX_BUFFER)
+            if overflow > 0:
+                del self._rows[:overflow]
+                metrics.increment("llm_calls.dropped", overflow)
+            batch_ready = len(self._rows) >= max(1, settings.LLM_CALL_LOG_BATCH_SIZE)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # Called outside an event loop (scripts): write right away
+            self.flush_sync()
+            return
+        self._ensure_flush_loop(loop)
+        if batch_ready:
+            loop.create_task(self.flush())
+
+    def _ensure_flush_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._flush_task is None or self._flush_task.done() or self._flush_task.get_loop() is not loop:
+            self._flush_task = loop.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(max(0.1, settings.LLM_CALL_LOG_FLUSH_SECONDS))
+            await self.flush()
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows, self._rows = self._rows, []
+        return rows
+
+    async def flush(self) -> int:
+        rows = self._take_batch()
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+        return len(rows)
+
+    def flush_sync(self) -> int:
+        rows = self._take_batch()
+        if rows:
+            self._write(rows)
+        return len(rows)
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            crud_llm_call.insert_batch(db, rows=rows)
+            metrics.increment("llm_calls.written", len(rows))
+        except Exception as e:
+            db.rollback()
+            metrics.increment("llm_calls.write_failures")
+            metrics.increment("llm_calls.dropped", len(rows))
+            print(f"--- Failed to write {len(rows)} llm_calls rows: {e} ---")
+        finally:
+            db.close()
+            metrics.observe("llm_calls.flush_seconds", time.perf_counter() - started)
+
+    async def close(self) -> None:
+        """Stops the periodic flush and writes what is buffered (application shutdown)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+
+llm_call_recorder = LLMCallRecorder()
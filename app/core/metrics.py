@@ -0,0 +1,104 @@
+# app/core/metrics.py
+"""
+Minimal in-process metrics registry (per worker process).
+
+Counters, gauges and simple histograms keyed by name plus optional labels. Gauges can also be
+registered as callbacks that are evaluated when a snapshot is taken (e.g. queue depth).
+`GET /api/v1/metrics` returns `metrics.snapshot()` as JSON.
+"""
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def metric_key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{key}={labels[key]}" for key in sorted(labels)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts: List[int] = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket containing the q-quantile (None for the overflow bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else None,
+            "max": self.max,
+            "p50_le": self.quantile(0.5),
+            "p95_le": self.quantile(0.95),
+            "p99_le": self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._gauge_callbacks: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._histograms: Dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._gauges[metric_key(name, labels)] = value
+
+    def register_gauge_callback(self, name: str, callback: Callable[[], Dict[str, float]]) -> None:
+        """`callback()` returns {metric_key: value}; it is called on every snapshot."""
+        with self._lock:
+            self._gauge_callbacks[name] = callback
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = metric_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            gauges = dict(self._gauges)
+            callbacks = list(self._gauge_callbacks.values())
+            counters = dict(self._counters)
+            histograms = {key: histogram.to_dict() for key, histogram in self._histograms.items()}
+        for callback in callbacks:
+            try:
+                gauges.update(callback())
+            except Exception as e:  # A broken callback must not break the metrics endpoint
+                print(f"ERROR: metrics gauge callback failed: {e}")
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,154 @@
+# app/core/model_tiering.py
+"""
+Model tiering: pick a cheap/fast model or the large one per call from cheap pre-features.
+
+Vision: image size, grayscale entropy and an edge-density based element estimate, computed on a
+small thumbnail. Planner: page count and the total number of detected elements.
+
+A call routed to the small tier is escalated to the large tier when its output fails validation
+or looks incomplete. Decisions and escalations are counted in `app.core.metrics`
+(`tiering.decisions`, `tiering.escalations`). Tiering only kicks in when a small model is
+configured; otherwise every call uses the large tier, as before.
+"""
+import io
+import re
+from typing import Any, Optional
+
+from PIL import Image, ImageFilter
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+FEATURE_THUMBNAIL_WIDTH = 256
+EDGE_THRESHOLD = 32
+# Estimated elements per edge pixel of the full-size image (calibrated on typical dashboards:
+# ~50 elements for a plain 1280x800 page, several hundred for dense ones).
+ELEMENTS_PER_EDGE_PIXEL = 1 / 2000
+
+
+class ModelTier:
+    def __init__(self, name: str, model: Optional[str], max_tokens: int, reason: str):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.reason = reason
+
+    @property
+    def is_small(self) -> bool:
+        return self.name == "small"
+
+    def __repr__(self) -> str:
+        return f"ModelTier({self.name}, {self.model}, max_tokens={self.max_tokens}, reason={self.reason})"
+
+
+class ImageFeatures:
+    def __init__(self, width: int, height: int, entropy: float, edge_density: float):
+        self.width = width
+        self.height = height
+        self.entropy = entropy
+        self.edge_density = edge_density
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+    @property
+    def estimated_element_count(self) -> int:
+        return int(self.edge_density * self.pixels * ELEMENTS_PER_EDGE_PIXEL)
+
+
+def compute_image_features(image_bytes: bytes) -> Optional[ImageFeatures]:
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        width, height = img.width, img.height
+        img.draft("L", (FEATURE_THUMBNAIL_WIDTH, FEATURE_THUMBNAIL_WIDTH)) # JPEG: decode at reduced size
+        thumbnail = img.convert("L")
+        thumbnail.thumbnail((FEATURE_THUMBNAIL_WIDTH, max(1, FEATURE_THUMBNAIL_WIDTH * height // max(1, width))))
+        edges = thumbnail.filter(ImageFilter.FIND_EDGES).histogram()
+        edge_density = sum(edges[EDGE_THRESHOLD:]) / max(1, thumbnail.width * thumbnail.height)
+        return ImageFeatures(width, height, thumbnail.entropy(), edge_density)
+    except Exception as e:
+        print(f"Could not compute image features for tiering: {e}")
+        return None
+
+
+def _large_vision_tier(reason: str) -> ModelTier:
+    return ModelTier("large", settings.OPENROUTER_MODEL_IDENTIFIER, settings.VISION_MAX_TOKENS_LARGE, reason)
+
+
+def _large_planner_tier(reason: str) -> ModelTier:
+    return ModelTier("large", settings.OPENROUTER_PLANNER_MODEL_IDENTIFIER, settings.PLANNER_MAX_TOKENS_LARGE, reason)
+
+
+def _record_decision(stage: str, tier: ModelTier) -> ModelTier:
+    metrics.increment("tiering.decisions", stage=stage, tier=tier.name, reason=tier.reason)
+    return tier
+
+
+def vision_tiering_active() -> bool:
+    return bool(settings.MODEL_TIERING_ENABLED and settings.OPENROUTER_SMALL_MODEL_IDENTIFIER)
+
+
+def choose_vision_tier(features: Optional[ImageFeatures]) -> ModelTier:
+    if not vision_tiering_active():
+        return _large_vision_tier("tiering_off")
+    if features is None:
+        tier = _large_vision_tier("no_features")
+    elif features.pixels > settings.TIER_SMALL_MAX_IMAGE_PIXELS:
+        tier = _large_vision_tier("image_size")
+    elif features.entropy > settings.TIER_SMALL_MAX_IMAGE_ENTROPY:
+        tier = _large_vision_tier("entropy")
+    elif features.estimated_element_count > settings.TIER_SMALL_MAX_ESTIMATED_ELEMENTS:
+        tier = _large_vision_tier("element_estimate")
+    else:
+        tier = ModelTier("small", settings.OPENROUTER_SMALL_MODEL_IDENTIFIER, settings.VISION_MAX_TOKENS_SMALL, "simple_page")
+    return _record_decision("vision", tier)
+
+
+def escalated_vision_tier(reason: str) -> ModelTier:
+    metrics.increment("tiering.escalations", stage="vision", reason=reason)
+    return _large_vision_tier(f"escalated_{reason}")
+
+
+def choose_planner_tier(page_count: int, total_element_count: int) -> ModelTier:
+    if not settings.MODEL_TIERING_ENABLED or not settings.OPENROUTER_SMALL_PLANNER_MODEL_IDENTIFIER:
+        return _large_planner_tier("tiering_off")
+    if page_count > settings.TIER_SMALL_MAX_PAGES:
+        tier = _large_planner_tier("page_count")
+    elif total_element_count > settings.TIER_SMALL_MAX_PLANNER_ELEMENTS:
+        tier = _large_planner_tier("element_count")
+    else:
+        tier = ModelTier("small", settings.OPENROUTER_SMALL_PLANNER_MODEL_IDENTIFIER, settings.PLANNER_MAX_TOKENS_SMALL, "small_project")
+    return _record_decision("planner", tier)
+
+
+def escalated_planner_tier(reason: str) -> ModelTier:
+    metrics.increment("tiering.escalations", stage="planner", reason=reason)
+    return _large_planner_tier(f"escalated_{reason}")
+
+
+def vision_output_incomplete_reason(analysis: Any, features: Optional[ImageFeatures]) -> Optional[str]:
+    """Why a (validated) vision analysis looks incomplete, or None if it looks fine."""
+    if analysis.overall_analysis is None:
+        return "missing_overall_analysis"
+    if not analysis.detected_elements_tree:
+        return "empty_element_tree"
+    if features is not None and features.estimated_element_count >= 40:
+        node_count, stack = 0, list(analysis.detected_elements_tree)
+        while stack:
+            node = stack.pop(); node_count += 1; stack.extend(node.children or [])
+        if node_count * 10 < features.estimated_element_count:
+            return "too_few_elements"
+    return None
+
+
+_PLAN_SECTION_RE = re.compile(r"^\s*(?:#+\s*)?\**([1-7])\.", re.MULTILINE)
+
+
+def plan_incomplete_reason(plan_text: str) -> Optional[str]:
+    """Why a planner output looks incomplete, or None. The plan must cover points 1-7."""
+    if plan_text.lstrip().startswith("<error_in_planning>"):
+        return "planner_error"
+    if len(set(_PLAN_SECTION_RE.findall(plan_text))) < 6:
+        return "missing_sections"
+    return None
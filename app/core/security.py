@@ -47,7 +47,7 @@ def decode_access_token(token: str) -> Optional[TokenData]:
             # Subject claim is missing
             # We will raise specific HTTPExceptions in the get_current_user dependency
             return None 
-        return TokenData(subject=subject)
+        return TokenData(subject=subject, email=payload.get("email"))
     except JWTError as e: # Catches expired signature, invalid signature, etc.
         # We will raise specific HTTPExceptions in the get_current_user dependency
         print(f"JWT Error: {e}") # Log the error for debugging
@@ -0,0 +1,63 @@
+# app/core/single_flight.py
+"""
+In-process request coalescing ("single flight").
+
+The first caller for a key runs the work; identical calls that arrive while it is in flight
+wait for the same result instead of running it again. If the leading caller is cancelled, or its
+work raises one of the `handoff_on` exceptions (e.g. its client disconnected), one of the
+waiters takes over and runs the work itself.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple, Type, TypeVar
+
+from app.core.metrics import metrics
+
+T = TypeVar("T")
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    def __init__(self, name: str, handoff_on: Tuple[Type[BaseException], ...] = ()):
+        self.name = name
+        self.handoff_on = handoff_on
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self._in_flight
+
+    async def do(self, key: str, work: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Returns (result, shared) where `shared` is True if the result came from another caller's run."""
+        while (existing := self._in_flight.get(key)) is not None:
+            metrics.increment("single_flight.coalesced", group=self.name)
+            try:
+                return await asyncio.shield(existing), True
+            except _LeaderCancelled:
+                continue  # The leader went away; try to become the new leader
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except self.handoff_on:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._in_flight.pop(key, None)
+            # Marks a stored exception as retrieved, so there is no "exception was never retrieved"
+            # warning when nobody else was waiting on this key.
+            future.exception()
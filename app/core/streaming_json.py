@@ -0,0 +1,223 @@
+# app/core/streaming_json.py
+"""
+Incremental scanner for a JSON object that arrives in chunks (streamed LLM output).
+
+`IncrementalJSONScanner.feed(chunk)` tracks the JSON structure as text comes in and returns the
+top-level members of the root object whose values closed in this chunk, as (key, raw JSON text),
+so callers can validate each section without waiting for the rest. While scanning it enforces:
+
+- well-formedness of the structure (brackets, keys, separators); problems raise StreamingJSONError
+- a maximum string length (runaway strings)
+- a cap on element-tree nodes: objects directly inside arrays named in `node_array_keys`
+  (e.g. `detected_elements_tree` / `children`). Once the cap is hit the scanner stops and
+  `document_text()` returns the document cut after the last complete node, with all open
+  brackets closed.
+- repetition: too many consecutive sibling nodes that are identical apart from digits.
+
+Only the structure is tracked; values are not decoded until `json.loads` on a finished section.
+"""
+import hashlib
+import re
+from typing import List, Optional, Sequence, Tuple
+
+_DIGITS_RE = re.compile(r"\d+")
+_WHITESPACE = " \t\r\n"
+_SCALAR_CHARS = set("0123456789-+.eEtrufalsn")
+_MAX_PREAMBLE_CHARS = 64  # e.g. a ```json fence before the object
+
+
+class StreamingJSONError(ValueError):
+    def __init__(self, reason: str, message: str):
+        self.reason = reason
+        super().__init__(message)
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "expecting_key", "current_key", "start", "last_child_hash", "repeat_run", "is_node")
+
+    def __init__(self, kind: str, key: Optional[str], start: int, is_node: bool):
+        self.kind = kind  # "{" or "["
+        self.key = key  # Member name this container is the value of (inherited through arrays)
+        self.expecting_key = kind == "{"
+        self.current_key: Optional[str] = None
+        self.start = start
+        self.last_child_hash: Optional[bytes] = None
+        self.repeat_run = 0
+        self.is_node = is_node
+
+
+class IncrementalJSONScanner:
+    def __init__(
+        self,
+        node_array_keys: Sequence[str] = (),
+        max_nodes: Optional[int] = None,
+        max_repeated_siblings: Optional[int] = None,
+        max_string_chars: Optional[int] = None,
+    ):
+        self.node_array_keys = frozenset(node_array_keys)
+        self.max_nodes = max_nodes
+        self.max_repeated_siblings = max_repeated_siblings
+        self.max_string_chars = max_string_chars
+
+        self.buffer = ""
+        self.position = 0
+        self.stack: List[_Frame] = []
+        self.started = False
+        self.document_start = 0
+        self.complete = False
+        self.node_count = 0
+        self.node_limit_reached = False
+        self._in_string = False
+        self._string_start = 0
+        self._escape = False
+        self._section_start: Optional[int] = None  # Start of the current top-level member value
+        self._safe_end: Optional[int] = None  # Offset just after the last complete node
+        self._safe_closers = ""  # Brackets that close the document from that point
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        if self.complete or self.node_limit_reached or not chunk:
+            return []
+        self.buffer += chunk
+        sections: List[Tuple[str, str]] = []
+        buffer, end = self.buffer, len(self.buffer)
+        i = self.position
+        while i < end:
+            if self._in_string:
+                # Jump to the next quote or backslash instead of walking every character.
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                quote, backslash = buffer.find('"', i), buffer.find("\\", i)
+                if backslash != -1 and (quote == -1 or backslash < quote):
+                    self._escape = True
+                    i = backslash + 1
+                    continue
+                if quote == -1:
+                    i = end
+                    self._check_string_length(end)
+                    break
+                self._check_string_length(quote)
+                self._in_string = False
+                self._end_string(quote)
+                i = quote + 1
+                continue
+
+            char = buffer[i]
+            if char in _WHITESPACE:
+                i += 1
+                continue
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.document_start = i
+                    self.stack.append(_Frame("{", None, i, False))
+                elif i >= _MAX_PREAMBLE_CHARS:
+                    raise StreamingJSONError("malformed", "Output does not start with a JSON object.")
+                i += 1
+                continue
+            if self.complete:
+                break  # Trailing text (e.g. a closing fence) is ignored
+
+            frame = self.stack[-1]
+            if char == '"':
+                if frame.kind == "{" and not frame.expecting_key and frame.current_key is None:
+                    raise StreamingJSONError("malformed", f"Unexpected string at offset {i}.")
+                self._begin_value(frame, i)
+                self._in_string = True
+                self._string_start = i
+            elif char == "{" or char == "[":
+                self._begin_value(frame, i)
+                if frame.kind == "{":
+                    key = frame.current_key
+                else:
+                    key = frame.key
+                is_node = char == "{" and frame.kind == "[" and frame.key in self.node_array_keys
+                if is_node:
+                    self.node_count += 1
+                    if self.max_nodes is not None and self.node_count > self.max_nodes:
+                        self.node_count -= 1
+                        self.node_limit_reached = True
+                        self.position = i
+                        return sections
+                self.stack.append(_Frame(char, key, i, is_node))
+            elif char == "}" or char == "]":
+                if (char == "}") != (frame.kind == "{"):
+                    raise StreamingJSONError("malformed", f"Mismatched '{char}' at offset {i}.")
+                if len(self.stack) == 1:
+                    self._finish_scalar_section(i, sections)
+                self.stack.pop()
+                if not self.stack:
+                    self.complete = True
+                else:
+                    parent = self.stack[-1]
+                    if frame.is_node:
+                        self._node_closed(frame, parent, i)
+                    if len(self.stack) == 1:
+                        sections.append((parent.current_key, buffer[self._section_start:i + 1]))
+                        self._section_start = None
+                    if parent.kind == "{":
+                        parent.current_key = None
+            elif char == ":":
+                if frame.kind != "{" or frame.current_key is None or not frame.expecting_key:
+                    raise StreamingJSONError("malformed", f"Unexpected ':' at offset {i}.")
+                frame.expecting_key = False
+            elif char == ",":
+                if len(self.stack) == 1:
+                    self._finish_scalar_section(i, sections)
+                if frame.kind == "{":
+                    frame.expecting_key = True
+                    frame.current_key = None
+            elif char in _SCALAR_CHARS:
+                if frame.kind == "{" and frame.expecting_key:
+                    raise StreamingJSONError("malformed", f"Expected a key at offset {i}.")
+                self._begin_value(frame, i)
+            else:
+                raise StreamingJSONError("malformed", f"Unexpected character {char!r} at offset {i}.")
+            i += 1
+        self.position = i
+        return sections
+
+    def _begin_value(self, frame: _Frame, offset: int) -> None:
+        if len(self.stack) == 1 and not frame.expecting_key and self._section_start is None:
+            self._section_start = offset
+
+    def _end_string(self, quote_offset: int) -> None:
+        frame = self.stack[-1]
+        if frame.kind == "{" and frame.expecting_key and frame.current_key is None:
+            frame.current_key = self.buffer[self._string_start + 1:quote_offset]
+
+    def _check_string_length(self, offset: int) -> None:
+        if self.max_string_chars is not None and offset - self._string_start > self.max_string_chars:
+            raise StreamingJSONError("runaway_string", f"String longer than {self.max_string_chars} characters.")
+
+    def _finish_scalar_section(self, offset: int, sections: List[Tuple[str, str]]) -> None:
+        root = self.stack[0]
+        if self._section_start is not None and root.current_key is not None:
+            sections.append((root.current_key, self.buffer[self._section_start:offset].strip()))
+        self._section_start = None
+
+    def _node_closed(self, node: _Frame, parent: _Frame, offset: int) -> None:
+        self._safe_end = offset + 1
+        self._safe_closers = "".join("}" if frame.kind == "{" else "]" for frame in reversed(self.stack))
+        if self.max_repeated_siblings is None:
+            return
+        node_text = self.buffer[node.start:offset + 1]
+        node_hash = hashlib.blake2b(_DIGITS_RE.sub("", node_text).encode("utf-8"), digest_size=16).digest()
+        if node_hash == parent.last_child_hash:
+            parent.repeat_run += 1
+            if parent.repeat_run >= self.max_repeated_siblings:
+                raise StreamingJSONError("repeating", f"{parent.repeat_run + 1} identical consecutive nodes in '{parent.key}'.")
+        else:
+            parent.last_child_hash = node_hash
+            parent.repeat_run = 0
+
+    def document_text(self) -> str:
+        """The complete document, or, after the node cap was hit, the document cut after the last complete node."""
+        if self.complete:
+            return self.buffer[self.document_start:self.position]
+        if self.node_limit_reached:
+            if self._safe_end is None:
+                raise StreamingJSONError("node_limit", "Node limit reached before any node was complete.")
+            return self.buffer[self.document_start:self._safe_end] + self._safe_closers
+        raise StreamingJSONError("incomplete", "Output ended before the JSON document was complete.")
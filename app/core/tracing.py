@@ -0,0 +1,209 @@
+# app/core/tracing.py
+"""
+Request-scoped tracing.
+
+Every HTTP request gets a `RequestTrace` stored in a contextvar. Code that wants to show up
+in the per-request breakdown wraps itself in `span("name")` (or decorates a function with
+`@traced("name")`). When the response starts, the collected spans are emitted as a
+`Server-Timing` header, and when it finishes they are written as one structured JSON log record.
+
+If an admin sends `X-Profile: 1` (or `?profile=1`), the request is additionally run under the
+sampling profiler from `app.core.profiler`, and the collapsed-stack profile is stored on disk.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+
+trace_logger = logging.getLogger("app.trace")
+if not trace_logger.handlers:
+    # Uvicorn only configures its own loggers, so give the trace logger a plain handler
+    # that prints the JSON record as-is (one record per line).
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+_SERVER_TIMING_NAME_RE = re.compile(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]")
+
+
+class RequestTrace:
+    """Spans collected for a single request."""
+
+    def __init__(self, method: str, path: str, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add_span(self, name: str, start: float, end: float, error: Optional[str] = None) -> None:
+        span_record = {
+            "name": name,
+            "start_ms": round((start - self.started_at) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+        }
+        if error:
+            span_record["error"] = error
+        self.spans.append(span_record)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def server_timing_header(self) -> str:
+        """
+        Builds the Server-Timing value. Spans with the same name (e.g. one vision call per page)
+        are summed into a single metric and the number of calls goes into `desc`.
+        """
+        totals: Dict[str, float] = {}
+        counts: Dict[str, int] = {}
+        for span_record in self.spans:
+            name = _SERVER_TIMING_NAME_RE.sub("_", span_record["name"])
+            totals[name] = totals.get(name, 0.0) + span_record["duration_ms"]
+            counts[name] = counts.get(name, 0) + 1
+        metrics = [
+            f'{name};dur={duration:.1f}' + (f';desc="x{counts[name]}"' if counts[name] > 1 else "")
+            for name, duration in totals.items()
+        ]
+        metrics.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(metrics)
+
+    def to_log_record(self, status_code: Optional[int]) -> Dict[str, Any]:
+        return {
+            "event": "request_trace",
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "duration_ms": round(self.elapsed_ms(), 3),
+            "spans": self.spans,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_request_trace", default=None)
+
+
+def get_current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the enclosed block and records it on the current request trace (no-op outside a request)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add_span(name, start, time.perf_counter(), error)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator version of `span()`. Works for both plain and `async def` functions."""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return sync_wrapper
+    return decorator
+
+
+def _profiling_requested(scope: Dict[str, Any]) -> bool:
+    headers = dict(scope.get("headers") or [])
+    if headers.get(b"x-profile", b"").strip() in (b"1", b"true"):
+        return True
+    query_string = scope.get("query_string", b"")
+    return any(part in (b"profile=1", b"profile=true") for part in query_string.split(b"&"))
+
+
+def _is_admin_request(scope: Dict[str, Any]) -> bool:
+    """Checks the bearer token of the raw request against ADMIN_EMAILS_CSV."""
+    # Imported lazily: app.core.security pulls in the schemas package.
+    from app.core.security import decode_access_token
+
+    admin_emails = settings.parsed_admin_emails
+    if not admin_emails:
+        return False
+    authorization = dict(scope.get("headers") or []).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    token_data = decode_access_token(token)
+    return bool(token_data and token_data.email and token_data.email.lower() in admin_emails)
+
+
+class RequestTracingMiddleware:
+    """
+    Pure ASGI middleware (so the contextvar it sets is visible inside the endpoint and its
+    dependencies) that owns the per-request trace and the optional per-request profiler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(method=scope.get("method", ""), path=scope.get("path", ""))
+        token = _current_trace.set(trace)
+        status_code: Optional[int] = None
+
+        profiler = None
+        if _profiling_requested(scope) and _is_admin_request(scope):
+            from app.core.profiler import SamplingProfiler
+            profiler = SamplingProfiler(interval_seconds=settings.PROFILER_SAMPLE_INTERVAL_MS / 1000.0)
+
+        async def send_with_server_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", trace.server_timing_header().encode("latin-1")))
+                headers.append((b"x-request-id", trace.request_id.encode("latin-1")))
+                if profiler is not None:
+                    headers.append((b"x-profile-id", trace.request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            if profiler is not None:
+                profiler.start()
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                try:
+                    profile_path = profiler.save(settings.PROFILE_OUTPUT_DIR, trace.request_id)
+                    print(f"--- Stored request profile for {trace.method} {trace.path}: {profile_path} ---")
+                except OSError as e:
+                    print(f"ERROR: Could not store request profile: {e}")
+            _current_trace.reset(token)
+            if settings.TRACE_LOG_JSON:
+                trace_logger.info(json.dumps(trace.to_log_record(status_code)))
@@ -0,0 +1,199 @@
+# app/core/uploads.py
+"""
+Memory-bounded handling of multi-image uploads (/analyze-image and the session page edits).
+
+- `upload_form` (a FastAPI dependency) parses the multipart body with per-file, per-request and
+  file-count limits (413 / 400 as soon as a limit is crossed, before the rest of the body is read).
+  File parts go to SpooledTemporaryFiles that roll over to disk past UPLOAD_SPOOL_MAX_MEMORY_BYTES,
+  and are closed once the response has been sent.
+- Images are read back from those files one page (or one vision batch) at a time, inside
+  `image_memory_budget`: a per-worker cap on the estimated memory of the images being decoded and
+  sent to the vision model at once. Pages that don't fit wait for earlier ones to finish.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional, Tuple
+
+from fastapi import HTTPException, Request, UploadFile
+from PIL import Image
+from starlette.datastructures import FormData
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import ClientDisconnect
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tracing import span
+
+# Bytes held per encoded byte while an image is sent to the vision model: the raw bytes, the base64
+# bytes and string, the data URL and httpx's JSON str and UTF-8 body (base64 is 4/3 of the raw size)
+ENCODED_COPIES_FACTOR = 8
+DECODED_BYTES_PER_PIXEL = 4
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(status_code=413, detail=detail)
+
+
+def _mib(size: int) -> str:
+    return f"{size / (1024 * 1024):.0f} MiB"
+
+
+class _BoundedMultiPartParser(MultiPartParser):
+    """Starlette's parser with a configurable spool size and a per-file size limit checked as data arrives."""
+
+    def __init__(self, *args, max_file_bytes: int, spool_max_size: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_file_bytes = max_file_bytes
+        self.spool_max_size = spool_max_size
+        self._current_file_bytes = 0
+
+    def on_part_begin(self) -> None:
+        super().on_part_begin()
+        self._current_file_bytes = 0
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current_part.file is not None:
+            self._current_file_bytes += end - start
+            if self._current_file_bytes > self.max_file_bytes:
+                raise UploadTooLarge(f"File '{self._current_part.file.filename}' exceeds the {_mib(self.max_file_bytes)} per-file limit.")
+        super().on_part_data(data, start, end)
+
+
+async def _limited_body(request: Request, max_bytes: int) -> AsyncIterator[bytes]:
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadTooLarge(f"Request body exceeds the {_mib(max_bytes)} upload limit.")
+        yield chunk
+
+
+async def parse_upload_form(request: Request) -> FormData:
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_REQUEST_BYTES:
+        metrics.increment("uploads.rejected", reason="request_too_large")
+        raise UploadTooLarge(f"Request body exceeds the {_mib(settings.UPLOAD_MAX_REQUEST_BYTES)} upload limit.")
+    if not request.headers.get("content-type", "").lower().startswith("multipart/form-data"):
+        return await request.form(max_files=settings.UPLOAD_MAX_FILES)
+    parser = _BoundedMultiPartParser(
+        request.headers, _limited_body(request, settings.UPLOAD_MAX_REQUEST_BYTES),
+        max_files=settings.UPLOAD_MAX_FILES, max_fields=settings.UPLOAD_MAX_FILES * 2 + 10,
+        max_file_bytes=settings.UPLOAD_MAX_FILE_BYTES, spool_max_size=settings.UPLOAD_SPOOL_MAX_MEMORY_BYTES,
+    )
+    try:
+        form = await parser.parse()
+    except (UploadTooLarge, MultiPartException, ClientDisconnect) as e:
+        for spooled_file in parser._files_to_close_on_error: # Starlette only closes them on MultiPartException
+            spooled_file.close()
+        if isinstance(e, UploadTooLarge):
+            metrics.increment("uploads.rejected", reason="too_large")
+            raise
+        if isinstance(e, MultiPartException):
+            metrics.increment("uploads.rejected", reason="invalid_multipart")
+            raise HTTPException(status_code=400, detail=e.message)
+        raise
+    request._form = form # So Request.close() and any later request.form() see the same parts
+    uploads = [value for _, value in form.multi_items() if isinstance(value, UploadFile)]
+    metrics.observe("uploads.request_bytes", sum(upload.size or 0 for upload in uploads))
+    metrics.increment("uploads.spooled_to_disk", sum(1 for upload in uploads if getattr(upload.file, "_rolled", False)))
+    return form
+
+
+async def upload_form(request: Request) -> AsyncIterator[FormData]:
+    """FastAPI dependency: the parsed, size-limited form; its temp files are closed after the response."""
+    with span("form_parse"):
+        form = await parse_upload_form(request)
+    try:
+        yield form
+    finally:
+        await form.close()
+
+
+async def read_upload_bytes(upload: UploadFile) -> bytes:
+    """The whole file, from the start (other readers, e.g. the fingerprint pass, may have moved the position)."""
+    await upload.seek(0)
+    return await upload.read()
+
+
+def _header_dimensions(upload: UploadFile) -> Tuple[Optional[int], Optional[int]]:
+    upload.file.seek(0)
+    try:
+        with Image.open(upload.file) as img: # Reads the header only
+            return img.width, img.height
+    except Exception:
+        return None, None
+    finally:
+        upload.file.seek(0)
+
+
+async def upload_image_dimensions(upload: UploadFile) -> Tuple[Optional[int], Optional[int]]:
+    """Width and height from the image header, without reading the file into memory."""
+    return await asyncio.to_thread(_header_dimensions, upload)
+
+
+def estimated_image_memory(encoded_bytes: int, width: Optional[int], height: Optional[int]) -> int:
+    """Rough peak memory for analyzing one image: its encoded copies plus one decoded RGBA frame."""
+    return encoded_bytes * ENCODED_COPIES_FACTOR + (width or 0) * (height or 0) * DECODED_BYTES_PER_PIXEL
+
+
+class MemoryBudget:
+    """
+    An async byte semaphore. `reserve(n)` waits (FIFO) until `n` more bytes fit under the capacity;
+    a reservation larger than the capacity is clamped to it, so it runs alone rather than never.
+    """
+
+    def __init__(self, name: str, capacity_bytes: int):
+        self.name = name
+        self.capacity_bytes = max(1, capacity_bytes)
+        self.in_use_bytes = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("memory_budget.in_use_bytes", self.in_use_bytes, budget=self.name)
+        metrics.set_gauge("memory_budget.waiting", len(self._waiters), budget=self.name)
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_use_bytes + self._waiters[0][0] <= self.capacity_bytes:
+            size, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_use_bytes += size
+            future.set_result(None)
+        self._publish()
+
+    def _release(self, size: int) -> None:
+        self.in_use_bytes -= size
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        size = min(max(0, int(size)), self.capacity_bytes)
+        if not self._waiters and self.in_use_bytes + size <= self.capacity_bytes:
+            self.in_use_bytes += size
+            self._publish()
+        else:
+            waiter = (size, asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            self._publish()
+            started = time.monotonic()
+            try:
+                await waiter[1]
+            except BaseException:
+                if waiter[1].done() and not waiter[1].cancelled():
+                    self._release(size) # Granted, but the waiting task was cancelled at the same time
+                else:
+                    if waiter in self._waiters: # A release in the same tick may already have dropped the cancelled waiter
+                        self._waiters.remove(waiter)
+                    self._wake_waiters() # It may have been the head blocking smaller reservations
+                raise
+            metrics.observe("memory_budget.wait_seconds", time.monotonic() - started, budget=self.name)
+        try:
+            yield
+        finally:
+            self._release(size)
+
+
+image_memory_budget = MemoryBudget("images", settings.IMAGE_MEMORY_BUDGET_BYTES)
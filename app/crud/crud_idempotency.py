@@ -0,0 +1,72 @@
+# app/crud/crud_idempotency.py
+import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.tracing import traced
+from app.crud.crud_base import CRUDBase
+from app.models.prompt_session import IdempotencyKey
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    # SQLite hands back naive datetimes; everything we store is UTC.
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+
+class CRUDIdempotencyKey(CRUDBase[IdempotencyKey, BaseModel, BaseModel]):
+    @traced("crud.idempotency_get")
+    def get_active(self, db: Session, *, owner_id: int, key: str) -> Optional[IdempotencyKey]:
+        """
+        Returns the record for (owner, key) if it has not expired. Expired records are deleted
+        on the way so the key can be claimed again.
+        """
+        record = db.query(IdempotencyKey).filter(IdempotencyKey.owner_id == owner_id, IdempotencyKey.key == key).first()
+        if record is not None and _as_utc(record.expires_at) <= datetime.datetime.now(datetime.timezone.utc):
+            db.delete(record)
+            db.commit()
+            return None
+        return record
+
+    @traced("crud.idempotency_claim")
+    def claim(self, db: Session, *, owner_id: int, key: str, request_fingerprint: str, ttl: datetime.timedelta) -> Optional[IdempotencyKey]:
+        """
+        Inserts an in-progress record. Returns None if another request claimed the key first
+        (unique constraint on owner_id + key).
+        """
+        record = IdempotencyKey(
+            owner_id=owner_id,
+            key=key,
+            request_fingerprint=request_fingerprint,
+            status="in_progress",
+            expires_at=datetime.datetime.now(datetime.timezone.utc) + ttl,
+        )
+        db.add(record)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        db.refresh(record)
+        return record
+
+    @traced("crud.idempotency_complete")
+    def complete(self, db: Session, *, record: IdempotencyKey, response_json: Dict[str, Any], prompt_session_id: Optional[int]) -> IdempotencyKey:
+        record.status = "completed"
+        record.response_json = response_json
+        record.prompt_session_id = prompt_session_id
+        db.add(record)
+        db.commit()
+        db.refresh(record)
+        return record
+
+    @traced("crud.idempotency_release")
+    def release(self, db: Session, *, record: IdempotencyKey) -> None:
+        """Drops an in-progress claim after a failed run, so the client can retry with the same key."""
+        db.delete(record)
+        db.commit()
+
+
+idempotency_key = CRUDIdempotencyKey(IdempotencyKey)
@@ -0,0 +1,93 @@
+# app/crud/crud_image_blob.py
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.core.tracing import traced
+from app.crud.crud_base import CRUDBase
+from app.models.prompt_session import ImageBlob, ImageEntry, PromptSession
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _is_referenced(sha256_column):
+    return exists().where(ImageEntry.image_sha256 == sha256_column)
+
+
+class CRUDImageBlob(CRUDBase[ImageBlob, BaseModel, BaseModel]):
+    @traced("crud.image_blob_record")
+    def record_upload(self, db: Session, *, sha256: str, size_bytes: int, content_type: Optional[str]) -> None:
+        """Inserts the blob's row, or marks an existing one as used now. Committed right away: the GC relies on it."""
+        insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+        now = _utcnow()
+        statement = insert(ImageBlob).values(sha256=sha256, size_bytes=size_bytes, content_type=content_type, created_at=now, last_used_at=now)
+        db.execute(statement.on_conflict_do_update(index_elements=[ImageBlob.sha256], set_={"last_used_at": now}))
+        db.commit()
+
+    def touch(self, db: Session, *, sha256s: Iterable[str]) -> None:
+        sha256s = list(set(sha256s))
+        if sha256s:
+            db.execute(update(ImageBlob).where(ImageBlob.sha256.in_(sha256s)).values(last_used_at=_utcnow()))
+            db.commit()
+
+    def get_many(self, db: Session, *, sha256s: Iterable[str]) -> Dict[str, ImageBlob]:
+        sha256s = list(set(sha256s))
+        if not sha256s:
+            return {}
+        return {blob.sha256: blob for blob in db.execute(select(ImageBlob).where(ImageBlob.sha256.in_(sha256s))).scalars()}
+
+    def exists(self, db: Session, *, sha256: str) -> bool:
+        return db.execute(select(ImageBlob.sha256).where(ImageBlob.sha256 == sha256)).first() is not None
+
+    def total_bytes(self, db: Session) -> int:
+        return int(db.execute(select(func.coalesce(func.sum(ImageBlob.size_bytes), 0))).scalar_one())
+
+    @traced("crud.image_blob_owner_usage")
+    def bytes_referenced_by_owner(self, db: Session, *, owner_id: int) -> int:
+        """Size of the distinct blobs the owner's pages reference (a blob shared by two pages counts once)."""
+        owner_hashes = select(ImageEntry.image_sha256).join(PromptSession, ImageEntry.prompt_session_id == PromptSession.id).where(PromptSession.owner_id == owner_id)
+        return int(db.execute(select(func.coalesce(func.sum(ImageBlob.size_bytes), 0)).where(ImageBlob.sha256.in_(owner_hashes))).scalar_one())
+
+    def is_referenced_by_owner(self, db: Session, *, owner_id: int, sha256: str) -> bool:
+        statement = select(ImageEntry.id).join(PromptSession, ImageEntry.prompt_session_id == PromptSession.id).where(PromptSession.owner_id == owner_id, ImageEntry.image_sha256 == sha256).limit(1)
+        return db.execute(statement).first() is not None
+
+    def reference_summary(self, db: Session) -> Dict[str, int]:
+        """Blob count and bytes, split into referenced and unreferenced."""
+        referenced = _is_referenced(ImageBlob.sha256)
+        row = db.execute(select(
+            func.count(),
+            func.coalesce(func.sum(ImageBlob.size_bytes), 0),
+            func.count().filter(~referenced),
+            func.coalesce(func.sum(ImageBlob.size_bytes).filter(~referenced), 0),
+        )).one()
+        return {"blobs": row[0], "bytes": int(row[1]), "unreferenced_blobs": row[2], "unreferenced_bytes": int(row[3])}
+
+    def unreferenced(self, db: Session, *, used_before: datetime.datetime, limit: Optional[int]) -> List[ImageBlob]:
+        statement = select(ImageBlob).where(ImageBlob.last_used_at < used_before, ~_is_referenced(ImageBlob.sha256)).order_by(ImageBlob.last_used_at).limit(limit)
+        return list(db.execute(statement).scalars())
+
+    def least_recently_used(self, db: Session, *, limit: Optional[int]) -> List[ImageBlob]:
+        return list(db.execute(select(ImageBlob).order_by(ImageBlob.last_used_at, ImageBlob.sha256).limit(limit)).scalars())
+
+    def delete_if_unreferenced(self, db: Session, *, sha256: str, used_before: datetime.datetime) -> bool:
+        """Deletes the row if nothing references it and nobody used it since `used_before` (re-checked in the statement)."""
+        result = db.execute(delete(ImageBlob).where(ImageBlob.sha256 == sha256, ImageBlob.last_used_at < used_before, ~_is_referenced(ImageBlob.sha256)))
+        db.commit()
+        return result.rowcount == 1
+
+    def delete_if_unused_since(self, db: Session, *, sha256: str, last_used_at: datetime.datetime) -> bool:
+        """Eviction: deletes the row unless the blob was uploaded or read again after `last_used_at`."""
+        result = db.execute(delete(ImageBlob).where(ImageBlob.sha256 == sha256, ImageBlob.last_used_at <= last_used_at))
+        db.commit()
+        return result.rowcount == 1
+
+
+image_blob = CRUDImageBlob(ImageBlob)
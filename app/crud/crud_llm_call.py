@@ -0,0 +1,75 @@
+# app/crud/crud_llm_call.py
+import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from pydantic import BaseModel
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.tracing import traced
+from app.crud.crud_base import CRUDBase
+from app.models.prompt_session import LLMCall
+
+LLM_USAGE_GROUP_COLUMNS = {
+    "user": LLMCall.user_id,
+    "model": LLMCall.model,
+    "stage": LLMCall.stage,
+    "outcome": LLMCall.outcome,
+    "day": func.date(LLMCall.created_at), # UTC day on SQLite, where created_at is stored as UTC text; see _group_column
+}
+
+
+def _group_column(key: str, dialect_name: str):
+    if key == "day" and dialect_name == "postgresql":
+        # date(timestamptz) follows the session TimeZone; convert to UTC first so days don't depend on server config
+        return func.date(func.timezone("UTC", LLMCall.created_at))
+    return LLM_USAGE_GROUP_COLUMNS[key]
+
+
+class CRUDLLMCall(CRUDBase[LLMCall, BaseModel, BaseModel]):
+    def insert_batch(self, db: Session, *, rows: List[Dict[str, Any]]) -> None:
+        """One multi-row INSERT (executemany) for a buffered batch; no ORM objects are built."""
+        if rows:
+            db.execute(insert(LLMCall), rows)
+            db.commit()
+
+    @traced("crud.llm_usage_aggregate")
+    def aggregate(
+        self,
+        db: Session,
+        *,
+        group_by: Sequence[str],
+        since: datetime.datetime,
+        until: datetime.datetime,
+        user_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Token, cost and latency totals per group over [since, until). `group_by` are keys of
+        LLM_USAGE_GROUP_COLUMNS; an empty `group_by` gives a single totals row.
+        """
+        group_columns = [_group_column(key, db.get_bind().dialect.name).label(key) for key in group_by]
+        failed = case((LLMCall.outcome != "ok", 1), else_=0)
+        without_cost = case((LLMCall.cost_usd.is_(None), 1), else_=0)
+        statement = (
+            select(
+                *group_columns,
+                func.count().label("calls"),
+                func.coalesce(func.sum(failed), 0).label("failed_calls"),
+                func.coalesce(func.sum(LLMCall.prompt_tokens), 0).label("prompt_tokens"),
+                func.coalesce(func.sum(LLMCall.completion_tokens), 0).label("completion_tokens"),
+                func.coalesce(func.sum(LLMCall.cached_tokens), 0).label("cached_tokens"),
+                func.sum(LLMCall.cost_usd).label("cost_usd"),
+                func.coalesce(func.sum(without_cost), 0).label("calls_without_cost"),
+                func.coalesce(func.sum(LLMCall.latency_ms), 0).label("total_latency_ms"),
+                func.max(LLMCall.latency_ms).label("max_latency_ms"),
+            )
+            .where(LLMCall.created_at >= since, LLMCall.created_at < until)
+        )
+        if user_id is not None:
+            statement = statement.where(LLMCall.user_id == user_id)
+        if group_columns:
+            statement = statement.group_by(*group_columns).order_by(*group_columns)
+        return [dict(row) for row in db.execute(statement).mappings() if row["calls"]]
+
+
+llm_call = CRUDLLMCall(LLMCall)
@@ -1,13 +1,83 @@
 # app/crud/crud_prompt_session.py
+from sqlalchemy import and_, cast, func, literal, or_, select, text
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from sqlalchemy.orm import Session
-from typing import List, Optional, Any, Dict
+from typing import Iterator, List, Optional, Any, Dict, Tuple, Union
 
+from app.core.config import settings
+from app.core.tracing import traced
 from app.crud.crud_base import CRUDBase
 from app.models.prompt_session import PromptSession, GeneratedPrompt, User, ImageEntry # Import ImageEntry model
 # Ensure GeminiVisionAnalysis is your rich schema if you named it that, or RichImageAnalysisSchema
-from app.schemas.prompt import PromptSessionCreate, GeneratedPromptCreate 
+from app.schemas.prompt import ANALYSIS_STORAGE_FORMAT, ANALYSIS_STORAGE_FORMAT_KEY, PromptSessionCreate, GeneratedPromptCreate
+
+
+def _sql_iso_timestamp(column: str) -> str:
+    # Same text pydantic produces for a UTC datetime: no fraction when it is zero, "Z" suffix
+    utc = f"({column} AT TIME ZONE 'UTC')"
+    return (
+        f"(to_char({utc}, 'YYYY-MM-DD\"T\"HH24:MI:SS')"
+        f" || CASE WHEN date_trunc('second', {column}) = {column} THEN '' ELSE to_char({utc}, '.US') END || 'Z')"
+    )
+
+
+# One row per session, already in the PromptSessionInDB / ImageEntryInDB / GeneratedPromptInDB
+# JSON shape (same keys, same child ordering as the ORM relationships). Analyses stamped with the
+# current ANALYSIS_STORAGE_FORMAT are complete RichImageAnalysisSchema dumps and are passed through
+# (minus the stamp). Anything else - columnar and repeat-compacted trees, analyses stored under an
+# older schema, error placeholders ({"error": ...}) - is left as stored and `needs_expansion` flags
+# the session, so the endpoint runs it through PromptSessionInDB like the ORM path does.
+HISTORY_JSON_SQL = f"""
+SELECT
+    json_build_object(
+        'id', s.id,
+        'owner_id', s.owner_id,
+        'session_name', s.session_name,
+        'image_filename', s.image_filename,
+        'created_at', {_sql_iso_timestamp("s.created_at")},
+        'updated_at', {_sql_iso_timestamp("s.updated_at")},
+        'image_entries', coalesce((
+            SELECT json_agg(json_build_object(
+                'title', e.title,
+                'original_filename', e.original_filename,
+                'analysis_output_json', CASE
+                    WHEN e.analysis_output_json ->> '{ANALYSIS_STORAGE_FORMAT_KEY}' = :storage_format THEN (e.analysis_output_json - '{ANALYSIS_STORAGE_FORMAT_KEY}')::json
+                    ELSE e.analysis_output_json::json
+                END,
+                'order_in_session', e.order_in_session,
+                'id', e.id,
+                'prompt_session_id', e.prompt_session_id,
+                'created_at', {_sql_iso_timestamp("e.created_at")}
+            ) ORDER BY e.order_in_session, e.id)
+            FROM image_entries e WHERE e.prompt_session_id = s.id
+        ), '[]'::json),
+        'generated_prompts', coalesce((
+            SELECT json_agg(json_build_object(
+                'prompt_type', g.prompt_type,
+                'prompt_text', g.prompt_text,
+                'order_in_session', g.order_in_session,
+                'id', g.id,
+                'version', g.version,
+                'created_at', {_sql_iso_timestamp("g.created_at")}
+            ) ORDER BY g.version DESC, g.order_in_session, g.id)
+            FROM generated_prompts g WHERE g.session_id = s.id
+        ), '[]'::json)
+    )::text AS session_json,
+    EXISTS (
+        SELECT 1 FROM image_entries e
+        WHERE e.prompt_session_id = s.id AND e.analysis_output_json IS NOT NULL AND (
+            e.analysis_output_json ?| array['detected_elements_columns', 'detected_elements_compact']
+            OR e.analysis_output_json ->> '{ANALYSIS_STORAGE_FORMAT_KEY}' IS DISTINCT FROM :storage_format
+        )
+    ) AS needs_expansion
+FROM prompt_sessions s
+WHERE s.owner_id = :owner_id
+ORDER BY s.created_at DESC, s.id DESC
+OFFSET :skip LIMIT :limit
+"""
 
 class CRUDPromptSession(CRUDBase[PromptSession, PromptSessionCreate, PromptSessionCreate]):
+    @traced("crud.create_session")
     def create_with_images_and_final_prompt(
         self, 
         db: Session, 
@@ -41,6 +111,7 @@ class CRUDPromptSession(CRUDBase[PromptSession, PromptSessionCreate, PromptSessi
             db_image_entry = ImageEntry(
                 title=img_analysis_data.get("title", "Untitled Image"),
                 original_filename=img_analysis_data.get("original_filename"),
+                image_sha256=img_analysis_data.get("image_sha256"),
                 analysis_output_json=analysis_json_for_db,
                 order_in_session=order,
                 prompt_session_id=db_session.id 
@@ -68,6 +139,7 @@ class CRUDPromptSession(CRUDBase[PromptSession, PromptSessionCreate, PromptSessi
         
         return db_session
 
+    @traced("crud.history")
     def get_multi_by_owner(
         self, db: Session, *, owner_id: int, skip: int = 0, limit: int = 100
     ) -> List[PromptSession]:
@@ -80,7 +152,20 @@ class CRUDPromptSession(CRUDBase[PromptSession, PromptSessionCreate, PromptSessi
             .all()
         )
 
+    def iter_history_json_rows(self, db: Session, *, owner_id: int, skip: int = 0, limit: int = 100, batch_size: int = 50) -> Iterator[Tuple[str, bool]]:
+        """
+        PostgreSQL only: the same page as get_multi_by_owner, as (session JSON text, needs_expansion)
+        rows built by the database and read through a server-side cursor.
+        """
+        result = db.execute(
+            text(HISTORY_JSON_SQL).execution_options(yield_per=batch_size),
+            {"owner_id": owner_id, "skip": skip, "limit": limit, "storage_format": ANALYSIS_STORAGE_FORMAT},
+        )
+        for row in result:
+            yield row.session_json, row.needs_expansion
+
     # --- ADD THIS NEW METHOD ---
+    @traced("crud.history_count")
     def get_count_by_owner(self, db: Session, *, owner_id: int) -> int:
         """
         Get the total count of prompt sessions for a specific owner.
@@ -88,4 +173,193 @@ class CRUDPromptSession(CRUDBase[PromptSession, PromptSessionCreate, PromptSessi
         return db.query(self.model).filter(PromptSession.owner_id == owner_id).count()
     # --- END OF NEW METHOD ---
 
+    @traced("crud.history_version")
+    def get_history_version_by_owner(self, db: Session, *, owner_id: int) -> Tuple[int, Optional[Any]]:
+        """
+        (session count, latest updated_at) of the owner's sessions, for the /history ETag. Creating or
+        editing a session moves the timestamp and deleting one drops the count; served by the
+        (owner_id, updated_at) index.
+        """
+        row = db.query(func.count(PromptSession.id), func.max(PromptSession.updated_at)).filter(PromptSession.owner_id == owner_id).one()
+        return row[0], row[1]
+
+    @traced("crud.history_search")
+    def search_by_owner(
+        self, db: Session, *, owner_id: int, query_text: str, limit: int = 20, after: Optional[Tuple[float, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Summary rows of the owner's sessions matching `query_text`, best match first (ties: newest first).
+        `after` is the (rank, id) of the last row of the previous page. On PostgreSQL this matches the
+        trigger-maintained `search_vector` (GIN index, websearch syntax); elsewhere it falls back to a
+        case-insensitive substring match with rank 0.
+        """
+        page_count = (
+            select(func.count(ImageEntry.id))
+            .where(ImageEntry.prompt_session_id == PromptSession.id)
+            .correlate(PromptSession)
+            .scalar_subquery()
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            ts_query = func.websearch_to_tsquery(cast(settings.HISTORY_SEARCH_TEXT_CONFIG, REGCONFIG), query_text)
+            rank = func.ts_rank(PromptSession.search_vector, ts_query)
+            match = PromptSession.search_vector.op("@@")(ts_query)
+        else:
+            escaped = query_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = f"%{escaped}%"
+            page_title_guess = ImageEntry.analysis_output_json["overall_analysis"]["page_title_guess"].as_string()
+            rank = literal(0.0)
+            match = or_(
+                PromptSession.session_name.ilike(pattern, escape="\\"),
+                PromptSession.image_entries.any(or_(ImageEntry.title.ilike(pattern, escape="\\"), page_title_guess.ilike(pattern, escape="\\"))),
+                PromptSession.generated_prompts.any(GeneratedPrompt.prompt_text.ilike(pattern, escape="\\")),
+            )
+
+        statement = (
+            select(
+                PromptSession.id, PromptSession.session_name, PromptSession.image_filename,
+                PromptSession.created_at, PromptSession.updated_at,
+                page_count.label("page_count"), rank.label("rank"),
+            )
+            .where(PromptSession.owner_id == owner_id, match)
+            .order_by(rank.desc(), PromptSession.id.desc())
+            .limit(limit)
+        )
+        if after is not None:
+            after_rank, after_id = after
+            statement = statement.where(or_(rank < after_rank, and_(rank == after_rank, PromptSession.id < after_id)))
+        return [dict(row._mapping) for row in db.execute(statement)]
+
+    def iter_export_records(self, db: Session, *, owner_id: int, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the owner's sessions one at a time as plain dicts (with their pages and prompts),
+        without building ORM objects. Sessions, entries and prompts are read as three server-side
+        cursors ordered by session id and merged, so memory stays flat whatever the history size.
+        """
+        stream = {"yield_per": batch_size} # Implies stream_results (a named cursor on PostgreSQL)
+        sessions = db.execute(
+            select(PromptSession.id, PromptSession.session_name, PromptSession.image_filename, PromptSession.created_at, PromptSession.updated_at)
+            .where(PromptSession.owner_id == owner_id)
+            .order_by(PromptSession.id)
+            .execution_options(**stream)
+        )
+        entries = iter(db.execute(
+            select(ImageEntry.prompt_session_id, ImageEntry.id, ImageEntry.title, ImageEntry.original_filename, ImageEntry.order_in_session, ImageEntry.created_at, ImageEntry.analysis_output_json)
+            .join(PromptSession, ImageEntry.prompt_session_id == PromptSession.id)
+            .where(PromptSession.owner_id == owner_id)
+            .order_by(ImageEntry.prompt_session_id, ImageEntry.order_in_session, ImageEntry.id)
+            .execution_options(**stream)
+        ))
+        prompts = iter(db.execute(
+            select(GeneratedPrompt.session_id, GeneratedPrompt.id, GeneratedPrompt.prompt_type, GeneratedPrompt.prompt_text, GeneratedPrompt.order_in_session, GeneratedPrompt.version, GeneratedPrompt.created_at)
+            .join(PromptSession, GeneratedPrompt.session_id == PromptSession.id)
+            .where(PromptSession.owner_id == owner_id)
+            .order_by(GeneratedPrompt.session_id, GeneratedPrompt.version.desc(), GeneratedPrompt.order_in_session, GeneratedPrompt.id)
+            .execution_options(**stream)
+        ))
+        next_entry, next_prompt = next(entries, None), next(prompts, None)
+        for session_row in sessions:
+            # The three queries don't share a snapshot; skip child rows of sessions deleted in between
+            while next_entry is not None and next_entry.prompt_session_id < session_row.id:
+                next_entry = next(entries, None)
+            while next_prompt is not None and next_prompt.session_id < session_row.id:
+                next_prompt = next(prompts, None)
+            record = dict(session_row._mapping)
+            record["image_entries"], record["generated_prompts"] = [], []
+            while next_entry is not None and next_entry.prompt_session_id == session_row.id:
+                record["image_entries"].append(dict(next_entry._mapping))
+                next_entry = next(entries, None)
+            while next_prompt is not None and next_prompt.session_id == session_row.id:
+                record["generated_prompts"].append(dict(next_prompt._mapping))
+                next_prompt = next(prompts, None)
+            yield record
+
+    def _session_id_filters(self, *, after_id: int, owner_id: Optional[int], session_ids: Optional[List[int]]) -> List[Any]:
+        filters = [PromptSession.id > after_id]
+        if owner_id is not None:
+            filters.append(PromptSession.owner_id == owner_id)
+        if session_ids:
+            filters.append(PromptSession.id.in_(session_ids))
+        return filters
+
+    def count_session_ids(self, db: Session, *, after_id: int = 0, owner_id: Optional[int] = None, session_ids: Optional[List[int]] = None) -> int:
+        return db.query(func.count(PromptSession.id)).filter(*self._session_id_filters(after_id=after_id, owner_id=owner_id, session_ids=session_ids)).scalar() or 0
+
+    def iter_session_ids(self, db: Session, *, after_id: int = 0, owner_id: Optional[int] = None, session_ids: Optional[List[int]] = None, batch_size: int = 1000) -> Iterator[int]:
+        """Session ids above `after_id` in ascending order, read through a server-side cursor (for batch jobs)."""
+        rows = db.execute(
+            select(PromptSession.id)
+            .where(*self._session_id_filters(after_id=after_id, owner_id=owner_id, session_ids=session_ids))
+            .order_by(PromptSession.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for row in rows:
+            yield row.id
+
+    @traced("crud.session_get_owned")
+    def get_by_owner(self, db: Session, *, id: int, owner_id: int) -> Optional[PromptSession]:
+        return db.query(self.model).filter(PromptSession.id == id, PromptSession.owner_id == owner_id).first()
+
+    @traced("crud.session_version")
+    def get_updated_at_by_owner(self, db: Session, *, id: int, owner_id: int) -> Tuple[bool, Optional[Any]]:
+        """(exists, updated_at) of one owned session, read by primary key without loading the session."""
+        row = db.query(PromptSession.updated_at).filter(PromptSession.id == id, PromptSession.owner_id == owner_id).first()
+        return (row is not None), (row[0] if row is not None else None)
+
+    @traced("crud.session_update_pages")
+    def update_pages_with_new_prompt_version(
+        self,
+        db: Session,
+        *,
+        db_session: PromptSession,
+        ordered_pages: List[Union[ImageEntry, Dict[str, Any]]],
+        final_prompts_obj_in: List[GeneratedPromptCreate],
+    ) -> PromptSession:
+        """
+        Applies a page edit in one transaction. `ordered_pages` is the session's new page list:
+        existing ImageEntry rows are kept (and re-numbered), dicts become new ImageEntry rows, and
+        entries missing from the list are deleted. The final prompt(s) are stored as a new version.
+        """
+        # Concurrent edits of one session take turns from here to the commit, so each reads the
+        # max(version) the previous one wrote (FOR UPDATE is a no-op on SQLite, which locks on write)
+        db.query(PromptSession.id).filter(PromptSession.id == db_session.id).with_for_update().one()
+        kept_entry_ids = {page.id for page in ordered_pages if isinstance(page, ImageEntry)}
+        for entry in list(db_session.image_entries):
+            if entry.id not in kept_entry_ids:
+                db_session.image_entries.remove(entry) # delete-orphan cascade deletes the row
+
+        for order, page in enumerate(ordered_pages):
+            if isinstance(page, ImageEntry):
+                page.order_in_session = order
+                continue
+            analysis_json_for_db = page.get("analysis_output_json")
+            if not isinstance(analysis_json_for_db, dict) and analysis_json_for_db is not None:
+                print(f"WARNING CRUD: analysis_output_json for {page.get('title')} is not a dict, type: {type(analysis_json_for_db)}")
+                analysis_json_for_db = None
+            db.add(ImageEntry(
+                title=page.get("title", "Untitled Image"),
+                original_filename=page.get("original_filename"),
+                image_sha256=page.get("image_sha256"),
+                analysis_output_json=analysis_json_for_db,
+                order_in_session=order,
+                prompt_session_id=db_session.id
+            ))
+
+        current_version = db.query(func.max(GeneratedPrompt.version)).filter(GeneratedPrompt.session_id == db_session.id).scalar() or 0
+        for order, prompt_in in enumerate(final_prompts_obj_in):
+            db.add(GeneratedPrompt(
+                prompt_type=prompt_in.prompt_type or "consolidated_multi_page",
+                prompt_text=prompt_in.prompt_text,
+                order_in_session=order,
+                version=current_version + 1,
+                session_id=db_session.id
+            ))
+
+        first_page = ordered_pages[0] if ordered_pages else None
+        db_session.image_filename = first_page.original_filename if isinstance(first_page, ImageEntry) else (first_page or {}).get("original_filename")
+        db_session.updated_at = func.now() # Page edits don't touch the session row's own columns otherwise
+        db.add(db_session)
+        db.commit()
+        db.refresh(db_session)
+        return db_session
+
 prompt_session = CRUDPromptSession(PromptSession)
\ No newline at end of file
@@ -2,17 +2,21 @@
 from sqlalchemy.orm import Session
 from typing import Optional
 
+from app.core.tracing import traced
 from app.crud.crud_base import CRUDBase
 from app.models.prompt_session import User # Your SQLAlchemy User model
 from app.schemas.user import UserCreate, UserUpdate # Your Pydantic User schemas
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
+    @traced("crud.user_by_email")
     def get_by_email(self, db: Session, *, email: str) -> Optional[User]:
         return db.query(User).filter(User.email == email).first()
 
+    @traced("crud.user_by_oauth_id")
     def get_by_oauth_id(self, db: Session, *, oauth_provider: str, oauth_id: str) -> Optional[User]:
         return db.query(User).filter(User.oauth_provider == oauth_provider, User.oauth_id == oauth_id).first()
 
+    @traced("crud.user_create")
     def create(self, db: Session, *, obj_in: UserCreate) -> User:
         # In a real app, if supporting passwords, you'd hash password here before saving
         db_obj = User(
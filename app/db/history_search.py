@@ -0,0 +1,146 @@
+# app/db/history_search.py
+"""
+PostgreSQL full-text search index for session history.
+
+`prompt_sessions.search_vector` holds a weighted tsvector per session:
+  A - session_name
+  B - ImageEntry.title and analysis_output_json.overall_analysis.page_title_guess
+  C - GeneratedPrompt.prompt_text (latest version only)
+
+A generated column can't read other tables, so the vector is kept in sync by triggers: a BEFORE
+trigger on prompt_sessions (insert / session_name change) and statement-level AFTER triggers on
+image_entries and generated_prompts. Those read the statement's transition tables and recompute
+each affected session's vector once per statement, not once per row, so saving an N-page session
+(or a batch reprocessing run) doesn't re-tokenize it N times. A GIN index serves the `@@` match.
+
+There are no migrations (tables come from create_all), so `install_history_search` is idempotent
+and runs at startup: it adds the column to existing tables, (re)creates functions and triggers,
+creates the index and backfills sessions that don't have a vector yet.
+"""
+import re
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+_TEXT_CONFIG_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def _install_statements(text_config: str, max_prompt_chars: int) -> list:
+    config = f"'{text_config}'::regconfig"
+    return [
+        "ALTER TABLE prompt_sessions ADD COLUMN IF NOT EXISTS search_vector tsvector",
+
+        f"""
+        CREATE OR REPLACE FUNCTION prompt_session_search_document(p_session_id integer, p_session_name text)
+        RETURNS tsvector LANGUAGE sql STABLE AS $$
+            SELECT setweight(to_tsvector({config}, coalesce(p_session_name, '')), 'A')
+                || setweight(to_tsvector({config}, coalesce((
+                       SELECT string_agg(coalesce(e.title, '') || ' ' || coalesce(e.analysis_output_json -> 'overall_analysis' ->> 'page_title_guess', ''), ' ')
+                       FROM image_entries e
+                       WHERE e.prompt_session_id = p_session_id), '')), 'B')
+                || setweight(to_tsvector({config}, coalesce((
+                       SELECT string_agg(left(g.prompt_text, {max_prompt_chars}), ' ')
+                       FROM generated_prompts g
+                       WHERE g.session_id = p_session_id
+                         AND g.version = (SELECT max(version) FROM generated_prompts WHERE session_id = p_session_id)), '')), 'C')
+        $$
+        """,
+
+        # Row-level triggers of earlier installs
+        "DROP TRIGGER IF EXISTS image_entries_search ON image_entries",
+        "DROP TRIGGER IF EXISTS generated_prompts_search ON generated_prompts",
+        "DROP FUNCTION IF EXISTS refresh_prompt_session_search(integer)",
+
+        """
+        CREATE OR REPLACE FUNCTION refresh_prompt_sessions_search(p_session_ids integer[])
+        RETURNS void LANGUAGE sql AS $$
+            UPDATE prompt_sessions SET search_vector = prompt_session_search_document(id, session_name) WHERE id = ANY(p_session_ids)
+        $$
+        """,
+
+        """
+        CREATE OR REPLACE FUNCTION prompt_sessions_search_vector_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.search_vector := prompt_session_search_document(NEW.id, NEW.session_name);
+            RETURN NEW;
+        END
+        $$
+        """,
+
+        # Updates only refresh sessions whose indexed fields changed (re-ordering pages doesn't)
+        """
+        CREATE OR REPLACE FUNCTION image_entries_search_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM refresh_prompt_sessions_search(ARRAY(SELECT DISTINCT prompt_session_id FROM new_rows));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM refresh_prompt_sessions_search(ARRAY(SELECT DISTINCT prompt_session_id FROM old_rows));
+            ELSE
+                PERFORM refresh_prompt_sessions_search(ARRAY(
+                    SELECT DISTINCT unnest(ARRAY[o.prompt_session_id, n.prompt_session_id])
+                    FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE o.prompt_session_id IS DISTINCT FROM n.prompt_session_id
+                       OR o.title IS DISTINCT FROM n.title
+                       OR (o.analysis_output_json -> 'overall_analysis' ->> 'page_title_guess') IS DISTINCT FROM (n.analysis_output_json -> 'overall_analysis' ->> 'page_title_guess')));
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+
+        """
+        CREATE OR REPLACE FUNCTION generated_prompts_search_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM refresh_prompt_sessions_search(ARRAY(SELECT DISTINCT session_id FROM new_rows));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM refresh_prompt_sessions_search(ARRAY(SELECT DISTINCT session_id FROM old_rows));
+            ELSE
+                PERFORM refresh_prompt_sessions_search(ARRAY(
+                    SELECT DISTINCT unnest(ARRAY[o.session_id, n.session_id])
+                    FROM old_rows o JOIN new_rows n ON n.id = o.id
+                    WHERE o.session_id IS DISTINCT FROM n.session_id OR o.version IS DISTINCT FROM n.version OR o.prompt_text IS DISTINCT FROM n.prompt_text));
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+
+        # UPDATE OF <columns>: the refresh itself only sets search_vector, so it doesn't re-fire this
+        "DROP TRIGGER IF EXISTS prompt_sessions_search_vector ON prompt_sessions",
+        """
+        CREATE TRIGGER prompt_sessions_search_vector BEFORE INSERT OR UPDATE OF session_name ON prompt_sessions
+        FOR EACH ROW EXECUTE FUNCTION prompt_sessions_search_vector_trigger()
+        """,
+        # A trigger with transition tables can only have one event (and no column list)
+        *[
+            statement
+            for table in ("image_entries", "generated_prompts")
+            for event, referencing in (("INSERT", "NEW TABLE AS new_rows"), ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"), ("DELETE", "OLD TABLE AS old_rows"))
+            for statement in (
+                f"DROP TRIGGER IF EXISTS {table}_search_{event.lower()} ON {table}",
+                f"""
+                CREATE TRIGGER {table}_search_{event.lower()} AFTER {event} ON {table}
+                REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION {table}_search_trigger()
+                """,
+            )
+        ],
+
+        "CREATE INDEX IF NOT EXISTS ix_prompt_sessions_search_vector ON prompt_sessions USING gin (search_vector)",
+        "UPDATE prompt_sessions SET search_vector = prompt_session_search_document(id, session_name) WHERE search_vector IS NULL",
+    ]
+
+
+def install_history_search(engine: Engine) -> bool:
+    """Installs/refreshes the search column, triggers and index. Returns False on non-PostgreSQL databases."""
+    if engine.dialect.name != "postgresql":
+        return False
+    text_config = settings.HISTORY_SEARCH_TEXT_CONFIG
+    if not _TEXT_CONFIG_RE.match(text_config):
+        raise ValueError(f"Invalid HISTORY_SEARCH_TEXT_CONFIG: {text_config!r}")
+    with engine.begin() as connection:
+        for statement in _install_statements(text_config, int(settings.HISTORY_SEARCH_MAX_PROMPT_CHARS)):
+            connection.execute(text(statement))
+    return True
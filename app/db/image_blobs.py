@@ -0,0 +1,27 @@
+# app/db/image_blobs.py
+"""
+Schema for the blob store (app/core/blob_store.py): `image_entries.image_sha256` references the
+stored original of a page, by content hash, in `image_blobs`.
+
+There are no migrations (tables come from create_all, which creates `image_blobs` but doesn't add
+columns to an existing `image_entries`), so `install_image_blob_reference` is idempotent and runs
+at startup, after partitioning and before the index loop creates the column's index. On a
+partitioned `image_entries` the column is added to the parent and PostgreSQL adds it to every
+partition, cold ones included. Pages stored before have no reference and can't be re-analyzed.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+def install_image_blob_reference(engine: Engine) -> bool:
+    """Adds the column when missing. Returns False when it was already there."""
+    with engine.begin() as connection:
+        if "image_entries" not in inspect(connection).get_table_names():
+            return False
+        if any(column["name"] == "image_sha256" for column in inspect(connection).get_columns("image_entries")):
+            return False
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("ALTER TABLE image_entries ADD COLUMN IF NOT EXISTS image_sha256 VARCHAR(64)"))
+        else:
+            connection.execute(text("ALTER TABLE image_entries ADD COLUMN image_sha256 VARCHAR(64)"))
+    return True
@@ -0,0 +1,319 @@
+# app/db/partitioning.py
+"""
+Monthly range partitioning by `created_at` for image_entries and generated_prompts (PostgreSQL),
+and archival of old partitions into compressed cold partitions.
+
+Only the child tables are partitioned: they hold the large JSONB/TOAST data (stored analyses,
+prompt texts). prompt_sessions rows are small, and it is the target of foreign keys by `id`, which
+PostgreSQL only allows on a partitioned table if the key includes the partition column.
+
+- `install_partitioning` (startup, idempotent, DB_PARTITIONING_ENABLED) converts a plain table in
+  place: it is renamed to `<table>_p_legacy` and attached, unchanged, as the partition for
+  everything before next month, under a new partitioned parent with the same name, columns,
+  defaults, sequence and foreign keys. The primary key becomes (id, created_at) in the database;
+  the ORM keeps using `id`. Monthly partitions are created DB_PARTITION_MONTHS_AHEAD ahead, plus
+  a default partition for anything outside them.
+- `archive_partitions` (run by `python -m app.archive`) rewrites each partition whose month ended
+  more than ARCHIVE_AFTER_MONTHS ago as `<partition>_cold`: a packed copy (fillfactor 100, a low
+  toast_tuple_target so large values are compressed out of line) whose large columns are
+  recompressed with ARCHIVE_COMPRESSION, optionally in ARCHIVE_TABLESPACE. A partition that
+  straddles the cutoff (the legacy one) is split into a cold part and monthly hot partitions.
+  Cold tables are attached in place of the originals, so every existing query (and the CRUD
+  layer) reads archived sessions exactly as before; old months are no longer rewritten by vacuum
+  or re-indexed with the hot data, and can be backed up separately.
+
+There are no migrations (tables come from create_all), so installation runs at startup, after
+create_all and before the indexes and the history search triggers are (re)created on the parents.
+"""
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import settings
+
+# Large columns recompressed in cold partitions, with the cast that forces a fresh (uncompressed)
+# value: copying a compressed datum as-is would keep its original compression method
+PARTITIONED_TABLES: Dict[str, Dict[str, str]] = {
+    "image_entries": {"analysis_output_json": "{column}::text::jsonb"},
+    "generated_prompts": {"prompt_text": "({column} || '')"},
+}
+PARTITION_COLUMN = "created_at"
+_ADVISORY_LOCK_KEY = 780_311_046 # Serializes installation/archival across workers and the CLI
+_IDENTIFIER_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+_INDEX_DEF_RE = re.compile(r"^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON )(\S+)( USING .*)$")
+
+
+@dataclass
+class Partition:
+    table: str
+    name: str
+    bound: str # "FOR VALUES FROM (...) TO (...)" or "DEFAULT", as PostgreSQL prints it
+    lower: Optional[datetime.datetime] # None for MINVALUE / the default partition
+    upper: Optional[datetime.datetime] # None for MAXVALUE / the default partition
+
+    @property
+    def is_default(self) -> bool:
+        return self.bound == "DEFAULT"
+
+    @property
+    def is_cold(self) -> bool:
+        return self.name.endswith("_cold")
+
+
+def _identifier(name: str) -> str:
+    if not _IDENTIFIER_RE.match(name) or len(name) > 63:
+        raise ValueError(f"Unexpected identifier: {name!r}")
+    return name
+
+
+def month_start(day: datetime.date, months: int = 0) -> datetime.datetime:
+    """Midnight UTC on the first day of the month `months` after `day`'s month."""
+    month_index = day.year * 12 + day.month - 1 + months
+    return datetime.datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _timestamp_literal(value: datetime.datetime) -> str:
+    return f"'{value.strftime('%Y-%m-%d %H:%M:%S')}+00'"
+
+
+def _parse_bound_value(value: str) -> Optional[datetime.datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.datetime.fromisoformat(value.strip("'"))
+
+
+def _begin_maintenance(connection: Connection) -> None:
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+    connection.execute(text("SET LOCAL TimeZone = 'UTC'")) # Partition bounds print (and parse) in UTC
+
+
+def is_partitioned(connection: Connection, table: str) -> bool:
+    return connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}).scalar() == "p"
+
+
+def list_partitions(connection: Connection, table: str) -> List[Partition]:
+    rows = connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {"table": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound)
+        lower, upper = (_parse_bound_value(match.group(1)), _parse_bound_value(match.group(2))) if match else (None, None)
+        partitions.append(Partition(table, name, bound, lower, upper))
+    return partitions
+
+
+def _constraint_definitions(connection: Connection, table: str, types: str) -> List[Any]:
+    return connection.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = ANY(:types) ORDER BY conname"
+    ), {"table": table, "types": list(types)}).all()
+
+
+def _convert_to_partitioned(connection: Connection, table: str, boundary: datetime.datetime) -> None:
+    """Turns `table` into a partitioned table whose existing rows form the partition before `boundary`."""
+    legacy = _identifier(f"{table}_p_legacy")
+    connection.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+    foreign_keys = _constraint_definitions(connection, table, "f")
+    primary_key = _constraint_definitions(connection, table, "p")
+    connection.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    # The parent gets a primary key that includes the partition column; its other indexes are
+    # created by name at startup and pick up these (renamed) ones instead of rebuilding them
+    for constraint_name, _ in primary_key:
+        connection.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {_identifier(constraint_name)}"))
+    for (index_name,) in connection.execute(text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"), {"table": legacy}):
+        connection.execute(text(f"ALTER INDEX {_identifier(index_name)} RENAME TO {_identifier((index_name + '_legacy')[:63])}"))
+    # The history search triggers are re-created on the parent, whose statement triggers cover every partition
+    for (trigger_name,) in connection.execute(text("SELECT tgname FROM pg_trigger WHERE tgrelid = to_regclass(:table) AND NOT tgisinternal"), {"table": legacy}):
+        connection.execute(text(f"DROP TRIGGER {_identifier(trigger_name)} ON {legacy}"))
+    connection.execute(text(f"UPDATE {legacy} SET {PARTITION_COLUMN} = now() WHERE {PARTITION_COLUMN} IS NULL"))
+    connection.execute(text(f"ALTER TABLE {legacy} ALTER COLUMN {PARTITION_COLUMN} SET NOT NULL"))
+
+    connection.execute(text(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING STORAGE INCLUDING COMPRESSION) PARTITION BY RANGE ({PARTITION_COLUMN})"))
+    connection.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {_identifier(f'{table}_pkey')} PRIMARY KEY (id, {PARTITION_COLUMN})"))
+    # Identical definitions: attaching the partition merges its foreign keys into these without re-checking
+    for constraint_name, definition in foreign_keys:
+        connection.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {_identifier(constraint_name)} {definition}"))
+    if sequence:
+        connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")) # Survives dropping the legacy partition
+    bound_check = _identifier(f"{legacy}_bound")
+    connection.execute(text(f"ALTER TABLE {legacy} ADD CONSTRAINT {bound_check} CHECK ({PARTITION_COLUMN} < {_timestamp_literal(boundary)})"))
+    connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({_timestamp_literal(boundary)})"))
+    connection.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {bound_check}")) # Only there to skip the attach-time scan
+    print(f"--- Converted {table} to a partitioned table ({legacy} holds the rows before {boundary:%Y-%m-%d}) ---")
+
+
+def ensure_partitions(connection: Connection, table: str, today: datetime.date, months_ahead: int) -> List[str]:
+    """Creates the monthly partitions from this month to `months_ahead` months ahead, and the default partition."""
+    created = []
+    existing = list_partitions(connection, table)
+    for offset in range(0, months_ahead + 1):
+        lower, upper = month_start(today, offset), month_start(today, offset + 1)
+        overlaps = any(
+            not partition.is_default and (partition.lower is None or partition.lower < upper) and (partition.upper is None or partition.upper > lower)
+            for partition in existing
+        )
+        if overlaps:
+            continue
+        name = _identifier(f"{table}_p{lower:%Y%m}")
+        try:
+            with connection.begin_nested(): # Fails if the default partition already holds rows of that month
+                connection.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({_timestamp_literal(lower)}) TO ({_timestamp_literal(upper)})"))
+            created.append(name)
+        except Exception as e:
+            print(f"WARNING: Could not create partition {name}: {e}")
+    if not any(partition.is_default for partition in existing):
+        connection.execute(text(f"CREATE TABLE {_identifier(f'{table}_p_default')} PARTITION OF {table} DEFAULT"))
+        created.append(f"{table}_p_default")
+    return created
+
+
+def install_partitioning(engine: Engine, today: Optional[datetime.date] = None) -> bool:
+    """Converts the tables (first run) and creates upcoming partitions. Returns False when disabled or not on PostgreSQL."""
+    if engine.dialect.name != "postgresql" or not settings.DB_PARTITIONING_ENABLED:
+        return False
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    with engine.begin() as connection:
+        _begin_maintenance(connection)
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(connection, table):
+                _convert_to_partitioned(connection, table, month_start(today, 1))
+            ensure_partitions(connection, table, today, max(0, settings.DB_PARTITION_MONTHS_AHEAD))
+    return True
+
+
+def toast_compression(connection: Connection) -> str:
+    supported = connection.execute(text("SELECT enumvals FROM pg_settings WHERE name = 'default_toast_compression'")).scalar() or []
+    if settings.ARCHIVE_COMPRESSION in supported:
+        return settings.ARCHIVE_COMPRESSION
+    print(f"WARNING: ARCHIVE_COMPRESSION={settings.ARCHIVE_COMPRESSION} is not supported by this server, using pglz.")
+    return "pglz"
+
+
+def relation_size(connection: Connection, name: str) -> int:
+    return int(connection.execute(text("SELECT pg_total_relation_size(to_regclass(:name))"), {"name": name}).scalar() or 0)
+
+
+@dataclass
+class _Piece:
+    name: str
+    lower: Optional[datetime.datetime]
+    upper: Optional[datetime.datetime]
+    cold: bool
+
+    @property
+    def bound(self) -> str:
+        lower = _timestamp_literal(self.lower) if self.lower else "MINVALUE"
+        upper = _timestamp_literal(self.upper) if self.upper else "MAXVALUE"
+        return f"FOR VALUES FROM ({lower}) TO ({upper})"
+
+    def range_condition(self) -> str:
+        conditions = [f"{PARTITION_COLUMN} IS NOT NULL"]
+        if self.lower is not None:
+            conditions.append(f"{PARTITION_COLUMN} >= {_timestamp_literal(self.lower)}")
+        if self.upper is not None:
+            conditions.append(f"{PARTITION_COLUMN} < {_timestamp_literal(self.upper)}")
+        return " AND ".join(conditions)
+
+
+def archive_plan(partition: Partition, cutoff: datetime.datetime) -> List[_Piece]:
+    """
+    The tables that replace `partition` when archiving up to `cutoff`: one cold copy if it ends by
+    the cutoff; if it straddles it (the legacy partition), a cold copy of the rows before the cutoff
+    and monthly hot partitions for the rest. Empty if there is nothing to archive.
+    """
+    table = partition.table
+    if partition.is_default or partition.is_cold or partition.upper is None or (partition.lower is not None and partition.lower >= cutoff):
+        return []
+    if partition.upper <= cutoff:
+        return [_Piece(_identifier(f"{partition.name}_cold"), partition.lower, partition.upper, cold=True)]
+    cold_name = f"{table}_p{partition.lower:%Y%m}_{cutoff:%Y%m}_cold" if partition.lower else f"{table}_p_before{cutoff:%Y%m}_cold"
+    pieces = [_Piece(_identifier(cold_name), partition.lower, cutoff, cold=True)]
+    month = cutoff
+    while month < partition.upper:
+        next_month = month_start(month.date(), 1)
+        pieces.append(_Piece(_identifier(f"{table}_p{month:%Y%m}"), month, min(next_month, partition.upper), cold=False))
+        month = next_month
+    return pieces
+
+
+def _replace_partition(connection: Connection, partition: Partition, pieces: List[_Piece], compression: str) -> None:
+    """Copies `partition`'s rows into `pieces` (with its keys and indexes) and swaps them in for it."""
+    table, source = partition.table, _identifier(partition.name)
+    tablespace = f" TABLESPACE {_identifier(settings.ARCHIVE_TABLESPACE)}" if settings.ARCHIVE_TABLESPACE else ""
+    connection.execute(text(f"LOCK TABLE {source} IN SHARE MODE")) # Readable while it is copied, not writable
+    columns = [row[0] for row in connection.execute(text(
+        "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped ORDER BY attnum"
+    ), {"table": source})]
+    constraints = _constraint_definitions(connection, source, "pf")
+    indexes = connection.execute(text(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = to_regclass(:table) AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)"
+    ), {"table": source}).all()
+    recompress = PARTITIONED_TABLES[table]
+
+    for piece in pieces:
+        piece_tablespace = tablespace if piece.cold else ""
+        storage = " WITH (fillfactor = 100, toast_tuple_target = 128)" if piece.cold else ""
+        connection.execute(text(f"CREATE TABLE {piece.name} (LIKE {source} INCLUDING DEFAULTS INCLUDING STORAGE INCLUDING COMPRESSION){storage}{piece_tablespace}"))
+        if piece.cold:
+            for column in recompress:
+                connection.execute(text(f"ALTER TABLE {piece.name} ALTER COLUMN {column} SET COMPRESSION {compression}"))
+            select_list = ", ".join(recompress[column].format(column=column) if column in recompress else column for column in columns)
+        else:
+            select_list = ", ".join(columns)
+        connection.execute(text(f"INSERT INTO {piece.name} ({', '.join(columns)}) SELECT {select_list} FROM {source} WHERE {piece.range_condition()}"))
+        # Same keys and indexes as the source, built before the swap so attaching only links them
+        for constraint_name, definition in constraints:
+            if definition.startswith("PRIMARY KEY"): # Its index is a relation, so it needs a name of its own
+                connection.execute(text(f"ALTER TABLE {piece.name} ADD CONSTRAINT {_identifier(f'{piece.name[:58]}_pkey')} {definition}{' USING INDEX' + piece_tablespace if piece_tablespace else ''}"))
+            else:
+                connection.execute(text(f"ALTER TABLE {piece.name} ADD CONSTRAINT {_identifier(constraint_name)} {definition}"))
+        for number, (index_name, index_definition) in enumerate(indexes, start=1):
+            match = _INDEX_DEF_RE.match(index_definition)
+            if match is None:
+                raise RuntimeError(f"Unexpected index definition for {index_name}: {index_definition}")
+            connection.execute(text(f"{match.group(1)}{_identifier(f'{piece.name[:55]}_{number}_idx')}{match.group(3)}{piece.name}{match.group(5)}{piece_tablespace}"))
+        connection.execute(text(f"ALTER TABLE {piece.name} ADD CONSTRAINT {_identifier(f'{piece.name[:57]}_bound')} CHECK ({piece.range_condition()})"))
+
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {source}"))
+    for piece in pieces:
+        connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {piece.name} {piece.bound}"))
+        connection.execute(text(f"ALTER TABLE {piece.name} DROP CONSTRAINT {_identifier(f'{piece.name[:57]}_bound')}")) # Only there to skip the attach-time scan
+    connection.execute(text(f"DROP TABLE {source}"))
+    for piece in pieces:
+        connection.execute(text(f"ANALYZE {piece.name}"))
+
+
+def archive_partitions(engine: Engine, cutoff: datetime.datetime, dry_run: bool = False) -> List[Dict[str, Any]]:
+    """
+    Moves every row created before `cutoff` into compressed cold partitions, one transaction per
+    source partition. Returns what was (or, with `dry_run`, would be) replaced, with sizes.
+    """
+    with engine.begin() as connection:
+        _begin_maintenance(connection)
+        plans = [
+            (partition, pieces, relation_size(connection, partition.name))
+            for table in PARTITIONED_TABLES if is_partitioned(connection, table)
+            for partition in list_partitions(connection, table)
+            if (pieces := archive_plan(partition, cutoff))
+        ]
+        compression = toast_compression(connection) if plans and not dry_run else None
+    results = []
+    for partition, pieces, size_before in plans:
+        result = {"table": partition.table, "partition": partition.name, "bytes_before": size_before, "pieces": {piece.name: None for piece in pieces}}
+        if not dry_run:
+            with engine.begin() as connection:
+                _begin_maintenance(connection)
+                if connection.execute(text("SELECT to_regclass(:name)"), {"name": partition.name}).scalar() is None:
+                    continue # Replaced by a concurrent run since the plan was made
+                _replace_partition(connection, partition, pieces, compression)
+                result["pieces"] = {piece.name: relation_size(connection, piece.name) for piece in pieces}
+        results.append(result)
+    return results
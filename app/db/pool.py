@@ -0,0 +1,53 @@
+# app/db/pool.py
+"""
+Connection pool instrumentation.
+
+`InstrumentedQueuePool` is SQLAlchemy's QueuePool plus timing of every checkout (how long a
+request waited for a connection, including timeouts). `register_pool_gauges` publishes the pool's
+size, checked-out and overflow connections as gauges. All metrics carry an `engine` label
+("primary" / "replica").
+"""
+import time
+from typing import Dict
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from app.core.metrics import metric_key, metrics
+
+
+class InstrumentedQueuePool(QueuePool):
+    engine_name = "primary" # Set on the instance after create_engine(); kept across recreate()
+
+    def recreate(self) -> "InstrumentedQueuePool":
+        # QueuePool.recreate() (used on engine.dispose()) doesn't know about engine_name
+        new_pool = super().recreate()
+        new_pool.engine_name = self.engine_name
+        return new_pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            metrics.increment("db.pool.timeouts", engine=self.engine_name)
+            raise
+        finally:
+            metrics.observe("db.pool.wait_seconds", time.perf_counter() - started, engine=self.engine_name)
+        metrics.increment("db.pool.checkouts", engine=self.engine_name)
+        return connection
+
+
+def register_pool_gauges(engine_name: str, engine: Engine) -> None:
+    def gauges() -> Dict[str, float]:
+        pool = engine.pool # Looked up each time: engine.dispose() swaps in a new pool
+        labels = {"engine": engine_name}
+        values = {metric_key("db.pool.checked_out", labels): pool.checkedout()}
+        if isinstance(pool, QueuePool):
+            values[metric_key("db.pool.size", labels)] = pool.size()
+            values[metric_key("db.pool.checked_in", labels)] = pool.checkedin()
+            values[metric_key("db.pool.overflow", labels)] = max(0, pool.overflow()) # Negative while the pool is still filling up
+        return values
+
+    metrics.register_gauge_callback(f"db.pool.{engine_name}", gauges)
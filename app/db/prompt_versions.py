@@ -0,0 +1,26 @@
+# app/db/prompt_versions.py
+"""
+Schema for prompt versions: `generated_prompts.version` numbers the prompt sets a session got from
+its page edits (see crud_prompt_session.update_pages_with_new_prompt_version).
+
+There are no migrations (tables come from create_all, which doesn't add columns to an existing
+`generated_prompts`), so `install_prompt_version_column` is idempotent and runs at startup, right
+after create_all: partitioning copies the table's columns, and the history search triggers and
+the /history queries read `version`. Rows stored before the column existed become version 1.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+def install_prompt_version_column(engine: Engine) -> bool:
+    """Adds the column when missing. Returns False when it was already there."""
+    with engine.begin() as connection:
+        if "generated_prompts" not in inspect(connection).get_table_names():
+            return False
+        if any(column["name"] == "version" for column in inspect(connection).get_columns("generated_prompts")):
+            return False
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("ALTER TABLE generated_prompts ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"))
+        else:
+            connection.execute(text("ALTER TABLE generated_prompts ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    return True
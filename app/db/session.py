@@ -1,17 +1,53 @@
+import time
+from typing import Optional
+
+from fastapi import Depends
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base # For model class inheritance
 
 from app.core.config import settings # Import settings from your config.py
+from app.core.metrics import metrics
+from app.db.pool import InstrumentedQueuePool, register_pool_gauges
+
+
+def create_db_engine(database_url: str, engine_name: str) -> Engine:
+    """Engine with the configured pool sizing and checkout instrumentation (see app/db/pool.py)."""
+    # connect_args is often used for SQLite, for PostgreSQL it's usually not needed unless specific SSL modes etc.
+    # SQLite (used by the benchmark harness) needs check_same_thread disabled because FastAPI
+    # runs sync dependencies and endpoints in a threadpool.
+    connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+    pool_args = {}
+    if database_url == "sqlite://" or ":memory:" in database_url:
+        pass # In-memory SQLite keeps SQLAlchemy's default single-connection pool
+    else:
+        pool_args = dict(
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        )
+    db_engine = create_engine(database_url, pool_pre_ping=settings.DB_POOL_PRE_PING, connect_args=connect_args, **pool_args)
+    if isinstance(db_engine.pool, InstrumentedQueuePool):
+        db_engine.pool.engine_name = engine_name
+    register_pool_gauges(engine_name, db_engine)
+    return db_engine
+
 
-# Create the SQLAlchemy engine
-# connect_args is often used for SQLite, for PostgreSQL it's usually not needed unless specific SSL modes etc.
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+# Create the SQLAlchemy engine (the primary: all writes, and reads that must see them)
+engine = create_db_engine(settings.DATABASE_URL, "primary")
+read_engine: Optional[Engine] = None
+if settings.DATABASE_READ_REPLICA_URL and settings.DATABASE_READ_REPLICA_ENABLED:
+    read_engine = create_db_engine(settings.DATABASE_READ_REPLICA_URL, "replica")
 
 # Create a SessionLocal class
 # This SessionLocal class itself is not a database session yet.
 # But when we call SessionLocal(), we will get an individual session.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_engine is not None else None
 
 # Base class for our SQLAlchemy models to inherit from
 # All your model classes (tables) will inherit from this Base.
@@ -23,4 +59,42 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+_replica_down_until = 0.0
+
+
+def open_read_session() -> Optional[Session]:
+    """A session on the read replica with a connection already checked out, or None (use the primary)."""
+    global _replica_down_until
+    if ReadSessionLocal is None or time.monotonic() < _replica_down_until:
+        return None
+    db = ReadSessionLocal()
+    try:
+        db.connection() # Connect now, so an unreachable replica falls back before any query runs
+        return db
+    except (DBAPIError, PoolTimeoutError) as e:
+        db.close()
+        _replica_down_until = time.monotonic() + settings.DATABASE_READ_REPLICA_RETRY_SECONDS
+        metrics.increment("db.read_replica_fallbacks")
+        print(f"--- Read replica unavailable, using the primary for {settings.DATABASE_READ_REPLICA_RETRY_SECONDS}s: {e} ---")
+        return None
+
+
+def read_session_factory() -> Session:
+    """For code that opens its own session (e.g. streaming responses): replica if available, else primary."""
+    return open_read_session() or SessionLocal()
+
+
+# Dependency for read-only endpoints that tolerate replication lag (history, search, auth lookups).
+# Without a (healthy) replica this is the request's primary session from get_db, so it costs nothing extra.
+def get_read_db(primary_db: Session = Depends(get_db)):
+    db = open_read_session()
+    if db is None:
+        yield primary_db
+        return
+    try:
+        yield db
+    finally:
+        db.close()
@@ -2,12 +2,20 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware # Ensure this is imported
 
 from app.core.config import settings
+from app.core.llm_usage import llm_call_recorder
+from app.core.tracing import RequestTracingMiddleware
 from app.db.session import engine 
+from app.db.history_search import install_history_search
+from app.db.image_blobs import install_image_blob_reference
+from app.db.partitioning import install_partitioning
+from app.db.prompt_versions import install_prompt_version_column
 from app.models import prompt_session # Ensure this is imported if Base is used from it
 
 # Import your API routers
 from app.api.api_v1.endpoints import prompts as prompts_router
 from app.api.api_v1.endpoints import auth as auth_router
+from app.api.api_v1.endpoints import metrics as metrics_router
+from app.api.api_v1.endpoints import usage as usage_router
 # If you had an auth_router, you would import it like this:
 # from app.api.api_v1.endpoints import auth as auth_router
 
@@ -26,6 +34,44 @@ except Exception as e:
     # Depending on your policy, you might want the app to exit if DB is not ready
     # or handle this more gracefully.
 
+# generated_prompts.version for tables created before it; partitioning, the indexes and the history
+# search triggers below all expect the column
+try:
+    if install_prompt_version_column(engine):
+        print("Prompt version column added upon startup.")
+except Exception as e:
+    print(f"Error adding the prompt version column upon startup: {e}")
+
+# Monthly partitions for image_entries / generated_prompts (PostgreSQL, opt-in, idempotent). Runs before
+# the index loop, which creates the model indexes on the partitioned parents after a conversion.
+try:
+    if install_partitioning(engine):
+        print("Table partitions checked/created successfully upon startup.")
+except Exception as e:
+    print(f"Error installing table partitions upon startup: {e}")
+
+# image_entries.image_sha256 (stored originals, see app/core/blob_store.py) for tables created before it
+try:
+    if install_image_blob_reference(engine):
+        print("Image blob reference column added upon startup.")
+except Exception as e:
+    print(f"Error adding the image blob reference column upon startup: {e}")
+
+# create_all skips tables that already exist, so indexes added to existing models are created here
+try:
+    for table in prompt_session.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+except Exception as e:
+    print(f"Error creating database indexes upon startup: {e}")
+
+# Full-text search triggers and GIN index for /history/search (PostgreSQL only, idempotent)
+try:
+    if install_history_search(engine):
+        print("History search triggers and index checked/created successfully upon startup.")
+except Exception as e:
+    print(f"Error installing history search triggers upon startup: {e}")
+
 
 # --- FastAPI Application Instance ---
 app = FastAPI(
@@ -45,10 +91,23 @@ if settings.parsed_cors_origins: # Use the property here
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["Server-Timing", "X-Request-ID", "X-Profile-ID", "Retry-After", "Idempotent-Replayed", "X-Coalesced", "ETag"],
     )
 else:
     print("Warning: No CORS origins configured. Frontend might not connect if on a different origin.")
 
+# --- Request Tracing Middleware ---
+# Added last so it is the outermost middleware and its timings cover everything below it.
+# Adds the Server-Timing header, writes a JSON trace log record per request and
+# runs the sampling profiler for admin requests sent with `X-Profile: 1`.
+app.add_middleware(RequestTracingMiddleware)
+
+
+# --- Shutdown: write the LLM call rows still buffered in this worker ---
+@app.on_event("shutdown")
+async def flush_llm_call_log():
+    await llm_call_recorder.close()
+
 
 # --- Root Endpoint ---
 @app.get("/", tags=["Root"])
@@ -67,6 +126,8 @@ app.include_router(
     tags=["Prompts"] # Groups these endpoints under "Prompts" in Swagger UI
 )
 app.include_router(auth_router.router, prefix=settings.API_V1_STR + "/auth", tags=["Authentication"])
+app.include_router(metrics_router.router, prefix=settings.API_V1_STR + "/metrics", tags=["Metrics"])
+app.include_router(usage_router.router, prefix=settings.API_V1_STR + "/usage", tags=["Usage"])
 
 # If you create an authentication router later, you would include it like this:
 # app.include_router(
@@ -1,9 +1,14 @@
 # app/models/prompt_session.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, func
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, DateTime, Float, ForeignKey, Index, Text, JSON, UniqueConstraint, func
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from app.db.session import Base 
 
+# JSONB on PostgreSQL, plain JSON elsewhere (lets the benchmark harness run against SQLite)
+JSONBType = JSON().with_variant(JSONB(), "postgresql")
+# tsvector on PostgreSQL; elsewhere an unused text column (search falls back to substring matching)
+TSVectorType = Text().with_variant(TSVECTOR(), "postgresql")
+
 # User model remains the same
 class User(Base):
     __tablename__ = "users"
@@ -26,10 +31,13 @@ class ImageEntry(Base):
     title = Column(String, index=True, nullable=False) # Title given by the user
     original_filename = Column(String, nullable=True)  # Original filename of this specific image
     # Store the AI analysis specific to this image
-    analysis_output_json = Column(JSONB, nullable=True) 
+    analysis_output_json = Column(JSONBType, nullable=True) 
     order_in_session = Column(Integer, default=0) # Its order within the session
+    # sha256 of the original upload in the blob store (ImageBlob), None if it was not kept. Not a foreign
+    # key: an evicted blob leaves the hash behind, and uploading the same image again restores it.
+    image_sha256 = Column(String(64), nullable=True, index=True)
 
-    prompt_session_id = Column(Integer, ForeignKey("prompt_sessions.id"), nullable=False)
+    prompt_session_id = Column(Integer, ForeignKey("prompt_sessions.id"), nullable=False, index=True)
     prompt_session = relationship("PromptSession", back_populates="image_entries")
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -37,6 +45,8 @@ class ImageEntry(Base):
 
 class PromptSession(Base):
     __tablename__ = "prompt_sessions"
+    # Serves the per-user count/max(updated_at) lookup behind the /history ETag
+    __table_args__ = (Index("ix_prompt_sessions_owner_updated", "owner_id", "updated_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     session_name = Column(String, index=True, nullable=True) 
@@ -55,11 +65,15 @@ class PromptSession(Base):
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False) # Assuming sessions must have owners
     owner = relationship("User", back_populates="prompt_sessions") 
 
+    # Search document for /history/search (session name, page titles, page title guesses, latest prompt
+    # text). Maintained by database triggers, see app/db/history_search.py; never written by the ORM.
+    search_vector = deferred(Column(TSVectorType, nullable=True))
+
     # Relationship to ImageEntry objects
     image_entries = relationship("ImageEntry", back_populates="prompt_session", cascade="all, delete-orphan", order_by="ImageEntry.order_in_session")
 
     # GeneratedPrompts will now ideally be the FINAL consolidated prompt(s) for the whole session
-    generated_prompts = relationship("GeneratedPrompt", back_populates="session", cascade="all, delete-orphan")
+    generated_prompts = relationship("GeneratedPrompt", back_populates="session", cascade="all, delete-orphan", order_by="[GeneratedPrompt.version.desc(), GeneratedPrompt.order_in_session]") # Latest version first
 
 
 class GeneratedPrompt(Base):
@@ -70,6 +84,67 @@ class GeneratedPrompt(Base):
     prompt_type = Column(String, index=True, nullable=True) # e.g., "consolidated_multi_page"
     prompt_text = Column(Text, nullable=False)
     order_in_session = Column(Integer, default=0) # Usually just one consolidated prompt
+    version = Column(Integer, nullable=False, default=1, server_default="1") # Bumped every time the session's pages are edited and re-planned
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    session_id = Column(Integer, ForeignKey("prompt_sessions.id"), nullable=False, index=True) 
+    session = relationship("PromptSession", back_populates="generated_prompts")
+
+
+class IdempotencyKey(Base):
+    """
+    Stored result of an /analyze-image submission sent with an `Idempotency-Key` header,
+    so a client retry within the TTL gets the original response instead of a new pipeline run.
+    """
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("owner_id", "key", name="uq_idempotency_keys_owner_key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(255), nullable=False)
+    request_fingerprint = Column(String(64), nullable=False) # sha256 of the submission (images, titles, session name)
+    status = Column(String, nullable=False, default="in_progress") # "in_progress" or "completed"
+    response_json = Column(JSONBType, nullable=True) # PromptAnalysisResponse once completed
+    prompt_session_id = Column(Integer, ForeignKey("prompt_sessions.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class LLMCall(Base):
+    """
+    One outbound LLM request (vision, planner, ...) with its token usage, latency and outcome.
+    Written in batches by `app.core.llm_usage.llm_call_recorder`; queried by /api/v1/usage.
+    """
+    __tablename__ = "llm_calls"
+    __table_args__ = (
+        Index("ix_llm_calls_user_created", "user_id", "created_at"),
+        Index("ix_llm_calls_model_created", "model", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True) # None for calls outside a user request
+    request_id = Column(String(64), nullable=True) # X-Request-ID of the API request that made the call
+    stage = Column(String(32), nullable=False) # "vision", "planner", "planner_map", ...
+    model = Column(String, nullable=False)
+    outcome = Column(String(32), nullable=False) # "ok", "http_429", "timeout", "cancelled", "invalid_output", ...
+    streamed = Column(Boolean, nullable=False, default=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0, server_default="0")
+    completion_tokens = Column(Integer, nullable=False, default=0, server_default="0")
+    cached_tokens = Column(Integer, nullable=False, default=0, server_default="0") # Prompt tokens served from the provider's cache
+    latency_ms = Column(Float, nullable=False)
+    cost_usd = Column(Float, nullable=True) # Provider-reported cost, else from LLM_PRICING_CSV, else unknown
+
+
+class ImageBlob(Base):
+    """
+    One original upload in the content-addressed blob store (app/core/blob_store.py); the file lives
+    at a path derived from `sha256`. ImageEntry.image_sha256 rows are its references, counted by the
+    garbage collector rather than kept in a counter column.
+    """
+    __tablename__ = "image_blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    content_type = Column(String(100), nullable=True) # As declared by the first upload
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    session_id = Column(Integer, ForeignKey("prompt_sessions.id"), nullable=False) 
-    session = relationship("PromptSession", back_populates="generated_prompts")
\ No newline at end of file
+    last_used_at = Column(DateTime(timezone=True), nullable=False, index=True) # Last upload or re-analysis; GC grace and LRU eviction
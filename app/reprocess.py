@@ -0,0 +1,314 @@
+# app/reprocess.py
+"""
+Offline batch reprocessing of stored sessions, after a change to OVERALL_PROJECT_REQUIREMENTS,
+the prompt rendering or the planner model/instructions:
+
+    python -m app.reprocess --mode render --checkpoint reprocess.json
+    python -m app.reprocess --mode replan --concurrency 4 --sessions-per-minute 60 --checkpoint replan.json
+
+Modes:
+- `render`: rebuilds each session's final prompt from its stored page analyses
+  (`ImageEntry.analysis_output_json`) and the current requirements text, keeping the development
+  plan of its latest prompt version. No LLM calls.
+- `replan`: same, but the planner runs again over the stored analyses (hierarchical planning and
+  tiering apply as in the API; calls are attributed to the session's owner in `llm_calls` and
+  scheduled in the LLM governor's "batch" class, behind interactive calls in the same process).
+
+Vision is not re-run here. Pages whose original upload is kept in the blob store
+(app/core/blob_store.py) can be re-analyzed per session with POST /sessions/{id}/reanalyze, which
+goes through the API's admission control like any other vision request.
+
+A changed prompt is stored as a new GeneratedPrompt version (like a page edit); unchanged prompts
+and failed planner runs leave the session as it is. Session ids are read through a server-side
+cursor and handed to `--concurrency` async workers; `--sessions-per-minute` caps the start rate.
+With `--checkpoint`, progress is saved to a JSON file (every id up to `watermark`, plus the ids
+finished above it) and a rerun with the same file resumes where the previous run stopped;
+sessions that failed are listed in the file and re-run with `--retry-failed`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from app.api.api_v1.endpoints.prompts import generate_final_consolidated_prompt_with_planner, page_input_from_stored_entry
+from app.core.admission import TokenBucket
+from app.core.llm_governor import llm_priority
+from app.core.llm_usage import llm_call_recorder, llm_usage_user
+from app.core.metrics import metrics
+from app.crud.crud_prompt_session import prompt_session as crud_prompt_session
+from app.db.session import SessionLocal
+from app.models.prompt_session import PromptSession
+from app.schemas import GeneratedPromptCreate
+
+MODES = ("render", "replan")
+PLAN_OPEN_TAG, PLAN_CLOSE_TAG = "<development_planning>\n", "\n</development_planning>"
+
+
+def extract_development_plan(prompt_text: Optional[str]) -> Optional[str]:
+    """The planner output embedded at the end of a stored consolidated prompt, or None."""
+    prompt_text = (prompt_text or "").rstrip()
+    # The plan follows the last page block (page text could itself mention the tags)
+    pages_end = max(prompt_text.rfind("</image_analysis>"), prompt_text.rfind("</image_analysis_error>"), 0)
+    start = prompt_text.find(PLAN_OPEN_TAG, pages_end)
+    if start < 0 or not prompt_text.endswith(PLAN_CLOSE_TAG):
+        return None
+    return prompt_text[start + len(PLAN_OPEN_TAG):-len(PLAN_CLOSE_TAG)]
+
+
+class Checkpoint:
+    """
+    Resumable progress over ascending session ids. Sessions finish out of order, so the file keeps
+    a watermark (every id up to it is done) plus the finished ids above it.
+    """
+
+    def __init__(self, path: Optional[str], job: Dict[str, Any]):
+        self.path = path
+        self.job = job
+        self.watermark = 0
+        self.done_above: Set[int] = set()
+        self.failed: Dict[str, str] = {}
+        self.outcomes: Dict[str, int] = {}
+        self._dispatched: Deque[int] = deque() # Ids handed to workers and not yet below the watermark
+        self.retrying = False # Re-running `failed` ids, which are all below the watermark or done already
+
+    def load(self) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("job") != self.job:
+            raise SystemExit(f"Checkpoint {self.path} was written for a different job ({state.get('job')}); use another --checkpoint file.")
+        self.watermark = int(state.get("watermark") or 0)
+        self.done_above = set(state.get("done_above") or [])
+        self.failed = dict(state.get("failed") or {})
+        self.outcomes = dict(state.get("outcomes") or {})
+        return True
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        state = {"job": self.job, "watermark": self.watermark, "done_above": sorted(self.done_above), "failed": self.failed, "outcomes": self.outcomes, "saved_at": time.time()}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def dispatched(self, session_id: int) -> None:
+        if not self.retrying:
+            self._dispatched.append(session_id)
+
+    def finished(self, session_id: int, outcome: str, error: Optional[str] = None) -> None:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if error is not None:
+            self.failed[str(session_id)] = error
+        else:
+            self.failed.pop(str(session_id), None)
+        if self.retrying:
+            return
+        self.done_above.add(session_id)
+        while self._dispatched and self._dispatched[0] in self.done_above:
+            self.watermark = self._dispatched.popleft()
+            self.done_above.discard(self.watermark)
+
+
+class ProgressReporter:
+    def __init__(self, total: int, interval_seconds: float):
+        self.total = total
+        self.interval_seconds = interval_seconds
+        self.completed = 0
+        self.outcomes: Dict[str, int] = {} # This run's; the checkpoint keeps the totals across runs
+        self.started_at = time.monotonic()
+        self._last_report = (self.started_at, 0)
+
+    def finished(self, outcome: str) -> None:
+        self.completed += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def line(self) -> str:
+        now = time.monotonic()
+        elapsed = max(now - self.started_at, 1e-9)
+        window_seconds = max(now - self._last_report[0], 1e-9)
+        recent_rate = (self.completed - self._last_report[1]) / window_seconds
+        self._last_report = (now, self.completed)
+        overall_rate = self.completed / elapsed
+        remaining = max(0, self.total - self.completed)
+        eta = f"{remaining / overall_rate:.0f}s" if overall_rate > 0 else "?"
+        counts = ", ".join(f"{name} {count}" for name, count in sorted(self.outcomes.items()))
+        return f"    {self.completed}/{self.total} sessions ({counts}) | {recent_rate:.2f}/s recent, {overall_rate:.2f}/s overall | elapsed {elapsed:.0f}s, ETA {eta}"
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            print(self.line(), flush=True)
+
+
+async def reprocess_session(session_id: int, mode: str, dry_run: bool) -> str:
+    """Re-renders (or re-plans) one session and stores the result as a new prompt version. Returns the outcome."""
+    db = SessionLocal()
+    try:
+        db_session = db.get(PromptSession, session_id)
+        if db_session is None:
+            return "missing" # Deleted since the scan started
+        entries = list(db_session.image_entries)
+        if not entries:
+            return "skipped_no_pages"
+        latest_version = db_session.generated_prompts[0].version if db_session.generated_prompts else None
+        latest_prompts = [p for p in db_session.generated_prompts if p.version == latest_version]
+        development_plan = None
+        if mode == "render":
+            development_plan = extract_development_plan(latest_prompts[0].prompt_text if latest_prompts else None)
+            if development_plan is None:
+                return "skipped_no_plan"
+        page_inputs = [page_input_from_stored_entry(entry) for entry in entries]
+        with llm_usage_user(db_session.owner_id), llm_priority("batch"):
+            new_prompts = await generate_final_consolidated_prompt_with_planner(page_inputs, db_session.session_name, development_plan=development_plan)
+        if mode == "replan" and "<error_in_planning>" in (extract_development_plan(new_prompts[0].prompt_text) or "<error_in_planning>"):
+            raise RuntimeError("Planner call failed; the session was left unchanged.")
+        if [(p.prompt_type, p.prompt_text) for p in new_prompts] == [(p.prompt_type, p.prompt_text) for p in latest_prompts]:
+            return "unchanged"
+        if dry_run:
+            return "would_update"
+        crud_prompt_session.update_pages_with_new_prompt_version(
+            db=db, db_session=db_session, ordered_pages=entries,
+            final_prompts_obj_in=[GeneratedPromptCreate(prompt_type=p.prompt_type, prompt_text=p.prompt_text) for p in new_prompts],
+        )
+        return "updated"
+    finally:
+        db.close()
+
+
+def _stream_session_ids(loop: asyncio.AbstractEventLoop, queue: "asyncio.Queue[Optional[int]]", stop: threading.Event, after_id: int, skip_ids: Set[int], owner_id: Optional[int], session_ids: Optional[List[int]], limit: Optional[int]) -> None:
+    # Runs in a thread: the cursor blocks, and queue.put blocks it in turn while the workers are behind
+    db = SessionLocal()
+    try:
+        produced = 0
+        for session_id in crud_prompt_session.iter_session_ids(db, after_id=after_id, owner_id=owner_id, session_ids=session_ids):
+            if stop.is_set() or (limit is not None and produced >= limit):
+                break
+            if session_id in skip_ids:
+                continue
+            asyncio.run_coroutine_threadsafe(queue.put(session_id), loop).result()
+            produced += 1
+    finally:
+        db.close()
+        asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+
+async def run_reprocessing(args: argparse.Namespace) -> Checkpoint:
+    job = {"mode": args.mode, "owner_id": args.owner_id, "session_ids": sorted(args.session_id) if args.session_id else None}
+    checkpoint = Checkpoint(args.checkpoint, job)
+    resumed = checkpoint.load()
+    if args.retry_failed:
+        if not checkpoint.failed:
+            raise SystemExit("--retry-failed: the checkpoint has no failed sessions.")
+        checkpoint.retrying = True
+        after_id, skip_ids, session_ids = 0, set(), sorted(int(session_id) for session_id in checkpoint.failed)
+        print(f"--- Retrying {len(session_ids)} failed sessions from {args.checkpoint} ---")
+    else:
+        after_id, skip_ids, session_ids = checkpoint.watermark, set(checkpoint.done_above), args.session_id
+        if resumed:
+            print(f"--- Resuming from {args.checkpoint}: every session up to id {checkpoint.watermark} done, plus {len(checkpoint.done_above)} above it ---")
+    db = SessionLocal()
+    try:
+        total = crud_prompt_session.count_session_ids(db, after_id=after_id, owner_id=args.owner_id, session_ids=session_ids) - len(skip_ids)
+    finally:
+        db.close()
+    if args.limit is not None:
+        total = min(total, args.limit)
+    print(f"--- Reprocessing {total} sessions (mode={args.mode}, concurrency={args.concurrency}{f', {args.sessions_per_minute}/min' if args.sessions_per_minute else ''}{', dry run' if args.dry_run else ''}) ---")
+
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Optional[int]]" = asyncio.Queue(maxsize=args.concurrency * 2)
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_stream_session_ids, name="reprocess-scan", daemon=True,
+        args=(loop, queue, stop, after_id, skip_ids, args.owner_id, session_ids, args.limit),
+    )
+    start_rate = TokenBucket(capacity=args.concurrency, refill_per_second=args.sessions_per_minute / 60) if args.sessions_per_minute else None
+    progress = ProgressReporter(total, args.progress_interval)
+    finished_since_save = 0
+    scan_done = asyncio.Event()
+
+    async def next_session_id() -> Optional[int]:
+        # One worker at a time takes an id, so ids are dispatched (and checkpointed) in ascending order
+        if scan_done.is_set():
+            return None
+        session_id = await queue.get()
+        if session_id is None:
+            scan_done.set()
+            return None
+        checkpoint.dispatched(session_id)
+        return session_id
+
+    take_lock = asyncio.Lock()
+
+    async def worker() -> None:
+        nonlocal finished_since_save
+        while True:
+            async with take_lock:
+                if start_rate is not None:
+                    while (wait_seconds := start_rate.try_take(1)) > 0:
+                        await asyncio.sleep(wait_seconds)
+                session_id = await next_session_id()
+            if session_id is None:
+                return
+            started = time.monotonic()
+            error = None
+            try:
+                outcome = await reprocess_session(session_id, args.mode, args.dry_run)
+            except Exception as e:
+                outcome, error = "failed", f"{type(e).__name__}: {e}"
+                print(f"--- Session {session_id} failed: {error} ---")
+            metrics.increment("reprocess.sessions", mode=args.mode, outcome=outcome)
+            metrics.observe("reprocess.session_seconds", time.monotonic() - started, mode=args.mode)
+            checkpoint.finished(session_id, outcome, error)
+            progress.finished(outcome)
+            finished_since_save += 1
+            if finished_since_save >= args.checkpoint_every:
+                checkpoint.save()
+                finished_since_save = 0
+
+    producer.start()
+    reporter = asyncio.create_task(progress.run())
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        stop.set()
+        reporter.cancel()
+        checkpoint.save()
+        await llm_call_recorder.close()
+    print(progress.line())
+    return checkpoint
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-render or re-plan the final prompts of stored sessions.")
+    parser.add_argument("--mode", choices=MODES, default="render")
+    parser.add_argument("--owner-id", type=int, default=None, help="Only this user's sessions.")
+    parser.add_argument("--session-id", type=int, action="append", default=None, help="Only these sessions (repeatable).")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many sessions.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessions processed at once.")
+    parser.add_argument("--sessions-per-minute", type=float, default=0, help="Cap on session starts per minute (0 = no cap).")
+    parser.add_argument("--checkpoint", default=None, help="JSON file to save progress to and resume from.")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="Save the checkpoint after this many sessions.")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines.")
+    parser.add_argument("--retry-failed", action="store_true", help="Only re-run the sessions the --checkpoint file lists as failed.")
+    parser.add_argument("--dry-run", action="store_true", help="Compute the new prompts but store nothing.")
+    args = parser.parse_args()
+    args.concurrency = max(1, args.concurrency)
+    args.checkpoint_every = max(1, args.checkpoint_every)
+    if args.retry_failed and not args.checkpoint:
+        parser.error("--retry-failed needs --checkpoint")
+
+    checkpoint = asyncio.run(run_reprocessing(args))
+    if checkpoint.failed:
+        print(f"--- {len(checkpoint.failed)} sessions failed (see {args.checkpoint or 'the log above'}) ---")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
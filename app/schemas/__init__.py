@@ -27,7 +27,13 @@ from .prompt import (
     
     # API Response Schemas
     GeneratedPromptData, 
-    PromptAnalysisResponse
+    PromptAnalysisResponse,
+    PageOrderUpdate,
+    SessionReanalyzeRequest,
+    HistorySearchResult,
+    HistorySearchResponse,
 )
+from .element_columns import ColumnarElementTree
 from .token import Token, TokenData
+from .usage import LLMUsageSummary, LLMUsageSummaryRow
 from .user import User, UserCreate, UserUpdate, UserInDB # Assuming UserInDB is your main User schema
\ No newline at end of file
@@ -0,0 +1,289 @@
+# app/schemas/element_columns.py
+"""
+Flat, columnar representation of `detected_elements_tree`.
+
+The nested `BaseElementSchema` tree costs one pydantic model (plus a dict bounding box and a
+list of `StyleHintItem` models) per node. For trees with thousands of nodes, validating,
+dumping and storing that is slow and memory-heavy. `ColumnarElementTree` keeps the same data as
+parallel `array('i')` columns in pre-order (a parent always comes before its children):
+
+- `parent[i]` is the index of node i's parent (-1 for top-level nodes), `depth[i]` its depth.
+- String fields are indexes into one interned string table (`strings`), -1 meaning None.
+- Bounding boxes are 4 ints per node in `bbox` (x, y, width, height), with `has_bbox[i]` set.
+  Boxes that don't have exactly those four int keys are kept as-is in `bbox_extra`.
+- Style hints are stored CSR-style: node i owns `style_properties/style_values[style_offsets[i]:style_offsets[i + 1]]`.
+
+Conversion to and from the nested schema is lossless, and `to_storage()` / `from_storage()` give a
+compact JSON-able form that `RichImageAnalysisSchema` accepts under `detected_elements_columns`.
+"""
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+STORAGE_FORMAT = "columnar-v1"
+NO_VALUE = -1
+STRING_FIELDS = ("id", "element_type", "semantic_guess", "text_content", "interaction_notes", "accessibility_notes")
+BBOX_KEYS = ("x", "y", "width", "height")
+
+# has_bbox values
+BBOX_NONE, BBOX_STANDARD, BBOX_EXTRA = 0, 1, 2
+
+
+class ColumnarElementTree:
+    __slots__ = ("strings", "_string_index", "parent", "depth", "columns", "bbox", "has_bbox", "bbox_extra",
+                 "style_offsets", "style_properties", "style_values")
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._string_index: Dict[str, int] = {}
+        self.parent = array("i")
+        self.depth = array("i")
+        self.columns: Dict[str, array] = {field: array("i") for field in STRING_FIELDS}
+        self.bbox = array("i")
+        self.has_bbox = array("b")
+        self.bbox_extra: Dict[int, Dict[str, Any]] = {}
+        self.style_offsets = array("i", [0])
+        self.style_properties = array("i")
+        self.style_values = array("i")
+
+    # --- Basic accessors ---
+
+    @property
+    def node_count(self) -> int:
+        return len(self.parent)
+
+    def intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_VALUE
+        index = self._string_index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self._string_index[value] = index
+        return index
+
+    def get(self, field: str, node_index: int) -> Optional[str]:
+        string_index = self.columns[field][node_index]
+        return None if string_index == NO_VALUE else self.strings[string_index]
+
+    def bounding_box(self, node_index: int) -> Optional[Dict[str, Any]]:
+        kind = self.has_bbox[node_index]
+        if kind == BBOX_STANDARD:
+            offset = node_index * 4
+            return {"x": self.bbox[offset], "y": self.bbox[offset + 1], "width": self.bbox[offset + 2], "height": self.bbox[offset + 3]}
+        if kind == BBOX_EXTRA:
+            return dict(self.bbox_extra[node_index])
+        return None
+
+    def style_hints(self, node_index: int) -> List[Tuple[str, str]]:
+        start, end = self.style_offsets[node_index], self.style_offsets[node_index + 1]
+        strings = self.strings
+        return [(strings[self.style_properties[i]], strings[self.style_values[i]]) for i in range(start, end)]
+
+    def style_hint_count(self, node_index: int) -> int:
+        return self.style_offsets[node_index + 1] - self.style_offsets[node_index]
+
+    def has_children(self, node_index: int) -> bool:
+        # Pre-order: if node i has children, the first one is stored right after it.
+        next_index = node_index + 1
+        return next_index < len(self.parent) and self.parent[next_index] == node_index
+
+    def iter_children(self, node_index: int) -> Iterator[int]:
+        """Direct children of a node (-1 for the top-level nodes), in order."""
+        for index in range(node_index + 1, len(self.parent)):
+            parent = self.parent[index]
+            if parent == node_index:
+                yield index
+            elif node_index != NO_VALUE and self.depth[index] <= self.depth[node_index]:
+                break
+
+    # --- Building ---
+
+    def append_node(
+        self,
+        parent_index: int,
+        element_type: str,
+        node_id: Optional[str] = None,
+        semantic_guess: Optional[str] = None,
+        text_content: Optional[str] = None,
+        interaction_notes: Optional[str] = None,
+        accessibility_notes: Optional[str] = None,
+        bounding_box: Optional[Dict[str, Any]] = None,
+        style_hints: Iterable[Tuple[str, str]] = (),
+    ) -> int:
+        node_index = len(self.parent)
+        self.parent.append(parent_index)
+        self.depth.append(0 if parent_index == NO_VALUE else self.depth[parent_index] + 1)
+        columns, intern = self.columns, self.intern
+        columns["id"].append(intern(node_id))
+        columns["element_type"].append(intern(element_type))
+        columns["semantic_guess"].append(intern(semantic_guess))
+        columns["text_content"].append(intern(text_content))
+        columns["interaction_notes"].append(intern(interaction_notes))
+        columns["accessibility_notes"].append(intern(accessibility_notes))
+
+        if bounding_box is None:
+            self.has_bbox.append(BBOX_NONE)
+            self.bbox.extend((0, 0, 0, 0))
+        elif len(bounding_box) == 4 and all(type(bounding_box.get(key)) is int for key in BBOX_KEYS):
+            self.has_bbox.append(BBOX_STANDARD)
+            self.bbox.extend((bounding_box["x"], bounding_box["y"], bounding_box["width"], bounding_box["height"]))
+        else:
+            self.has_bbox.append(BBOX_EXTRA)
+            self.bbox.extend((0, 0, 0, 0))
+            self.bbox_extra[node_index] = dict(bounding_box)
+
+        for style_property, style_value in style_hints:
+            self.style_properties.append(intern(style_property))
+            self.style_values.append(intern(style_value))
+        self.style_offsets.append(len(self.style_properties))
+        return node_index
+
+    @classmethod
+    def from_elements(cls, elements: Optional[List[Any]]) -> "ColumnarElementTree":
+        """Builds the columns from a list of (already validated) `BaseElementSchema` objects."""
+        tree = cls()
+        stack = [(element, NO_VALUE) for element in reversed(elements or [])]
+        while stack:
+            element, parent_index = stack.pop()
+            node_index = tree.append_node(
+                parent_index,
+                element.element_type,
+                node_id=element.id,
+                semantic_guess=element.semantic_guess,
+                text_content=element.text_content,
+                interaction_notes=element.interaction_notes,
+                accessibility_notes=element.accessibility_notes,
+                bounding_box=element.bounding_box,
+                style_hints=((hint.property, hint.value) for hint in element.style_hints),
+            )
+            if element.children:
+                stack.extend((child, node_index) for child in reversed(element.children))
+        return tree
+
+    @classmethod
+    def from_dicts(cls, elements: Optional[List[Dict[str, Any]]]) -> "ColumnarElementTree":
+        """
+        Builds the columns straight from raw JSON dicts (e.g. parsed LLM output), without creating
+        any pydantic models. Raises ValueError for nodes the nested schema would also reject.
+        """
+        tree = cls()
+        stack = [(element, NO_VALUE) for element in reversed(elements or [])]
+        while stack:
+            element, parent_index = stack.pop()
+            if not isinstance(element, dict) or not isinstance(element.get("element_type"), str):
+                raise ValueError(f"Invalid element node (element_type must be a string): {str(element)[:200]}")
+            style_hints = []
+            for hint in element.get("style_hints") or []:
+                if not isinstance(hint, dict) or not isinstance(hint.get("property"), str) or not isinstance(hint.get("value"), str):
+                    raise ValueError(f"Invalid style hint: {hint!r}")
+                style_hints.append((hint["property"], hint["value"]))
+            node_index = tree.append_node(
+                parent_index,
+                element["element_type"],
+                node_id=element.get("id"),
+                semantic_guess=element.get("semantic_guess"),
+                text_content=element.get("text_content"),
+                interaction_notes=element.get("interaction_notes"),
+                accessibility_notes=element.get("accessibility_notes"),
+                bounding_box=element.get("bounding_box"),
+                style_hints=style_hints,
+            )
+            children = element.get("children")
+            if children:
+                stack.extend((child, node_index) for child in reversed(children))
+        return tree
+
+    # --- Converting back ---
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Nested dicts in the same shape as `BaseElementSchema.model_dump()`."""
+        roots: List[Dict[str, Any]] = []
+        nodes: List[Dict[str, Any]] = []
+        for index in range(self.node_count):
+            node: Dict[str, Any] = {}
+            node_id = self.get("id", index)
+            if node_id is not None:
+                node["id"] = node_id
+            node["element_type"] = self.get("element_type", index)
+            node["semantic_guess"] = self.get("semantic_guess", index)
+            node["text_content"] = self.get("text_content", index)
+            node["bounding_box"] = self.bounding_box(index)
+            node["style_hints"] = [{"property": p, "value": v} for p, v in self.style_hints(index)]
+            node["interaction_notes"] = self.get("interaction_notes", index)
+            node["accessibility_notes"] = self.get("accessibility_notes", index)
+            node["children"] = []
+            nodes.append(node)
+            parent_index = self.parent[index]
+            (roots if parent_index == NO_VALUE else nodes[parent_index]["children"]).append(node)
+        return roots
+
+    def to_elements(self) -> List[Any]:
+        """
+        Nested `BaseElementSchema` objects. Uses `model_construct` (no re-validation), since the
+        columns can only hold values that already passed validation or `from_dicts` checks.
+        """
+        from app.schemas.prompt import BaseElementSchema, StyleHintItem
+
+        roots: List[Any] = []
+        nodes: List[Any] = []
+        for index in range(self.node_count):
+            fields: Dict[str, Any] = {
+                "element_type": self.get("element_type", index),
+                "semantic_guess": self.get("semantic_guess", index),
+                "text_content": self.get("text_content", index),
+                "bounding_box": self.bounding_box(index),
+                "style_hints": [StyleHintItem.model_construct(property=p, value=v) for p, v in self.style_hints(index)],
+                "interaction_notes": self.get("interaction_notes", index),
+                "accessibility_notes": self.get("accessibility_notes", index),
+                "children": [],
+            }
+            node_id = self.get("id", index)
+            if node_id is not None:
+                fields["id"] = node_id
+            element = BaseElementSchema.model_construct(**fields)
+            nodes.append(element)
+            parent_index = self.parent[index]
+            (roots if parent_index == NO_VALUE else nodes[parent_index].children).append(element)
+        return roots
+
+    # --- Storage ---
+
+    def to_storage(self) -> Dict[str, Any]:
+        storage: Dict[str, Any] = {"format": STORAGE_FORMAT, "strings": self.strings, "parent": self.parent.tolist()}
+        for field in STRING_FIELDS:
+            storage[field] = self.columns[field].tolist()
+        storage["has_bbox"] = self.has_bbox.tolist()
+        storage["bbox"] = self.bbox.tolist()
+        storage["bbox_extra"] = {str(index): value for index, value in self.bbox_extra.items()}
+        storage["style_offsets"] = self.style_offsets.tolist()
+        storage["style_properties"] = self.style_properties.tolist()
+        storage["style_values"] = self.style_values.tolist()
+        return storage
+
+    @classmethod
+    def from_storage(cls, data: Dict[str, Any]) -> "ColumnarElementTree":
+        if not isinstance(data, dict) or data.get("format") != STORAGE_FORMAT:
+            raise ValueError(f"Unsupported columnar element tree format: {data.get('format') if isinstance(data, dict) else type(data)}")
+        tree = cls()
+        tree.strings = list(data["strings"])
+        tree._string_index = {value: index for index, value in enumerate(tree.strings)}
+        tree.parent = array("i", data["parent"])
+        node_count = len(tree.parent)
+        for field in STRING_FIELDS:
+            tree.columns[field] = array("i", data[field])
+        tree.has_bbox = array("b", data["has_bbox"])
+        tree.bbox = array("i", data["bbox"])
+        tree.bbox_extra = {int(index): value for index, value in (data.get("bbox_extra") or {}).items()}
+        tree.style_offsets = array("i", data["style_offsets"])
+        tree.style_properties = array("i", data["style_properties"])
+        tree.style_values = array("i", data["style_values"])
+        if (any(len(tree.columns[field]) != node_count for field in STRING_FIELDS) or len(tree.has_bbox) != node_count
+                or len(tree.bbox) != node_count * 4 or len(tree.style_offsets) != node_count + 1
+                or len(tree.style_properties) != len(tree.style_values)):
+            raise ValueError("Columnar element tree columns have inconsistent lengths.")
+        depth = tree.depth
+        for node_index, parent_index in enumerate(tree.parent):
+            if parent_index >= node_index:
+                raise ValueError("Columnar element tree is not in pre-order (parent stored after child).")
+            depth.append(0 if parent_index == NO_VALUE else depth[parent_index] + 1)
+        return tree
@@ -0,0 +1,233 @@
+# app/schemas/element_repeats.py
+"""
+Repeated-structure compaction of `detected_elements_tree`.
+
+Card grids, tables and lists come back from the vision model as runs of sibling subtrees that
+are identical apart from their text, ids and positions. `find_repeat_groups` assigns every
+subtree of a `ColumnarElementTree` a structural signature (element_type, semantic_guess, notes,
+style hints, whether it has a box, and the children's signatures - but not id, text_content or
+bounding_box) and reports runs of at least REPEAT_MIN_COUNT consecutive siblings with the same
+signature. Signatures are canonical ids handed out per distinct shape, so equal ids always mean
+equal structure (no hash collisions).
+
+A run is written once as a template (its first repeat) plus a repeat count and per-repeat variants:
+
+- `to_compact_storage()` / `expand_compact_storage()`: a lossless JSON form that
+  `RichImageAnalysisSchema` accepts under `detected_elements_compact`. Variants hold each
+  repeat's ids, texts and boxes in template pre-order.
+- `to_prompt_dicts()`: the same shape for the planner's JSON encoding, with only the text
+  variants.
+- `iter_compacted_nodes()`: walks the columns with each run collapsed, for the text renderers.
+"""
+import copy
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from app.schemas.element_columns import BBOX_STANDARD, NO_VALUE, ColumnarElementTree
+
+STORAGE_FORMAT = "repeats-v1"
+REPEAT_MIN_COUNT = 3
+
+
+class RepeatGroup:
+    """A run of `count` consecutive sibling subtrees with the same structure; `roots` are their node indexes."""
+    __slots__ = ("parent", "roots", "subtree_size")
+
+    def __init__(self, parent: int, roots: List[int], subtree_size: int):
+        self.parent = parent
+        self.roots = roots
+        self.subtree_size = subtree_size
+
+    @property
+    def count(self) -> int:
+        return len(self.roots)
+
+    @property
+    def template_end(self) -> int:
+        return self.roots[0] + self.subtree_size
+
+    @property
+    def end(self) -> int:
+        return self.roots[-1] + self.subtree_size
+
+    def __repr__(self) -> str:
+        return f"RepeatGroup(x{self.count}, roots={self.roots[:3]}{'...' if self.count > 3 else ''}, size={self.subtree_size})"
+
+
+def find_repeat_groups(tree: ColumnarElementTree, min_count: int = REPEAT_MIN_COUNT) -> Dict[int, RepeatGroup]:
+    """Runs of structurally identical siblings, keyed by the index of the run's first root."""
+    node_count = tree.node_count
+    if node_count < min_count:
+        return {}
+    parents, columns = tree.parent, tree.columns
+    types, semantics = columns["element_type"], columns["semantic_guess"]
+    interactions, accessibility = columns["interaction_notes"], columns["accessibility_notes"]
+    style_offsets, style_properties, style_values = tree.style_offsets, tree.style_properties, tree.style_values
+    signature_ids: Dict[Tuple[Any, ...], int] = {}
+    signatures = [0] * node_count
+    sizes = [1] * node_count
+    child_signatures: List[List[int]] = [[] for _ in range(node_count)]
+    for index in range(node_count - 1, -1, -1): # Reverse pre-order: children are done before their parent
+        start, end = style_offsets[index], style_offsets[index + 1]
+        key = (
+            types[index], semantics[index], interactions[index], accessibility[index], tree.has_bbox[index] != 0,
+            tuple(style_properties[start:end]), tuple(style_values[start:end]), tuple(reversed(child_signatures[index])),
+        )
+        signature = signature_ids.setdefault(key, len(signature_ids))
+        signatures[index] = signature
+        parent = parents[index]
+        if parent != NO_VALUE:
+            child_signatures[parent].append(signature)
+            sizes[parent] += sizes[index]
+
+    groups: Dict[int, RepeatGroup] = {}
+    run_roots: Dict[int, List[int]] = {} # Parent -> roots of the run currently being extended
+    for index in range(node_count): # Siblings are visited in order, each parent's runs separately
+        parent = parents[index]
+        run = run_roots.get(parent)
+        if run and signatures[run[-1]] == signatures[index] and run[-1] + sizes[run[-1]] == index:
+            run.append(index)
+            continue
+        if run and len(run) >= min_count:
+            groups[run[0]] = RepeatGroup(parent, run, sizes[run[0]])
+        run_roots[parent] = [index]
+    for parent, run in run_roots.items():
+        if len(run) >= min_count:
+            groups[run[0]] = RepeatGroup(parent, run, sizes[run[0]])
+    return groups
+
+
+def iter_compacted_nodes(tree: ColumnarElementTree, groups: Dict[int, RepeatGroup]) -> Iterator[Tuple[str, Any, int]]:
+    """
+    Pre-order walk with every repeat group collapsed to its template. Yields
+    ("repeat_start", group, extra_depth), ("node", index, extra_depth) and ("repeat_end", group, extra_depth);
+    nodes inside a template get one extra level of depth per enclosing group.
+    """
+    node_count = tree.node_count
+    open_groups: List[RepeatGroup] = []
+    index = 0
+    while True:
+        while open_groups and index >= open_groups[-1].template_end:
+            group = open_groups.pop()
+            yield "repeat_end", group, len(open_groups)
+            index = max(index, group.end) # Skip the other repeats
+        if index >= node_count:
+            break
+        group = groups.get(index)
+        if group is not None:
+            yield "repeat_start", group, len(open_groups)
+            open_groups.append(group)
+        yield "node", index, len(open_groups)
+        index += 1
+
+
+def repeat_texts(tree: ColumnarElementTree, group: RepeatGroup) -> List[List[str]]:
+    """Non-empty text_content of each repeat, in pre-order."""
+    texts = tree.columns["text_content"]
+    strings = tree.strings
+    return [[strings[texts[i]] for i in range(root, root + group.subtree_size) if texts[i] != NO_VALUE and strings[texts[i]]] for root in group.roots]
+
+
+# --- Nested dict forms ---
+
+def _node_dict(tree: ColumnarElementTree, index: int) -> Dict[str, Any]:
+    node: Dict[str, Any] = {}
+    node_id = tree.get("id", index)
+    if node_id is not None:
+        node["id"] = node_id
+    node["element_type"] = tree.get("element_type", index)
+    node["semantic_guess"] = tree.get("semantic_guess", index)
+    node["text_content"] = tree.get("text_content", index)
+    node["bounding_box"] = tree.bounding_box(index)
+    node["style_hints"] = [{"property": p, "value": v} for p, v in tree.style_hints(index)]
+    node["interaction_notes"] = tree.get("interaction_notes", index)
+    node["accessibility_notes"] = tree.get("accessibility_notes", index)
+    node["children"] = []
+    return node
+
+
+def _compact_dicts(tree: ColumnarElementTree, groups: Dict[int, RepeatGroup], variants_for: Callable[[RepeatGroup], Any]) -> List[Dict[str, Any]]:
+    roots: List[Dict[str, Any]] = []
+    containers: Dict[int, List[Dict[str, Any]]] = {NO_VALUE: roots} # Node index -> its (compacted) children list
+    group_entries: Dict[int, Dict[str, Any]] = {} # First root index -> the group's entry, until its template is set
+    for kind, value, _ in iter_compacted_nodes(tree, groups):
+        if kind == "repeat_start":
+            group_entry = {"repeat_count": value.count, "template": None, "variants": variants_for(value)}
+            containers[value.parent].append(group_entry)
+            group_entries[value.roots[0]] = group_entry
+        elif kind == "node":
+            node = _node_dict(tree, value)
+            containers[value] = node["children"]
+            group_entry = group_entries.pop(value, None)
+            if group_entry is not None:
+                group_entry["template"] = node
+            else:
+                containers[tree.parent[value]].append(node)
+    return roots
+
+
+def _storage_variants(tree: ColumnarElementTree, group: RepeatGroup) -> Dict[str, Any]:
+    # Repeats 2..n; each is a list over the template's nodes in pre-order. Standard boxes as [x, y, w, h].
+    variants: Dict[str, Any] = {}
+    for field in ("id", "text_content"):
+        variants[field] = [[tree.get(field, i) for i in range(root, root + group.subtree_size)] for root in group.roots[1:]]
+    boxes = []
+    for root in group.roots[1:]:
+        repeat_boxes = []
+        for i in range(root, root + group.subtree_size):
+            if tree.has_bbox[i] == BBOX_STANDARD:
+                repeat_boxes.append(tree.bbox[i * 4:i * 4 + 4].tolist())
+            else:
+                repeat_boxes.append(tree.bounding_box(i))
+        boxes.append(repeat_boxes)
+    variants["bounding_box"] = boxes
+    return variants
+
+
+def to_compact_storage(tree: ColumnarElementTree, groups: Dict[int, RepeatGroup]) -> Dict[str, Any]:
+    return {"format": STORAGE_FORMAT, "tree": _compact_dicts(tree, groups, lambda group: _storage_variants(tree, group))}
+
+
+def to_prompt_dicts(tree: ColumnarElementTree, groups: Dict[int, RepeatGroup]) -> List[Dict[str, Any]]:
+    """Nested dicts for the planner with each run as {"repeat_count", "template", "variants": [texts per repeat]}."""
+    return _compact_dicts(tree, groups, lambda group: repeat_texts(tree, group))
+
+
+def _preorder(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(current["children"]))
+
+
+def _expand_entries(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    expanded: List[Dict[str, Any]] = []
+    for entry in entries:
+        if "repeat_count" not in entry:
+            entry = dict(entry)
+            entry["children"] = _expand_entries(entry.get("children") or [])
+            expanded.append(entry)
+            continue
+        template = _expand_entries([entry["template"]])[0]
+        expanded.append(template)
+        variants = entry["variants"]
+        template_size = sum(1 for _ in _preorder(template))
+        for repeat_index in range(entry["repeat_count"] - 1):
+            repeat = copy.deepcopy(template)
+            ids, texts, boxes = variants["id"][repeat_index], variants["text_content"][repeat_index], variants["bounding_box"][repeat_index]
+            if not len(ids) == len(texts) == len(boxes) == template_size:
+                raise ValueError("Repeat group variants don't match the template size.")
+            for node, node_id, text, box in zip(_preorder(repeat), ids, texts, boxes):
+                if node_id is None: node.pop("id", None)
+                else: node["id"] = node_id
+                node["text_content"] = text
+                node["bounding_box"] = dict(zip(("x", "y", "width", "height"), box)) if isinstance(box, list) else box
+            expanded.append(repeat)
+    return expanded
+
+
+def expand_compact_storage(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The full nested `detected_elements_tree` (list of node dicts) from `to_compact_storage()` output."""
+    if not isinstance(data, dict) or data.get("format") != STORAGE_FORMAT:
+        raise ValueError(f"Unsupported compact element tree format: {data.get('format') if isinstance(data, dict) else type(data)}")
+    return _expand_entries(data["tree"])
@@ -1,6 +1,8 @@
 # app/schemas/prompt.py
 import datetime
-from pydantic import BaseModel, Field
+import hashlib
+import json
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Dict, Any, Optional
 import uuid
 
@@ -11,6 +13,7 @@ class ImageMetadata(BaseModel):
     original_filename: Optional[str] = None
     image_dimensions: Optional[Dict[str, int]] = None
     analysis_timestamp: Optional[str] = None
+    instruction_version: Optional[str] = None # Vision instruction prefix version that produced the analysis
 
 class OverallAnalysis(BaseModel):
     page_title_guess: Optional[str] = "Untitled Page"
@@ -98,9 +101,32 @@ class RichImageAnalysisSchema(BaseModel):
     visual_style_guide: Optional[VisualStyleSchema] = None 
     detected_elements_tree: List[BaseElementSchema] = Field(default_factory=list) 
 
+    @model_validator(mode="before")
+    @classmethod
+    def expand_columnar_elements_tree(cls, data: Any) -> Any:
+        # Analyses stored with STORE_ELEMENT_TREE_COLUMNAR keep the tree under
+        # `detected_elements_columns` (see app/schemas/element_columns.py), and ones with repeated
+        # subtrees under `detected_elements_compact` (app/schemas/element_repeats.py); expand them
+        # back here so every reader still sees the normal nested `detected_elements_tree`.
+        if isinstance(data, dict) and data.get("detected_elements_columns") and not data.get("detected_elements_tree"):
+            from app.schemas.element_columns import ColumnarElementTree
+            data = dict(data)
+            data["detected_elements_tree"] = ColumnarElementTree.from_storage(data.pop("detected_elements_columns")).to_dicts()
+        elif isinstance(data, dict) and data.get("detected_elements_compact") and not data.get("detected_elements_tree"):
+            from app.schemas.element_repeats import expand_compact_storage
+            data = dict(data)
+            data["detected_elements_tree"] = expand_compact_storage(data.pop("detected_elements_compact"))
+        return data
+
     class Config:
         from_attributes = True
 
+# Stamped into analyses stored as a complete RichImageAnalysisSchema dump (see dump_analysis_for_storage).
+# Derived from the schema, so it changes with it: /history passes stamped analyses through as stored and
+# sends any other shape (older schema versions, error placeholders) through this schema first.
+ANALYSIS_STORAGE_FORMAT_KEY = "storage_format"
+ANALYSIS_STORAGE_FORMAT = hashlib.sha256(json.dumps(RichImageAnalysisSchema.model_json_schema(), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
 # --- Schemas for Database Interaction & API Responses ---
 
 class ImageEntryBase(BaseModel):
@@ -130,6 +156,7 @@ class GeneratedPromptCreate(GeneratedPromptBase):
 
 class GeneratedPromptInDB(GeneratedPromptBase):
     id: int
+    version: Optional[int] = 1
     created_at: datetime.datetime
 
     class Config:
@@ -168,6 +195,29 @@ class PromptAnalysisResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class PageOrderUpdate(BaseModel):
+    # The session's ImageEntry ids in their new order (must contain every entry exactly once)
+    entry_ids: List[int]
+
+class SessionReanalyzeRequest(BaseModel):
+    # Pages to run through vision again from their stored originals; default: every page that has one
+    entry_ids: Optional[List[int]] = None
+    only_failed: bool = False # Only pages whose stored analysis is an error (e.g. unfinished pages of a partial session)
+
+class HistorySearchResult(BaseModel):
+    # Lightweight summary row; fetch /sessions/{id} for pages and prompts
+    id: int
+    session_name: Optional[str] = None
+    image_filename: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: Optional[datetime.datetime] = None
+    page_count: int = 0
+    rank: float = 0.0
+
+class HistorySearchResponse(BaseModel):
+    results: List[HistorySearchResult]
+    next_cursor: Optional[str] = None # Pass back as ?cursor= for the next page; None on the last page
+
 # --- NEW SCHEMA FOR PAGINATED HISTORY RESPONSE ---
 class HistoryResponse(BaseModel):
     total_count: int
@@ -8,4 +8,5 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     # This will store the "subject" of the token, e.g., user's email or ID
-    subject: Optional[str] = None
\ No newline at end of file
+    subject: Optional[str] = None
+    email: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,34 @@
+# app/schemas/usage.py
+import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class LLMUsageSummaryRow(BaseModel):
+    # Group keys: only the ones requested in group_by are set
+    user_id: Optional[int] = None
+    model: Optional[str] = None
+    stage: Optional[str] = None
+    outcome: Optional[str] = None
+    day: Optional[str] = None
+
+    calls: int = 0
+    failed_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cached_prompt_fraction: float = 0.0
+    cost_usd: Optional[float] = None # Sum over calls with a known cost; see calls_without_cost
+    calls_without_cost: int = 0
+    avg_latency_ms: float = 0.0
+    max_latency_ms: Optional[float] = None
+    completion_tokens_per_second: float = 0.0 # Generation throughput: completion tokens / summed call latency
+    calls_per_minute: float = 0.0 # Over the whole [since, until) window
+
+class LLMUsageSummary(BaseModel):
+    since: datetime.datetime
+    until: datetime.datetime
+    group_by: List[str]
+    rows: List[LLMUsageSummaryRow]
+    totals: LLMUsageSummaryRow
@@ -0,0 +1,152 @@
+# benchmarks/bench_element_repeats.py
+"""
+Size benchmark for repeated-structure compaction (app/schemas/element_repeats.py): stored
+analysis JSON, the prompt's element tree text and both planner encodings, with and without
+compaction. Every stored analysis is checked to expand back to the original tree.
+
+    python -m benchmarks.bench_element_repeats --cards 12,48 --rows 20,100
+    python -m benchmarks.bench_element_repeats --export history.ndjson   # GET /prompts/history/export output
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+
+from app.api.api_v1.endpoints.prompts import format_columnar_elements_tree_for_prompt, format_columnar_elements_tree_outline  # noqa: E402
+from app.schemas import ColumnarElementTree, RichImageAnalysisSchema  # noqa: E402
+from app.schemas.element_repeats import expand_compact_storage, find_repeat_groups, to_compact_storage, to_prompt_dicts  # noqa: E402
+from benchmarks import common  # noqa: E402
+from benchmarks.mock_openrouter import canned_rich_analysis  # noqa: E402
+
+
+def _element(element_type: str, semantic_guess: str = None, text: str = None, box: Tuple[int, int, int, int] = None, styles: Dict[str, str] = None, children: List[Dict[str, Any]] = None, element_id: str = None) -> Dict[str, Any]:
+    element = {
+        "element_type": element_type, "semantic_guess": semantic_guess, "text_content": text,
+        "bounding_box": dict(zip(("x", "y", "width", "height"), box)) if box else None,
+        "style_hints": [{"property": p, "value": v} for p, v in (styles or {}).items()],
+        "interaction_notes": None, "accessibility_notes": None, "children": children or [],
+    }
+    if element_id is not None:
+        element["id"] = element_id
+    return element
+
+
+def dashboard_tree(card_count: int, row_count: int) -> List[Dict[str, Any]]:
+    """A page shaped like typical vision output: nav links, a card grid, a data table and footer links."""
+    nav = _element("nav", "top navigation", box=(0, 0, 1280, 64), styles={"background-color": "#1e293b"}, children=[
+        _element("a", "nav link", text=label, box=(200 + i * 120, 20, 100, 24), styles={"color": "#ffffff", "font-weight": "500"}, element_id=f"nav_{i}")
+        for i, label in enumerate(["Home", "Projects", "Reports", "Team", "Settings"])
+    ])
+    cards = [
+        _element("div", "project card", box=(40 + (i % 3) * 400, 120 + (i // 3) * 320, 380, 300), styles={"background-color": "#ffffff", "border-radius": "8px", "box-shadow": "0 1px 3px rgba(0,0,0,0.1)"}, element_id=f"card_{i}", children=[
+            _element("img", "thumbnail", box=(40 + (i % 3) * 400, 120 + (i // 3) * 320, 380, 160), styles={"object-fit": "cover"}),
+            _element("h3", "card title", text=f"Project {i}: {['Website redesign', 'Mobile app', 'Data pipeline', 'Billing revamp'][i % 4]}", styles={"font-size": "18px", "font-weight": "600"}),
+            _element("p", "card description", text=f"Owned by team {i % 7}, last updated {i % 28 + 1} days ago.", styles={"font-size": "14px", "color": "#64748b"}),
+            _element("button", "card action", text="Open", styles={"background-color": "#2563eb", "color": "#ffffff", "border-radius": "6px"}),
+        ])
+        for i in range(card_count)
+    ]
+    rows = [
+        _element("tr", "table row", box=(40, 900 + i * 40, 1200, 40), styles={"border-bottom": "1px solid #e2e8f0"}, children=[
+            _element("td", "cell", text=value, styles={"padding": "8px 12px"})
+            for value in (f"INV-{1000 + i}", f"Customer {i % 13}", f"${(i * 37) % 900 + 100}.00", ["Paid", "Pending", "Overdue"][i % 3])
+        ])
+        for i in range(row_count)
+    ]
+    table = _element("table", "invoices table", box=(40, 860, 1200, 40 * (row_count + 1)), children=[
+        _element("tr", "table header", children=[_element("th", "column header", text=label, styles={"font-weight": "600"}) for label in ("Invoice", "Customer", "Amount", "Status")]),
+        *rows,
+    ])
+    footer = _element("footer", "page footer", styles={"background-color": "#f8fafc"}, children=[
+        _element("a", "footer link", text=label, styles={"font-size": "12px"}) for label in ("About", "Careers", "Privacy", "Terms", "Contact")
+    ])
+    return [nav, _element("section", "card grid", text="Recent projects", children=cards), table, footer]
+
+
+def synthetic_analyses(card_counts: List[int], row_counts: List[int]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for card_count in card_counts:
+        for row_count in row_counts:
+            analysis = canned_rich_analysis(1)
+            analysis["detected_elements_tree"] = dashboard_tree(card_count, row_count)
+            yield f"dashboard cards={card_count} rows={row_count}", analysis
+
+
+def exported_analyses(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            session = json.loads(line)
+            for entry in session.get("image_entries") or []:
+                analysis = entry.get("analysis_output_json")
+                if isinstance(analysis, dict) and analysis.get("detected_elements_tree"):
+                    yield f"session {session.get('id')} / {entry.get('title') or entry.get('id')}", analysis
+
+
+def measure(label: str, raw_analysis: Dict[str, Any], min_count: int) -> Dict[str, Any]:
+    analysis = RichImageAnalysisSchema.model_validate(raw_analysis)
+    columns = ColumnarElementTree.from_elements(analysis.detected_elements_tree)
+    started = time.perf_counter()
+    groups = find_repeat_groups(columns, min_count)
+    find_ms = (time.perf_counter() - started) * 1000
+
+    nested_storage = json.dumps(analysis.model_dump())
+    compact_dict = analysis.model_dump(exclude={"detected_elements_tree"})
+    compact_dict["detected_elements_tree"] = []
+    compact_dict["detected_elements_compact"] = to_compact_storage(columns, groups)
+    compact_storage = json.dumps(compact_dict)
+    assert expand_compact_storage(json.loads(compact_storage)["detected_elements_compact"]) == columns.to_dicts(), f"{label}: compact storage does not round-trip"
+
+    planner_json = analysis.model_dump_json(indent=2)
+    planner_dict = analysis.model_dump(mode="json", exclude={"detected_elements_tree"})
+    planner_dict["detected_elements_tree"] = to_prompt_dicts(columns, groups)
+    return {
+        "label": label,
+        "nodes": columns.node_count,
+        "repeat_groups": len(groups),
+        "find_groups_ms": round(find_ms, 3),
+        "bytes": {
+            "storage": (len(nested_storage), len(compact_storage)),
+            "prompt_tree": (len(format_columnar_elements_tree_for_prompt(columns, 2)), len(format_columnar_elements_tree_for_prompt(columns, 2, groups))),
+            "planner_json": (len(planner_json), len(json.dumps(planner_dict, indent=2, ensure_ascii=False))),
+            "planner_outline": (len(format_columnar_elements_tree_outline(columns)), len(format_columnar_elements_tree_outline(columns, groups))),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Size reduction from repeated-structure compaction of element trees.")
+    parser.add_argument("--cards", default="12,48", help="Comma-separated card counts for the synthetic dashboard.")
+    parser.add_argument("--rows", default="20,100", help="Comma-separated table row counts for the synthetic dashboard.")
+    parser.add_argument("--export", default=None, help="NDJSON history export to measure instead of synthetic pages.")
+    parser.add_argument("--min-count", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.export:
+        analyses = exported_analyses(args.export)
+    else:
+        analyses = synthetic_analyses([int(n) for n in args.cards.split(",")], [int(n) for n in args.rows.split(",")])
+    results = [measure(label, analysis, args.min_count) for label, analysis in analyses]
+    totals: Dict[str, List[int]] = {}
+    for result in results:
+        print(f"--- {result['label']}: {result['nodes']} nodes, {result['repeat_groups']} repeat groups ({result['find_groups_ms']:.2f} ms) ---")
+        for name, (full, compact) in result["bytes"].items():
+            print(f"    {name:<16} {full / 1024:>9.1f} KiB -> {compact / 1024:>9.1f} KiB  ({100 * (1 - compact / full):5.1f}% smaller)")
+            total = totals.setdefault(name, [0, 0])
+            total[0] += full
+            total[1] += compact
+    if len(results) > 1:
+        print(f"--- Total over {len(results)} analyses ---")
+        for name, (full, compact) in totals.items():
+            print(f"    {name:<16} {full / 1024:>9.1f} KiB -> {compact / 1024:>9.1f} KiB  ({100 * (1 - compact / full):5.1f}% smaller)")
+    output_path = common.write_results("element-repeats", {"config": vars(args), "results": results}, args.output)
+    print(f"--- Results written to {output_path} ---")
+
+
+if __name__ == "__main__":
+    main()
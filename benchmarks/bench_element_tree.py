@@ -0,0 +1,108 @@
+# benchmarks/bench_element_tree.py
+"""
+Speed and memory benchmark: nested `BaseElementSchema` trees vs `ColumnarElementTree`.
+
+    python -m benchmarks.bench_element_tree --nodes 1000,5000,20000
+"""
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Tuple
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+
+from app.api.api_v1.endpoints.prompts import format_columnar_elements_tree_for_prompt, format_detected_elements_tree_for_prompt  # noqa: E402
+from app.schemas import BaseElementSchema, ColumnarElementTree  # noqa: E402
+from benchmarks import common  # noqa: E402
+from benchmarks.mock_openrouter import canned_rich_analysis  # noqa: E402
+
+
+def timed(func: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """Best-of-`repeat` wall time in ms, plus the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 3), result
+
+
+def retained_bytes(build: Callable[[], Any]) -> int:
+    """Bytes still allocated after `build()` returns, i.e. the size of the structure it keeps alive."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def bench_node_count(node_count: int, repeat: int) -> Dict[str, Any]:
+    raw_tree = canned_rich_analysis(node_count)["detected_elements_tree"]
+    raw_json = json.dumps(raw_tree)
+
+    def validate_nested():
+        return [BaseElementSchema.model_validate(node) for node in json.loads(raw_json)]
+
+    nested_validate_ms, nested = timed(validate_nested, repeat)
+    columnar_build_ms, columns = timed(lambda: ColumnarElementTree.from_dicts(json.loads(raw_json)), repeat)
+    from_elements_ms, _ = timed(lambda: ColumnarElementTree.from_elements(nested), repeat)
+    nested_dump_ms, nested_dump = timed(lambda: json.dumps([node.model_dump() for node in nested]), repeat)
+    columnar_dump_ms, columnar_dump = timed(lambda: json.dumps(columns.to_storage()), repeat)
+    columnar_load_ms, _ = timed(lambda: ColumnarElementTree.from_storage(json.loads(columnar_dump)), repeat)
+    to_elements_ms, _ = timed(columns.to_elements, repeat)
+    to_dicts_ms, _ = timed(columns.to_dicts, repeat)
+    nested_render_ms, nested_text = timed(lambda: format_detected_elements_tree_for_prompt(nested, 2), repeat)
+    columnar_render_ms, columnar_text = timed(lambda: format_columnar_elements_tree_for_prompt(columns, 2), repeat)
+    assert nested_text == columnar_text, "Renderers disagree"
+
+    return {
+        "nodes": columns.node_count,
+        "timings_ms": {
+            "nested_validate_from_json": nested_validate_ms,
+            "columnar_build_from_json": columnar_build_ms,
+            "columnar_from_nested_models": from_elements_ms,
+            "nested_dump_to_json": nested_dump_ms,
+            "columnar_dump_to_json": columnar_dump_ms,
+            "columnar_load_from_json": columnar_load_ms,
+            "columnar_to_nested_models": to_elements_ms,
+            "columnar_to_nested_dicts": to_dicts_ms,
+            "nested_render_prompt": nested_render_ms,
+            "columnar_render_prompt": columnar_render_ms,
+        },
+        "memory_bytes": {
+            "nested_models": retained_bytes(validate_nested),
+            "columnar": retained_bytes(lambda: ColumnarElementTree.from_dicts(json.loads(raw_json))),
+        },
+        "storage_bytes": {"nested_json": len(nested_dump), "columnar_json": len(columnar_dump)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Nested vs columnar element tree benchmark.")
+    parser.add_argument("--nodes", default="1000,5000,20000", help="Comma-separated tree sizes.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    results = [bench_node_count(int(n), args.repeat) for n in args.nodes.split(",")]
+    for result in results:
+        memory, storage = result["memory_bytes"], result["storage_bytes"]
+        print(f"--- {result['nodes']} nodes ---")
+        for name, value in result["timings_ms"].items():
+            print(f"    {name:<32} {value:>10.2f} ms")
+        print(f"    memory: nested {memory['nested_models'] / 1024:.0f} KiB, columnar {memory['columnar'] / 1024:.0f} KiB")
+        print(f"    storage: nested {storage['nested_json'] / 1024:.0f} KiB, columnar {storage['columnar_json'] / 1024:.0f} KiB")
+    output_path = common.write_results("element-tree", {"config": vars(args), "results": results}, args.output)
+    print(f"--- Results written to {output_path} ---")
+
+
+if __name__ == "__main__":
+    main()
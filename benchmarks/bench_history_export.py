@@ -0,0 +1,133 @@
+# benchmarks/bench_history_export.py
+"""
+History export benchmark: seeds a user with many sessions, then streams
+GET /prompts/history/export (NDJSON and zip) from a uvicorn subprocess and records time, size
+and server RSS while it runs. With --compare-history the same sessions are also fetched through
+`/history?limit=<all>` (full ORM graphs) for comparison.
+
+    python -m benchmarks.bench_history_export --sessions 10000
+    python -m benchmarks.bench_history_export --database-url postgresql://postgres:pw@localhost/voidcoder_bench --compare-history
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+import httpx
+
+from benchmarks import common
+from benchmarks.mock_openrouter import canned_rich_analysis
+from benchmarks.run_load_test import MemorySampler
+
+SEED_BATCH_SIZE = 1000
+
+
+def seed_sessions(session_count: int, pages_per_session: int, nodes_per_page: int) -> None:
+    """Bulk-inserts sessions (pages + one prompt each) for the benchmark user via Core inserts."""
+    from sqlalchemy import insert, select
+
+    from app.db.session import SessionLocal
+    from app.models.prompt_session import GeneratedPrompt, ImageEntry, PromptSession, User
+
+    analysis = canned_rich_analysis(nodes_per_page)
+    prompt_text = "Build the following multi-page application.\n" + "Detailed section text. " * 400
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db = SessionLocal()
+    try:
+        owner_id = db.execute(select(User.id).where(User.email == "benchmark@example.com")).scalar_one()
+        for start in range(0, session_count, SEED_BATCH_SIZE):
+            count = min(SEED_BATCH_SIZE, session_count - start)
+            session_ids = db.execute(
+                insert(PromptSession).returning(PromptSession.id),
+                [{"session_name": f"Benchmark session {start + i}", "image_filename": "page-0.png", "owner_id": owner_id, "created_at": now, "updated_at": now} for i in range(count)],
+            ).scalars().all()
+            db.execute(insert(ImageEntry), [
+                {"title": f"Page {page}", "original_filename": f"page-{page}.png", "analysis_output_json": analysis, "order_in_session": page, "prompt_session_id": session_id, "created_at": now}
+                for session_id in session_ids for page in range(pages_per_session)
+            ])
+            db.execute(insert(GeneratedPrompt), [
+                {"prompt_type": "consolidated_multi_page", "prompt_text": prompt_text, "order_in_session": 0, "version": 1, "session_id": session_id, "created_at": now}
+                for session_id in session_ids
+            ])
+            db.commit()
+            print(f"    seeded {start + count}/{session_count} sessions")
+    finally:
+        db.close()
+
+
+def measure_download(app_pid: int, url: str, token: str, params: Dict[str, Any], timeout_seconds: float) -> Dict[str, Any]:
+    size_bytes = lines = 0
+    rss_before_kb = common.read_tree_rss_kb(app_pid)
+    started = time.perf_counter()
+    first_byte_ms = None
+    with MemorySampler(app_pid, interval_seconds=0.05) as sampler:
+        with httpx.stream("GET", url, params=params, headers={"Authorization": f"Bearer {token}"}, timeout=timeout_seconds) as response:
+            response.raise_for_status()
+            for chunk in response.iter_bytes():
+                if first_byte_ms is None:
+                    first_byte_ms = round((time.perf_counter() - started) * 1000, 1)
+                size_bytes += len(chunk)
+                lines += chunk.count(b"\n")
+    rss_max_kb = max(sampler.samples_kb or [rss_before_kb or 0])
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "first_byte_ms": first_byte_ms,
+        "bytes": size_bytes,
+        "newlines": lines,
+        "rss_before_kb": rss_before_kb,
+        "rss_max_sampled_kb": rss_max_kb,
+        "rss_growth_kb": rss_max_kb - (rss_before_kb or 0),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Streaming history export benchmark.")
+    parser.add_argument("--database-url", default=None, help="Defaults to a fresh SQLite file in a temp directory.")
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--pages-per-session", type=int, default=2)
+    parser.add_argument("--nodes-per-page", type=int, default=20, help="Element tree size of each stored analysis.")
+    parser.add_argument("--formats", default="ndjson,zip")
+    parser.add_argument("--compare-history", action="store_true", help="Also fetch everything through /history?limit=N.")
+    parser.add_argument("--request-timeout", type=float, default=600.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="voidcoder-export-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    app_port = common.free_port()
+    app_env = common.benchmark_app_env(database_url, "http://127.0.0.1:9") # No LLM calls in this benchmark
+    os.environ.update({key: app_env[key] for key in ("DATABASE_URL", "SECRET_KEY")})
+    token = common.seed_benchmark_user()
+    print(f"--- Seeding {args.sessions} sessions ---")
+    seed_sessions(args.sessions, args.pages_per_session, args.nodes_per_page)
+
+    app_process = None
+    try:
+        app_process = common.start_app_server(app_port, app_env)
+        base_url = f"http://127.0.0.1:{app_port}/api/v1/prompts"
+        results: Dict[str, Any] = {}
+        for export_format in [f.strip() for f in args.formats.split(",") if f.strip()]:
+            print(f"--- Exporting as {export_format} ---")
+            results[f"export_{export_format}"] = measure_download(app_process.pid, f"{base_url}/history/export", token, {"format": export_format}, args.request_timeout)
+            print(f"    {results[f'export_{export_format}']}")
+        if args.compare_history:
+            print("--- Fetching the same history through /history ---")
+            try:
+                results["history_full"] = measure_download(app_process.pid, f"{base_url}/history", token, {"limit": args.sessions}, args.request_timeout)
+            except httpx.HTTPError as e:
+                results["history_full"] = {"error": f"{type(e).__name__}: {e}", "timeout_seconds": args.request_timeout}
+            print(f"    {results['history_full']}")
+        output_path = common.write_results("history-export", {
+            "config": {key: value for key, value in vars(args).items() if key != "output"} | {"database": database_url.split(":", 1)[0]},
+            "results": results,
+            "server_memory": {"rss_peak_kb": common.read_peak_rss_kb(app_process.pid)},
+        }, args.output)
+        print(f"--- Results written to {output_path} ---")
+    finally:
+        common.stop_process(app_process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# benchmarks/bench_llm_governor.py
+"""
+Outbound LLM governor benchmark: drives planner calls (request_planner_completion, in process)
+against the mock OpenRouter server with a provider-side limit, once with the governor off and
+once with it on, and compares failed calls, provider 429s and latency per priority class.
+
+Workload: a batch backlog (`--batch-calls`, as app.reprocess would queue) is submitted at once;
+`--users` interactive users then each send `--calls-per-user` calls, `--user-concurrency` at a time.
+
+    python -m benchmarks.bench_llm_governor --provider-max-concurrent 8 --provider-requests-per-minute 600
+    python -m benchmarks.bench_llm_governor --modes on --batch-calls 0 --users 8 --provider-max-concurrent 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks import common
+from benchmarks.mock_openrouter import add_mock_arguments, mock_arguments_to_argv
+
+MODEL = "mock/planner-large"
+
+
+async def timed_call(prompts_module: Any, priority: str, user_id: int, results: List[Dict[str, Any]]) -> None:
+    from app.core.llm_governor import llm_priority
+    from app.core.llm_usage import llm_usage_user
+
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        with llm_usage_user(user_id), llm_priority(priority):
+            await prompts_module.request_planner_completion("Plan a small app.", MODEL, 256, stage="bench")
+    except httpx.HTTPStatusError as e:
+        outcome = f"http_{e.response.status_code}"
+    except Exception as e:
+        outcome = type(e).__name__
+    results.append({"priority": priority, "outcome": outcome, "latency_ms": (time.perf_counter() - started) * 1000})
+
+
+async def run_workload(args: argparse.Namespace, governor_on: bool, mock_url: str) -> Dict[str, Any]:
+    from app.api.api_v1.endpoints import prompts
+    from app.core.config import settings
+    from app.core.llm_governor import LLMGovernor
+
+    # A fresh governor per run, so limits learned in one run do not carry over
+    prompts.llm_governor = LLMGovernor(
+        default_concurrency=settings.LLM_MAX_CONCURRENT_PER_MODEL,
+        default_requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE_PER_MODEL,
+        model_limits=settings.parsed_llm_model_limits,
+        priority_weights=settings.parsed_llm_priority_weights,
+        max_rate_limit_retries=settings.LLM_RATE_LIMIT_RETRIES,
+        enabled=governor_on,
+    )
+    async with httpx.AsyncClient() as client:
+        errors_before = (await client.get(f"{mock_url}/health")).json()["requests"]["provider_limited"]
+    results: List[Dict[str, Any]] = []
+
+    async def interactive_user(user_id: int) -> None:
+        semaphore = asyncio.Semaphore(args.user_concurrency)
+
+        async def one_call() -> None:
+            async with semaphore:
+                await timed_call(prompts, "interactive", user_id, results)
+        await asyncio.gather(*(one_call() for _ in range(args.calls_per_user)))
+
+    started = time.perf_counter()
+    batch = [asyncio.create_task(timed_call(prompts, "batch", 0, results)) for _ in range(args.batch_calls)]
+    await asyncio.sleep(args.interactive_delay)
+    await asyncio.gather(*(interactive_user(user_id) for user_id in range(1, args.users + 1)))
+    interactive_seconds = time.perf_counter() - started
+    await asyncio.gather(*batch)
+    total_seconds = time.perf_counter() - started
+    async with httpx.AsyncClient() as client:
+        provider_429s = (await client.get(f"{mock_url}/health")).json()["requests"]["provider_limited"] - errors_before
+
+    summary: Dict[str, Any] = {"total_seconds": round(total_seconds, 3), "interactive_done_seconds": round(interactive_seconds, 3), "provider_429s": provider_429s}
+    for priority in ("interactive", "batch"):
+        calls = [r for r in results if r["priority"] == priority]
+        outcomes: Dict[str, int] = {}
+        for call in calls:
+            outcomes[call["outcome"]] = outcomes.get(call["outcome"], 0) + 1
+        summary[priority] = {"calls": len(calls), "outcomes": outcomes, "latency_ms": common.latency_summary([c["latency_ms"] for c in calls if c["outcome"] == "ok"])}
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Failed calls and per-class latency with and without the outbound LLM governor.")
+    parser.add_argument("--modes", default="off,on", help="Comma-separated governor modes to run, in order.")
+    parser.add_argument("--batch-calls", type=int, default=120)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--calls-per-user", type=int, default=10)
+    parser.add_argument("--user-concurrency", type=int, default=4)
+    parser.add_argument("--interactive-delay", type=float, default=0.5, help="Seconds between queuing the batch backlog and starting the users.")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="Extra Settings overrides, e.g. LLM_MAX_CONCURRENT_PER_MODEL=8.")
+    parser.add_argument("--output", default=None)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="voidcoder-governor-bench-")
+    mock_port = common.free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    env = common.benchmark_app_env(f"sqlite:///{os.path.join(temp_dir, 'bench.db')}", mock_url, {"LLM_CALL_LOG_ENABLED": "false"})
+    env.update(item.split("=", 1) for item in args.app_env)
+    os.environ.update(env) # Before the app modules read their Settings
+
+    mock_process = common.start_mock_openrouter(mock_port, mock_arguments_to_argv(args))
+    runs: Dict[str, Any] = {}
+    try:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            print(f"--- Governor {mode}: {args.batch_calls} batch calls, {args.users} users x {args.calls_per_user} interactive calls ---")
+            runs[mode] = asyncio.run(run_workload(args, mode == "on", mock_url))
+            summary = runs[mode]
+            for priority in ("interactive", "batch"):
+                print(f"    {priority:<12} outcomes {summary[priority]['outcomes']}  p50 {summary[priority]['latency_ms']['p50_ms'] or 0:.0f} ms  p95 {summary[priority]['latency_ms']['p95_ms'] or 0:.0f} ms")
+            print(f"    provider 429s {summary['provider_429s']}, interactive done after {summary['interactive_done_seconds']}s, all done after {summary['total_seconds']}s")
+        output_path = common.write_results("llm-governor", {"config": {key: value for key, value in vars(args).items() if key != "output"}, "runs": runs}, args.output)
+        print(f"--- Results written to {output_path} ---")
+    finally:
+        common.stop_process(mock_process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# benchmarks/bench_reprocess.py
+"""
+Batch reprocessing benchmark: seeds sessions with stored analyses, then runs
+`python -m app.reprocess` against them (mock OpenRouter for --mode replan) in two parts: a first
+run stopped after --first-run-sessions, a resumed run from its checkpoint, and --retry-failed runs
+while sessions fail. Records throughput and checks that every session got exactly one new prompt version.
+
+    python -m benchmarks.bench_reprocess --sessions 200 --mode replan --concurrency 8 --latency-ms 800
+    python -m benchmarks.bench_reprocess --sessions 2000 --mode render
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks import common
+from benchmarks.mock_openrouter import add_mock_arguments, canned_rich_analysis, mock_arguments_to_argv
+
+SEED_BATCH_SIZE = 500
+
+
+def seed_sessions(session_count: int, pages_per_session: int, nodes_per_page: int) -> None:
+    """Bulk-inserts sessions whose version-1 prompt has the layout the API produces (pages, then the plan)."""
+    from sqlalchemy import insert, select
+
+    from app.db.session import SessionLocal
+    from app.models.prompt_session import GeneratedPrompt, ImageEntry, PromptSession, User
+
+    analysis = canned_rich_analysis(nodes_per_page)
+    prompt_text = "Old requirements.\n\n<project_summary_title>\nBenchmark\n</project_summary_title>\n\n<image_analysis>\n</image_analysis>\n\n<development_planning>\n1. Project Structure: seeded plan.\n</development_planning>"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db = SessionLocal()
+    try:
+        owner_id = db.execute(select(User.id).where(User.email == "benchmark@example.com")).scalar_one()
+        for start in range(0, session_count, SEED_BATCH_SIZE):
+            count = min(SEED_BATCH_SIZE, session_count - start)
+            session_ids = db.execute(
+                insert(PromptSession).returning(PromptSession.id),
+                [{"session_name": f"Reprocess session {start + i}", "image_filename": "page-0.png", "owner_id": owner_id, "created_at": now, "updated_at": now} for i in range(count)],
+            ).scalars().all()
+            db.execute(insert(ImageEntry), [
+                {"title": f"Page {page}", "original_filename": f"page-{page}.png", "analysis_output_json": analysis, "order_in_session": page, "prompt_session_id": session_id, "created_at": now}
+                for session_id in session_ids for page in range(pages_per_session)
+            ])
+            db.execute(insert(GeneratedPrompt), [
+                {"prompt_type": "ultra_detailed_multi_page_app_with_ai_planning", "prompt_text": prompt_text, "order_in_session": 0, "version": 1, "session_id": session_id, "created_at": now}
+                for session_id in session_ids
+            ])
+            db.commit()
+    finally:
+        db.close()
+
+
+def prompt_version_counts() -> Dict[int, int]:
+    """{latest prompt version: number of sessions}."""
+    from sqlalchemy import func, select
+
+    from app.db.session import SessionLocal
+    from app.models.prompt_session import GeneratedPrompt
+
+    db = SessionLocal()
+    try:
+        latest = select(GeneratedPrompt.session_id, func.max(GeneratedPrompt.version).label("version")).group_by(GeneratedPrompt.session_id).subquery()
+        return {version: count for version, count in db.execute(select(latest.c.version, func.count()).group_by(latest.c.version))}
+    finally:
+        db.close()
+
+
+def run_cli(env: Dict[str, str], cli_args: List[str]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-m", "app.reprocess", *cli_args], cwd=common.REPO_ROOT, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    output_lines = [line for line in completed.stdout.splitlines() if line.strip()]
+    print("\n".join(line for line in output_lines if line.startswith(("    ", "--- Reprocessing", "--- Resuming", "--- Retrying", "--- Session"))))
+    if completed.returncode not in (0, 1):
+        print(completed.stderr[-4000:])
+        raise RuntimeError(f"app.reprocess exited with {completed.returncode}")
+    return {"exit_code": completed.returncode, "seconds": round(seconds, 3), "summary": output_lines[-1] if output_lines else None}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput and resume check for the batch reprocessing CLI.")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--pages-per-session", type=int, default=2)
+    parser.add_argument("--nodes-per-page", type=int, default=20)
+    parser.add_argument("--mode", choices=("render", "replan"), default="replan")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sessions-per-minute", type=float, default=0)
+    parser.add_argument("--first-run-sessions", type=int, default=None, help="Sessions in the first (interrupted) run; default half.")
+    parser.add_argument("--max-retry-runs", type=int, default=3, help="--retry-failed runs while sessions keep failing (e.g. with --error-rate).")
+    parser.add_argument("--output", default=None)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="voidcoder-reprocess-bench-")
+    database_url = f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    checkpoint_path = os.path.join(temp_dir, "checkpoint.json")
+    mock_port = common.free_port()
+    # A changed requirements text, so that every session's prompt differs from the stored one
+    env = common.benchmark_app_env(database_url, f"http://127.0.0.1:{mock_port}", {"OVERALL_PROJECT_REQUIREMENTS": "Reprocessing benchmark requirements."})
+    os.environ.update({key: env[key] for key in ("DATABASE_URL", "SECRET_KEY")})
+    common.seed_benchmark_user()
+    print(f"--- Seeding {args.sessions} sessions ---")
+    seed_sessions(args.sessions, args.pages_per_session, args.nodes_per_page)
+
+    cli_args = ["--mode", args.mode, "--concurrency", str(args.concurrency), "--checkpoint", checkpoint_path, "--progress-interval", "5"]
+    if args.sessions_per_minute:
+        cli_args += ["--sessions-per-minute", str(args.sessions_per_minute)]
+    first_run_sessions = args.first_run_sessions if args.first_run_sessions is not None else args.sessions // 2
+    mock_process = None
+    try:
+        if args.mode == "replan":
+            mock_process = common.start_mock_openrouter(mock_port, mock_arguments_to_argv(args))
+        print(f"--- First run: {first_run_sessions} sessions ---")
+        first_run = run_cli(env, cli_args + ["--limit", str(first_run_sessions)])
+        print("--- Resumed run ---")
+        resumed_run = run_cli(env, cli_args)
+        retry_runs = []
+        while (retry_runs[-1] if retry_runs else resumed_run)["exit_code"] == 1 and len(retry_runs) < args.max_retry_runs:
+            print("--- Retrying failed sessions ---")
+            retry_runs.append(run_cli(env, cli_args + ["--retry-failed"]))
+        version_counts = prompt_version_counts()
+        print(f"--- Latest prompt version per session: {version_counts} ---")
+        total_seconds = first_run["seconds"] + resumed_run["seconds"] + sum(run["seconds"] for run in retry_runs)
+        output_path = common.write_results(f"reprocess-{args.mode}", {
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "first_run": first_run,
+            "resumed_run": resumed_run,
+            "retry_runs": retry_runs,
+            "sessions_per_second": round(args.sessions / total_seconds, 2) if total_seconds else None,
+            "latest_version_counts": version_counts,
+            "every_session_reprocessed_once": version_counts == {2: args.sessions},
+        }, args.output)
+        print(f"--- Results written to {output_path} ---")
+    finally:
+        common.stop_process(mock_process)
+
+
+if __name__ == "__main__":
+    main()
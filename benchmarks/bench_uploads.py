@@ -0,0 +1,112 @@
+# benchmarks/bench_uploads.py
+"""
+Upload memory benchmark: posts multi-image /analyze-image submissions of large, incompressible
+screenshots to a uvicorn subprocess (mock OpenRouter behind it) and records the server's RSS
+before the run, the highest sampled RSS and the process peak (VmHWM, Linux only).
+
+    python -m benchmarks.bench_uploads --images-per-request 20 --concurrency 2
+    python -m benchmarks.bench_uploads --app-env IMAGE_MEMORY_BUDGET_BYTES=67108864 --label tight-budget
+"""
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks import common
+from benchmarks.mock_openrouter import add_mock_arguments, mock_arguments_to_argv
+from benchmarks.run_load_test import MemorySampler
+
+
+def make_noise_png(width: int, height: int, seed: int) -> bytes:
+    """A PNG that barely compresses, so the upload is close to width * height * 3 bytes."""
+    import random
+
+    from PIL import Image
+
+    img = Image.frombytes("RGB", (width, height), random.Random(seed).randbytes(width * height * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+async def post_submissions(base_url: str, token: str, images: List[bytes], requests: int, concurrency: int, timeout_seconds: float) -> Dict[str, Any]:
+    status_counts: Dict[str, int] = {}
+    latencies_ms: List[float] = []
+    next_index = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for request_index in next_index:
+            files = [("image_files", (f"page_{i}.png", image_bytes, "image/png")) for i, image_bytes in enumerate(images)]
+            data = {"session_name": f"Upload benchmark {request_index}", "image_titles": [f"Page {i}" for i in range(len(images))]}
+            started = time.perf_counter()
+            try:
+                response = await client.post("/api/v1/prompts/analyze-image", headers={"Authorization": f"Bearer {token}"}, files=files, data=data)
+                status_key = str(response.status_code)
+            except httpx.HTTPError as e:
+                status_key = type(e).__name__
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+            status_counts[status_key] = status_counts.get(status_key, 0) + 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_seconds) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return {"status_counts": status_counts, "latency": common.latency_summary(latencies_ms)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Server memory while receiving large multi-image submissions.")
+    parser.add_argument("--images-per-request", type=int, default=20)
+    parser.add_argument("--image-width", type=int, default=1920)
+    parser.add_argument("--image-height", type=int, default=1080)
+    parser.add_argument("--requests", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--request-timeout", type=float, default=600.0)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="Extra Settings overrides for the API process.")
+    parser.add_argument("--label", default="uploads", help="Used in the results file name.")
+    parser.add_argument("--output", default=None)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    images = [make_noise_png(args.image_width, args.image_height, seed) for seed in range(args.images_per_request)]
+    upload_mib = sum(len(image) for image in images) / (1024 * 1024)
+    print(f"--- {len(images)} images per request, {upload_mib:.1f} MiB per request ---")
+
+    temp_dir = tempfile.mkdtemp(prefix="voidcoder-bench-")
+    database_url = f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    mock_port, app_port = common.free_port(), common.free_port()
+    mock_base_url = f"http://127.0.0.1:{mock_port}"
+    # Admission control would otherwise reject most of these large submissions with 429
+    extra_env = {"ADMISSION_IMAGE_BURST_PER_USER": "100000", "ADMISSION_IMAGES_PER_MINUTE_PER_USER": "100000"}
+    extra_env.update(item.split("=", 1) for item in args.app_env)
+    app_env = common.benchmark_app_env(database_url, mock_base_url, extra_env)
+    os.environ.update({key: app_env[key] for key in ("DATABASE_URL", "SECRET_KEY")})
+    token = common.seed_benchmark_user()
+
+    mock_process = app_process = None
+    try:
+        mock_process = common.start_mock_openrouter(mock_port, mock_arguments_to_argv(args))
+        app_process = common.start_app_server(app_port, app_env)
+        rss_before_kb = common.read_tree_rss_kb(app_process.pid)
+        with MemorySampler(app_process.pid, interval_seconds=0.05) as sampler:
+            run = asyncio.run(post_submissions(f"http://127.0.0.1:{app_port}", token, images, args.requests, args.concurrency, args.request_timeout))
+        memory = sampler.summary() | {"rss_before_kb": rss_before_kb}
+        print(f"    statuses {run['status_counts']}, latency p50 {run['latency']['p50_ms']} ms")
+        print(f"    server RSS: before {rss_before_kb / 1024:.0f} MiB, max sampled {(memory['rss_max_sampled_kb'] or 0) / 1024:.0f} MiB, peak {(memory['rss_peak_kb'] or 0) / 1024:.0f} MiB")
+        output_path = common.write_results(args.label, {
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "upload_bytes_per_request": sum(len(image) for image in images),
+            "run": run,
+            "server_memory": memory,
+        }, args.output)
+        print(f"--- Results written to {output_path} ---")
+    finally:
+        common.stop_process(app_process)
+        common.stop_process(mock_process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# benchmarks/common.py
+"""
+Shared helpers for the benchmark scripts: starting the mock OpenRouter server and the API
+in subprocesses, seeding a benchmark user, sampling process memory and writing results.
+"""
+import datetime
+import io
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout_seconds: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    last_error: Optional[Exception] = None
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError as e:
+            last_error = e
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready: {last_error}")
+
+
+def benchmark_app_env(database_url: str, mock_base_url: str, extra_env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Environment for running the API against a local database and the mock OpenRouter server."""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "SECRET_KEY": env.get("SECRET_KEY", "benchmark-secret-key"),
+        "ACTIVE_AI_PROVIDER": "OPENROUTER",
+        "OPENROUTER_API_KEY": "mock-key",
+        "OPENROUTER_BASE_URL": mock_base_url,
+        "OPENROUTER_MODEL_IDENTIFIER": "mock/vision-large",
+        "OPENROUTER_PLANNER_MODEL_IDENTIFIER": "mock/planner-large",
+        "TRACE_LOG_JSON": "false",
+        "PYTHONPATH": REPO_ROOT,
+    })
+    if "BLOB_STORE_DIR" not in env: # Stored originals go to a scratch directory, not the repo's blob_store/
+        env["BLOB_STORE_DIR"] = tempfile.mkdtemp(prefix="voidcoder-blobs-")
+    env.update(extra_env or {})
+    return env
+
+
+def start_mock_openrouter(port: int, mock_args: List[str]) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_openrouter", "--port", str(port), *mock_args],
+        cwd=REPO_ROOT,
+        env={**os.environ, "PYTHONPATH": REPO_ROOT},
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/health")
+    return process
+
+
+def start_app_server(port: int, env: Dict[str, str], workers: int = 1) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/")
+    return process
+
+
+def stop_process(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def seed_benchmark_user(email: str = "benchmark@example.com") -> str:
+    """
+    Creates (or reuses) the benchmark user and returns a bearer token for it.
+    Must be called with DATABASE_URL / SECRET_KEY already set in os.environ.
+    """
+    from app.core.security import create_access_token
+    from app.crud.crud_user import user as crud_user
+    from app.db.session import SessionLocal
+    from app.models import prompt_session
+    from app.db.session import engine
+    from app.schemas.user import UserCreate
+
+    prompt_session.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db_user = crud_user.get_by_email(db, email=email)
+        if db_user is None:
+            db_user = crud_user.create(db, obj_in=UserCreate(email=email, display_name="Benchmark User", oauth_provider="benchmark", oauth_id=email))
+        return create_access_token(subject_id=db_user.id, user_email=db_user.email, user_given_name="Benchmark", expires_delta=datetime.timedelta(days=1))
+    finally:
+        db.close()
+
+
+def make_test_png(width: int = 1280, height: int = 800, seed: int = 0) -> bytes:
+    """A synthetic screenshot-like PNG: a header bar plus a grid of coloured cards."""
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, width, 64], fill=(30, 41, 59))
+    card_width, card_height = 280, 180
+    for row, y in enumerate(range(96, height - card_height, card_height + 24)):
+        for col, x in enumerate(range(32, width - card_width, card_width + 24)):
+            shade = (seed * 37 + row * 53 + col * 97) % 200
+            draw.rectangle([x, y, x + card_width, y + card_height], fill=(255, 255, 255), outline=(shade, 120, 200))
+            draw.rectangle([x + 16, y + 16, x + card_width - 16, y + 96], fill=(shade, 180, 220))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    """Current resident set size of a process in KiB (Linux /proc only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def process_tree_pids(pid: int) -> List[int]:
+    """`pid` and all its descendants (Linux /proc only), e.g. the uvicorn master and its --workers processes."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        parent_pid = int(stat.rsplit(")", 1)[1].split()[1]) # "pid (comm) state ppid ..."; comm may contain spaces
+        children.setdefault(parent_pid, []).append(int(entry))
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(children.get(current, []))
+    return pids
+
+
+def read_tree_rss_kb(pid: int) -> Optional[int]:
+    """Summed RSS of a process and its descendants in KiB (Linux /proc only)."""
+    rss_values = [rss_kb for tree_pid in process_tree_pids(pid) if (rss_kb := read_rss_kb(tree_pid)) is not None]
+    return sum(rss_values) if rss_values else None
+
+
+def read_peak_rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, Optional[float]]:
+    ordered = sorted(latencies_ms)
+    return {
+        "p50_ms": percentile(ordered, 50),
+        "p95_ms": percentile(ordered, 95),
+        "p99_ms": percentile(ordered, 99),
+        "max_ms": ordered[-1] if ordered else None,
+        "mean_ms": (sum(ordered) / len(ordered)) if ordered else None,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name: str, results: Dict[str, Any], output_path: Optional[str] = None) -> str:
+    if output_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output_path = os.path.join(RESULTS_DIR, f"{timestamp}-{name}.json")
+    results = {"benchmark": name, "git_revision": git_revision(), "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), **results}
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return output_path
@@ -0,0 +1,36 @@
+# benchmarks/compare_results.py
+"""
+Compares two benchmark result files written by the benchmark scripts.
+
+    python -m benchmarks.compare_results benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+from typing import Any, Dict, Iterator, Tuple
+
+
+def flatten_numbers(data: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from flatten_numbers(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, float(data)
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> None:
+    before_numbers = dict(flatten_numbers({k: v for k, v in before.items() if k != "config"}))
+    after_numbers = dict(flatten_numbers({k: v for k, v in after.items() if k != "config"}))
+    print(f"{'metric':<60} {'before':>14} {'after':>14} {'change':>9}")
+    for key in sorted(set(before_numbers) | set(after_numbers)):
+        old, new = before_numbers.get(key), after_numbers.get(key)
+        change = f"{(new - old) / old * 100:+.1f}%" if old not in (None, 0) and new is not None else ""
+        print(f"{key:<60} {'' if old is None else f'{old:.2f}':>14} {'' if new is None else f'{new:.2f}':>14} {change:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result JSON files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    with open(args.before) as f_before, open(args.after) as f_after:
+        compare(json.load(f_before), json.load(f_after))
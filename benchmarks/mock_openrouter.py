@@ -0,0 +1,337 @@
+# benchmarks/mock_openrouter.py
+"""
+A local stand-in for the OpenRouter chat-completions API.
+
+Vision requests (messages containing an `image_url` part) get a canned, schema-valid
+`RichImageAnalysisSchema` payload; everything else is treated as a planner request and gets a
+canned development plan. Latency, token streaming speed and error rates are configurable, so
+the benchmark harness can model both a healthy and a struggling provider. With
+--provider-max-concurrent / --provider-requests-per-minute it also enforces a provider-side limit
+like OpenRouter's: over-limit requests get 429 with `Retry-After`, and every response carries
+`x-ratelimit-limit-requests` / `-remaining-requests` / `-reset-requests` headers.
+
+Run standalone:
+    python -m benchmarks.mock_openrouter --port 8900 --latency-ms 800 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from app.schemas import RichImageAnalysisSchema
+
+mock_config: Dict[str, Any] = {
+    "latency_ms": 500.0,
+    "latency_jitter_ms": 100.0,
+    "tokens_per_second": 400.0,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "malformed_rate": 0.0,
+    "repetition_rate": 0.0,
+    "element_count": 40,
+    "small_model_speedup": 3.0,
+    "small_model_incomplete_rate": 0.0,
+    "provider_max_concurrent": 0,
+    "provider_requests_per_minute": 0.0,
+    "seed": None,
+}
+
+mock_app = FastAPI(title="Mock OpenRouter")
+request_counter = {"vision": 0, "planner": 0, "errors": 0, "provider_limited": 0}
+# Provider-side limits: requests in flight, and the start times of the last minute's requests
+provider_state: Dict[str, Any] = {"in_flight": 0, "recent_starts": deque()}
+# Leading text parts seen so far; a repeat counts as a prompt-cache hit in the usage block.
+seen_prompt_prefixes = set()
+
+
+def canned_element(index: int, depth: int, children_per_node: int, budget: List[int]) -> Dict[str, Any]:
+    budget[0] -= 1
+    node = {
+        "id": f"el_{index:05d}_{depth}",
+        "element_type": ["div", "section", "button", "img", "p", "a"][index % 6],
+        "semantic_guess": ["card", "hero", "cta", "thumbnail", "body copy", "link"][index % 6],
+        "text_content": f"Sample text content {index}",
+        "bounding_box": {"x": (index * 37) % 1200, "y": (index * 53) % 4000, "width": 240, "height": 120},
+        "style_hints": [{"property": "background-color", "value": "#ffffff"}, {"property": "border-radius", "value": "8px"}],
+        "interaction_notes": None,
+        "accessibility_notes": None,
+        "children": [],
+    }
+    if depth < 3:
+        for child in range(children_per_node):
+            if budget[0] <= 0:
+                break
+            node["children"].append(canned_element(index * children_per_node + child + 1, depth + 1, children_per_node, budget))
+    return node
+
+
+def canned_rich_analysis(element_count: int, page_index: int = 0) -> Dict[str, Any]:
+    """A schema-valid vision analysis with roughly `element_count` nodes in detected_elements_tree."""
+    budget = [element_count]
+    tree = []
+    root_index = 0
+    while budget[0] > 0:
+        tree.append(canned_element(root_index, 0, 3, budget))
+        root_index += 1
+    analysis = {
+        "image_metadata": {"original_filename": f"page_{page_index}.png", "image_dimensions": {"width": 1280, "height": 800}, "analysis_timestamp": None},
+        "overall_analysis": {
+            "page_title_guess": f"Mock Page {page_index}",
+            "page_purpose_and_audience": "Benchmark page for load testing.",
+            "dominant_theme": "Light theme with blue accents.",
+            "primary_layout_type": "Header with card grid.",
+            "general_description": "A synthetic dashboard with a header bar and a grid of cards.",
+            "key_takeaways": ["Card grid", "Top navigation"],
+        },
+        "navigation_elements": [{"id": "nav_1", "element_type": "top_header", "items": ["Home", "Projects", "Settings"], "style_hints": "dark background"}],
+        "layout_components": [{"id": "layout_1", "element_type": "grid", "description": "Three column card grid", "grid_details": "grid-cols-3 gap-6"}],
+        "content_sections": [{"id": "content_1", "element_type": "card_grid", "headline": "Recent projects", "text_elements": ["Project A", "Project B"], "image_elements": ["thumbnail"]}],
+        "interactive_controls": [{"id": "control_1", "element_type": "button", "label_or_text": "New project", "purpose": "Create a project"}],
+        "visual_style_guide": {
+            "primary_colors": [{"hex": "#1e293b", "name": "Slate 800", "usage_hint": "Header background"}],
+            "secondary_colors": [], "accent_colors": [], "neutral_colors": [],
+            "primary_font_family": "Inter, sans-serif", "secondary_font_family": None,
+            "heading_typography": [{"level": "h1", "font_size": "32px", "font_weight": "700"}],
+            "body_typography": {"font_size": "16px", "line_height": "24px"},
+            "spacing_density": "Normal", "component_spacing": "24px",
+            "corner_radius_style": "Slightly Rounded (4-8px)", "shadow_style": "Subtle box shadows", "iconography_style": "Outline icons",
+        },
+        "detected_elements_tree": tree,
+    }
+    RichImageAnalysisSchema.model_validate(analysis)  # Fail fast if the canned payload drifts from the schema
+    return analysis
+
+
+CANNED_PLAN = """1. Project Structure:
+src/app/layout.tsx, src/app/page.tsx, src/components/Header.tsx, src/components/ProjectCard.tsx
+2. Key Features: Project dashboard with card grid and top navigation.
+3. State Management: Local component state is sufficient.
+4. Routes: /, /projects, /settings
+5. Component Architecture: Layout wrapper, shared Header, feature cards.
+6. Responsive Breakpoints: grid-cols-1 md:grid-cols-2 lg:grid-cols-3.
+7. Data Fetching: Placeholder JSON data for projects.
+"""
+
+
+def is_vision_request(payload: Dict[str, Any]) -> bool:
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content if isinstance(part, dict)):
+            return True
+    return False
+
+
+def count_images(payload: Dict[str, Any]) -> int:
+    total = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            total += sum(1 for part in content if isinstance(part, dict) and part.get("type") == "image_url")
+    return total
+
+
+def cached_prefix_length(payload: Dict[str, Any]) -> int:
+    """Length of the first text part if an identical one was sent before (simulated prefix caching)."""
+    messages = payload.get("messages") or [{}]
+    content = messages[0].get("content")
+    first_text = content if isinstance(content, str) else next((part.get("text", "") for part in content or [] if part.get("type") == "text"), "")
+    if not first_text:
+        return 0
+    if first_text in seen_prompt_prefixes:
+        return len(first_text)
+    seen_prompt_prefixes.add(first_text)
+    return 0
+
+
+def usage_block(prompt_text_length: int, completion_text: str, cached_prefix_chars: int = 0) -> Dict[str, Any]:
+    prompt_tokens = max(1, prompt_text_length // 4)
+    completion_tokens = max(1, len(completion_text) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": min(prompt_tokens, cached_prefix_chars // 4)},
+    }
+
+
+async def simulated_latency(speedup: float = 1.0) -> None:
+    latency_ms = mock_config["latency_ms"] + random.uniform(-1, 1) * mock_config["latency_jitter_ms"]
+    await asyncio.sleep(max(0.0, latency_ms) / 1000.0 / speedup)
+
+
+@mock_app.get("/health")
+async def health():
+    return {"status": "ok", "requests": request_counter}
+
+
+def provider_limit_check() -> Tuple[Optional[float], Dict[str, str]]:
+    """Applies the --provider-* limits to a new request. Returns (Retry-After seconds if rejected, rate-limit headers)."""
+    now = time.monotonic()
+    recent_starts: Deque[float] = provider_state["recent_starts"]
+    while recent_starts and recent_starts[0] <= now - 60.0:
+        recent_starts.popleft()
+    retry_after = None
+    headers: Dict[str, str] = {}
+    requests_per_minute = mock_config["provider_requests_per_minute"]
+    if requests_per_minute > 0:
+        reset_seconds = recent_starts[0] + 60.0 - now if recent_starts else 0.0
+        if len(recent_starts) >= requests_per_minute:
+            retry_after = reset_seconds
+        remaining = int(requests_per_minute) - len(recent_starts) - (0 if retry_after is not None else 1)
+        headers = {"x-ratelimit-limit-requests": f"{requests_per_minute:g}", "x-ratelimit-remaining-requests": str(max(0, remaining)), "x-ratelimit-reset-requests": f"{reset_seconds:.3f}s"}
+    if retry_after is None and mock_config["provider_max_concurrent"] and provider_state["in_flight"] >= mock_config["provider_max_concurrent"]:
+        retry_after = 1.0
+    if retry_after is None:
+        recent_starts.append(now)
+        provider_state["in_flight"] += 1
+    return retry_after, headers
+
+
+def release_provider_slot() -> None:
+    provider_state["in_flight"] -= 1
+
+
+@mock_app.post("/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    retry_after, limit_headers = provider_limit_check()
+    if retry_after is not None:
+        request_counter["errors"] += 1
+        request_counter["provider_limited"] += 1
+        return JSONResponse(status_code=429, content={"error": {"message": "Provider rate limit exceeded (mock)"}}, headers={"Retry-After": str(max(1, math.ceil(retry_after))), **limit_headers})
+    try:
+        response = await completion_response(payload)
+    except BaseException:
+        release_provider_slot()
+        raise
+    if isinstance(response, StreamingResponse):
+        body_iterator = response.body_iterator
+
+        async def released_at_end():
+            try:
+                async for chunk in body_iterator:
+                    yield chunk
+            finally:
+                release_provider_slot()
+        response.body_iterator = released_at_end()
+    else:
+        release_provider_slot()
+    response.headers.update(limit_headers)
+    return response
+
+
+async def completion_response(payload: Dict[str, Any]) -> Response:
+    vision = is_vision_request(payload)
+    model = payload.get("model", "mock/unknown")
+    # Models with "small" in the name (e.g. mock/vision-small) answer faster and are sometimes sloppy
+    small_model = "small" in model
+    speedup = max(1.0, mock_config["small_model_speedup"]) if small_model else 1.0
+    tokens_per_second = mock_config["tokens_per_second"] * speedup
+    request_counter["vision" if vision else "planner"] += 1
+
+    roll = random.random()
+    if roll < mock_config["rate_limit_rate"]:
+        request_counter["errors"] += 1
+        return JSONResponse(status_code=429, content={"error": {"message": "Rate limit exceeded (mock)"}}, headers={"Retry-After": "1"})
+    if roll < mock_config["rate_limit_rate"] + mock_config["error_rate"]:
+        await simulated_latency()
+        request_counter["errors"] += 1
+        return JSONResponse(status_code=502, content={"error": {"message": "Upstream provider error (mock)"}})
+
+    if vision:
+        image_count = count_images(payload)
+        if image_count > 1:
+            pages = [canned_rich_analysis(mock_config["element_count"], page_index=i) for i in range(image_count)]
+            content = json.dumps({"pages": pages})
+        else:
+            analysis = canned_rich_analysis(mock_config["element_count"])
+            if small_model and random.random() < mock_config["small_model_incomplete_rate"]:
+                analysis["detected_elements_tree"] = []  # Incomplete answer that still validates
+            elif random.random() < mock_config["repetition_rate"]:
+                # Degenerate output: the model keeps emitting the same node with a counter in the id
+                loop_node = analysis["detected_elements_tree"][0]
+                analysis["detected_elements_tree"] = [dict(loop_node, id=f"el_loop_{i}", children=[]) for i in range(200)]
+            content = json.dumps(analysis)
+    else:
+        content = CANNED_PLAN
+    if random.random() < mock_config["malformed_rate"]:
+        content = content[: len(content) // 2]  # Truncated JSON, like a model that stopped early
+
+    prompt_text_length = len(json.dumps(payload.get("messages", [])))
+    cached_prefix_chars = cached_prefix_length(payload)
+    completion_id = f"gen-mock-{uuid.uuid4().hex[:12]}"
+
+    if payload.get("stream"):
+        async def event_stream():
+            await simulated_latency(speedup)
+            chunk_chars = 64
+            seconds_per_chunk = (chunk_chars / 4.0) / max(1.0, tokens_per_second)
+            for start in range(0, len(content), chunk_chars):
+                chunk = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {"content": content[start:start + chunk_chars]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(seconds_per_chunk)
+            final_chunk = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage_block(prompt_text_length, content, cached_prefix_chars)}
+            yield f"data: {json.dumps(final_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    await simulated_latency(speedup)
+    # Non-streaming responses still pay for generating every token.
+    await asyncio.sleep((len(content) / 4.0) / max(1.0, tokens_per_second))
+    return JSONResponse({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage_block(prompt_text_length, content, cached_prefix_chars),
+    })
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=mock_config["latency_ms"], help="Base latency before the first token.")
+    parser.add_argument("--latency-jitter-ms", type=float, default=mock_config["latency_jitter_ms"])
+    parser.add_argument("--tokens-per-second", type=float, default=mock_config["tokens_per_second"], help="Simulated generation speed.")
+    parser.add_argument("--error-rate", type=float, default=mock_config["error_rate"], help="Fraction of requests answered with HTTP 502.")
+    parser.add_argument("--rate-limit-rate", type=float, default=mock_config["rate_limit_rate"], help="Fraction of requests answered with HTTP 429.")
+    parser.add_argument("--malformed-rate", type=float, default=mock_config["malformed_rate"], help="Fraction of responses with truncated JSON content.")
+    parser.add_argument("--repetition-rate", type=float, default=mock_config["repetition_rate"], help="Fraction of vision responses stuck repeating one element.")
+    parser.add_argument("--element-count", type=int, default=mock_config["element_count"], help="Nodes in the canned detected_elements_tree.")
+    parser.add_argument("--small-model-speedup", type=float, default=mock_config["small_model_speedup"], help="Latency/generation speedup for models with 'small' in the name.")
+    parser.add_argument("--small-model-incomplete-rate", type=float, default=mock_config["small_model_incomplete_rate"], help="Fraction of small-model vision answers with an empty element tree.")
+    parser.add_argument("--provider-max-concurrent", type=int, default=mock_config["provider_max_concurrent"], help="Requests in flight beyond this get HTTP 429 (0 = no limit).")
+    parser.add_argument("--provider-requests-per-minute", type=float, default=mock_config["provider_requests_per_minute"], help="Sliding-window request limit answered with 429 + rate-limit headers (0 = no limit).")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def mock_arguments_to_argv(args: argparse.Namespace) -> List[str]:
+    """Turns parsed mock arguments back into argv, for starting the mock in a subprocess."""
+    argv = []
+    for name in ("latency_ms", "latency_jitter_ms", "tokens_per_second", "error_rate", "rate_limit_rate", "malformed_rate", "repetition_rate", "element_count", "small_model_speedup", "small_model_incomplete_rate", "provider_max_concurrent", "provider_requests_per_minute", "seed"):
+        value = getattr(args, name)
+        if value is not None:
+            argv += [f"--{name.replace('_', '-')}", str(value)]
+    return argv
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenRouter server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    for key in mock_config:
+        mock_config[key] = getattr(args, key)
+    if args.seed is not None:
+        random.seed(args.seed)
+    uvicorn.run(mock_app, host=args.host, port=args.port, log_level="warning")
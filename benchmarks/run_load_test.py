@@ -0,0 +1,175 @@
+# benchmarks/run_load_test.py
+"""
+Load test / benchmark harness.
+
+Starts the mock OpenRouter server and the API (uvicorn subprocess) against a local SQLite file
+or a local Postgres database, seeds a benchmark user, then drives the selected scenarios at the
+requested concurrency. Reports throughput, p50/p95/p99 latency, error counts and server memory,
+and stores everything as JSON under benchmarks/results/ so runs can be compared with
+`python -m benchmarks.compare_results`.
+
+Examples:
+    python -m benchmarks.run_load_test --scenarios analyze,history --concurrency 8 --requests 64
+    python -m benchmarks.run_load_test --database-url postgresql://postgres:pw@localhost/voidcoder_bench \\
+        --latency-ms 1500 --error-rate 0.05 --label slow-provider
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks import common
+from benchmarks.mock_openrouter import add_mock_arguments, mock_arguments_to_argv
+
+
+class MemorySampler:
+    """
+    Samples the RSS of a process and its descendants in a background thread while the benchmark
+    runs, so with uvicorn `--workers > 1` the workers are counted, not just the master.
+    """
+
+    def __init__(self, pid: int, interval_seconds: float = 0.25):
+        self.pid = pid
+        self.interval_seconds = interval_seconds
+        self.samples_kb: List[int] = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval_seconds):
+            rss_kb = common.read_tree_rss_kb(self.pid)
+            if rss_kb is not None:
+                self.samples_kb.append(rss_kb)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        self._thread.join()
+
+    def summary(self) -> Dict[str, Optional[int]]:
+        pids = common.process_tree_pids(self.pid)
+        peaks = [peak_kb for pid in pids if (peak_kb := common.read_peak_rss_kb(pid)) is not None]
+        return {
+            "processes": len(pids),
+            "rss_start_kb": self.samples_kb[0] if self.samples_kb else None,
+            "rss_end_kb": self.samples_kb[-1] if self.samples_kb else None,
+            "rss_max_sampled_kb": max(self.samples_kb) if self.samples_kb else None,
+            "rss_peak_kb": sum(peaks) if peaks else None, # Sum of per-process peaks: an upper bound with several workers
+        }
+
+
+def build_scenarios(args: argparse.Namespace, token: str) -> Dict[str, Callable[[httpx.AsyncClient, int], Any]]:
+    auth_headers = {"Authorization": f"Bearer {token}"}
+    test_images = [common.make_test_png(args.image_width, args.image_height, seed=i) for i in range(args.images_per_request)]
+
+    async def analyze(client: httpx.AsyncClient, request_index: int) -> httpx.Response:
+        files = [("image_files", (f"page_{i}.png", image_bytes, "image/png")) for i, image_bytes in enumerate(test_images)]
+        data = {"session_name": f"Benchmark session {request_index}", "image_titles": [f"Page {i}" for i in range(len(test_images))]}
+        return await client.post("/api/v1/prompts/analyze-image", headers=auth_headers, files=files, data=data)
+
+    async def history(client: httpx.AsyncClient, request_index: int) -> httpx.Response:
+        return await client.get("/api/v1/prompts/history", headers=auth_headers, params={"limit": args.history_limit})
+
+    async def auth_rejected(client: httpx.AsyncClient, request_index: int) -> httpx.Response:
+        # Measures the cost of the auth dependency on the rejection path.
+        return await client.get("/api/v1/prompts/history", headers={"Authorization": "Bearer invalid-token"})
+
+    return {"analyze": analyze, "history": history, "auth_rejected": auth_rejected}
+
+
+async def run_scenario(base_url: str, scenario: Callable, concurrency: int, total_requests: int, timeout_seconds: float) -> Dict[str, Any]:
+    latencies_ms: List[float] = []
+    status_counts: Dict[str, int] = {}
+    next_index = iter(range(total_requests))
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for request_index in next_index:
+            started = time.perf_counter()
+            try:
+                response = await scenario(client, request_index)
+                status_key = str(response.status_code)
+            except httpx.HTTPError as e:
+                status_key = type(e).__name__
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+            status_counts[status_key] = status_counts.get(status_key, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_seconds, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall_seconds = time.perf_counter() - started
+
+    return {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(total_requests / wall_seconds, 3) if wall_seconds else None,
+        "status_counts": status_counts,
+        "latency": common.latency_summary(latencies_ms),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="VoidCoder API load test against a mock OpenRouter server.")
+    parser.add_argument("--database-url", default=None, help="Defaults to a fresh SQLite file in a temp directory.")
+    parser.add_argument("--scenarios", default="analyze,history,auth_rejected")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=32, help="Requests per scenario.")
+    parser.add_argument("--images-per-request", type=int, default=3)
+    parser.add_argument("--image-width", type=int, default=1280)
+    parser.add_argument("--image-height", type=int, default=800)
+    parser.add_argument("--history-limit", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the API.")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="Extra Settings overrides for the API process.")
+    parser.add_argument("--label", default="load-test", help="Used in the results file name.")
+    parser.add_argument("--output", default=None, help="Explicit results file path.")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="voidcoder-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    mock_port, app_port = common.free_port(), common.free_port()
+    mock_base_url = f"http://127.0.0.1:{mock_port}"
+    extra_env = dict(item.split("=", 1) for item in args.app_env)
+    app_env = common.benchmark_app_env(database_url, mock_base_url, extra_env)
+
+    # The harness seeds the user through the app's own CRUD layer, so it needs the same settings.
+    os.environ.update({key: app_env[key] for key in ("DATABASE_URL", "SECRET_KEY")})
+    token = common.seed_benchmark_user()
+
+    mock_process = app_process = None
+    try:
+        mock_process = common.start_mock_openrouter(mock_port, mock_arguments_to_argv(args))
+        app_process = common.start_app_server(app_port, app_env, workers=args.workers)
+        scenarios = build_scenarios(args, token)
+        results: Dict[str, Any] = {}
+        with MemorySampler(app_process.pid) as sampler:
+            for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+                if name not in scenarios:
+                    raise SystemExit(f"Unknown scenario '{name}'. Available: {', '.join(scenarios)}")
+                print(f"--- Running scenario '{name}' ({args.requests} requests, concurrency {args.concurrency}) ---")
+                results[name] = asyncio.run(run_scenario(f"http://127.0.0.1:{app_port}", scenarios[name], args.concurrency, args.requests, args.request_timeout))
+                print(f"    {results[name]['throughput_rps']} req/s, latency {results[name]['latency']}, statuses {results[name]['status_counts']}")
+        output_path = common.write_results(args.label, {
+            "config": {key: value for key, value in vars(args).items() if key != "output"} | {"database": database_url.split(":", 1)[0]},
+            "scenarios": results,
+            "server_memory": sampler.summary(),
+            "mock_requests": httpx.get(f"{mock_base_url}/health").json().get("requests"),
+        }, args.output)
+        print(f"--- Results written to {output_path} ---")
+    finally:
+        common.stop_process(app_process)
+        common.stop_process(mock_process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import datetime
+import io
+import os
+import tempfile
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+# app.core.config requires these. The database is a throwaway SQLite file (an in-memory one would
+# be a different database in each thread); app.main creates the tables on import.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='voidcoder-tests-')}/test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+
+@pytest.fixture(scope="session")
+def api_app():
+    from app.main import app
+    return app
+
+
+@pytest.fixture
+def db(api_app): # Importing the app creates the tables
+    from app.db.session import SessionLocal
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def user(db):
+    from app.crud.crud_user import user as crud_user
+    from app.schemas.user import UserCreate
+    email = f"user-{uuid.uuid4().hex[:8]}@example.com"
+    return crud_user.create(db, obj_in=UserCreate(email=email, display_name="Test User", oauth_provider="test", oauth_id=email))
+
+
+@pytest.fixture
+def auth_headers(user):
+    from app.core.security import create_access_token
+    token = create_access_token(subject_id=user.id, user_email=user.email, user_given_name="Test", expires_delta=datetime.timedelta(hours=1))
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def client(api_app, auth_headers):
+    from fastapi.testclient import TestClient
+    with TestClient(api_app, headers=auth_headers) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """
+    Replaces the vision stage and the planner with canned results. `calls.vision` / `calls.planner`
+    record the page titles each one saw; `calls.planner_hook(call_number)` (async) runs before the
+    planner answers.
+    """
+    from app.api.api_v1.endpoints import prompts
+    from app.schemas.prompt import GeneratedPromptData, OverallAnalysis, RichImageAnalysisSchema
+
+    calls = SimpleNamespace(vision=[], planner=[], planner_hook=None)
+
+    async def analyze_uploaded_images(uploads, results=None):
+        if results is None: results = []
+        results[:] = [None] * len(uploads)
+        for index, (upload, title, _) in enumerate(uploads):
+            calls.vision.append(title)
+            analysis = RichImageAnalysisSchema(overall_analysis=OverallAnalysis(page_title_guess=f"{title} page"))
+            db_entry = {"title": title, "original_filename": upload.filename, "analysis_output_json": prompts.dump_analysis_for_storage(analysis)}
+            results[index] = (db_entry, {"title": title, "analysis_output": analysis, "element_columns": None, "error": None})
+        return results
+
+    async def generate_final_consolidated_prompt_with_planner(page_inputs, session_name, development_plan=None):
+        titles = [page_input["title"] for page_input in page_inputs]
+        calls.planner.append(titles)
+        if calls.planner_hook is not None:
+            await calls.planner_hook(len(calls.planner))
+        return [GeneratedPromptData(prompt_type="ultra_detailed", prompt_text="Build: " + ", ".join(titles))]
+
+    monkeypatch.setattr(prompts, "analyze_uploaded_images", analyze_uploaded_images)
+    monkeypatch.setattr(prompts, "generate_final_consolidated_prompt_with_planner", generate_final_consolidated_prompt_with_planner)
+    return calls
+
+
+def png_upload(name: str, seed: int = 0):
+    """A (filename, bytes, content type) multipart file with a small PNG."""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 24), (seed * 40 % 256, 80, 160)).save(buffer, format="PNG")
+    return (name, buffer.getvalue(), "image/png")
@@ -0,0 +1,185 @@
+import asyncio
+import math
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import admission
+from app.core.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", fake)
+    return fake
+
+
+def _controller(**overrides) -> AdmissionController:
+    options = dict(units_per_minute=600, burst=10, per_user_concurrency=2, global_concurrency=2, max_queue_depth=4, max_queue_wait_seconds=5.0)
+    options.update(overrides)
+    return AdmissionController("test", **options)
+
+
+def test_token_bucket_refill_and_wait(clock):
+    bucket = TokenBucket(capacity=4, refill_per_second=2)
+    assert bucket.try_take(3) == 0
+    assert bucket.try_take(3) == pytest.approx(1.0) # 1 token left, 2 more take a second
+    assert bucket.tokens == pytest.approx(1) # Nothing is taken on a miss
+
+    clock.now += 0.5
+    assert bucket.try_take(2) == 0
+    assert bucket.tokens == pytest.approx(0)
+
+    clock.now += 60
+    assert bucket.is_full() and bucket.tokens == 4 # Refill stops at the capacity
+    bucket.refund(3)
+    assert bucket.tokens == 4
+
+
+def test_token_bucket_without_refill_never_recovers(clock):
+    bucket = TokenBucket(capacity=1, refill_per_second=0)
+    assert bucket.try_take(1) == 0
+    assert bucket.try_take(1) == math.inf
+
+
+def test_rate_limit_rejects_with_retry_after(clock):
+    async def scenario():
+        controller = _controller(units_per_minute=60, burst=3)
+        async with controller.admit("a", cost=3):
+            pass
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit("a", cost=2):
+                pass
+        assert excinfo.value.reason == "rate_limited"
+        assert excinfo.value.status_code == 429
+        assert excinfo.value.headers == {"Retry-After": "2"}
+        async with controller.admit("b", cost=3): # Buckets are per user
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_cost_above_the_burst_is_a_bad_request():
+    async def scenario():
+        with pytest.raises(HTTPException) as excinfo:
+            async with _controller(burst=3).admit("a", cost=4):
+                pass
+        assert excinfo.value.status_code == 400
+
+    asyncio.run(scenario())
+
+
+async def _enter(controller, user_id, order, name, release: asyncio.Event, cost=1):
+    async with controller.admit(user_id, cost=cost):
+        order.append(name)
+        await release.wait()
+
+
+def test_queued_requests_start_in_order_as_slots_free_up():
+    async def scenario():
+        controller = _controller(global_concurrency=1)
+        order, release = [], asyncio.Event()
+        tasks = []
+        for name in ("first", "second", "third"):
+            tasks.append(asyncio.create_task(_enter(controller, name, order, name, release)))
+            await asyncio.sleep(0)
+        assert order == ["first"] and len(controller._queue) == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == ["first", "second", "third"]
+        assert controller._active_total == 0 and not controller._active_by_user
+
+    asyncio.run(scenario())
+
+
+def test_user_at_their_own_cap_does_not_block_others():
+    async def scenario():
+        controller = _controller(per_user_concurrency=1, global_concurrency=2)
+        order, release = [], asyncio.Event()
+        first = asyncio.create_task(_enter(controller, "a", order, "a1", release))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(_enter(controller, "a", order, "a2", release))
+        await asyncio.sleep(0)
+        other = asyncio.create_task(_enter(controller, "b", order, "b1", release))
+        await asyncio.sleep(0.01) # Woken waiters resume through wait_for + shield
+        assert order == ["a1", "b1"] # a2 waits for a1, not b1 for a2
+
+        release.set()
+        await asyncio.gather(first, second, other)
+        assert order == ["a1", "b1", "a2"]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_and_refunds_tokens():
+    async def scenario():
+        controller = _controller(global_concurrency=1, max_queue_depth=1)
+        order, release = [], asyncio.Event()
+        active = asyncio.create_task(_enter(controller, "a", order, "active", release))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(_enter(controller, "b", order, "queued", release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit("c", cost=4):
+                pass
+        assert excinfo.value.reason == "queue_full"
+        assert int(excinfo.value.headers["Retry-After"]) >= 1
+        assert controller._buckets["c"].tokens == pytest.approx(10, abs=0.1)
+
+        release.set()
+        await asyncio.gather(active, queued)
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_past_the_limit_is_rejected():
+    async def scenario():
+        controller = _controller(global_concurrency=1, max_queue_wait_seconds=0.05)
+        order, release = [], asyncio.Event()
+        active = asyncio.create_task(_enter(controller, "a", order, "active", release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit("b", cost=2):
+                pass
+        assert excinfo.value.reason == "queue_timeout"
+        assert not controller._queue
+        assert controller._buckets["b"].tokens == pytest.approx(10, abs=0.1)
+
+        release.set()
+        await active
+        assert controller._active_total == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = _controller(global_concurrency=1)
+        order, release = [], asyncio.Event()
+        active = asyncio.create_task(_enter(controller, "a", order, "active", release))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(_enter(controller, "b", order, "waiting", release))
+        await asyncio.sleep(0)
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not controller._queue
+
+        release.set()
+        await active
+        assert order == ["active"] and controller._active_total == 0
+
+    asyncio.run(scenario())
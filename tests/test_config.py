@@ -0,0 +1,17 @@
+from app.core.config import Settings
+
+
+def test_per_model_csvs_are_parsed_once():
+    settings = Settings(VISION_BATCH_SIZES_BY_MODEL_CSV="vision/a=3, vision/b=x,=4", VISION_BATCH_SIZE_DEFAULT=2, ADMIN_EMAILS_CSV=" Admin@Example.com ,")
+
+    assert settings.vision_batch_size_for_model("vision/a") == 3
+    assert settings.vision_batch_size_for_model("vision/b") == 2 # Invalid sizes fall back to the default
+    assert settings.vision_batch_size_for_model(None) == 2
+    assert settings.parsed_admin_emails == ["admin@example.com"]
+    assert settings.parsed_vision_batch_sizes is settings.parsed_vision_batch_sizes
+    assert settings.parsed_llm_model_limits is settings.parsed_llm_model_limits
+
+
+def test_parsed_views_are_not_settings_fields():
+    assert not {name for name in Settings.model_fields if name.startswith("parsed_")}
+    assert "parsed_admin_emails" not in Settings().model_dump()
@@ -0,0 +1,102 @@
+import json
+
+from app.schemas.element_columns import ColumnarElementTree
+from app.schemas.element_repeats import (
+    expand_compact_storage, find_repeat_groups, iter_compacted_nodes, to_compact_storage, to_prompt_dicts,
+)
+from app.schemas.prompt import RichImageAnalysisSchema
+
+
+def _node(element_type: str, text=None, box=None, children=(), node_id=None, **fields):
+    node = {"element_type": element_type, "text_content": text, "bounding_box": box, "children": list(children), **fields}
+    if node_id is not None:
+        node["id"] = node_id
+    return node
+
+
+def _card(i: int, box=None):
+    return _node(
+        "card", box=box if box is not None else {"x": 20 + 300 * i, "y": 400, "width": 280, "height": 360}, node_id=f"card_{i}",
+        style_hints=[{"property": "shadow", "value": "sm"}],
+        children=[
+            _node("image", box={"x": 20 + 300 * i, "y": 400, "width": 280, "height": 160}, node_id=f"img_{i}"),
+            _node("heading", text=f"Plan {i}", box={"x": 30 + 300 * i, "y": 580, "width": 260, "height": 30}, node_id=f"h_{i}"),
+            _node("button", text="Choose", node_id=f"btn_{i}", interaction_notes="Opens checkout"),
+        ],
+    )
+
+
+def _page():
+    rows = [_node("row", text=f"Row {i}", node_id=f"row_{i}") for i in range(4)]
+    return [
+        _node("header", text="Pricing", node_id="header"),
+        _node("grid", node_id="grid", children=[_card(i) for i in range(5)]),
+        _node("table", node_id="table", children=rows),
+        _node("footer", text="Contact", node_id="footer"),
+    ]
+
+
+def _normalized(nodes):
+    # The shape ColumnarElementTree.to_dicts() gives back (all keys present)
+    return ColumnarElementTree.from_dicts(nodes).to_dicts()
+
+
+def test_find_repeat_groups_reports_runs_of_identical_siblings():
+    tree = ColumnarElementTree.from_dicts(_page())
+    groups = sorted(find_repeat_groups(tree).values(), key=lambda group: group.roots[0])
+
+    assert [(group.count, group.subtree_size) for group in groups] == [(5, 4), (4, 1)]
+    assert [tree.get("id", root) for root in groups[0].roots] == [f"card_{i}" for i in range(5)]
+    assert find_repeat_groups(tree, min_count=6) == {}
+
+
+def test_differently_shaped_siblings_break_a_run():
+    cards = [_card(i) for i in range(4)]
+    cards[2]["children"].pop()
+    tree = ColumnarElementTree.from_dicts([_node("grid", children=cards)])
+
+    assert find_repeat_groups(tree) == {}
+
+
+def test_compact_storage_round_trips():
+    page = _page()
+    page[1]["children"][3] = _card(3, box={"x": 1.5, "y": 2, "width": 3, "height": 4}) # Non-int box kept as-is
+    tree = ColumnarElementTree.from_dicts(page)
+    groups = find_repeat_groups(tree)
+
+    stored = json.loads(json.dumps(to_compact_storage(tree, groups)))
+    grid_entries = stored["tree"][1]["children"]
+
+    assert len(grid_entries) == 1 and grid_entries[0]["repeat_count"] == 5
+    assert expand_compact_storage(stored) == _normalized(page)
+
+
+def test_schema_accepts_compact_storage():
+    tree = ColumnarElementTree.from_dicts(_page())
+    stored = to_compact_storage(tree, find_repeat_groups(tree))
+
+    analysis = RichImageAnalysisSchema.model_validate({"detected_elements_compact": stored})
+
+    assert [element.model_dump() for element in analysis.detected_elements_tree] == _normalized(_page())
+
+
+def test_prompt_dicts_collapse_runs_to_texts():
+    tree = ColumnarElementTree.from_dicts(_page())
+    grid = to_prompt_dicts(tree, find_repeat_groups(tree))[1]
+
+    (entry,) = grid["children"]
+    assert entry["repeat_count"] == 5
+    assert entry["template"]["id"] == "card_0"
+    assert entry["variants"] == [[f"Plan {i}", "Choose"] for i in range(5)]
+
+
+def test_iter_compacted_nodes_skips_the_other_repeats():
+    tree = ColumnarElementTree.from_dicts(_page())
+    events = [(kind, tree.get("id", value) if kind == "node" else value.count, depth) for kind, value, depth in iter_compacted_nodes(tree, find_repeat_groups(tree))]
+
+    assert events == [
+        ("node", "header", 0), ("node", "grid", 0),
+        ("repeat_start", 5, 0), ("node", "card_0", 1), ("node", "img_0", 1), ("node", "h_0", 1), ("node", "btn_0", 1), ("repeat_end", 5, 0),
+        ("node", "table", 0), ("repeat_start", 4, 0), ("node", "row_0", 1), ("repeat_end", 4, 0),
+        ("node", "footer", 0),
+    ]
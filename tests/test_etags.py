@@ -0,0 +1,91 @@
+import datetime
+
+from app.core.etags import etag_matches, weak_etag
+from tests.conftest import png_upload
+
+PROMPTS_URL = "/api/v1/prompts"
+
+
+def _create_session(client, title="Home"):
+    response = client.post(f"{PROMPTS_URL}/analyze-image", files=[("image_files", png_upload(f"{title.lower()}.png"))], data={"image_titles": [title], "session_name": title})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def _backdate(db, session_id):
+    # SQLite's CURRENT_TIMESTAMP has one-second resolution; an edit in the same second would keep the tag
+    from app.models.prompt_session import PromptSession
+    db.query(PromptSession).filter(PromptSession.id == session_id).update({PromptSession.updated_at: datetime.datetime(2020, 1, 1)}, synchronize_session=False)
+    db.commit()
+
+
+def test_weak_etag_is_stable_per_state():
+    updated_at = datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    tag = weak_etag("session", 7, updated_at)
+
+    assert tag.startswith('W/"') and tag.endswith('"')
+    assert tag == weak_etag("session", 7, updated_at)
+    assert tag != weak_etag("session", 7, updated_at + datetime.timedelta(microseconds=1))
+    assert tag != weak_etag("session", 8, updated_at)
+    assert weak_etag("history", 1, 10, None, 0, 100) != weak_etag("history", 1, 10, None, 0, 50)
+
+
+def test_etag_matching_is_weak_and_accepts_lists():
+    tag = weak_etag("session", 1, None)
+
+    assert etag_matches(tag, tag)
+    assert etag_matches(tag[2:], tag) # Strong form of the same opaque tag
+    assert etag_matches(f'W/"other", {tag}', tag)
+    assert etag_matches("*", tag)
+    assert not etag_matches('W/"other"', tag)
+    assert not etag_matches(None, tag) and not etag_matches("", tag)
+
+
+def test_history_revalidation(client, fake_llm):
+    _create_session(client)
+    first = client.get(f"{PROMPTS_URL}/history")
+    etag = first.headers["ETag"]
+
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "private, no-cache"
+    not_modified = client.get(f"{PROMPTS_URL}/history", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b"" and not_modified.headers["ETag"] == etag
+    assert client.get(f"{PROMPTS_URL}/history?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+    _create_session(client, "Pricing")
+    changed = client.get(f"{PROMPTS_URL}/history", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag and len(changed.json()) == 2
+
+
+def test_session_revalidation(client, fake_llm):
+    session_id = _create_session(client)
+    etag = client.get(f"{PROMPTS_URL}/sessions/{session_id}").headers["ETag"]
+
+    not_modified = client.get(f"{PROMPTS_URL}/sessions/{session_id}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert client.get(f"{PROMPTS_URL}/sessions/{session_id + 1000}", headers={"If-None-Match": etag}).status_code == 404
+
+
+def test_page_edit_changes_the_session_and_history_tags(client, fake_llm, db):
+    session_id = _create_session(client)
+    _backdate(db, session_id)
+    session = client.get(f"{PROMPTS_URL}/sessions/{session_id}")
+    history_etag = client.get(f"{PROMPTS_URL}/history").headers["ETag"]
+    entry_id = session.json()["image_entries"][0]["id"]
+
+    # The edit only adds rows to other tables; it must still move the session's updated_at
+    assert client.put(f"{PROMPTS_URL}/sessions/{session_id}/page-order", json={"entry_ids": [entry_id]}).status_code == 200
+
+    after = client.get(f"{PROMPTS_URL}/sessions/{session_id}", headers={"If-None-Match": session.headers["ETag"]})
+    assert after.status_code == 200 and after.headers["ETag"] != session.headers["ETag"]
+    assert len(after.json()["generated_prompts"]) > len(session.json()["generated_prompts"])
+    assert client.get(f"{PROMPTS_URL}/history", headers={"If-None-Match": history_etag}).status_code == 200
+
+
+def test_etags_can_be_disabled(client, fake_llm, monkeypatch):
+    from app.core.config import settings
+    session_id = _create_session(client)
+    monkeypatch.setattr(settings, "HISTORY_ETAGS_ENABLED", False)
+
+    assert "ETag" not in client.get(f"{PROMPTS_URL}/history").headers
+    response = client.get(f"{PROMPTS_URL}/sessions/{session_id}", headers={"If-None-Match": "*"})
+    assert response.status_code == 200 and "ETag" not in response.headers
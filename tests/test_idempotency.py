@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+
+import httpx
+
+from app.api.api_v1.endpoints import prompts
+from app.core.deadline import ClientDisconnected
+from app.crud.crud_idempotency import idempotency_key as crud_idempotency_key
+from tests.conftest import png_upload
+
+ANALYZE_URL = "/api/v1/prompts/analyze-image"
+
+
+def _submission(session_name="Checkout flow"):
+    files = [("image_files", png_upload("cart.png", 1)), ("image_files", png_upload("payment.png", 2))]
+    return {"files": files, "data": {"image_titles": ["Cart", "Payment"], "session_name": session_name}}
+
+
+def test_completed_key_replays_the_stored_response(client, fake_llm):
+    first = client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-1"}, **_submission())
+    second = client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-1"}, **_submission())
+
+    assert first.status_code == second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert len(fake_llm.planner) == 1
+
+
+def test_key_reused_for_a_different_submission_is_rejected(client, fake_llm):
+    assert client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-2"}, **_submission()).status_code == 200
+    response = client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-2"}, **_submission(session_name="Other"))
+
+    assert response.status_code == 422
+    assert len(fake_llm.planner) == 1
+
+
+def test_key_in_progress_in_another_worker_gets_409(client, fake_llm, db, user):
+    fingerprint = asyncio.run(_fingerprint(user.id))
+    crud_idempotency_key.claim(db, owner_id=user.id, key="order-3", request_fingerprint=fingerprint, ttl=datetime.timedelta(hours=1))
+
+    response = client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-3"}, **_submission())
+
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "5"
+    assert fake_llm.planner == []
+
+
+def test_failed_run_releases_the_key(client, fake_llm):
+    async def fail(call_number):
+        if call_number == 1:
+            raise RuntimeError("planner down")
+
+    fake_llm.planner_hook = fail
+    try:
+        client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-4"}, **_submission())
+    except RuntimeError:
+        pass # TestClient re-raises unhandled app errors
+    response = client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-4"}, **_submission())
+
+    assert response.status_code == 200 and "Idempotent-Replayed" not in response.headers
+    assert len(fake_llm.planner) == 2
+
+
+def test_follower_completes_the_key_when_the_leader_disconnects(api_app, auth_headers, fake_llm, monkeypatch):
+    joined = asyncio.Event()
+    original_do = prompts.analyze_single_flight.do
+    entered = []
+
+    async def counting_do(key, work):
+        entered.append(key)
+        if len(entered) == 2:
+            joined.set()
+        return await original_do(key, work)
+
+    async def leader_disconnects(call_number):
+        if call_number == 1:
+            await joined.wait()
+            await asyncio.sleep(0.01) # Let the follower start waiting on the leader's run
+            raise ClientDisconnected()
+
+    monkeypatch.setattr(prompts.analyze_single_flight, "do", counting_do)
+    fake_llm.planner_hook = leader_disconnects
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=api_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=auth_headers) as async_client:
+            post = lambda: async_client.post(ANALYZE_URL, headers={"Idempotency-Key": "order-5"}, **_submission())
+            leader = asyncio.create_task(post())
+            await asyncio.sleep(0.05)
+            follower = asyncio.create_task(post())
+            leader_response, follower_response = await asyncio.gather(leader, follower)
+            retry_response = await post()
+        return leader_response, follower_response, retry_response
+
+    leader_response, follower_response, retry_response = asyncio.run(scenario())
+
+    assert leader_response.status_code == 499
+    assert follower_response.status_code == 200
+    assert len(fake_llm.planner) == 2 # The follower ran the pipeline itself
+    assert retry_response.status_code == 200
+    assert retry_response.headers["Idempotent-Replayed"] == "true"
+    assert retry_response.json() == follower_response.json()
+    assert len(fake_llm.planner) == 2
+
+
+async def _fingerprint(user_id):
+    from starlette.datastructures import Headers, UploadFile
+    import io
+    uploads = [UploadFile(io.BytesIO(content), filename=name, headers=Headers({"content-type": content_type})) for _, (name, content, content_type) in _submission()["files"]]
+    return await prompts.fingerprint_submission(user_id, "Checkout flow", uploads, ["Cart", "Payment"])
@@ -0,0 +1,109 @@
+import io
+
+from PIL import Image
+
+from app.core.config import settings
+from app.core.image_tiling import ImageTile, merge_tile_analyses, plan_tile_bands, split_tall_image
+from app.schemas.prompt import (
+    BaseElementSchema, ContentSectionSchema, OverallAnalysis, RichImageAnalysisSchema, VisualStyleColorSchema, VisualStyleSchema,
+)
+
+
+def _png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _tiles(bands):
+    height = bands[-1][1]
+    return [ImageTile(index, len(bands), top, bottom, 1000, height, b"") for index, (top, bottom) in enumerate(bands)]
+
+
+def _element(element_id: str, y: int, height: int, text: str, children=()) -> BaseElementSchema:
+    return BaseElementSchema(
+        id=element_id, element_type="card", text_content=text,
+        bounding_box={"x": 100, "y": y, "width": 800, "height": height}, children=list(children),
+    )
+
+
+def test_plan_tile_bands_cover_the_page_with_overlap():
+    bands = plan_tile_bands(1000, 12000)
+    assert bands[0][0] == 0 and bands[-1][1] == 12000
+    assert len({bottom - top for top, bottom in bands}) == 1
+    for (_, previous_bottom), (top, _) in zip(bands, bands[1:]):
+        assert previous_bottom - top >= settings.VISION_TILE_OVERLAP_PX
+    assert len(plan_tile_bands(100, 200000)) == settings.VISION_TILE_MAX_TILES
+
+
+def test_split_tall_image_crops_each_band():
+    tiles = split_tall_image(_png(400, 3000))
+    assert tiles is not None and len(tiles) > 1
+    for tile in tiles:
+        with Image.open(io.BytesIO(tile.image_bytes)) as band:
+            assert band.format == "PNG"
+            assert band.size == (400, tile.bottom - tile.top)
+    assert split_tall_image(_png(1000, 800)) is None
+    assert split_tall_image(b"not an image") is None
+
+
+def test_merge_offsets_boxes_and_drops_overlap_duplicates():
+    tiles = _tiles([(0, 1000), (800, 1800)])
+    top_band = RichImageAnalysisSchema(
+        overall_analysis=OverallAnalysis(page_title_guess="Pricing", key_takeaways=["Three plans"]),
+        detected_elements_tree=[_element("el_1", 50, 100, "Header"), _element("el_2", 850, 150, "Plans and pri")],
+    )
+    bottom_band = RichImageAnalysisSchema(
+        overall_analysis=OverallAnalysis(page_title_guess="Plans", key_takeaways=["three  plans", "FAQ"]),
+        detected_elements_tree=[
+            _element("el_1", 40, 160, "Plans and pricing", children=[_element("el_3", 60, 40, "Basic")]),
+            _element("el_2", 600, 100, "FAQ"),
+        ],
+    )
+
+    merged, duplicates = merge_tile_analyses([top_band, bottom_band], tiles)
+
+    assert duplicates == 1
+    header, plans, faq = merged.detected_elements_tree
+    assert header.bounding_box["y"] == 50
+    assert plans.text_content == "Plans and pricing" # The more complete subtree is kept
+    assert plans.bounding_box == {"x": 100, "y": 840, "width": 800, "height": 160}
+    assert plans.children[0].bounding_box["y"] == 860
+    assert faq.bounding_box["y"] == 1400
+    assert len({header.id, plans.id, faq.id, plans.children[0].id}) == 4
+    assert merged.overall_analysis.page_title_guess == "Pricing"
+    assert merged.overall_analysis.key_takeaways == ["Three plans", "FAQ"]
+    # The inputs are left untouched
+    assert bottom_band.detected_elements_tree[1].bounding_box["y"] == 600
+
+
+def test_merge_keeps_distinct_elements_in_the_overlap():
+    tiles = _tiles([(0, 1000), (800, 1800)])
+    top_band = RichImageAnalysisSchema(detected_elements_tree=[_element("a", 850, 100, "Sign up")])
+    bottom_band = RichImageAnalysisSchema(detected_elements_tree=[_element("a", 50, 100, "Log in")])
+
+    merged, duplicates = merge_tile_analyses([top_band, bottom_band], tiles)
+
+    assert duplicates == 0
+    assert [element.id for element in merged.detected_elements_tree] == ["a", "a_2"]
+
+
+def test_merge_unions_sections_and_style_guides():
+    tiles = _tiles([(0, 1000), (800, 1800)])
+    section = lambda headline: ContentSectionSchema(element_type="hero", headline=headline)
+    color = lambda hex_value: VisualStyleColorSchema(hex=hex_value)
+    top_band = RichImageAnalysisSchema(
+        content_sections=[section("Welcome")],
+        visual_style_guide=VisualStyleSchema(primary_colors=[color("#FFF")], heading_typography=[{"level": "h1"}]),
+    )
+    bottom_band = RichImageAnalysisSchema(
+        content_sections=[section("welcome"), section("Pricing")],
+        visual_style_guide=VisualStyleSchema(primary_colors=[color("#fff"), color("#000")], heading_typography=[{"level": "h1"}], iconography_style="Outline"),
+    )
+
+    merged, _ = merge_tile_analyses([top_band, bottom_band], tiles)
+
+    assert [section.headline for section in merged.content_sections] == ["Welcome", "Pricing"]
+    assert [color.hex for color in merged.visual_style_guide.primary_colors] == ["#FFF", "#000"]
+    assert merged.visual_style_guide.heading_typography == [{"level": "h1"}]
+    assert merged.visual_style_guide.iconography_style == "Outline"
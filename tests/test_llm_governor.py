@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.core.llm_governor import LLMGovernor, ModelLimiter, parse_reset_seconds, parse_retry_after
+
+
+async def _queue_behind_holder(limiter: ModelLimiter, calls):
+    """Holds the only slot, queues `calls` ((name, flow, weight)) and returns the order they were served in."""
+    order = []
+
+    async def call(name, flow, weight):
+        await limiter.acquire(flow, weight, "test")
+        order.append(name)
+        limiter.release()
+
+    await limiter.acquire(("interactive", 0), 1.0, "test")
+    tasks = []
+    for name, flow, weight in calls:
+        tasks.append(asyncio.create_task(call(name, flow, weight)))
+        await asyncio.sleep(0)
+    limiter.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_users_in_the_same_class_take_turns():
+    limiter = ModelLimiter("m", 1, 0)
+    calls = [(f"a{i}", ("interactive", 1), 1.0) for i in range(3)] + [("b0", ("interactive", 2), 1.0)]
+
+    assert asyncio.run(_queue_behind_holder(limiter, calls)) == ["a0", "b0", "a1", "a2"]
+
+
+def test_heavier_classes_get_the_larger_share():
+    limiter = ModelLimiter("m", 1, 0)
+    calls = [(f"batch{i}", ("batch", 1), 1.0) for i in range(3)] + [(f"web{i}", ("interactive", 2), 8.0) for i in range(3)]
+
+    assert asyncio.run(_queue_behind_holder(limiter, calls)) == ["web0", "web1", "web2", "batch0", "batch1", "batch2"]
+
+
+def test_cancelled_waiter_is_skipped():
+    async def scenario():
+        limiter = ModelLimiter("m", 1, 0)
+        await limiter.acquire(("interactive", 0), 1.0, "test")
+        first = asyncio.create_task(limiter.acquire(("interactive", 1), 1.0, "test"))
+        second = asyncio.create_task(limiter.acquire(("interactive", 2), 1.0, "test"))
+        await asyncio.sleep(0)
+        assert limiter.queue_depth() == 2
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert limiter.queue_depth() == 1
+        limiter.release()
+        await second
+        assert limiter.active == 1 and limiter.queue_depth() == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_granted_and_cancelled_in_the_same_tick_is_given_back():
+    async def scenario():
+        limiter = ModelLimiter("m", 1, 0)
+        await limiter.acquire(("interactive", 0), 1.0, "test")
+        waiter = asyncio.create_task(limiter.acquire(("interactive", 1), 1.0, "test"))
+        await asyncio.sleep(0)
+
+        limiter.release() # Hands the slot to the waiter...
+        waiter.cancel() # ...which is cancelled before it runs
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.active == 0 and not limiter._queue
+
+    asyncio.run(scenario())
+
+
+def test_429_halves_the_limit_once_and_pauses_dispatch():
+    async def scenario():
+        limiter = ModelLimiter("m", 8, 0)
+        assert limiter.observe_response(httpx.Response(429, headers={"retry-after": "0.2"}))
+        assert limiter.observe_response(httpx.Response(429, headers={"retry-after": "0.2"})) # In flight at the same time
+        assert limiter.concurrency_limit == 4
+        assert limiter.paused_until > time.monotonic()
+
+        started = time.monotonic()
+        waited = await limiter.acquire(("interactive", 1), 1.0, "test")
+        assert time.monotonic() - started >= 0.15 and waited >= 0.15
+        limiter.release()
+
+        limiter.observe_response(httpx.Response(200))
+        assert limiter.concurrency_limit == 4.25 # Additive increase: one per limit's worth of successes
+
+    asyncio.run(scenario())
+
+
+def test_learned_rate_limit_and_exhausted_quota():
+    limiter = ModelLimiter("m", 4, 120)
+    limiter.observe_response(httpx.Response(200, headers={"x-ratelimit-limit-requests": "60"}))
+    assert limiter.requests_per_minute == 60
+    limiter.observe_response(httpx.Response(200, headers={"x-ratelimit-limit-requests": "600"}))
+    assert limiter.requests_per_minute == 120 # Never above the configured rate
+
+    limiter.observe_response(httpx.Response(200, headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "30s"}))
+    assert limiter.paused_until - time.monotonic() == pytest.approx(30, abs=1)
+
+
+def test_run_retries_after_a_429():
+    async def scenario():
+        governor = LLMGovernor(default_concurrency=2, default_requests_per_minute=0, model_limits={}, priority_weights={"interactive": 8.0}, max_rate_limit_retries=1)
+        statuses = []
+
+        def attempt_with(status_codes):
+            async def attempt(permit):
+                status = status_codes[len(statuses)]
+                statuses.append(status)
+                response = httpx.Response(status, headers={"retry-after": "0.05"}, request=httpx.Request("POST", "https://llm.test"))
+                permit.observe_response(response)
+                response.raise_for_status()
+                return "ok"
+            return attempt
+
+        assert await governor.run("m", "test", attempt_with([429, 200])) == "ok"
+        assert statuses == [429, 200]
+
+        statuses.clear()
+        with pytest.raises(httpx.HTTPStatusError):
+            await governor.run("m", "test", attempt_with([429, 429, 429]))
+        assert statuses == [429, 429] # One retry, then the 429 is raised
+        assert governor.limiter_for("m").active == 0
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_header_parsing():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("soon") is None
+    assert parse_reset_seconds("6m0s") == 360.0
+    assert parse_reset_seconds("250ms") == 0.25
+    assert parse_reset_seconds(str(int((time.time() + 10) * 1000))) == pytest.approx(10, abs=1)
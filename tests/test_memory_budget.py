@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from app.core.uploads import MemoryBudget
+
+
+async def _hold(budget: MemoryBudget, size: int, order: list, name: str, release: asyncio.Event):
+    async with budget.reserve(size):
+        order.append(name)
+        await release.wait()
+
+
+def test_waiters_are_served_in_fifo_order():
+    async def scenario():
+        budget = MemoryBudget("test", 100)
+        order, release = [], asyncio.Event()
+        first = asyncio.create_task(_hold(budget, 80, order, "first", release))
+        await asyncio.sleep(0)
+        big = asyncio.create_task(_hold(budget, 60, order, "big", release))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(_hold(budget, 10, order, "small", release)) # Would fit, but queues behind "big"
+        await asyncio.sleep(0)
+        assert order == ["first"] and budget.in_use_bytes == 80 and len(budget._waiters) == 2
+
+        release.set()
+        await asyncio.gather(first, big, small)
+        assert order == ["first", "big", "small"]
+        assert budget.in_use_bytes == 0 and not budget._waiters
+
+    asyncio.run(scenario())
+
+
+def test_oversized_reservation_is_clamped_and_runs_alone():
+    async def scenario():
+        budget = MemoryBudget("test", 100)
+        async with budget.reserve(10_000):
+            assert budget.in_use_bytes == 100
+        assert budget.in_use_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_head_waiter_unblocks_smaller_ones():
+    async def scenario():
+        budget = MemoryBudget("test", 100)
+        order, release = [], asyncio.Event()
+        first = asyncio.create_task(_hold(budget, 50, order, "first", release))
+        await asyncio.sleep(0)
+        big = asyncio.create_task(_hold(budget, 80, order, "big", release))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(_hold(budget, 40, order, "small", release))
+        await asyncio.sleep(0)
+
+        big.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await big
+        await asyncio.sleep(0)
+        assert order == ["first", "small"]
+
+        release.set()
+        await asyncio.gather(first, small)
+        assert budget.in_use_bytes == 0 and not budget._waiters
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("cancel_first", [True, False])
+def test_cancel_and_release_in_the_same_tick(cancel_first):
+    async def scenario():
+        budget = MemoryBudget("test", 100)
+        order = []
+        holder = budget.reserve(100)
+        await holder.__aenter__()
+        waiter = asyncio.create_task(_hold(budget, 100, order, "waiter", asyncio.Event()))
+        await asyncio.sleep(0)
+        assert len(budget._waiters) == 1
+
+        # Neither step yields to the event loop, so the waiter only runs once both have happened
+        if cancel_first: # The release drops the cancelled waiter from the queue
+            waiter.cancel()
+            await holder.__aexit__(None, None, None)
+        else: # The waiter is granted the bytes, then cancelled
+            await holder.__aexit__(None, None, None)
+            waiter.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert order == []
+        assert budget.in_use_bytes == 0 and not budget._waiters
+
+    asyncio.run(scenario())
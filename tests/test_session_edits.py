@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+
+import httpx
+
+from tests.conftest import png_upload
+
+PROMPTS_URL = "/api/v1/prompts"
+
+
+def _create_session(client, titles=("Home", "Pricing", "Contact")):
+    files = [("image_files", png_upload(f"{title.lower()}.png", seed)) for seed, title in enumerate(titles)]
+    response = client.post(f"{PROMPTS_URL}/analyze-image", files=files, data={"image_titles": list(titles), "session_name": "Marketing site"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def _session(client, session_id):
+    response = client.get(f"{PROMPTS_URL}/sessions/{session_id}")
+    assert response.status_code == 200
+    return response.json()
+
+
+def _pages(session):
+    return [entry["title"] for entry in sorted(session["image_entries"], key=lambda entry: entry["order_in_session"])]
+
+
+def _latest_prompts(session):
+    latest = max(prompt["version"] for prompt in session["generated_prompts"])
+    return latest, [prompt["prompt_text"] for prompt in session["generated_prompts"] if prompt["version"] == latest]
+
+
+def test_add_pages_analyzes_only_the_new_ones(client, fake_llm):
+    session_id = _create_session(client)
+    fake_llm.vision.clear()
+
+    response = client.post(f"{PROMPTS_URL}/sessions/{session_id}/pages", files=[("image_files", png_upload("about.png"))], data={"image_titles": ["About"], "insert_at": "1"})
+
+    assert response.status_code == 200
+    assert fake_llm.vision == ["About"]
+    assert fake_llm.planner[-1] == ["Home", "About", "Pricing", "Contact"]
+    session = _session(client, session_id)
+    assert _pages(session) == ["Home", "About", "Pricing", "Contact"]
+    assert _latest_prompts(session) == (2, ["Build: Home, About, Pricing, Contact"])
+    assert sorted({prompt["version"] for prompt in session["generated_prompts"]}) == [1, 2] # Earlier versions are kept
+
+
+def test_add_pages_validates_the_form(client, fake_llm):
+    session_id = _create_session(client)
+    upload = [("image_files", png_upload("about.png"))]
+
+    assert client.post(f"{PROMPTS_URL}/sessions/{session_id}/pages", files=upload, data={"image_titles": ["About"], "insert_at": "9"}).status_code == 400
+    assert client.post(f"{PROMPTS_URL}/sessions/{session_id}/pages", files=upload, data={"image_titles": ["About"], "insert_at": "x"}).status_code == 400
+    assert client.post(f"{PROMPTS_URL}/sessions/{session_id}/pages", files=upload, data={"image_titles": ["About", "Extra"]}).status_code == 400
+    assert len(fake_llm.planner) == 1
+
+
+def test_replace_page_keeps_its_position_and_title(client, fake_llm):
+    session_id = _create_session(client)
+    pricing = next(entry for entry in _session(client, session_id)["image_entries"] if entry["title"] == "Pricing")
+    fake_llm.vision.clear()
+
+    response = client.put(f"{PROMPTS_URL}/sessions/{session_id}/pages/{pricing['id']}", files={"image_file": png_upload("pricing-v2.png", 7)})
+
+    assert response.status_code == 200
+    assert fake_llm.vision == ["Pricing"]
+    session = _session(client, session_id)
+    assert _pages(session) == ["Home", "Pricing", "Contact"]
+    replaced = next(entry for entry in session["image_entries"] if entry["title"] == "Pricing")
+    assert replaced["id"] != pricing["id"] and replaced["original_filename"] == "pricing-v2.png"
+    assert client.put(f"{PROMPTS_URL}/sessions/{session_id}/pages/999999", files={"image_file": png_upload("x.png")}).status_code == 404
+
+
+def test_remove_page_reuses_the_other_analyses(client, fake_llm):
+    session_id = _create_session(client)
+    entries = _session(client, session_id)["image_entries"]
+    fake_llm.vision.clear()
+
+    response = client.delete(f"{PROMPTS_URL}/sessions/{session_id}/pages/{entries[0]['id']}")
+
+    assert response.status_code == 200
+    assert fake_llm.vision == []
+    session = _session(client, session_id)
+    assert _pages(session) == ["Pricing", "Contact"]
+    assert _latest_prompts(session) == (2, ["Build: Pricing, Contact"])
+    assert client.delete(f"{PROMPTS_URL}/sessions/{session_id}/pages/{entries[0]['id']}").status_code == 404
+
+
+def test_last_page_cannot_be_removed(client, fake_llm):
+    session_id = _create_session(client, titles=("Home",))
+    entry_id = _session(client, session_id)["image_entries"][0]["id"]
+
+    assert client.delete(f"{PROMPTS_URL}/sessions/{session_id}/pages/{entry_id}").status_code == 400
+    assert _pages(_session(client, session_id)) == ["Home"]
+
+
+def test_reorder_pages(client, fake_llm):
+    session_id = _create_session(client)
+    ids = {entry["title"]: entry["id"] for entry in _session(client, session_id)["image_entries"]}
+
+    response = client.put(f"{PROMPTS_URL}/sessions/{session_id}/page-order", json={"entry_ids": [ids["Contact"], ids["Home"], ids["Pricing"]]})
+
+    assert response.status_code == 200
+    assert fake_llm.planner[-1] == ["Contact", "Home", "Pricing"]
+    assert _pages(_session(client, session_id)) == ["Contact", "Home", "Pricing"]
+    assert client.put(f"{PROMPTS_URL}/sessions/{session_id}/page-order", json={"entry_ids": [ids["Home"], ids["Home"], ids["Pricing"]]}).status_code == 400
+
+
+def test_versions_increase_with_each_edit(client, fake_llm):
+    session_id = _create_session(client)
+    for _ in range(3):
+        entries = _session(client, session_id)["image_entries"]
+        assert client.put(f"{PROMPTS_URL}/sessions/{session_id}/page-order", json={"entry_ids": [entry["id"] for entry in reversed(entries)]}).status_code == 200
+
+    assert sorted(prompt["version"] for prompt in _session(client, session_id)["generated_prompts"]) == [1, 2, 3, 4]
+
+
+def test_concurrent_edits_get_distinct_versions(api_app, client, auth_headers, fake_llm):
+    session_id = _create_session(client)
+    ids = [entry["id"] for entry in _session(client, session_id)["image_entries"]]
+    both_planning = asyncio.Event()
+
+    async def wait_for_each_other(call_number):
+        if call_number == 3: # Calls 2 and 3 are the two edits; call 1 created the session
+            both_planning.set()
+        await asyncio.wait_for(both_planning.wait(), timeout=5)
+
+    fake_llm.planner_hook = wait_for_each_other
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_app), base_url="http://test", headers=auth_headers) as async_client:
+            return await asyncio.gather(*(async_client.put(f"{PROMPTS_URL}/sessions/{session_id}/page-order", json={"entry_ids": order}) for order in (ids[::-1], ids)))
+
+    responses = asyncio.run(scenario())
+
+    # Both edits read the session before either wrote; the locked version read still numbers them apart
+    assert [response.status_code for response in responses] == [200, 200]
+    assert sorted(prompt["version"] for prompt in _session(client, session_id)["generated_prompts"]) == [1, 2, 3]
+
+
+def test_other_users_sessions_are_not_editable(api_app, client, fake_llm, db):
+    from fastapi.testclient import TestClient
+    from app.core.security import create_access_token
+    from app.crud.crud_user import user as crud_user
+    from app.schemas.user import UserCreate
+    session_id = _create_session(client)
+    entry_id = _session(client, session_id)["image_entries"][0]["id"]
+    other = crud_user.create(db, obj_in=UserCreate(email=f"other-{session_id}@example.com", display_name="Other", oauth_provider="test", oauth_id=f"other-{session_id}"))
+    token = create_access_token(subject_id=other.id, user_email=other.email, user_given_name="Other", expires_delta=datetime.timedelta(hours=1))
+
+    with TestClient(api_app, headers={"Authorization": f"Bearer {token}"}) as other_client:
+        assert other_client.get(f"{PROMPTS_URL}/sessions/{session_id}").status_code == 404
+        assert other_client.delete(f"{PROMPTS_URL}/sessions/{session_id}/pages/{entry_id}").status_code == 404
+        assert other_client.put(f"{PROMPTS_URL}/sessions/{session_id}/page-order", json={"entry_ids": [entry_id]}).status_code == 404
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app.core.single_flight import SingleFlight
+
+
+class Disconnected(Exception):
+    pass
+
+
+def test_identical_calls_share_one_run():
+    async def scenario():
+        flight = SingleFlight("test")
+        runs = []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        assert results == [("result", False), ("result", True), ("result", True)]
+        assert len(runs) == 1 and flight.in_flight_count() == 0
+
+    asyncio.run(scenario())
+
+
+def test_followers_see_the_leaders_error():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert not flight.is_in_flight("key")
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("leader_exit", ["disconnect", "cancel"])
+def test_follower_takes_over_when_the_leader_goes_away(leader_exit):
+    async def scenario():
+        flight = SingleFlight("test", handoff_on=(Disconnected,))
+        runs = []
+        follower_joined = asyncio.Event()
+
+        async def leader_work():
+            runs.append("leader")
+            await follower_joined.wait()
+            if leader_exit == "disconnect":
+                raise Disconnected()
+            await asyncio.sleep(10)
+
+        async def follower_work():
+            runs.append("follower")
+            return "result"
+
+        leader = asyncio.create_task(flight.do("key", leader_work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", follower_work))
+        await asyncio.sleep(0)
+        follower_joined.set()
+        if leader_exit == "cancel":
+            await asyncio.sleep(0)
+            leader.cancel()
+
+        with pytest.raises(Disconnected if leader_exit == "disconnect" else asyncio.CancelledError):
+            await leader
+        assert await follower == ("result", False) # It ran the work itself
+        assert runs == ["leader", "follower"]
+        assert flight.in_flight_count() == 0
+
+    asyncio.run(scenario())
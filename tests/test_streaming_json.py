@@ -0,0 +1,128 @@
+import json
+import random
+
+import pytest
+
+from app.core.streaming_json import IncrementalJSONScanner, StreamingJSONError
+
+NODE_KEYS = ("detected_elements_tree", "children")
+
+
+def _node(index: int, children=()) -> dict:
+    return {"id": f"el_{index}", "element_type": "card", "text_content": f"Card {index} with \"quotes\", {{braces}} and [brackets]", "children": list(children)}
+
+
+def _document() -> dict:
+    return {
+        "image_metadata": {"original_filename": "page.png", "image_dimensions": {"width": 1440, "height": 900}},
+        "overall_analysis": {"page_title_guess": "Dashboard \\ Projects", "key_takeaways": ["a", "b"]},
+        "schema_version": 3,
+        "is_final": True,
+        "detected_elements_tree": [_node(0, [_node(1), _node(2, [_node(3)])]), _node(4)],
+        "notes": None,
+    }
+
+
+def _random_chunks(text: str, rng: random.Random):
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 12)
+        yield text[position:position + size]
+        position += size
+
+
+def _count_nodes(nodes) -> int:
+    return sum(1 + _count_nodes(node.get("children", [])) for node in nodes)
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_sections_and_document_survive_random_chunk_boundaries(seed):
+    document = _document()
+    text = "```json\n" + json.dumps(document, indent=1 if seed % 2 else None) + "\n```"
+    scanner = IncrementalJSONScanner(node_array_keys=NODE_KEYS)
+    sections = []
+    for chunk in _random_chunks(text, random.Random(seed)):
+        sections.extend(scanner.feed(chunk))
+
+    assert scanner.complete
+    assert [key for key, _ in sections] == list(document)
+    assert {key: json.loads(raw) for key, raw in sections} == document
+    assert json.loads(scanner.document_text()) == document
+    assert scanner.node_count == 5
+
+
+def test_section_is_returned_by_the_chunk_that_closes_it():
+    scanner = IncrementalJSONScanner()
+    assert scanner.feed('{"overall_analysis": {"page_title_guess": "A"') == []
+    assert scanner.feed("}, ") == [("overall_analysis", '{"page_title_guess": "A"}')]
+    assert scanner.feed('"count": 12') == []
+    assert scanner.feed("}") == [("count", "12")]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_node_cap_cuts_after_the_last_complete_node(seed):
+    document = {"overall_analysis": {"page_title_guess": "List"}, "detected_elements_tree": [_node(i) for i in range(10)], "after": 1}
+    scanner = IncrementalJSONScanner(node_array_keys=NODE_KEYS, max_nodes=4)
+    for chunk in _random_chunks(json.dumps(document), random.Random(seed)):
+        scanner.feed(chunk)
+
+    assert scanner.node_limit_reached and not scanner.complete
+    truncated = json.loads(scanner.document_text())
+    assert truncated["overall_analysis"] == document["overall_analysis"]
+    assert truncated["detected_elements_tree"] == document["detected_elements_tree"][:4]
+    assert scanner.feed('"ignored"') == [] # Scanning stops at the cap
+
+
+def test_node_cap_inside_nested_children_keeps_valid_json():
+    document = {"detected_elements_tree": [_node(0, [_node(1), _node(2, [_node(3), _node(4)])]), _node(5)]}
+    scanner = IncrementalJSONScanner(node_array_keys=NODE_KEYS, max_nodes=4)
+    scanner.feed(json.dumps(document))
+
+    truncated = json.loads(scanner.document_text())
+    assert _count_nodes(truncated["detected_elements_tree"]) <= 4
+    assert truncated["detected_elements_tree"][0]["children"][0] == _node(1)
+
+
+def test_node_cap_before_any_complete_node_is_an_error():
+    scanner = IncrementalJSONScanner(node_array_keys=NODE_KEYS, max_nodes=1)
+    scanner.feed(json.dumps({"detected_elements_tree": [_node(0, [_node(1)])]}))
+    with pytest.raises(StreamingJSONError) as excinfo:
+        scanner.document_text()
+    assert excinfo.value.reason == "node_limit"
+
+
+@pytest.mark.parametrize("text, reason", [
+    ('{"a": 1]', "malformed"),
+    ('{"a" 1}', "malformed"),
+    ('{1: 2}', "malformed"),
+    ('{"a": 1, "b": x}', "malformed"),
+    ("x" * 100 + "{}", "malformed"),
+])
+def test_malformed_structure_raises(text, reason):
+    with pytest.raises(StreamingJSONError) as excinfo:
+        IncrementalJSONScanner().feed(text)
+    assert excinfo.value.reason == reason
+
+
+def test_runaway_string_is_detected_across_chunks():
+    scanner = IncrementalJSONScanner(max_string_chars=50)
+    scanner.feed('{"text": "' + "a" * 30)
+    with pytest.raises(StreamingJSONError) as excinfo:
+        scanner.feed("a" * 30)
+    assert excinfo.value.reason == "runaway_string"
+
+
+def test_repeated_siblings_differing_only_in_digits_are_detected():
+    nodes = ",".join(json.dumps({"id": f"el_{i}", "element_type": "row", "text_content": f"Row {i}"}) for i in range(6))
+    scanner = IncrementalJSONScanner(node_array_keys=NODE_KEYS, max_repeated_siblings=3)
+    with pytest.raises(StreamingJSONError) as excinfo:
+        scanner.feed('{"detected_elements_tree": [' + nodes + "]}")
+    assert excinfo.value.reason == "repeating"
+
+
+def test_incomplete_document_is_an_error():
+    scanner = IncrementalJSONScanner()
+    scanner.feed('{"a": [1, 2')
+    with pytest.raises(StreamingJSONError) as excinfo:
+        scanner.document_text()
+    assert excinfo.value.reason == "incomplete"